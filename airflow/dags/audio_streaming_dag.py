@@ -1,8 +1,23 @@
 from datetime import datetime
 from airflow import DAG
-import importlib
+from airflow.decorators import task, task_group
+from operators.generate_melody_operator import GenerateMelodyOperator
+from operators.generate_voice_operator import GenerateVoiceOperator
+from operators.generate_song_operator import GenerateSongOperator
+from operators.generate_song_cover_operator import GenerateSongCoverOperator
+from operators.index_to_elasticsearch_operator import IndexToElasticsearchOperator
+from operators.package_hls_operator import PackageHlsOperator
+from operators.stage_resources import stage_task_kwargs
+from operators.base_custom_operator import record_run_failure
+from functools import partial
 import os
 
+# The operator modules only import their heavy dependencies (torch, transformers, diffusers, pydub,
+# scipy, elasticsearch...) inside execute(), so parsing this file stays cheap for the scheduler.
+
+# Package the final song as HLS for instant-start playback
+ENABLE_HLS_PACKAGING = os.environ.get("ENABLE_HLS_PACKAGING", "false").lower() == "true"
+
 # Define default arguments for the DAG
 default_args = {
     'owner': 'airflow',
@@ -11,77 +26,97 @@ default_args = {
     'logging_level': 'INFO'
 }
 
-# Create the DAG with the specified default arguments
-with DAG('music_generation_dag', default_args=default_args, default_view="graph", schedule_interval=None, catchup=False) as dag:
-    # Import the necessary operators from external modules
-    operators_module = importlib.import_module('operators.generate_melody_operator')
-    GenerateMelodyOperator = operators_module.GenerateMelodyOperator
-    operators_module = importlib.import_module('operators.generate_voice_operator')
-    GenerateVoiceOperator = operators_module.GenerateVoiceOperator
-    operators_module = importlib.import_module('operators.generate_song_operator')
-    GenerateSongOperator = operators_module.GenerateSongOperator
-    operators_module = importlib.import_module('operators.generate_song_cover_operator')
-    GenerateSongCoverOperator = operators_module.GenerateSongCoverOperator
-    operators_module = importlib.import_module('operators.index_to_elasticsearch_operator')
-    IndexToElasticsearchOperator = operators_module.IndexToElasticsearchOperator
-
-    # Define the tasks for each operator
-    generate_melody_task = GenerateMelodyOperator(
-        task_id='generate_melody_task',
-        mongo_uri=os.environ.get("MONGO_URI"),
-        mongo_db=os.environ.get("MONGO_DB"),
-        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
-        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
-        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME")
-    )
+# MongoDB and MinIO settings shared by every task
+storage_kwargs = {
+    "mongo_uri": os.environ.get("MONGO_URI"),
+    "mongo_db": os.environ.get("MONGO_DB"),
+    "mongo_db_collection": os.environ.get("MONGO_DB_COLLECTION"),
+    "minio_endpoint": os.environ.get("MINIO_ENDPOINT"),
+    "minio_access_key": os.environ.get("MINIO_ACCESS_KEY"),
+    "minio_secret_key": os.environ.get("MINIO_SECRET_KEY"),
+    "minio_bucket_name": os.environ.get("MINIO_BUCKET_NAME")
+}
+
+@task
+def resolve_song_ids(dag_run=None):
+    """
+    Read the songs of the run: `song_ids` for mapped runs, or the single `song_id` of older triggers.
+    """
+    conf = dag_run.conf or {}
+    song_ids = conf.get("song_ids") or [conf["song_id"]]
+    return [str(song_id) for song_id in song_ids]
+
+
+@task_group(group_id="song")
+def generate_song(song_id):
+    """
+    The generation stages of one song; mapped over the songs of the run.
 
+    Pools, queues, priority weights and concurrency limits of every stage come from
+    config/stage_resources.json.
+    """
     generate_voice_task = GenerateVoiceOperator(
         task_id='generate_voice_task',
-        mongo_uri=os.environ.get("MONGO_URI"),
-        mongo_db=os.environ.get("MONGO_DB"),
-        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
-        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
-        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME")
+        song_id=song_id,
+        **stage_task_kwargs('generate_voice_task'),
+        **storage_kwargs
+    )
+
+    generate_melody_task = GenerateMelodyOperator(
+        task_id='generate_melody_task',
+        song_id=song_id,
+        **stage_task_kwargs('generate_melody_task'),
+        **storage_kwargs
     )
 
     generate_song_task = GenerateSongOperator(
         task_id='generate_song_task',
-        mongo_uri=os.environ.get("MONGO_URI"),
-        mongo_db=os.environ.get("MONGO_DB"),
-        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
-        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
-        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME")
+        song_id=song_id,
+        **stage_task_kwargs('generate_song_task'),
+        **storage_kwargs
     )
 
     generate_song_cover_operator = GenerateSongCoverOperator(
         task_id='generate_song_cover_operator',
-        mongo_uri=os.environ.get("MONGO_URI"),
-        mongo_db=os.environ.get("MONGO_DB"),
-        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
-        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
-        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME")
+        song_id=song_id,
+        **stage_task_kwargs('generate_song_cover_operator'),
+        **storage_kwargs
     )
 
     index_to_elasticsearch_operator = IndexToElasticsearchOperator(
         task_id='index_to_elasticsearch_operator',
-        mongo_uri=os.environ.get("MONGO_URI"),
-        mongo_db=os.environ.get("MONGO_DB"),
-        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
-        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
-        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME"),
+        song_id=song_id,
+        **stage_task_kwargs('index_to_elasticsearch_operator'),
+        **storage_kwargs,
         elasticsearch_host=os.environ.get("ELASTICSEARCH_HOST"),
         elasticsearch_index=os.environ.get("ELASTICSEARCH_INDEX")
     )
 
-    # Define task dependencies by chaining the tasks in sequence
-    generate_melody_task >> generate_voice_task >> generate_song_task >> generate_song_cover_operator >> index_to_elasticsearch_operator
+    # Define task dependencies by chaining the tasks in sequence; the voice goes first so the
+    # melody can be generated with the same duration
+    generate_voice_task >> generate_melody_task >> generate_song_task >> generate_song_cover_operator >> index_to_elasticsearch_operator
+
+    if ENABLE_HLS_PACKAGING:
+        # Segment the final song while the cover is drawn; the song is indexed once both are done
+        package_hls_task = PackageHlsOperator(
+            task_id='package_hls_task',
+            song_id=song_id,
+            **stage_task_kwargs('package_hls_task'),
+            **storage_kwargs
+        )
+        generate_song_task >> package_hls_task >> index_to_elasticsearch_operator
+
+
+# Marks the unfinished songs of a failed run as failed, including failures no task callback sees
+on_dag_run_failure = partial(
+    record_run_failure,
+    mongo_uri=storage_kwargs["mongo_uri"],
+    mongo_db=storage_kwargs["mongo_db"],
+    mongo_db_collection=storage_kwargs["mongo_db_collection"]
+)
+
+# Create the DAG with the specified default arguments
+with DAG('music_generation_dag', default_args=default_args, default_view="graph", schedule_interval=None,
+         catchup=False, on_failure_callback=on_dag_run_failure) as dag:
+    # One task group instance per song: a failed song does not stop the others of the run
+    generate_song.expand(song_id=resolve_song_ids())
@@ -1,11 +1,163 @@
 from airflow.models import BaseOperator
-from airflow.utils.decorators import apply_defaults
-from pymongo import MongoClient
-from minio import Minio
+from operators.pipeline_metrics import StageTimer, record_histograms, PIPELINE_METRICS_COLLECTION
+from operators import pipeline_logs
+from bson import ObjectId
+from contextlib import contextmanager
 from datetime import datetime
+import importlib
+import hashlib
+import tempfile
+import uuid
+import os
+import re
+import time
+
+# When set, inference phases are profiled with the torch profiler and their traces written here
+PIPELINE_TORCH_PROFILER_DIR = os.environ.get("PIPELINE_TORCH_PROFILER_DIR")
+
+# User metadata of every stored artifact holding the SHA-256 of its content
+ARTIFACT_CHECKSUM_METADATA = "sha256"
+# Suffix of the temporary objects written before an artifact is published under its final name
+ARTIFACT_TEMP_SUFFIX = ".tmp-"
+
+# Quality upgrades store every object under a new render generation, `{song_id}_g{n}_*` and
+# `{song_id}/hls/g{n}/*`, so the objects of the draft are never overwritten while they are served
+RENDER_GENERATION_PATTERN = re.compile(r"^[0-9a-f]{24}(?:_g(\d+)_|/hls/g(\d+)/)")
+
+
+def render_generation_of(object_name):
+    """
+    The render generation of an object: 0 for the objects of the first render of a song.
+
+    :param object_name: The object name.
+    :return: The render generation.
+    """
+    match = RENDER_GENERATION_PATTERN.match(object_name)
+    return int(match.group(1) or match.group(2)) if match else 0
+
+
+def record_song_failure(context):
+    """
+    Failure callback marking the song processed by the failed task as failed.
+
+    Songs of a mapped DAG run fail independently, so the failure is recorded in the song document
+    instead of only in the DAG run state. A failed quality upgrade only records `upgrade_failed_at`
+    and `upgrade_failure_reason`: the song keeps its status and its draft keeps being served.
+
+    :param context: The execution context of the failed task.
+    """
+    task = context['task']
+    song_id = getattr(task, "_current_song_id", None)
+    if not song_id and isinstance(getattr(task, "song_id", None), str):
+        # Failed before execute() resolved it, e.g. while connecting to MongoDB
+        song_id = task.song_id
+    if not song_id:
+        return
+    try:
+        collection = task._get_mongodb_collection()
+        upgrade = collection.update_one({"_id": ObjectId(song_id), "upgrading": True}, {
+            "$set": {
+                "upgrading": False,
+                "upgrade_failed_task": task.stage_name,
+                "upgrade_failure_reason": str(context.get('exception')),
+                "upgrade_failed_at": datetime.now()
+            },
+            "$unset": {"upgrade_render": ""},
+            "$push": {"status_history": task._status_history_entry("upgrade_failed", context)}
+        })
+        if upgrade.matched_count:
+            task._log_to_mongodb(f"Quality upgrade of song {song_id} failed in {task.stage_name}", context, "ERROR")
+            return
+        collection.update_one({"_id": ObjectId(song_id)}, {
+            "$set": {
+                "song_status": "failed",
+                "failed_task": task.stage_name,
+                "failure_reason": str(context.get('exception')),
+                "failed_at": datetime.now()
+            },
+            "$push": {"status_history": task._status_history_entry("failed", context)}
+        })
+        task._log_to_mongodb(f"Song {song_id} marked as failed by {task.stage_name}", context, "ERROR")
+    except Exception as e:
+        print(f"Error recording the failure of song {song_id}: {e}")
+
+
+def record_run_failure(context, mongo_uri, mongo_db, mongo_db_collection):
+    """
+    DAG failure callback marking the unfinished songs of the failed run as failed.
+
+    Covers the failures the task callback never sees (the songs of the run could not be resolved,
+    or the run was marked failed by hand), so those songs stop counting as in flight. Songs being
+    re-rendered at a higher quality tier only record the failure of the upgrade, as record_song_failure does.
+
+    :param context: The execution context of the failed DAG run.
+    :param mongo_uri: MongoDB connection URI.
+    :param mongo_db: MongoDB database name.
+    :param mongo_db_collection: MongoDB songs collection name.
+    """
+    dag_run = context.get('dag_run')
+    conf = (dag_run.conf if dag_run else None) or {}
+    song_ids = conf.get("song_ids") or ([conf["song_id"]] if conf.get("song_id") else [])
+    if not song_ids:
+        return
+    failure_reason = str(context.get('reason') or "DAG run failed")
+    client = importlib.import_module("pymongo").MongoClient(mongo_uri)
+    try:
+        collection = client[mongo_db][mongo_db_collection]
+        song_object_ids = [ObjectId(str(song_id)) for song_id in song_ids]
+        collection.update_many(
+            {"_id": {"$in": song_object_ids}, "upgrading": True},
+            {
+                "$set": {
+                    "upgrading": False,
+                    "upgrade_failed_task": None,
+                    "upgrade_failure_reason": failure_reason,
+                    "upgrade_failed_at": datetime.now()
+                },
+                "$unset": {"upgrade_render": ""},
+                "$push": {"status_history": {"status": "upgrade_failed", "task": None, "try_number": None, "at": datetime.now()}}
+            }
+        )
+        collection.update_many(
+            {"_id": {"$in": song_object_ids}, "song_status": {"$nin": ["song_indexed", "failed"]}, "upgrading": {"$ne": True}},
+            {
+                "$set": {
+                    "song_status": "failed",
+                    "failed_task": None,
+                    "failure_reason": failure_reason,
+                    "failed_at": datetime.now()
+                },
+                "$push": {"status_history": {"status": "failed", "task": None, "try_number": None, "at": datetime.now()}}
+            }
+        )
+    except Exception as e:
+        print(f"Error recording the failure of DAG run {getattr(dag_run, 'run_id', None)}: {e}")
+    finally:
+        client.close()
+
+
+def file_checksum(file_path):
+    """
+    SHA-256 of a file, read in chunks.
+
+    :param file_path: Path of the file.
+    :return: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_data:
+        for chunk in iter(lambda: file_data.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 class BaseCustomOperator(BaseOperator):
-    @apply_defaults
+    # song_id may be a literal, a Jinja template or the mapped argument of a task group
+    template_fields = ("song_id",)
+    # Artifacts read by the stage; a checkpoint is only reused while they are unchanged
+    input_artifacts = ()
+    # Artifacts written by the stage, which must still be valid in MinIO to reuse a checkpoint
+    output_artifacts = ()
+
     def __init__(
         self,
         mongo_uri,
@@ -15,7 +167,9 @@ class BaseCustomOperator(BaseOperator):
         minio_access_key,
         minio_secret_key,
         minio_bucket_name,
-        *args, **kwargs
+        *args,
+        song_id=None,
+        **kwargs
     ):
         """
         Initialize a custom base operator for common functionality.
@@ -27,8 +181,12 @@ class BaseCustomOperator(BaseOperator):
         :param minio_access_key: The access key for MinIO.
         :param minio_secret_key: The secret key for MinIO.
         :param minio_bucket_name: The name of the MinIO bucket.
+        :param song_id: The ID of the song to process. When not given, it is read from the DAG run
+            configuration or from the upstream task, as single-song runs do.
         """
+        kwargs.setdefault("on_failure_callback", record_song_failure)
         super().__init__(*args, **kwargs)
+        self.song_id = song_id
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
         self.mongo_db_collection = mongo_db_collection
@@ -36,6 +194,125 @@ class BaseCustomOperator(BaseOperator):
         self.minio_access_key = minio_access_key
         self.minio_secret_key = minio_secret_key
         self.minio_bucket_name = minio_bucket_name
+        self._stage_timer = None
+        self._current_song_id = None
+        self._mongo_client = None
+
+    @property
+    def stage_name(self):
+        """
+        The task ID without the task group prefix, identical for mapped and single-song runs.
+        """
+        return self.task_id.rsplit(".", 1)[-1]
+
+    def _resolve_song_id(self, context, upstream_task_id=None):
+        """
+        Get the ID of the song processed by this task instance.
+
+        :param context: The execution context.
+        :param upstream_task_id: The task whose XCom carries the song_id in single-song runs; when
+            None the song_id is read from the DAG run configuration.
+        :return: The song ID.
+        """
+        if self.song_id:
+            song_id = self.song_id
+        elif upstream_task_id:
+            song_id = context['task_instance'].xcom_pull(task_ids=upstream_task_id)['song_id']
+        else:
+            song_id = context['dag_run'].conf['song_id']
+        self._current_song_id = str(song_id)
+        return self._current_song_id
+
+    def _find_song(self, collection, song_id):
+        """
+        Read the song document as the stages of the current render see it.
+
+        While the song is re-rendered at a higher quality tier, the fields written by the stages of
+        the upgrade are kept in `upgrade_render` until the whole render is done, and override the
+        fields of the draft, which keep being served.
+
+        :param collection: The songs collection.
+        :param song_id: The ID of the song.
+        :return: The song document, or None if it does not exist.
+        """
+        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        if song_info and song_info.get("upgrading"):
+            song_info = {**song_info, **(song_info.get("upgrade_render") or {})}
+        return song_info
+
+    def _object_prefix(self, song_id, song_info):
+        """
+        Prefix of the names of the objects of the current render: the song ID, plus its render
+        generation for quality upgrades.
+
+        :param song_id: The ID of the song.
+        :param song_info: The song document, as returned by _find_song.
+        :return: The prefix.
+        """
+        render_generation = song_info.get("render_generation") or 0
+        return f"{song_id}_g{render_generation}" if render_generation else str(song_id)
+
+    def pre_execute(self, context):
+        super().pre_execute(context)
+        self._stage_timer = StageTimer(self.stage_name)
+
+    def post_execute(self, context, result=None):
+        super().post_execute(context, result)
+        song_id = result.get("song_id") if isinstance(result, dict) else None
+        if song_id:
+            self._record_stage_metrics(song_id, context)
+
+    def _get_stage_timer(self):
+        if self._stage_timer is None:
+            self._stage_timer = StageTimer(self.stage_name)
+        return self._stage_timer
+
+    @contextmanager
+    def _timed(self, phase, model=None, profile=False):
+        """
+        Time a phase of the task (model load, inference, encoding, uploads, database calls...).
+
+        :param phase: The phase name.
+        :param model: The model checkpoint involved in the phase, if any.
+        :param profile: Whether the phase runs under the torch profiler when PIPELINE_TORCH_PROFILER_DIR is set.
+        """
+        with self._get_stage_timer().span(phase, model):
+            if profile and PIPELINE_TORCH_PROFILER_DIR:
+                with self._torch_profiler(phase):
+                    yield
+            else:
+                yield
+
+    @contextmanager
+    def _torch_profiler(self, phase):
+        """
+        Profile a phase with the torch profiler, writing a Chrome trace to PIPELINE_TORCH_PROFILER_DIR.
+        """
+        torch = importlib.import_module("torch")
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as profiler:
+            yield
+        os.makedirs(PIPELINE_TORCH_PROFILER_DIR, exist_ok=True)
+        trace_path = os.path.join(PIPELINE_TORCH_PROFILER_DIR, f"{self.task_id}_{phase}_{int(time.time())}.json")
+        profiler.export_chrome_trace(trace_path)
+        print(profiler.key_averages().table(sort_by="cpu_time_total", row_limit=20))
+        print(f"Torch profiler trace written to {trace_path}")
+
+    def _record_stage_metrics(self, song_id, context):
+        """
+        Persist the phase timings of this task in the song document and fold them into the shared histograms.
+
+        :param song_id: The ID of the song processed by the task.
+        :param context: The execution context.
+        """
+        timer = self._get_stage_timer()
+        try:
+            self._get_mongodb_collection().update_one(
+                {"_id": ObjectId(song_id)},
+                {"$set": {f"stage_metrics.{self.stage_name}": timer.as_document()}}
+            )
+            record_histograms(self._get_mongodb_collection(PIPELINE_METRICS_COLLECTION), timer)
+        except Exception as e:
+            self._log_to_mongodb(f"Error recording stage metrics: {e}", context, "ERROR")
 
     def _get_mongodb_collection(self, collection_name=None):
         """
@@ -47,39 +324,57 @@ class BaseCustomOperator(BaseOperator):
         Returns:
             pymongo.collection.Collection: A reference to the desired MongoDB collection.
         """
-        client = MongoClient(self.mongo_uri)
-        db = client[self.mongo_db]
+        db = self._get_mongo_client()[self.mongo_db]
         
         if collection_name:
             return db[collection_name]
         else:
             return db[self.mongo_db_collection]
 
+    def _get_mongo_client(self):
+        """
+        The MongoDB client of this task, created on first use and reused by every read, write and log message.
+        """
+        if self._mongo_client is None:
+            self._mongo_client = importlib.import_module("pymongo").MongoClient(self.mongo_uri)
+        return self._mongo_client
+
     def _log_to_mongodb(self, message, context, log_level):
         """
-        Log a message to a MongoDB collection.
+        Log a message to the pipeline log, linked to the song processed by the task.
 
         :param message: The message to be logged.
         :param context: The execution context.
         :param log_level: The log level (e.g., INFO, ERROR).
         """
         task_instance = context['task_instance']
-        task_instance_id = f"{task_instance.dag_id}.{task_instance.task_id}"
-        current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_document = {
-            "task_instance_id": task_instance_id,
-            "log_level": log_level,
-            "timestamp": current_timestamp,
-            "log_message": message
-        }
-        client = MongoClient(self.mongo_uri)
-        db = client[self.mongo_db]
+        log_document = pipeline_logs.log_document(
+            song_id=self._current_song_id or self._get_configured_song_id(context),
+            stage=self.stage_name,
+            level=log_level,
+            message=message,
+            run_id=context.get('run_id'),
+            try_number=getattr(task_instance, "try_number", None)
+        )
         try:
-            db.dags_execution_logs.insert_one(log_document)
+            db = self._get_mongo_client()[self.mongo_db]
+            pipeline_logs.ensure_collection(db).insert_one(log_document)
             print("Log message registered in MongoDB")
         except Exception as e:
             print(f"Error writing log message to MongoDB: {e}")
 
+    def _get_configured_song_id(self, context):
+        """
+        The song ID known before execute() resolves it, so the first messages of a task are linked to the song too.
+
+        :param context: The execution context.
+        :return: The song ID, or None if it comes from an upstream task.
+        """
+        if isinstance(self.song_id, str):
+            return self.song_id
+        dag_run = context.get('dag_run')
+        return (getattr(dag_run, "conf", None) or {}).get('song_id')
+
     def _get_minio_client(self, context):
         """
         Get a MinIO client for interacting with MinIO.
@@ -92,7 +387,7 @@ class BaseCustomOperator(BaseOperator):
             self._log_to_mongodb(f"MinIO Endpoint: {self.minio_endpoint}  Bucket Name: {self.minio_bucket_name}", context, "INFO")
             self._log_to_mongodb(f"Access Key: {self.minio_access_key}", context, "INFO")
             self._log_to_mongodb("Connecting to MinIO...", context, "INFO")
-            minio_client = Minio(
+            minio_client = importlib.import_module("minio").Minio(
                 self.minio_endpoint,
                 access_key=self.minio_access_key,
                 secret_key=self.minio_secret_key,
@@ -111,55 +406,200 @@ class BaseCustomOperator(BaseOperator):
             raise Exception(error_message)
         
 
-    def _store_file_in_minio(self, local_file_path, minio_object_name, context, content_type=None):
+    def _store_file_in_minio(self, local_file_path, minio_object_name, context, content_type=None, song_id=None, artifact=None):
         """
-        Stores a file in MinIO.
+        Stores a file in MinIO atomically, tagged with the SHA-256 of its content.
 
         Args:
             local_file_path (str): The local path to the file to be stored in MinIO.
             minio_object_name (str): The name to be used for the object in MinIO.
             context (dict): The Airflow task context for logging and error handling.
             content_type (str, optional): The content type of the object to be stored in MinIO.
+            song_id (str, optional): The song the file belongs to; with `artifact`, the stored file is
+                recorded in the song document as soon as it is in MinIO.
+            artifact (str, optional): The name of the artifact in the song document.
 
         Raises:
             Exception: If there's an error during the MinIO file storage process.
 
-        This method is responsible for uploading a file to a specified MinIO bucket. It checks the file's
-        size, sets the content type if specified, and logs information about the storage process. If an error occurs,
-        it raises an exception with an error message.
-
-        Args:
-            local_file_path (str): The local path to the file.
-            minio_object_name (str): The name for the object in MinIO.
-            context (dict): The Airflow task context.
-            content_type (str, optional): The content type of the object.
+        The file is uploaded under a temporary name and then published under its final name with a
+        server-side copy, so a retry never finds a partially written object under the final name.
 
         Returns:
-            None
+            dict: The artifact record: object name, checksum, size and content type.
         """
+        temp_object_name = f"{minio_object_name}{ARTIFACT_TEMP_SUFFIX}{uuid.uuid4().hex}"
+        minio_client = None
         try:
-            with open(local_file_path, 'rb') as file_data:
-                file_data.seek(0, 2)
-                file_size_bytes = file_data.tell()
-                file_data.seek(0)
-                if file_size_bytes == 0:
-                    error_message = f"File '{local_file_path}' is empty"
-                    self._log_to_mongodb(error_message, context, "ERROR")
-                    raise Exception(error_message)
-                
-                file_size_kb = file_size_bytes / 1024
-                self._log_to_mongodb(f"Try to store file '{local_file_path}' ({file_size_kb:.2f} KB) in MinIO bucket: {self.minio_bucket_name}", context, "INFO")
-                 # Get MinIO client
-                minio_client = self._get_minio_client(context)
-                minio_client.put_object(
-                    self.minio_bucket_name,
-                    minio_object_name,
-                    file_data,
-                    file_size_bytes,
-                    content_type=content_type
-                )
-                self._log_to_mongodb(f"File '{local_file_path}' stored in MinIO bucket: {self.minio_bucket_name}", context, "INFO")
+            file_size_bytes = os.path.getsize(local_file_path)
+            if file_size_bytes == 0:
+                error_message = f"File '{local_file_path}' is empty"
+                self._log_to_mongodb(error_message, context, "ERROR")
+                raise Exception(error_message)
+            checksum = file_checksum(local_file_path)
+
+            file_size_kb = file_size_bytes / 1024
+            self._log_to_mongodb(f"Try to store file '{local_file_path}' ({file_size_kb:.2f} KB) in MinIO bucket: {self.minio_bucket_name}", context, "INFO")
+            # Get MinIO client
+            minio_client = self._get_minio_client(context)
+            with self._timed("minio_upload"):
+                with open(local_file_path, 'rb') as file_data:
+                    minio_client.put_object(
+                        self.minio_bucket_name,
+                        temp_object_name,
+                        file_data,
+                        file_size_bytes,
+                        content_type=content_type,
+                        metadata={ARTIFACT_CHECKSUM_METADATA: checksum}
+                    )
+                # MinIO has no rename: copy the complete object to its final name, then drop the temporary one
+                copy_source = importlib.import_module("minio.commonconfig").CopySource(self.minio_bucket_name, temp_object_name)
+                minio_client.copy_object(self.minio_bucket_name, minio_object_name, copy_source)
+                minio_client.remove_object(self.minio_bucket_name, temp_object_name)
+            self._get_stage_timer().add_bytes("upload", file_size_bytes)
+            self._log_to_mongodb(f"File '{local_file_path}' stored in MinIO bucket: {self.minio_bucket_name}", context, "INFO")
         except Exception as e:
+            if minio_client is not None:
+                try:
+                    minio_client.remove_object(self.minio_bucket_name, temp_object_name)
+                except Exception:
+                    pass
             error_message = f"Error storing file '{local_file_path}' in MinIO: {e}"
             self._log_to_mongodb(error_message, context, "ERROR")
-            raise Exception(error_message)
\ No newline at end of file
+            raise Exception(error_message)
+
+        artifact_record = {
+            "object_name": minio_object_name,
+            "sha256": checksum,
+            "size_bytes": file_size_bytes,
+            "content_type": content_type,
+            "task": self.stage_name,
+            "stored_at": datetime.now()
+        }
+        if song_id and artifact:
+            with self._timed("mongo_write"):
+                self._get_mongodb_collection().update_one(
+                    {"_id": ObjectId(song_id)},
+                    {"$set": {f"artifacts.{artifact}": artifact_record}}
+                )
+        return artifact_record
+
+    def _get_valid_artifact(self, song_info, artifact, context):
+        """
+        Return the record of an artifact if the song document has one and MinIO holds the same content.
+
+        The object's size and checksum metadata must match the record, so an artifact overwritten or
+        removed since it was recorded is not reused.
+
+        :param song_info: The song document.
+        :param artifact: The name of the artifact.
+        :param context: The execution context.
+        :return: The artifact record, or None when it has to be produced again.
+        """
+        artifact_record = (song_info.get("artifacts") or {}).get(artifact)
+        if not artifact_record:
+            return None
+        try:
+            with self._timed("minio_stat"):
+                stat = self._get_minio_client(context).stat_object(self.minio_bucket_name, artifact_record["object_name"])
+        except Exception as e:
+            self._log_to_mongodb(f"Artifact '{artifact}' is recorded but not readable in MinIO: {e}", context, "WARNING")
+            return None
+        metadata_key = f"x-amz-meta-{ARTIFACT_CHECKSUM_METADATA}"
+        checksum = next((value for key, value in (stat.metadata or {}).items() if key.lower() == metadata_key), None)
+        if stat.size != artifact_record["size_bytes"] or checksum != artifact_record["sha256"]:
+            self._log_to_mongodb(f"Artifact '{artifact}' in MinIO does not match its record; it will be produced again", context, "WARNING")
+            return None
+        return artifact_record
+
+    def _fetch_artifact(self, artifact_record, context, suffix=None):
+        """
+        Download a recorded artifact to a temporary file and verify its checksum.
+
+        :param artifact_record: The artifact record.
+        :param context: The execution context.
+        :param suffix: Suffix of the temporary file.
+        :return: The path of the downloaded file.
+        """
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+            local_file_path = temp_file.name
+        with self._timed("minio_download"):
+            self._get_minio_client(context).fget_object(self.minio_bucket_name, artifact_record["object_name"], local_file_path)
+        self._get_stage_timer().add_bytes("download", os.path.getsize(local_file_path))
+        if file_checksum(local_file_path) != artifact_record["sha256"]:
+            os.remove(local_file_path)
+            raise Exception(f"Checksum mismatch for '{artifact_record['object_name']}'")
+        return local_file_path
+
+    def _status_history_entry(self, song_status, context):
+        return {
+            "status": song_status,
+            "task": self.stage_name,
+            "try_number": getattr(context.get('task_instance'), "try_number", None),
+            "at": datetime.now()
+        }
+
+    def _complete_stage(self, collection, song_id, song_status, fields, context):
+        """
+        Record the outcome of the stage in the song document.
+
+        Besides the stage's fields and the current status, the transition is appended to
+        `status_history` and a checkpoint with the checksums of the stage's input artifacts is stored,
+        so a later try can tell whether the stage is already done. While the song is re-rendered at a
+        higher quality tier (`upgrading`) its status is left unchanged and the fields go to
+        `upgrade_render` until the stage completing the song swaps them for the fields of the draft.
+
+        :param collection: The songs collection.
+        :param song_id: The ID of the song.
+        :param song_status: The status reached by the song, or None to leave it unchanged.
+        :param fields: The other fields to set.
+        :param context: The execution context.
+        """
+        song_info = collection.find_one({"_id": ObjectId(song_id)}, {"artifacts": 1, "upgrading": 1, "upgrade_render": 1}) or {}
+        artifacts = song_info.get("artifacts") or {}
+        checkpoint = {
+            "inputs": {artifact: (artifacts.get(artifact) or {}).get("sha256") for artifact in self.input_artifacts},
+            "outputs": list(self.output_artifacts),
+            "completed_at": datetime.now()
+        }
+        changes = {}
+        if song_info.get("upgrading") and song_status == "song_indexed":
+            # The stage completing the song ends the upgrade: every field of the new render replaces
+            # the field of the draft in this single update, so readers never mix the objects of both.
+            # The objects of the draft are removed later by the storage reconciler (`stale_render`),
+            # once the names, presigned URLs and playlists handed out before the swap have expired.
+            updates = {**(song_info.get("upgrade_render") or {}), **fields, "upgrading": False, "upgraded_at": datetime.now()}
+            changes["$unset"] = {"upgrade_render": ""}
+        elif song_info.get("upgrading"):
+            updates = {f"upgrade_render.{field}": value for field, value in fields.items()}
+        else:
+            updates = dict(fields)
+            if song_status:
+                updates["song_status"] = song_status
+        updates[f"checkpoints.{self.stage_name}"] = checkpoint
+        with self._timed("mongo_write"):
+            collection.update_one({"_id": ObjectId(song_id)}, {
+                "$set": updates,
+                "$push": {"status_history": self._status_history_entry(song_status or "completed", context)},
+                **changes
+            })
+
+    def _is_stage_completed(self, song_info, context):
+        """
+        Whether a previous try already completed the stage for the current inputs.
+
+        :param song_info: The song document.
+        :param context: The execution context.
+        :return: True when the stage can be skipped.
+        """
+        checkpoint = (song_info.get("checkpoints") or {}).get(self.stage_name)
+        if not checkpoint:
+            return False
+        artifacts = song_info.get("artifacts") or {}
+        for artifact in self.input_artifacts:
+            if checkpoint["inputs"].get(artifact) != (artifacts.get(artifact) or {}).get("sha256"):
+                return False
+        if not all(self._get_valid_artifact(song_info, artifact, context) for artifact in self.output_artifacts):
+            return False
+        self._log_to_mongodb(f"Stage {self.stage_name} already completed at {checkpoint['completed_at']}; skipping", context, "INFO")
+        return True
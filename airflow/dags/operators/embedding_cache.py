@@ -0,0 +1,160 @@
+"""
+Cache of the text encoder outputs of the model stages.
+
+MusicGen encodes `[style] lyrics` with its T5 encoder and Stable Diffusion encodes the lyrics (and
+the empty negative prompt) with its CLIP text encoder on every run, although lyrics are often
+resubmitted. The hidden states are cached under the SHA-256 of the model and the text:
+
+- in memory, in a LRU of EMBEDDING_CACHE_MAX_ENTRIES entries, for the songs run by one process;
+- on disk when EMBEDDING_CACHE_DIR is set, one `.npy` file per entry loaded memory-mapped, so the
+  cache is shared by the task processes of a worker and survives restarts.
+"""
+from collections import OrderedDict
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+import threading
+
+# Entries kept in memory by each process; 0 disables the cache
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 256))
+
+# Directory of the on-disk entries; empty keeps the cache in memory only
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "")
+
+
+def model_fingerprint(checkpoint, encoder, variant=None):
+    """
+    Identify the encoder producing the embeddings, so models built from another configuration or run
+    by another inference backend never share entries.
+
+    :param checkpoint: The checkpoint the encoder was loaded from.
+    :type checkpoint: str
+    :param encoder: The text encoder.
+    :param variant: The inference backend or any other setting changing the outputs.
+    :type variant: str
+    :return: The fingerprint.
+    :rtype: str
+    """
+    config = getattr(encoder, "config", None)
+    if hasattr(config, "to_json_string"):
+        description = config.to_json_string()
+    else:
+        description = json.dumps(dict(config or {}), sort_keys=True, default=str)
+    return f"{checkpoint}|{variant or ''}|{hashlib.sha256(description.encode()).hexdigest()}"
+
+
+class EmbeddingCache:
+    """
+    LRU of text encoder outputs, optionally backed by memory-mapped `.npy` files.
+
+    :param max_entries: Entries kept in memory; 0 disables the cache.
+    :type max_entries: int
+    :param directory: Directory of the on-disk entries, or None.
+    :type directory: str
+    """
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, directory=EMBEDDING_CACHE_DIR or None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    def _remember(self, key, embedding):
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, model, text):
+        """
+        Look up the embedding of a text, in memory and then on disk.
+
+        :return: The embedding as a read-only numpy array, or None.
+        """
+        if not self.max_entries:
+            return None
+        key = self.key(model, text)
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.directory:
+            numpy = importlib.import_module("numpy")
+            try:
+                embedding = numpy.load(self._path(key), mmap_mode="r")
+            except (OSError, ValueError):
+                embedding = None
+            if embedding is not None:
+                with self._lock:
+                    self._remember(key, embedding)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return embedding
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model, text, embedding):
+        """
+        Store the embedding of a text.
+
+        :param embedding: The embedding, as a numpy array.
+        """
+        if not self.max_entries:
+            return
+        numpy = importlib.import_module("numpy")
+        key = self.key(model, text)
+        embedding = numpy.ascontiguousarray(embedding)
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name and renamed, so concurrent tasks never load a partial file
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".npy", delete=False) as temp_file:
+                numpy.save(temp_file, embedding)
+            os.replace(temp_file.name, path)
+        with self._lock:
+            self._remember(key, embedding)
+
+    def get_or_compute(self, model, text, compute):
+        """
+        Return the cached embedding of a text, computing and storing it on a miss.
+
+        :param compute: Function returning the embedding of the text as a numpy array.
+        :type compute: callable
+        :return: The embedding and whether it came from the cache.
+        :rtype: tuple
+        """
+        embedding = self.get(model, text)
+        if embedding is not None:
+            return embedding, True
+        embedding = compute()
+        self.put(model, text, embedding)
+        return embedding, False
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    """
+    The embedding cache of this process, created from the environment on first use.
+
+    :rtype: EmbeddingCache
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
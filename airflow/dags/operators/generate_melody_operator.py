@@ -1,11 +1,22 @@
-from airflow.utils.decorators import apply_defaults
 from operators.base_custom_operator import BaseCustomOperator
+from operators import embedding_cache, inference_backends, quality_tiers
 from bson import ObjectId
 import importlib
-import scipy
 import tempfile
+import math
+import os
 from datetime import datetime
 
+# Inference backend of MusicGen: "eager" or "int8" (see operators.inference_backends)
+MELODY_INFERENCE_BACKEND = os.environ.get("MELODY_INFERENCE_BACKEND", "eager")
+
+# "voice" sizes MusicGen's token budget to the duration of the voice; "fixed" always generates the
+# fixed_tokens of the song's quality tier (see operators.quality_tiers)
+MELODY_LENGTH_MODE = os.environ.get("MELODY_LENGTH_MODE", "voice")
+# Seconds of music kept after the voice ends
+MELODY_TAIL_SECONDS = float(os.environ.get("MELODY_TAIL_SECONDS", 1.0))
+# Lower bound of the melody duration; the upper bound is the max_seconds of the quality tier
+MELODY_MIN_SECONDS = 5
 
 class GenerateMelodyOperator(BaseCustomOperator):
 
@@ -26,15 +37,65 @@ class GenerateMelodyOperator(BaseCustomOperator):
 
     The operator is designed to be used within Airflow DAGs for music generation tasks.
     """
-    @apply_defaults
-    def __init__(
-        self,
-        *args, **kwargs
-    ):
-        super().__init__(*args, **kwargs)
 
+    input_artifacts = ("voice",)
+    output_artifacts = ("melody",)
+
+    def _melody_token_budget(self, model, voice_duration_seconds, settings):
+        """
+        Number of tokens MusicGen generates so the melody lasts as long as the voice plus a short tail.
+
+        Args:
+            model: The MusicGen model.
+            voice_duration_seconds (float): The duration of the voice, or None if it is unknown.
+            settings (dict): The melody settings of the song's quality tier.
 
-    def _generate_melody(self, song_text):
+        Returns:
+            int: The value of max_new_tokens.
+        """
+        if MELODY_LENGTH_MODE != "voice" or not voice_duration_seconds:
+            return settings["fixed_tokens"]
+        melody_seconds = min(max(voice_duration_seconds + MELODY_TAIL_SECONDS, MELODY_MIN_SECONDS), settings["max_seconds"])
+        # One token per audio frame, plus the steps the codebook delay pattern needs before the first complete frame
+        return math.ceil(melody_seconds * model.config.audio_encoder.frame_rate) + model.config.decoder.num_codebooks - 1
+
+    def _encode_text(self, model, inputs, song_text, checkpoint):
+        """
+        Encode the prompt with MusicGen's T5 encoder, reusing the hidden states cached for the same prompt.
+
+        Args:
+            model: The MusicGen model.
+            inputs (dict): The processor outputs for the prompt.
+            song_text (str): The prompt.
+            checkpoint (str): The checkpoint the model was loaded from.
+
+        Returns:
+            dict: The encoder_outputs and attention_mask arguments of generate.
+        """
+        torch = importlib.import_module("torch")
+        numpy = importlib.import_module("numpy")
+        modeling_outputs = importlib.import_module("transformers.modeling_outputs")
+
+        def encode():
+            with torch.no_grad():
+                return model.text_encoder(
+                    input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"]
+                ).last_hidden_state.cpu().numpy()
+
+        fingerprint = embedding_cache.model_fingerprint(checkpoint, model.text_encoder, MELODY_INFERENCE_BACKEND)
+        hidden_states, _ = embedding_cache.get_embedding_cache().get_or_compute(fingerprint, song_text, encode)
+        last_hidden_state = torch.from_numpy(numpy.array(hidden_states))
+        attention_mask = torch.as_tensor(numpy.asarray(inputs["attention_mask"]))
+        # generate only adds the null condition of classifier-free guidance when it runs the encoder itself
+        if (model.generation_config.guidance_scale or 1) > 1:
+            last_hidden_state = torch.cat([last_hidden_state, torch.zeros_like(last_hidden_state)])
+            attention_mask = torch.cat([attention_mask, torch.zeros_like(attention_mask)])
+        return {
+            "encoder_outputs": modeling_outputs.BaseModelOutput(last_hidden_state=last_hidden_state),
+            "attention_mask": attention_mask
+        }
+
+    def _generate_melody(self, song_text, voice_duration_seconds=None, settings=None):
         """
         Generates a musical melody from the given song text using the AudioCraft by Facebook model.
 
@@ -43,24 +104,38 @@ class GenerateMelodyOperator(BaseCustomOperator):
 
         Args:
             song_text (str): The text input used for generating the musical melody.
+            voice_duration_seconds (float, optional): The duration of the voice the melody goes with.
+            settings (dict, optional): The melody settings of the song's quality tier; the default tier's when None.
 
         Returns:
-            str: The file path to the generated WAV audio file.
+            tuple: The file path to the generated WAV audio file, its duration in seconds and the token budget used.
         """
+        settings = settings or quality_tiers.stage_settings(None, "melody")
+        checkpoint = settings["checkpoint"]
         transformers = importlib.import_module("transformers")
-        processor = transformers.AutoProcessor.from_pretrained("facebook/musicgen-small")
-        model = transformers.MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
+        with self._timed("model_load", model=checkpoint):
+            processor = transformers.AutoProcessor.from_pretrained(checkpoint)
+            model = transformers.MusicgenForConditionalGeneration.from_pretrained(checkpoint)
+        with self._timed("model_optimize", model=checkpoint):
+            model = inference_backends.optimize_model(model, MELODY_INFERENCE_BACKEND, checkpoint)
         inputs = processor(
             text=song_text,
             padding=True,
             return_tensors="pt",
         )
-        audio_values = model.generate(**inputs, max_new_tokens=500)
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            wav_file_path = temp_file.name
-            sampling_rate = model.config.audio_encoder.sampling_rate
-            scipy.io.wavfile.write(wav_file_path, rate=sampling_rate, data=audio_values[0, 0].numpy())
-        return wav_file_path
+        with self._timed("text_encode", model=checkpoint):
+            encoder_kwargs = self._encode_text(model, inputs, song_text, checkpoint)
+        max_new_tokens = self._melody_token_budget(model, voice_duration_seconds, settings)
+        with self._timed("inference", model=checkpoint, profile=True):
+            audio_values = model.generate(input_ids=inputs["input_ids"], max_new_tokens=max_new_tokens, **encoder_kwargs)
+        with self._timed("wav_encode"):
+            wavfile = importlib.import_module("scipy.io.wavfile")
+            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                wav_file_path = temp_file.name
+                sampling_rate = model.config.audio_encoder.sampling_rate
+                audio_data = audio_values[0, 0].numpy()
+                wavfile.write(wav_file_path, rate=sampling_rate, data=audio_data)
+        return wav_file_path, len(audio_data) / sampling_rate, max_new_tokens
     
     def _get_music_style_info(self, style_id):
         """
@@ -99,24 +174,25 @@ class GenerateMelodyOperator(BaseCustomOperator):
 
         self._log_to_mongodb(f"Starting execution of GenerateMelodyOperator", context, "INFO")
 
-        # Get the configuration passed to the DAG from the execution context
-        dag_run_conf = context['dag_run'].conf
-
-        # Get the song_info_id from the configuration
-        song_id = dag_run_conf['song_id']
+        # Retrieve song_id from the previous task using XCom
+        song_id = self._resolve_song_id(context, upstream_task_id='generate_voice_task')
         self._log_to_mongodb(f"Received song_id: {song_id}", context, "INFO")
 
         # Get a reference to the MongoDB collection
         collection = self._get_mongodb_collection()
         self._log_to_mongodb("Connected to MongoDB", context, "INFO")
 
-        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
         if song_info is None:
             error_message = f"Song info with ID {song_id} not found in MongoDB"
             self._log_to_mongodb(error_message, context, "ERROR")
             raise Exception(error_message)
 
         self._log_to_mongodb(f"Retrieved song info from MongoDB: {song_info}", context, "INFO")
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
+
         # Retrieve song title, text, and description from song_info
         song_title = song_info.get('song_title')
         song_text = song_info.get('song_text')
@@ -125,7 +201,8 @@ class GenerateMelodyOperator(BaseCustomOperator):
         music_style_id = song_info.get('music_style_id')
     
         # Retrieve music style details from MongoDB
-        style_info = self._get_music_style_info(music_style_id)
+        with self._timed("mongo_read"):
+            style_info = self._get_music_style_info(music_style_id)
 
         if style_info:
             style_name = style_info.get('style_name')
@@ -133,34 +210,39 @@ class GenerateMelodyOperator(BaseCustomOperator):
         else:
             self._log_to_mongodb("Music style not found in MongoDB", context, "WARNING")
 
-        try:
-            self._log_to_mongodb("Generating melody...", context, "INFO")
-            melody_file_path = self._generate_melody(song_text)
-            self._log_to_mongodb("Melody generated successfully", context, "INFO")
-        except Exception as e:
-            error_message = f"An error occurred while generating the melody: {e}"
-            self._log_to_mongodb(error_message, context, "ERROR")
-            raise Exception(error_message)
-
-        self._log_to_mongodb(f"Storing melody in MinIO for '{song_title}'", context, "INFO")
+        melody_object_name = f"{self._object_prefix(song_id, song_info)}_melody.wav"
+        melody_fields = {"melody_file_name": melody_object_name}
 
-        melody_object_name = f"{song_id}_melody.wav"
-
-        # Store the generated .wav file in MinIO
-        self._store_file_in_minio(
-            local_file_path=melody_file_path, 
-            minio_object_name=melody_object_name,
-            context=context, 
-            content_type="audio/wav")
+        # A previous try may have stored the melody before failing; reuse it instead of generating it again
+        if self._get_valid_artifact(song_info, "melody", context):
+            self._log_to_mongodb(f"Reusing the melody stored by a previous try for '{song_title}'", context, "INFO")
+        else:
+            try:
+                self._log_to_mongodb("Generating melody...", context, "INFO")
+                # The voice is generated first, so the melody is only as long as the song needs
+                melody_file_path, melody_duration_seconds, max_new_tokens = self._generate_melody(
+                    song_text, song_info.get("voice_duration_seconds"), quality_tiers.stage_settings(song_info, "melody"))
+                melody_fields.update(melody_duration_seconds=melody_duration_seconds, melody_max_new_tokens=max_new_tokens)
+                self._log_to_mongodb(f"Melody generated successfully ({melody_duration_seconds:.1f} s, {max_new_tokens} tokens)", context, "INFO")
+            except Exception as e:
+                error_message = f"An error occurred while generating the melody: {e}"
+                self._log_to_mongodb(error_message, context, "ERROR")
+                raise Exception(error_message)
+
+            self._log_to_mongodb(f"Storing melody in MinIO for '{song_title}'", context, "INFO")
+
+            # Store the generated .wav file in MinIO
+            self._store_file_in_minio(
+                local_file_path=melody_file_path,
+                minio_object_name=melody_object_name,
+                context=context,
+                content_type="audio/wav",
+                song_id=song_id,
+                artifact="melody")
 
         # Update the existing BSON document
-        collection.update_one({"_id": ObjectId(song_id)}, {
-            "$set": {
-                "melody_file_name": melody_object_name,
-                "song_status": "melody_generated",
-                "melody_generated_at": datetime.now()
-            }
-        })
+        melody_fields["melody_generated_at"] = datetime.now()
+        self._complete_stage(collection, song_id, "melody_generated", melody_fields, context)
         self._log_to_mongodb(f"Generated melody saved in MongoDB with ID: {song_id}", context, "INFO")
         self._log_to_mongodb("GenerateMelodyOperator execution completed", context, "INFO")
 
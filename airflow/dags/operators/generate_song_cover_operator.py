@@ -1,10 +1,22 @@
-from airflow.utils.decorators import apply_defaults
 from operators.base_custom_operator import BaseCustomOperator
+from operators import embedding_cache, inference_backends, quality_tiers
 from bson import ObjectId
-from diffusers import StableDiffusionPipeline
-import torch
 from datetime import datetime
+import importlib
 import tempfile
+import os
+
+# Inference backend of the Stable Diffusion UNet: "eager" or "onnx" (see operators.inference_backends)
+COVER_INFERENCE_BACKEND = os.environ.get("COVER_INFERENCE_BACKEND", "eager")
+
+# Widths of the precomputed cover variants, for list thumbnails up to full size
+COVER_VARIANT_WIDTHS = [128, 256, 512]
+# Formats of the precomputed cover variants; AVIF is skipped when Pillow cannot encode it
+COVER_VARIANT_FORMATS = {
+    "avif": {"content_type": "image/avif", "options": {"quality": 50}},
+    "webp": {"content_type": "image/webp", "options": {"quality": 75, "method": 6}},
+    "jpeg": {"content_type": "image/jpeg", "options": {"quality": 80, "optimize": True, "progressive": True}}
+}
 
 class GenerateSongCoverOperator(BaseCustomOperator):
     """
@@ -25,71 +37,174 @@ class GenerateSongCoverOperator(BaseCustomOperator):
     :param minio_bucket_name: MinIO bucket name for storing generated images.
     :type minio_bucket_name: str
     """
-    @apply_defaults
-    def __init__(
-        self,
-        *args, **kwargs
-    ):
-        super().__init__(*args, **kwargs)
-
-    def _generate_image_from_text(self,  song_text):
+
+    output_artifacts = ("cover",)
+
+    def _encode_prompt(self, pipe, song_text, checkpoint):
+        """
+        Encode the prompt and the empty negative prompt with the CLIP text encoder, reusing cached embeddings.
+
+        :param pipe: The Stable Diffusion pipeline.
+        :param song_text: Text description of the song.
+        :type song_text: str
+        :param checkpoint: The checkpoint the pipeline was loaded from.
+        :type checkpoint: str
+        :return: The prompt_embeds and negative_prompt_embeds arguments of the pipeline.
+        :rtype: dict
+        """
+        torch = importlib.import_module("torch")
+        numpy = importlib.import_module("numpy")
+        cache = embedding_cache.get_embedding_cache()
+        fingerprint = embedding_cache.model_fingerprint(checkpoint, pipe.text_encoder)
+
+        def embed(text):
+            def encode():
+                with torch.no_grad():
+                    return pipe.encode_prompt(text, pipe.device, 1, False)[0].cpu().numpy()
+            embeddings, _ = cache.get_or_compute(fingerprint, text, encode)
+            return torch.from_numpy(numpy.array(embeddings))
+
+        # The negative prompt is the empty string for every cover, so it is encoded once per cache
+        return {"prompt_embeds": embed(song_text), "negative_prompt_embeds": embed("")}
+
+    def _generate_image_from_text(self, song_text, settings=None):
         """
         Generate an image based on the provided text using the Stable Diffusion model.
 
         :param song_text: Text description of the song.
         :type song_text: str
+        :param settings: The cover settings of the song's quality tier (checkpoint, steps and resolution); the default tier's when None.
+        :type settings: dict
         :return: File path to the generated song cover image.
         :rtype: str
         """
+        settings = settings or quality_tiers.stage_settings(None, "cover")
+        checkpoint = settings["checkpoint"]
         # Load the Stable Diffusion model using the specified checkpoint
-        pipe = StableDiffusionPipeline.from_pretrained("runwayml/stable-diffusion-v1-5", torch_dtype=torch.float32)
+        torch = importlib.import_module("torch")
+        diffusers = importlib.import_module("diffusers")
+        with self._timed("model_load", model=checkpoint):
+            pipe = diffusers.StableDiffusionPipeline.from_pretrained(checkpoint, torch_dtype=torch.float32)
+        with self._timed("model_optimize", model=checkpoint):
+            pipe = inference_backends.optimize_model(pipe, COVER_INFERENCE_BACKEND, checkpoint)
+        with self._timed("text_encode", model=checkpoint):
+            prompt_kwargs = self._encode_prompt(pipe, song_text, checkpoint)
         # Generate an image based on the provided text using the model
-        image = pipe(song_text).images[0]
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
-            song_cover_image = temp_file.name
-            image.save(song_cover_image)
+        with self._timed("inference", model=checkpoint, profile=True):
+            image = pipe(
+                num_inference_steps=settings["num_inference_steps"],
+                height=settings["resolution"],
+                width=settings["resolution"],
+                **prompt_kwargs
+            ).images[0]
+        with self._timed("image_encode"):
+            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
+                song_cover_image = temp_file.name
+                image.save(song_cover_image)
         return song_cover_image
 
+    def _store_cover_variants(self, object_prefix, song_cover_image_file_path, context):
+        """
+        Encode resized variants of the cover in modern formats and store them in MinIO.
+
+        :param object_prefix: Prefix of the object names, as returned by _object_prefix.
+        :type object_prefix: str
+        :param song_cover_image_file_path: File path to the full size cover.
+        :type song_cover_image_file_path: str
+        :param context: The execution context.
+        :type context: dict
+        :return: The stored variants.
+        :rtype: list
+        """
+        Image = importlib.import_module("PIL.Image")
+        Image.init()
+        cover = Image.open(song_cover_image_file_path).convert("RGB")
+        song_cover_variants = []
+        for width in COVER_VARIANT_WIDTHS:
+            if width > cover.width:
+                continue
+            with self._timed("image_resize"):
+                resized_cover = cover.resize((width, max(1, round(cover.height * width / cover.width))), Image.LANCZOS)
+            for image_format, settings in COVER_VARIANT_FORMATS.items():
+                if image_format.upper() not in Image.SAVE:
+                    continue
+                with self._timed("image_encode"):
+                    with tempfile.NamedTemporaryFile(suffix=f".{image_format}", delete=False) as temp_file:
+                        variant_file_path = temp_file.name
+                        resized_cover.save(temp_file, format=image_format.upper(), **settings["options"])
+                variant_file_name = f"{object_prefix}_image_cover_{width}.{image_format}"
+                self._store_file_in_minio(
+                    local_file_path=variant_file_path,
+                    minio_object_name=variant_file_name,
+                    context=context,
+                    content_type=settings["content_type"])
+                song_cover_variants.append({
+                    "width": width,
+                    "format": image_format,
+                    "file_name": variant_file_name,
+                    "content_type": settings["content_type"],
+                    "size_bytes": os.path.getsize(variant_file_path)
+                })
+                os.remove(variant_file_path)
+        return song_cover_variants
+
     def execute(self, context):
         self._log_to_mongodb("Starting execution of GenerateSongCoverOperator", context, "INFO")
 
         # Retrieve song_id from the previous task using XCom
-        song_id = context['task_instance'].xcom_pull(task_ids='generate_voice_task')['song_id']
+        song_id = self._resolve_song_id(context, upstream_task_id='generate_voice_task')
         self._log_to_mongodb(f"Retrieved song_id: {song_id}", context, "INFO")
 
         # Get a reference to the MongoDB collection
         collection = self._get_mongodb_collection()
     
-        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
         song_text = song_info.get("song_text")
         self._log_to_mongodb(f"Retrieved song text for song_id: {song_id}", context, "INFO")
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
+
+        song_cover_name = f"{self._object_prefix(song_id, song_info)}_image_cover.jpg"
+
+        # A previous try may have stored the cover before failing; the variants are derived from it
+        cover_artifact = self._get_valid_artifact(song_info, "cover", context)
+        if cover_artifact:
+            self._log_to_mongodb(f"Reusing the song cover stored by a previous try for song_id: {song_id}", context, "INFO")
+            song_cover_image_file_path = self._fetch_artifact(cover_artifact, context, suffix=".jpg")
+        else:
+            try:
+                self._log_to_mongodb("Generating Song cover...", context, "INFO")
+                song_cover_image_file_path = self._generate_image_from_text(
+                    song_text, quality_tiers.stage_settings(song_info, "cover"))
+                self._log_to_mongodb("Song cover generated successfully", context, "INFO")
+            except Exception as e:
+                error_message = f"An error occurred while generating the song cover: {e}"
+                self._log_to_mongodb(error_message, context, "ERROR")
+                raise Exception(error_message)
+
+            # Store the generated .jpg file in MinIO
+            self._store_file_in_minio(
+                local_file_path=song_cover_image_file_path,
+                minio_object_name=song_cover_name,
+                context=context,
+                content_type="image/jpeg",
+                song_id=song_id,
+                artifact="cover")
 
+        # Variants only make list views lighter; the original cover is enough to go on
+        song_cover_variants = []
         try:
-            self._log_to_mongodb("Generating Song cover...", context, "INFO")
-            song_cover_image_file_path = self._generate_image_from_text(song_text)
-            self._log_to_mongodb("Song cover generated successfully", context, "INFO")
+            song_cover_variants = self._store_cover_variants(self._object_prefix(song_id, song_info), song_cover_image_file_path, context)
         except Exception as e:
-            error_message = f"An error occurred while generating the song cover: {e}"
-            self._log_to_mongodb(error_message, context, "ERROR")
-            raise Exception(error_message)
-        
-        song_cover_name = f"{song_id}_image_cover.jpg"
-        
-        # Store the generated .jpg file in MinIO
-        self._store_file_in_minio(
-            local_file_path=song_cover_image_file_path, 
-            minio_object_name=song_cover_name,
-            context=context, 
-            content_type="image/jpeg")
+            self._log_to_mongodb(f"Error generating the song cover variants: {e}", context, "ERROR")
 
         # Update the document with the song cover
-        collection.update_one({"_id": ObjectId(song_id)}, {
-            "$set": {
-                "song_cover_name": song_cover_name,
-                "song_status": "image_cover_generated",
-                "song_cover_generated_at": datetime.now()
-            }
-        })
+        self._complete_stage(collection, song_id, "image_cover_generated", {
+            "song_cover_name": song_cover_name,
+            "song_cover_variants": song_cover_variants,
+            "song_cover_generated_at": datetime.now()
+        }, context)
         self._log_to_mongodb("Updated MongoDB document with song cover", context, "INFO")
         self._log_to_mongodb("GenerateSongCoverOperator execution completed", context, "INFO")
 
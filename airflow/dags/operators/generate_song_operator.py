@@ -1,10 +1,25 @@
-from airflow.utils.decorators import apply_defaults
-from pydub import AudioSegment
 from operators.base_custom_operator import BaseCustomOperator
 from bson import ObjectId
 import tempfile
+import importlib
+import subprocess
+import json
+import os
 from datetime import datetime
 
+# ffmpeg binary used to encode the renditions of the final song
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+# Renditions encoded next to the original mix so listeners on slow links can stream fewer bytes
+SONG_RENDITIONS = [
+    {"name": "opus_48", "codec": "libopus", "bitrate_kbps": 48, "format": "ogg", "extension": "opus", "content_type": "audio/ogg; codecs=opus"},
+    {"name": "opus_96", "codec": "libopus", "bitrate_kbps": 96, "format": "ogg", "extension": "opus", "content_type": "audio/ogg; codecs=opus"},
+    {"name": "aac_128", "codec": "aac", "bitrate_kbps": 128, "format": "mp4", "extension": "m4a", "content_type": "audio/mp4"}
+]
+
+# Bitrate of the preview clip served to list views
+PREVIEW_BITRATE = "32k"
+
 class GenerateSongOperator(BaseCustomOperator):
 
     """
@@ -25,26 +40,225 @@ class GenerateSongOperator(BaseCustomOperator):
     :param minio_bucket_name: MinIO bucket name.
     :type minio_bucket_name: str
     """
-    @apply_defaults
-    def __init__(
-        self,
-        *args, **kwargs
-    ):
-        super().__init__(*args, **kwargs)
+
+    input_artifacts = ("melody", "voice")
+    output_artifacts = ("final_song",)
+
+    def _mix_tracks(self, melody, voice):
+        """
+        Mix the voice over the melody, padding the shorter track with silence.
+
+        :param melody: The melody track.
+        :type melody: pydub.AudioSegment
+        :param voice: The voice track.
+        :type voice: pydub.AudioSegment
+        :return: The combined audio.
+        :rtype: pydub.AudioSegment
+        """
+        AudioSegment = importlib.import_module("pydub").AudioSegment
+        # Try to normalize the voice in order to improve the audio quality
+        voice = voice.normalize()
+        fade_duration = 100
+        voice = voice.fade_in(fade_duration).fade_out(fade_duration)
+
+        amplification_factor = 5.0
+        melody = melody + amplification_factor
+        voice = voice + amplification_factor
+        # Resample the audio to match the same sample rate and channels
+        voice = voice.set_frame_rate(melody.frame_rate)
+        voice = voice.set_channels(melody.channels)
+
+        # Ensure both audio files have the same duration
+        if len(voice) > len(melody):
+            melody += AudioSegment.silent(duration=len(voice) - len(melody))
+        else:
+            voice += AudioSegment.silent(duration=len(melody) - len(voice))
+
+        # Combine the melody and voice
+        combined_audio = melody.overlay(voice)
+        return combined_audio
+
+    def _mix_stats(self, melody, voice):
+        """
+        Durations of both tracks and the silence added to the shorter one when they are mixed.
+
+        :param melody: The melody track.
+        :type melody: pydub.AudioSegment
+        :param voice: The voice track.
+        :type voice: pydub.AudioSegment
+        :return: The durations in milliseconds and the share of the song that is padding.
+        :rtype: dict
+        """
+        padding_ms = abs(len(melody) - len(voice))
+        song_ms = max(len(melody), len(voice))
+        return {
+            "melody_ms": len(melody),
+            "voice_ms": len(voice),
+            "padding_ms": padding_ms,
+            "padded_track": "voice" if len(melody) > len(voice) else "melody" if padding_ms else None,
+            "padding_ratio": round(padding_ms / song_ms, 4) if song_ms else 0.0
+        }
+
+    def _start_rendition_encoders(self, master_file_path, output_dir):
+        """
+        Launch one ffmpeg process per rendition, all running in parallel.
+
+        :param master_file_path: Path of the lossless WAV master of the song.
+        :type master_file_path: str
+        :param output_dir: Directory where the renditions are written.
+        :type output_dir: str
+        :return: (rendition, output path, process) tuples.
+        :rtype: list
+        """
+        encoders = []
+        for rendition in SONG_RENDITIONS:
+            output_path = os.path.join(output_dir, f"{rendition['name']}.{rendition['extension']}")
+            command = [
+                FFMPEG_BINARY, "-y", "-loglevel", "error", "-threads", "1",
+                "-i", master_file_path, "-vn",
+                "-c:a", rendition["codec"], "-b:a", f"{rendition['bitrate_kbps']}k"
+            ]
+            if rendition["format"] == "mp4":
+                # Put the index first so playback can start before the whole file is downloaded
+                command += ["-movflags", "+faststart"]
+            command += ["-f", rendition["format"], output_path]
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            encoders.append((rendition, output_path, process))
+        return encoders
+
+    def _wait_for_rendition_encoders(self, encoders):
+        """
+        Wait for every rendition encoder to finish.
+
+        :param encoders: The encoders returned by _start_rendition_encoders.
+        :type encoders: list
+        :return: (rendition, output path, return code, stderr) tuples.
+        :rtype: list
+        """
+        encoded_renditions = []
+        for rendition, output_path, process in encoders:
+            _, stderr = process.communicate()
+            encoded_renditions.append((rendition, output_path, process.returncode, stderr))
+        return encoded_renditions
+
+    def _store_renditions(self, object_prefix, encoded_renditions, context):
+        """
+        Store every successfully encoded rendition in MinIO.
+
+        A failed rendition is logged and skipped: the original mix is always available.
+
+        :param object_prefix: Prefix of the object names, as returned by _object_prefix.
+        :type object_prefix: str
+        :param encoded_renditions: The results returned by _wait_for_rendition_encoders.
+        :type encoded_renditions: list
+        :param context: The execution context.
+        :type context: dict
+        :return: The stored renditions, keyed by name.
+        :rtype: dict
+        """
+        song_renditions = {}
+        for rendition, output_path, returncode, stderr in encoded_renditions:
+            if returncode != 0 or not os.path.exists(output_path):
+                self._log_to_mongodb(f"Error encoding rendition {rendition['name']}: {stderr.decode(errors='replace').strip()}", context, "ERROR")
+                continue
+            rendition_file_name = f"{object_prefix}_final_song_{rendition['name']}.{rendition['extension']}"
+            self._store_file_in_minio(
+                local_file_path=output_path,
+                minio_object_name=rendition_file_name,
+                context=context,
+                content_type=rendition["content_type"])
+            song_renditions[rendition["name"]] = {
+                "name": rendition["name"],
+                "file_name": rendition_file_name,
+                "content_type": rendition["content_type"],
+                "extension": rendition["extension"],
+                "bitrate_kbps": rendition["bitrate_kbps"],
+                "size_bytes": os.path.getsize(output_path)
+            }
+        return song_renditions
+
+    def _store_waveforms(self, object_prefix, tracks, context):
+        """
+        Compute the waveform peaks of every track and store them in MinIO as small JSON files.
+
+        :param object_prefix: Prefix of the object names, as returned by _object_prefix.
+        :type object_prefix: str
+        :param tracks: The tracks keyed by name (melody, voice, song).
+        :type tracks: dict
+        :param context: The execution context.
+        :type context: dict
+        :return: The object names of the stored waveforms, keyed by track.
+        :rtype: dict
+        """
+        waveform = importlib.import_module("operators.waveform")
+        song_waveforms = {}
+        for track_name, track in tracks.items():
+            with self._timed("waveform_peaks"):
+                peaks = waveform.compute_peaks(track)
+                with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as waveform_temp_file:
+                    waveform_temp_file_path = waveform_temp_file.name
+                    json.dump(peaks, waveform_temp_file, separators=(",", ":"))
+            waveform_file_name = f"{object_prefix}_waveform_{track_name}.json"
+            self._store_file_in_minio(
+                local_file_path=waveform_temp_file_path,
+                minio_object_name=waveform_file_name,
+                context=context,
+                content_type="application/json")
+            os.remove(waveform_temp_file_path)
+            song_waveforms[track_name] = waveform_file_name
+        return song_waveforms
+
+    def _store_preview(self, object_prefix, combined_audio, context):
+        """
+        Cut a short low bitrate preview from the loudest part of the song and store it in MinIO.
+
+        :param object_prefix: Prefix of the object names, as returned by _object_prefix.
+        :type object_prefix: str
+        :param combined_audio: The final song.
+        :type combined_audio: pydub.AudioSegment
+        :param context: The execution context.
+        :type context: dict
+        :return: The preview description stored in the song document.
+        :rtype: dict
+        """
+        waveform = importlib.import_module("operators.waveform")
+        with self._timed("preview_encode"):
+            start_ms = waveform.loudest_window_start(combined_audio)
+            preview = combined_audio[start_ms:start_ms + waveform.PREVIEW_DURATION_MS].fade_in(500).fade_out(500)
+            with tempfile.NamedTemporaryFile(suffix=".opus", delete=False) as preview_temp_file:
+                preview_temp_file_path = preview_temp_file.name
+            preview.export(preview_temp_file_path, format="ogg", codec="libopus", bitrate=PREVIEW_BITRATE)
+        preview_file_name = f"{object_prefix}_preview.opus"
+        self._store_file_in_minio(
+            local_file_path=preview_temp_file_path,
+            minio_object_name=preview_file_name,
+            context=context,
+            content_type="audio/ogg; codecs=opus")
+        os.remove(preview_temp_file_path)
+        return {
+            "file_name": preview_file_name,
+            "content_type": "audio/ogg; codecs=opus",
+            "start_seconds": start_ms / 1000,
+            "duration_seconds": len(preview) / 1000
+        }
 
     def execute(self, context):
         self._log_to_mongodb("Starting execution of GenerateSongOperator", context, "INFO")
 
         # Retrieve melody_id from the previous task using XCom
-        song_id = context['task_instance'].xcom_pull(task_ids='generate_voice_task')['song_id']
+        song_id = self._resolve_song_id(context, upstream_task_id='generate_melody_task')
         self._log_to_mongodb(f"Retrieved song_id: {song_id}", context, "INFO")
 
         # Get a reference to the MongoDB collection
         collection = self._get_mongodb_collection()
 
-        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
         melody_file_name = song_info.get("melody_file_name")
         voice_file_name = song_info.get("voice_file_name")
+        object_prefix = self._object_prefix(song_id, song_info)
 
         self._log_to_mongodb(f"Retrieved melody WAV and voice audio paths for song_id: {song_id}", context, "INFO")
 
@@ -52,67 +266,82 @@ class GenerateSongOperator(BaseCustomOperator):
         minio_client = self._get_minio_client(context)
 
         try:
-            melody_file_data = minio_client.get_object(self.minio_bucket_name, melody_file_name)
-            voice_file_data = minio_client.get_object(self.minio_bucket_name, voice_file_name)
-
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as melody_temp_file:
-                melody_temp_file_path = melody_temp_file.name
-                melody_temp_file.write(melody_file_data.read())
-
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as voice_temp_file:
-                voice_temp_file_path = voice_temp_file.name
-                voice_temp_file.write(voice_file_data.read())
-
-            # Load the files using the file paths
-            melody = AudioSegment.from_file(melody_temp_file_path, format="wav")
-            voice = AudioSegment.from_file(voice_temp_file_path, format="wav")
-
-            # Try to normalize the voice in order to improve the audio quality
-            voice = voice.normalize()
-            fade_duration = 100
-            voice = voice.fade_in(fade_duration).fade_out(fade_duration)
-
-            amplification_factor = 5.0
-            melody = melody + amplification_factor
-            voice = voice + amplification_factor
-            # Resample the audio to match the same sample rate and channels
-            voice = voice.set_frame_rate(melody.frame_rate)
-            voice = voice.set_channels(melody.channels)
-
-            # Ensure both audio files have the same duration
-            if len(voice) > len(melody):
-                melody += AudioSegment.silent(duration=len(voice) - len(melody))
-            else:
-                voice += AudioSegment.silent(duration=len(melody) - len(voice))
-
-            # Combine the melody and voice
-            combined_audio = melody.overlay(voice)
+            with self._timed("minio_download"):
+                melody_file_data = minio_client.get_object(self.minio_bucket_name, melody_file_name)
+                voice_file_data = minio_client.get_object(self.minio_bucket_name, voice_file_name)
+
+                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as melody_temp_file:
+                    melody_temp_file_path = melody_temp_file.name
+                    melody_bytes = melody_file_data.read()
+                    melody_temp_file.write(melody_bytes)
+
+                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as voice_temp_file:
+                    voice_temp_file_path = voice_temp_file.name
+                    voice_bytes = voice_file_data.read()
+                    voice_temp_file.write(voice_bytes)
+            self._get_stage_timer().add_bytes("download", len(melody_bytes) + len(voice_bytes))
+
+            with self._timed("wav_decode"):
+                AudioSegment = importlib.import_module("pydub").AudioSegment
+                # Load the files using the file paths
+                melody = AudioSegment.from_file(melody_temp_file_path, format="wav")
+                voice = AudioSegment.from_file(voice_temp_file_path, format="wav")
+
+            with self._timed("mixing"):
+                song_mix = self._mix_stats(melody, voice)
+                combined_audio = self._mix_tracks(melody, voice)
             self._log_to_mongodb("Audio files combined", context, "INFO")
 
-            # Export the combined audio as bytes
-            with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as combined_audio_temp_file:
-                combined_audio_temp_file_path = combined_audio_temp_file.name
-                combined_audio.export(combined_audio_temp_file_path, format="mp4")
+            renditions_dir = tempfile.TemporaryDirectory()
+            try:
+                # Export the combined audio as bytes, encoding the renditions from a lossless master meanwhile
+                with self._timed("audio_encode"):
+                    master_file_path = os.path.join(renditions_dir.name, "master.wav")
+                    combined_audio.export(master_file_path, format="wav")
+                    try:
+                        encoders = self._start_rendition_encoders(master_file_path, renditions_dir.name)
+                    except OSError as e:
+                        self._log_to_mongodb(f"Error starting the rendition encoders: {e}", context, "ERROR")
+                        encoders = []
+                    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as combined_audio_temp_file:
+                        combined_audio_temp_file_path = combined_audio_temp_file.name
+                        combined_audio.export(combined_audio_temp_file_path, format="mp4")
+                    encoded_renditions = self._wait_for_rendition_encoders(encoders)
+
+                song_renditions = self._store_renditions(object_prefix, encoded_renditions, context)
+            finally:
+                renditions_dir.cleanup()
 
-            final_song_name = f"{song_id}_final_song.mp4"
+            final_song_name = f"{object_prefix}_final_song.mp4"
 
             # Store the generated file in MinIO
             self._store_file_in_minio(
                 local_file_path=combined_audio_temp_file_path, 
                 minio_object_name=final_song_name,
-                context=context, 
-                content_type="audio/mpeg")
+                context=context,
+                content_type="audio/mp4",
+                song_id=song_id,
+                artifact="final_song")
 
             self._log_to_mongodb(f"Combined audio stored in MinIO for song_id: {song_id}", context, "INFO")
 
+            # Waveforms and preview are conveniences for list views; the song is complete without them
+            song_waveforms, song_preview = None, None
+            try:
+                song_waveforms = self._store_waveforms(object_prefix, {"melody": melody, "voice": voice, "song": combined_audio}, context)
+                song_preview = self._store_preview(object_prefix, combined_audio, context)
+            except Exception as e:
+                self._log_to_mongodb(f"Error generating the waveforms or the preview: {e}", context, "ERROR")
+
             # Update the document in MongoDB
-            collection.update_one({"_id": ObjectId(song_id)}, {
-                "$set": {
-                    "final_song_name": final_song_name,
-                    "song_status": "final_song_generated",
-                    "final_song_generated_at": datetime.now()
-                }
-            })
+            self._complete_stage(collection, song_id, "final_song_generated", {
+                "final_song_name": final_song_name,
+                "song_renditions": song_renditions,
+                "song_waveforms": song_waveforms,
+                "song_preview": song_preview,
+                "song_mix": song_mix,
+                "final_song_generated_at": datetime.now()
+            }, context)
             self._log_to_mongodb("GenerateSongOperator execution completed", context, "INFO")
 
         except Exception as e:
@@ -1,11 +1,26 @@
-from airflow.utils.decorators import apply_defaults
 from operators.base_custom_operator import BaseCustomOperator
+from operators import inference_backends, quality_tiers
 from bson import ObjectId
 import importlib
-import scipy
+import hashlib
 import tempfile
+import time
+import re
+import os
 from datetime import datetime
 
+# Inference backend of Bark: "eager" or "int8" (see operators.inference_backends)
+VOICE_INFERENCE_BACKEND = os.environ.get("VOICE_INFERENCE_BACKEND", "eager")
+
+# Synthesize the voice segment by segment, publishing every segment as soon as it is decoded
+VOICE_PROGRESSIVE = os.environ.get("VOICE_PROGRESSIVE", "false").lower() == "true"
+# Characters of lyrics per segment; Bark generates about 13 seconds of audio per call
+VOICE_SEGMENT_MAX_CHARS = int(os.environ.get("VOICE_SEGMENT_MAX_CHARS", 220))
+
+# Object of each published segment: raw 16-bit little-endian mono PCM, concatenated by the streaming API
+VOICE_PART_OBJECT_INFIX = "_voice_part_"
+VOICE_PART_CONTENT_TYPE = "audio/L16"
+
 class GenerateVoiceOperator(BaseCustomOperator):
 
     """
@@ -24,84 +39,278 @@ class GenerateVoiceOperator(BaseCustomOperator):
         :param minio_secret_key: MinIO server secret key.
         :param minio_bucket_name: MinIO bucket name for storing speech files.
     """
-    @apply_defaults
-    def __init__(
-        self,
-        *args, **kwargs
-    ):
-        super().__init__(*args, **kwargs)
 
+    output_artifacts = ("voice",)
+
+    def _load_voice_model(self, settings=None):
+        """
+        Load the Bark variant of the song's quality tier with its processor.
+
+        Args:
+            settings (dict, optional): The voice settings of the song's quality tier; the default tier's when None.
+
+        Returns:
+            tuple: The processor, the model and the checkpoint.
+        """
+        checkpoint = (settings or quality_tiers.stage_settings(None, "voice"))["checkpoint"]
+        transformers = importlib.import_module("transformers")
+        with self._timed("model_load", model=checkpoint):
+            processor = transformers.AutoProcessor.from_pretrained(checkpoint)
+            model = transformers.BarkModel.from_pretrained(checkpoint)
+        with self._timed("model_optimize", model=checkpoint):
+            model = inference_backends.optimize_model(model, VOICE_INFERENCE_BACKEND, checkpoint)
+        return processor, model, checkpoint
 
-    def _generate_voice(self, song_text): 
+    def _synthesize(self, processor, model, checkpoint, song_text):
+        """
+        Generate the voice of a text with Bark, through its semantic, coarse and fine token stages.
+
+        The text is wrapped in the musical note symbol "♪", a cue for Bark to sing it rather than
+        speak it, so the generated audio stays coherent with the musical context.
+
+        Args:
+            processor: The Bark processor.
+            model: The Bark model.
+            checkpoint (str): The checkpoint of the model.
+            song_text (str): The text to sing.
+
+        Returns:
+            numpy.ndarray: The audio samples.
+        """
+        inputs = processor('♪' + song_text + '♪')
+        with self._timed("inference", model=checkpoint, profile=True):
+            audio_array = model.generate(**inputs)
+        return audio_array.cpu().numpy().squeeze()
+
+    def _write_wav(self, audio_array, sample_rate):
+        """
+        Write audio samples to a temporary WAV file.
+
+        Args:
+            audio_array (numpy.ndarray): The audio samples.
+            sample_rate (int): The sample rate.
+
+        Returns:
+            str: The path of the file.
+        """
+        with self._timed("wav_encode"):
+            wavfile = importlib.import_module("scipy.io.wavfile")
+            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                wav_file_path = temp_file.name
+                wavfile.write(wav_file_path, rate=sample_rate, data=audio_array)
+        return wav_file_path
+
+    def _generate_voice(self, song_text, settings=None):
         """
         Generates voice from a given song text using the 'suno/bark' model.
         
         Args:
             song_text (str): The text of the song to be transformed into voice, which starts and ends with the musical note symbol "♪."
+            settings (dict, optional): The voice settings of the song's quality tier, selecting the Bark variant; the default tier's when None.
         
         Returns:
-            str: The name of the generated voice audio file.
+            tuple: The name of the generated voice audio file and its duration in seconds.
 
         This method uses the 'suno/bark' model from the Transformers library to convert the provided song text into voice. 
         The input song_text is expected to start and end with "♪," indicating the beginning and end of a musical performance. 
         By including these symbols, you provide explicit cues for the model to generate audio that is coherent with the musical context, 
         ensuring a smoother transition in the generated voice. The resulting audio is saved as a WAV file with a name based on the `song_id`.
 
-        Returns the name of the generated voice audio file, which can be used to reference the stored audio.
+        Returns the name of the generated voice audio file, which can be used to reference the stored audio,
+        and its duration, which sizes the melody generated afterwards.
         """
-        # Add '♪' at the beginning and end of the song_text
-        song_text_with_symbols = '♪' + song_text + '♪'
-        transformers = importlib.import_module("transformers")
-        processor = transformers.AutoProcessor.from_pretrained("suno/bark")
-        model = transformers.BarkModel.from_pretrained("suno/bark")
-        inputs = processor(song_text_with_symbols)
-        audio_array = model.generate(**inputs)
-        audio_array = audio_array.cpu().numpy().squeeze()
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            wav_file_path = temp_file.name
-            sample_rate = model.generation_config.sample_rate
-            scipy.io.wavfile.write(wav_file_path, rate=sample_rate, data=audio_array)
-        return wav_file_path
+        processor, model, checkpoint = self._load_voice_model(settings)
+        audio_array = self._synthesize(processor, model, checkpoint, song_text)
+        sample_rate = model.generation_config.sample_rate
+        return self._write_wav(audio_array, sample_rate), len(audio_array) / sample_rate
+
+    def _split_song_text(self, song_text):
+        """
+        Split the lyrics into segments of at most VOICE_SEGMENT_MAX_CHARS characters, at line breaks
+        when possible and at word boundaries otherwise.
+
+        Args:
+            song_text (str): The lyrics.
+
+        Returns:
+            list: The segments, in order.
+        """
+        segments = []
+        current = ""
+        for line in re.split(r"[\r\n]+", song_text):
+            for word in line.split():
+                if current and len(current) + 1 + len(word) > VOICE_SEGMENT_MAX_CHARS:
+                    segments.append(current)
+                    current = word
+                else:
+                    current = f"{current} {word}" if current else word
+            # Close the segment at the end of a line once it is half full, so lines are sung whole
+            if len(current) >= VOICE_SEGMENT_MAX_CHARS // 2:
+                segments.append(current)
+                current = ""
+        if current:
+            segments.append(current)
+        return segments or [song_text]
+
+    def _generate_voice_progressively(self, song_id, song_info, settings, collection, context, started_at):
+        """
+        Generate the voice one segment of lyrics at a time, publishing each segment to MinIO and
+        recording it in `voice_progress` of the song document as soon as it is decoded, so the
+        streaming API can play the voice while the rest is still being synthesized.
+
+        Segments published by a previous try are reused when the lyrics and the checkpoint are unchanged.
+
+        Args:
+            song_id (str): The song ID.
+            song_info (dict): The song document.
+            settings (dict): The voice settings of the song's quality tier.
+            collection (pymongo.collection.Collection): The songs collection.
+            context (dict): The Airflow task context.
+            started_at (float): time.monotonic() when the task started.
+
+        Returns:
+            tuple: The path of the WAV file of the whole voice, its duration in seconds and the
+            seconds from the start of the task to the first published segment.
+        """
+        np = importlib.import_module("numpy")
+        segments = self._split_song_text(song_info.get("song_text") or "")
+        processor, model, checkpoint = self._load_voice_model(settings)
+        sample_rate = model.generation_config.sample_rate
+        digest = hashlib.sha256("\0".join([checkpoint, str(sample_rate)] + segments).encode()).hexdigest()
+        minio_client = self._get_minio_client(context)
+
+        progress = song_info.get("voice_progress") or {}
+        parts = progress.get("parts", []) if progress.get("digest") == digest else []
+        first_audio_seconds = progress.get("first_audio_seconds") if parts else None
+        audio_segments = []
+        if parts:
+            self._log_to_mongodb(f"Reusing {len(parts)} of {len(segments)} voice segments stored by a previous try", context, "INFO")
+            with self._timed("minio_download"):
+                for part in parts:
+                    response = minio_client.get_object(self.minio_bucket_name, part["object_name"])
+                    try:
+                        audio_segments.append(np.frombuffer(response.read(), dtype="<i2").astype(np.float32) / 32767)
+                    finally:
+                        response.close()
+                        response.release_conn()
+        else:
+            collection.update_one({"_id": ObjectId(song_id)}, {"$set": {"voice_progress": {
+                "digest": digest,
+                "sample_rate": sample_rate,
+                "segments_total": len(segments),
+                "segments_done": 0,
+                "parts": []
+            }}})
+
+        for index in range(len(parts), len(segments)):
+            audio_array = self._synthesize(processor, model, checkpoint, segments[index])
+            audio_segments.append(audio_array)
+            pcm = (np.clip(audio_array, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+            object_name = f"{self._object_prefix(song_id, song_info)}{VOICE_PART_OBJECT_INFIX}{index:03d}.pcm"
+            # Published like every other artifact, under a temporary name first, so a try dying
+            # mid-upload never leaves a truncated segment under the name the listeners read
+            with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as segment_file:
+                segment_file.write(pcm)
+            try:
+                self._store_file_in_minio(segment_file.name, object_name, context, content_type=VOICE_PART_CONTENT_TYPE)
+            finally:
+                os.remove(segment_file.name)
+            progress_fields = {"voice_progress.segments_done": index + 1}
+            if first_audio_seconds is None:
+                first_audio_seconds = time.monotonic() - started_at
+                progress_fields["voice_progress.first_audio_seconds"] = first_audio_seconds
+            with self._timed("mongo_write"):
+                collection.update_one({"_id": ObjectId(song_id)}, {
+                    "$set": progress_fields,
+                    "$push": {"voice_progress.parts": {
+                        "object_name": object_name,
+                        "samples": len(audio_array),
+                        "duration_seconds": len(audio_array) / sample_rate
+                    }}
+                })
+            self._log_to_mongodb(f"Voice segment {index + 1}/{len(segments)} published for '{song_id}'", context, "INFO")
+
+        audio_array = np.concatenate(audio_segments)
+        return self._write_wav(audio_array, sample_rate), len(audio_array) / sample_rate, first_audio_seconds
+
+    def _measure_voice(self, voice_artifact, context):
+        """
+        Measure the duration of a voice stored by a previous try.
+
+        Args:
+            voice_artifact (dict): The artifact record of the voice.
+            context (dict): The Airflow task context.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        voice_file_path = self._fetch_artifact(voice_artifact, context, suffix=".wav")
+        try:
+            sample_rate, audio_array = importlib.import_module("scipy.io.wavfile").read(voice_file_path, mmap=True)
+            return len(audio_array) / sample_rate
+        finally:
+            os.remove(voice_file_path)
 
     def execute(self, context):
-        # Retrieve song_id from the previous task using XCom
-        song_id = context['task_instance'].xcom_pull(task_ids='generate_melody_task')['song_id']
+        started_at = time.monotonic()
+        # Get the song_info_id from the task arguments or the DAG run configuration
+        song_id = self._resolve_song_id(context)
         self._log_to_mongodb(f"Retrieved song_id: {song_id}", context, "INFO")
 
         collection = self._get_mongodb_collection()
         self._log_to_mongodb(f"Connected to MongoDB", context, "INFO")
 
-        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
         song_text = song_info.get("song_text")
         self._log_to_mongodb(f"Retrieved song_text from MongoDB: {song_text}", context, "INFO")
-            
-        try:
-            self._log_to_mongodb(f"Generated speech using Suno Bark", context, "INFO")
-            voice_file_path = self._generate_voice(song_text)
-            self._log_to_mongodb("Voice generated successfully", context, "INFO")
-        except Exception as e:
-            error_message = f"An error occurred while generating the voice: {e}"
-            self._log_to_mongodb(error_message, context, "ERROR")
-            raise Exception(error_message)
-            
-        self._log_to_mongodb(f"Storing voice in MinIO for '{song_id}'", context, "INFO")
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
+
+        voice_file_name = f"{self._object_prefix(song_id, song_info)}_voice.wav"
+
+        # A previous try may have stored the voice before failing; reuse it instead of generating it again
+        voice_artifact = self._get_valid_artifact(song_info, "voice", context)
+        if voice_artifact:
+            self._log_to_mongodb(f"Reusing the voice stored by a previous try for '{song_id}'", context, "INFO")
+            voice_duration_seconds = self._measure_voice(voice_artifact, context)
+            first_audio_seconds = (song_info.get("voice_progress") or {}).get("first_audio_seconds")
+        else:
+            try:
+                self._log_to_mongodb(f"Generated speech using Suno Bark", context, "INFO")
+                if VOICE_PROGRESSIVE:
+                    voice_file_path, voice_duration_seconds, first_audio_seconds = self._generate_voice_progressively(
+                        song_id, song_info, quality_tiers.stage_settings(song_info, "voice"), collection, context, started_at)
+                else:
+                    voice_file_path, voice_duration_seconds = self._generate_voice(
+                        song_text, quality_tiers.stage_settings(song_info, "voice"))
+                self._log_to_mongodb("Voice generated successfully", context, "INFO")
+            except Exception as e:
+                error_message = f"An error occurred while generating the voice: {e}"
+                self._log_to_mongodb(error_message, context, "ERROR")
+                raise Exception(error_message)
+
+            self._log_to_mongodb(f"Storing voice in MinIO for '{song_id}'", context, "INFO")
 
-        voice_file_name = f"{song_id}_voice.wav"
-        # Store the generated .wav file in MinIO
-        self._store_file_in_minio(
-            local_file_path=voice_file_path, 
-            minio_object_name=voice_file_name,
-            context=context, 
-            content_type="audio/wav")
+            # Store the generated .wav file in MinIO
+            self._store_file_in_minio(
+                local_file_path=voice_file_path,
+                minio_object_name=voice_file_name,
+                context=context,
+                content_type="audio/wav",
+                song_id=song_id,
+                artifact="voice")
+            if not VOICE_PROGRESSIVE:
+                # Nothing can be played before the whole voice is stored
+                first_audio_seconds = time.monotonic() - started_at
 
         # Update the document in MongoDB
-        collection.update_one({"_id": ObjectId(song_id)}, {
-            "$set": {
-                "voice_file_name": voice_file_name,
-                "song_status": "voice_generated",
-                "voice_generated_at": datetime.now()
-            }
-        })
+        self._complete_stage(collection, song_id, "voice_generated", {
+            "voice_file_name": voice_file_name,
+            "voice_duration_seconds": voice_duration_seconds,
+            "voice_first_audio_seconds": first_audio_seconds,
+            "voice_generated_at": datetime.now()
+        }, context)
         self._log_to_mongodb(f"Updated MongoDB document with voice_file_name: {voice_file_name}", context, "INFO")
         self._log_to_mongodb(f"Updated MongoDB document with ID: {song_id}", context, "INFO")
         return {"song_id": str(song_id)}
@@ -1,12 +1,11 @@
-from elasticsearch import Elasticsearch
-from airflow.utils.decorators import apply_defaults
 from operators.base_custom_operator import BaseCustomOperator
+import vector_index
 from bson import ObjectId
 from datetime import datetime
+import importlib
 
 class IndexToElasticsearchOperator(BaseCustomOperator):
 
-    @apply_defaults
     def __init__(
         self, 
         elasticsearch_host,
@@ -19,34 +18,60 @@ class IndexToElasticsearchOperator(BaseCustomOperator):
     def execute(self, context):
         self._log_to_mongodb(f"Starting execution of IndexToElasticsearchOperator", context, "INFO")
 
-        # Get the configuration passed to the DAG from the execution context
-        dag_run_conf = context['dag_run'].conf
-
-        # Get the song_info_id from the configuration
-        song_id = dag_run_conf['song_id']
+        # Get the song_info_id from the task arguments or the DAG run configuration
+        song_id = self._resolve_song_id(context)
 
         # Retrieve song text from MongoDB based on song_id
         collection = self._get_mongodb_collection()
-        song_info = collection.find_one({"_id": ObjectId(song_id)})
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
         song_text = song_info.get('song_text')
 
         # Index the song text in Elasticsearch
-        self._index_song_text_to_elasticsearch(song_id, song_text)
+        with self._timed("elasticsearch_index"):
+            self._index_song_text_to_elasticsearch(song_id, song_text)
+
+        # Append the lyric embedding to the vector index of the semantic search
+        if vector_index.VECTOR_INDEX_DIR:
+            self._index_song_text_embedding(song_id, song_text, context)
 
         # Update the document in MongoDB
-        collection.update_one({"_id": ObjectId(song_id)}, {
-            "$set": {
-                "song_status": "song_indexed",
-                "song_indexed_at": datetime.now()
-            }
-        })
+        self._complete_stage(collection, song_id, "song_indexed", {
+            "song_indexed_at": datetime.now()
+        }, context)
         self._log_to_mongodb(f"Updated MongoDB document with ID: {song_id}", context, "INFO")
         self._log_to_mongodb(f"Indexing completed for song ID: {song_id}", context, "INFO")
 
+        return {"song_id": str(song_id)}
+
     def _index_song_text_to_elasticsearch(self, song_id, song_text):
-        es = Elasticsearch(self.elasticsearch_host)
+        elasticsearch = importlib.import_module("elasticsearch")
+        es = elasticsearch.Elasticsearch(self.elasticsearch_host)
         document = {
             'song_id': song_id,
             'song_text': song_text
         }
-        es.index(index=self.elasticsearch_index, doc_type='_doc', body=document)
\ No newline at end of file
+        # Indexed by song ID, so a retried task replaces the document instead of adding a duplicate
+        es.index(index=self.elasticsearch_index, doc_type='_doc', id=song_id, body=document)
+
+    def _index_song_text_embedding(self, song_id, song_text, context):
+        """
+        Embed the lyrics of a song and append them to the vector index shared with the API.
+
+        :param song_id: The song ID.
+        :type song_id: str
+        :param song_text: The lyrics.
+        :type song_text: str
+        :param context: The execution context.
+        """
+        encoder = vector_index.LyricEncoder()
+        with self._timed("model_load", model=encoder.model_name):
+            encoder.load()
+        with self._timed("lyric_embedding", model=encoder.model_name):
+            embedding = encoder.encode([song_text])
+        with self._timed("vector_index_append"):
+            # A retried task appends a row superseding the previous one
+            rows = vector_index.VectorIndex(vector_index.VECTOR_INDEX_DIR, model=encoder.model_name).append([str(song_id)], embedding)
+        self._log_to_mongodb(f"Appended the lyric embedding of song ID {song_id} to the vector index ({rows} rows)", context, "INFO")
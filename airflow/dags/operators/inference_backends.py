@@ -0,0 +1,211 @@
+"""
+Optimized CPU inference backends for the model stages.
+
+- `eager`: the PyTorch models as loaded by `transformers`/`diffusers`.
+- `int8`: dynamic int8 quantization of the linear layers. Meant for MusicGen and Bark, whose
+  autoregressive generation loop stays in `transformers` and whose cost is in the decoder matmuls.
+- `onnx`: the Stable Diffusion UNet, which runs twice per denoising step, exported to ONNX and run
+  by ONNX Runtime with every graph optimization enabled (operator fusion, constant folding). The
+  text encoder and the VAE run once per cover and stay in PyTorch.
+
+The exported UNet is cached in EXPORTED_MODELS_DIR under a key derived from the checkpoint and the
+UNet configuration, so only the first task of a worker pays the export. Run as a module to export
+it ahead of time:
+
+    python -m operators.inference_backends export
+"""
+from types import SimpleNamespace
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import tempfile
+
+# Directory holding the exported models, one subdirectory per checkpoint and configuration
+EXPORTED_MODELS_DIR = os.environ.get(
+    "EXPORTED_MODELS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "lyricwave", "exported_models")
+)
+
+# ONNX opset of the exported graphs
+ONNX_OPSET = 14
+
+# Length of the CLIP text embeddings the UNet is conditioned on
+TEXT_SEQUENCE_LENGTH = 77
+
+
+def quantize_int8(model):
+    """
+    Quantize the linear layers of a model to int8, with activations quantized on the fly.
+
+    :param model: The PyTorch model, quantized in place.
+    :type model: torch.nn.Module
+    :return: The quantized model.
+    :rtype: torch.nn.Module
+    """
+    torch = importlib.import_module("torch")
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class OnnxUNet:
+    """
+    Stand-in for the UNet of a diffusers pipeline running an exported ONNX graph.
+
+    Keeps the configuration of the replaced UNet, which the pipeline reads to prepare the latents.
+    The extra conditioning arguments (timestep_cond, added_cond_kwargs...) are not used by
+    Stable Diffusion 1.x and are ignored.
+
+    :param session: The ONNX Runtime session of the exported UNet.
+    :type session: onnxruntime.InferenceSession
+    :param unet: The PyTorch UNet it replaces.
+    :type unet: diffusers.UNet2DConditionModel
+    """
+
+    def __init__(self, session, unet):
+        self.session = session
+        self.config = unet.config
+        self.dtype = unet.dtype
+        self.device = unet.device
+
+    def __call__(self, sample, timestep, encoder_hidden_states, return_dict=True, **kwargs):
+        torch = importlib.import_module("torch")
+        # The scheduler passes a scalar timestep; the graph takes one per sample
+        timesteps = torch.as_tensor(timestep, dtype=torch.float32).reshape(-1)
+        if timesteps.numel() == 1:
+            timesteps = timesteps.repeat(sample.shape[0])
+        out_sample, = self.session.run(["out_sample"], {
+            "sample": sample.detach().float().cpu().numpy(),
+            "timestep": timesteps.numpy(),
+            "encoder_hidden_states": encoder_hidden_states.detach().float().cpu().numpy()
+        })
+        out_sample = torch.from_numpy(out_sample).to(sample.dtype)
+        return SimpleNamespace(sample=out_sample) if return_dict else (out_sample,)
+
+
+def unet_export_dir(checkpoint, unet):
+    """
+    Cache directory of the ONNX export of a UNet.
+
+    :param checkpoint: The checkpoint the UNet was loaded from.
+    :type checkpoint: str
+    :param unet: The PyTorch UNet.
+    :type unet: diffusers.UNet2DConditionModel
+    :return: The directory path.
+    :rtype: str
+    """
+    torch = importlib.import_module("torch")
+    # Models built from another configuration (or exported by another torch version) get their own entry
+    unet_config = json.dumps(dict(unet.config), sort_keys=True, default=str)
+    key = hashlib.sha256(f"{checkpoint}|{unet_config}|{ONNX_OPSET}|{torch.__version__}".encode()).hexdigest()[:16]
+    return os.path.join(EXPORTED_MODELS_DIR, f"{checkpoint.replace('/', '--')}-unet-{key}")
+
+
+def export_unet(unet, export_dir):
+    """
+    Export a UNet to ONNX, with dynamic batch, latent size and text length.
+
+    The graph is written to a staging directory renamed once complete, so concurrent tasks never
+    load a partial export; when another task finished first, its export is kept.
+
+    :param unet: The PyTorch UNet.
+    :type unet: diffusers.UNet2DConditionModel
+    :param export_dir: The cache directory of the export.
+    :type export_dir: str
+    """
+    torch = importlib.import_module("torch")
+    os.makedirs(EXPORTED_MODELS_DIR, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=".export-", dir=EXPORTED_MODELS_DIR)
+    try:
+        sample_size = unet.config.sample_size
+        sample = torch.randn(2, unet.config.in_channels, sample_size, sample_size)
+        timestep = torch.tensor([1.0, 1.0])
+        encoder_hidden_states = torch.randn(2, TEXT_SEQUENCE_LENGTH, unet.config.cross_attention_dim)
+        with torch.no_grad():
+            # Models above 2 GB (the UNet of Stable Diffusion 1.5) get their weights as external data files
+            torch.onnx.export(
+                unet,
+                (sample, timestep, encoder_hidden_states, {"return_dict": False}),
+                os.path.join(staging_dir, "unet.onnx"),
+                input_names=["sample", "timestep", "encoder_hidden_states"],
+                output_names=["out_sample"],
+                dynamic_axes={
+                    "sample": {0: "batch", 2: "height", 3: "width"},
+                    "timestep": {0: "batch"},
+                    "encoder_hidden_states": {0: "batch", 1: "sequence"}
+                },
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True
+            )
+        try:
+            os.rename(staging_dir, export_dir)
+        except OSError:
+            if not os.path.isdir(export_dir):
+                raise
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def load_onnx_unet(checkpoint, unet):
+    """
+    Load the ONNX export of a UNet, exporting it first when it is not cached.
+
+    :param checkpoint: The checkpoint the UNet was loaded from.
+    :type checkpoint: str
+    :param unet: The PyTorch UNet.
+    :type unet: diffusers.UNet2DConditionModel
+    :return: The replacement UNet.
+    :rtype: OnnxUNet
+    """
+    torch = importlib.import_module("torch")
+    onnxruntime = importlib.import_module("onnxruntime")
+    export_dir = unet_export_dir(checkpoint, unet)
+    if not os.path.exists(os.path.join(export_dir, "unet.onnx")):
+        export_unet(unet, export_dir)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Same thread budget as the PyTorch operators of the task
+    options.intra_op_num_threads = torch.get_num_threads()
+    session = onnxruntime.InferenceSession(
+        os.path.join(export_dir, "unet.onnx"), options, providers=["CPUExecutionProvider"]
+    )
+    return OnnxUNet(session, unet)
+
+
+def optimize_model(model, backend, checkpoint):
+    """
+    Apply an inference backend to a loaded model or Stable Diffusion pipeline.
+
+    :param model: The `transformers` model or `diffusers` pipeline.
+    :param backend: One of `eager`, `int8` (models) or `onnx` (pipelines).
+    :type backend: str
+    :param checkpoint: The checkpoint the model was loaded from.
+    :type checkpoint: str
+    :return: The model to run inference with.
+    """
+    is_pipeline = hasattr(model, "unet")
+    if backend == "eager":
+        return model
+    if backend == "int8" and not is_pipeline:
+        return quantize_int8(model)
+    if backend == "onnx" and is_pipeline:
+        model.unet = load_onnx_unet(checkpoint, model.unet)
+        return model
+    raise ValueError(f"Inference backend '{backend}' is not supported for {checkpoint}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the models of the LyricWave pipeline.")
+    parser.add_argument("command", choices=["export"], help="Export the Stable Diffusion UNet to ONNX")
+    parser.add_argument("--checkpoint", help="Stable Diffusion checkpoint; the one of the quality tier by default")
+    parser.add_argument("--tier", help="Quality tier whose cover checkpoint is exported; the default tier when omitted")
+    args = parser.parse_args()
+
+    diffusers = importlib.import_module("diffusers")
+    quality_tiers = importlib.import_module("operators.quality_tiers")
+    checkpoint = args.checkpoint or quality_tiers.stage_settings({"quality_tier": args.tier}, "cover")["checkpoint"]
+    unet = diffusers.UNet2DConditionModel.from_pretrained(checkpoint, subfolder="unet")
+    export_dir = unet_export_dir(checkpoint, unet)
+    if not os.path.exists(os.path.join(export_dir, "unet.onnx")):
+        export_unet(unet, export_dir)
+    print(export_dir)
@@ -0,0 +1,190 @@
+from operators.base_custom_operator import BaseCustomOperator
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from datetime import datetime
+import subprocess
+import tempfile
+import os
+
+# ffmpeg binary used to segment the final song
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+# Target duration of every HLS segment, in seconds
+HLS_SEGMENT_SECONDS = int(os.environ.get("HLS_SEGMENT_SECONDS", 4))
+# Parallel uploads of the packaged files to MinIO
+HLS_UPLOAD_CONCURRENCY = int(os.environ.get("HLS_UPLOAD_CONCURRENCY", 8))
+
+# Variant streams of the HLS presentation, lowest bandwidth first
+HLS_VARIANTS = [
+    {"name": "aac_64", "bitrate_kbps": 64},
+    {"name": "aac_128", "bitrate_kbps": 128}
+]
+
+HLS_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mp4": "audio/mp4",
+    ".m4s": "audio/mp4"
+}
+
+class PackageHlsOperator(BaseCustomOperator):
+    """
+    Packages the final song as an HLS presentation of short fMP4 segments stored in MinIO.
+
+    The files are stored under `{song_id}/hls/` (`{song_id}/hls/g{n}/` for the render generation n
+    of a quality upgrade): a master playlist plus one directory per variant holding its media
+    playlist, init segment and media segments. Every object is immutable, so the streaming API can
+    serve them with long-lived cache headers.
+
+    :param mongo_uri: MongoDB connection URI.
+    :type mongo_uri: str
+    :param mongo_db: MongoDB database name.
+    :type mongo_db: str
+    :param mongo_db_collection: MongoDB collection name.
+    :type mongo_db_collection: str
+    :param minio_endpoint: MinIO server endpoint.
+    :type minio_endpoint: str
+    :param minio_access_key: MinIO access key.
+    :type minio_access_key: str
+    :param minio_secret_key: MinIO secret key.
+    :type minio_secret_key: str
+    :param minio_bucket_name: MinIO bucket name.
+    :type minio_bucket_name: str
+    """
+
+    input_artifacts = ("final_song",)
+
+    def _start_segmenters(self, source_file_path, output_dir):
+        """
+        Launch one ffmpeg process per variant, all running in parallel.
+
+        :param source_file_path: Path of the final song.
+        :type source_file_path: str
+        :param output_dir: Directory where the presentation is written.
+        :type output_dir: str
+        :return: (variant, process) tuples.
+        :rtype: list
+        """
+        segmenters = []
+        for variant in HLS_VARIANTS:
+            variant_dir = os.path.join(output_dir, variant["name"])
+            os.makedirs(variant_dir)
+            command = [
+                FFMPEG_BINARY, "-y", "-loglevel", "error", "-threads", "1",
+                "-i", source_file_path, "-vn",
+                "-c:a", "aac", "-b:a", f"{variant['bitrate_kbps']}k",
+                "-f", "hls",
+                "-hls_time", str(HLS_SEGMENT_SECONDS),
+                "-hls_playlist_type", "vod",
+                "-hls_segment_type", "fmp4",
+                "-hls_fmp4_init_filename", "init.mp4",
+                "-hls_segment_filename", os.path.join(variant_dir, "segment_%05d.m4s"),
+                os.path.join(variant_dir, "playlist.m3u8")
+            ]
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            segmenters.append((variant, process))
+        return segmenters
+
+    def _write_master_playlist(self, output_dir):
+        """
+        Write the master playlist referencing every variant.
+
+        :param output_dir: Directory where the presentation is written.
+        :type output_dir: str
+        """
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+        for variant in HLS_VARIANTS:
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={variant["bitrate_kbps"] * 1000},CODECS="mp4a.40.2"')
+            lines.append(f"{variant['name']}/playlist.m3u8")
+        with open(os.path.join(output_dir, "master.m3u8"), "w") as master_playlist:
+            master_playlist.write("\n".join(lines) + "\n")
+
+    def _store_presentation_in_minio(self, output_dir, prefix, context):
+        """
+        Upload every file of the presentation in parallel, reusing a single MinIO client.
+
+        :param output_dir: Directory where the presentation is written.
+        :type output_dir: str
+        :param prefix: Prefix of the objects in MinIO.
+        :type prefix: str
+        :param context: The execution context.
+        :type context: dict
+        :return: The number of objects stored.
+        :rtype: int
+        """
+        minio_client = self._get_minio_client(context)
+        uploads = []
+        for directory, _, file_names in os.walk(output_dir):
+            for file_name in file_names:
+                local_file_path = os.path.join(directory, file_name)
+                object_name = f"{prefix}/{os.path.relpath(local_file_path, output_dir)}"
+                content_type = HLS_CONTENT_TYPES.get(os.path.splitext(file_name)[1], "application/octet-stream")
+                uploads.append((local_file_path, object_name, content_type))
+
+        def upload(item):
+            local_file_path, object_name, content_type = item
+            minio_client.fput_object(self.minio_bucket_name, object_name, local_file_path, content_type=content_type)
+            return os.path.getsize(local_file_path)
+
+        with self._timed("minio_upload"):
+            with ThreadPoolExecutor(max_workers=HLS_UPLOAD_CONCURRENCY) as executor:
+                uploaded_bytes = sum(executor.map(upload, uploads))
+        self._get_stage_timer().add_bytes("upload", uploaded_bytes)
+        return len(uploads)
+
+    def execute(self, context):
+        self._log_to_mongodb("Starting execution of PackageHlsOperator", context, "INFO")
+
+        # Retrieve song_id from the previous task using XCom
+        song_id = self._resolve_song_id(context, upstream_task_id='generate_song_task')
+        self._log_to_mongodb(f"Retrieved song_id: {song_id}", context, "INFO")
+
+        # Get a reference to the MongoDB collection
+        collection = self._get_mongodb_collection()
+
+        with self._timed("mongo_read"):
+            song_info = self._find_song(collection, song_id)
+        if self._is_stage_completed(song_info, context):
+            return {"song_id": str(song_id)}
+        final_song_name = song_info.get("final_song_name")
+
+        minio_client = self._get_minio_client(context)
+        output_dir = tempfile.TemporaryDirectory()
+        try:
+            source_file_path = os.path.join(output_dir.name, "final_song.mp4")
+            with self._timed("minio_download"):
+                minio_client.fget_object(self.minio_bucket_name, final_song_name, source_file_path)
+            self._get_stage_timer().add_bytes("download", os.path.getsize(source_file_path))
+
+            presentation_dir = os.path.join(output_dir.name, "hls")
+            os.makedirs(presentation_dir)
+            with self._timed("hls_segment"):
+                segmenters = self._start_segmenters(source_file_path, presentation_dir)
+                for variant, process in segmenters:
+                    _, stderr = process.communicate()
+                    if process.returncode != 0:
+                        raise Exception(f"Error segmenting variant {variant['name']}: {stderr.decode(errors='replace').strip()}")
+                self._write_master_playlist(presentation_dir)
+
+            render_generation = song_info.get("render_generation") or 0
+            # Segments are cached as immutable, so an upgraded render is packaged under a new prefix
+            hls_prefix = f"{song_id}/hls/g{render_generation}" if render_generation else f"{song_id}/hls"
+            stored_objects = self._store_presentation_in_minio(presentation_dir, hls_prefix, context)
+            self._log_to_mongodb(f"HLS presentation ({stored_objects} objects) stored in MinIO for song_id: {song_id}", context, "INFO")
+        except Exception as e:
+            self._log_to_mongodb(f"Error packaging the song as HLS: {e}", context, "ERROR")
+            raise
+        finally:
+            output_dir.cleanup()
+
+        # Update the document in MongoDB
+        # Runs next to the cover stage, so the song status is left to the main chain
+        self._complete_stage(collection, song_id, None, {
+            "song_hls": {
+                "master_playlist": f"{hls_prefix}/master.m3u8",
+                "segment_seconds": HLS_SEGMENT_SECONDS,
+                "variants": [variant["name"] for variant in HLS_VARIANTS]
+            },
+            "song_hls_packaged_at": datetime.now()
+        }, context)
+        self._log_to_mongodb("PackageHlsOperator execution completed", context, "INFO")
+
+        return {"song_id": str(song_id)}
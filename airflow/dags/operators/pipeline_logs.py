@@ -0,0 +1,114 @@
+"""
+Log of the song generation pipeline, stored in a MongoDB time-series collection.
+
+Every message logged by an operator is a measurement of PIPELINE_LOGS_COLLECTION with a native
+`timestamp`, its `level`, `message`, DAG run and try number, and a `meta` field holding the song
+and the stage, so MongoDB buckets the messages of a song and stage together and the whole log of a
+song is read with one query on the `(meta.song_id, timestamp)` index. Measurements expire after
+PIPELINE_LOGS_TTL_DAYS.
+
+It replaces the `dags_execution_logs` collection, whose documents had a string timestamp and a
+free-text task instance ID and no link to the song. Run as a module to create the collection and
+its index ahead of the first task, or to drop the old collection:
+
+    python -m operators.pipeline_logs create
+    python -m operators.pipeline_logs drop-legacy
+"""
+from datetime import datetime
+import argparse
+import importlib
+import os
+
+# Time-series collection of the pipeline log
+PIPELINE_LOGS_COLLECTION = os.environ.get("PIPELINE_LOGS_COLLECTION", "pipeline_logs")
+
+# Days the log messages are kept before MongoDB expires them
+PIPELINE_LOGS_TTL_DAYS = float(os.environ.get("PIPELINE_LOGS_TTL_DAYS", 30))
+
+# Unbounded collection the pipeline logged to before
+LEGACY_LOGS_COLLECTION = "dags_execution_logs"
+
+# Databases whose log collection this process already checked
+_ensured_databases = set()
+
+
+def ensure_collection(db, ttl_days=PIPELINE_LOGS_TTL_DAYS):
+    """
+    Create the time-series log collection and its song index if they don't exist, once per process.
+
+    :param db: The MongoDB database.
+    :type db: pymongo.database.Database
+    :param ttl_days: Days the messages are kept.
+    :type ttl_days: float
+    :return: The log collection.
+    :rtype: pymongo.collection.Collection
+    """
+    if db.name not in _ensured_databases:
+        # Attempted once per process, even if it fails, so a failure never delays every message
+        _ensured_databases.add(db.name)
+        if PIPELINE_LOGS_COLLECTION not in db.list_collection_names():
+            try:
+                db.create_collection(
+                    PIPELINE_LOGS_COLLECTION,
+                    timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"},
+                    expireAfterSeconds=int(ttl_days * 24 * 3600)
+                )
+            except importlib.import_module("pymongo.errors").CollectionInvalid:
+                # Created by another task in the meantime
+                pass
+        db[PIPELINE_LOGS_COLLECTION].create_index([("meta.song_id", 1), ("timestamp", 1)])
+    return db[PIPELINE_LOGS_COLLECTION]
+
+
+def log_document(song_id, stage, level, message, run_id=None, try_number=None, timestamp=None):
+    """
+    Build a log measurement.
+
+    :param song_id: The song the message is about, or None.
+    :type song_id: str
+    :param stage: The stage logging the message.
+    :type stage: str
+    :param level: The log level (e.g., INFO, ERROR).
+    :type level: str
+    :param message: The message.
+    :type message: str
+    :param run_id: The DAG run ID.
+    :type run_id: str
+    :param try_number: The try of the task instance.
+    :type try_number: int
+    :param timestamp: The time of the message; now when None.
+    :type timestamp: datetime
+    :return: The document to insert.
+    :rtype: dict
+    """
+    ObjectId = importlib.import_module("bson").ObjectId
+    return {
+        "timestamp": timestamp or datetime.utcnow(),
+        "meta": {
+            "song_id": ObjectId(song_id) if song_id and ObjectId.is_valid(str(song_id)) else None,
+            "stage": stage
+        },
+        "level": str(level).upper(),
+        "message": message,
+        "run_id": run_id,
+        "try_number": try_number
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the pipeline log collection.")
+    parser.add_argument("command", choices=["create", "drop-legacy"])
+    args = parser.parse_args()
+
+    client = importlib.import_module("pymongo").MongoClient(os.environ.get("MONGO_URI"))
+    db = client[os.environ.get("MONGO_DB")]
+    if args.command == "create":
+        ensure_collection(db)
+        print(f"Collection {PIPELINE_LOGS_COLLECTION} ready, messages expire after {PIPELINE_LOGS_TTL_DAYS:g} days")
+    else:
+        db.drop_collection(LEGACY_LOGS_COLLECTION)
+        print(f"Dropped {LEGACY_LOGS_COLLECTION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import os
+import time
+
+# Upper bounds (in seconds) of the phase duration histogram buckets
+PHASE_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Collection holding the cumulative histograms shared by every worker
+PIPELINE_METRICS_COLLECTION = "pipeline_metrics"
+
+
+class StageTimer:
+    """
+    Records the timed phases and the bytes moved by one execution of a pipeline operator.
+
+    :param task_id: The ID of the task being timed.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.spans = []
+        self.bytes_moved = {"upload": 0, "download": 0}
+
+    @contextmanager
+    def span(self, phase, model=None):
+        """
+        Time a block of code as one phase of the task.
+
+        :param phase: The phase name (e.g. model_load, inference, minio_upload).
+        :param model: The model involved in the phase, if any.
+        """
+        started_at = datetime.now()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append({
+                "phase": phase,
+                "model": model,
+                "started_at": started_at,
+                "duration_seconds": time.perf_counter() - start
+            })
+
+    def add_bytes(self, direction, byte_count):
+        """
+        Account bytes transferred to (upload) or from (download) the object store.
+        """
+        self.bytes_moved[direction] += byte_count
+
+    def as_document(self):
+        """
+        Build the summary persisted in the song document.
+        """
+        return {
+            "spans": self.spans,
+            "total_seconds": sum(span["duration_seconds"] for span in self.spans),
+            "bytes_moved": dict(self.bytes_moved),
+            "recorded_at": datetime.now()
+        }
+
+
+def record_histograms(collection, timer):
+    """
+    Fold the spans and byte counters of a timer into the cumulative histograms.
+
+    Histograms are stored in MongoDB, one document per (task, phase, model), so observations
+    from every worker process and every task instance aggregate in a single place.
+
+    :param collection: The pipeline metrics collection.
+    :param timer: The StageTimer of a finished task.
+    """
+    from pymongo import UpdateOne
+
+    operations = []
+    for span in timer.spans:
+        duration = span["duration_seconds"]
+        increments = {"count": 1, "sum": duration}
+        for position, upper_bound in enumerate(PHASE_DURATION_BUCKETS):
+            if duration <= upper_bound:
+                increments[f"buckets.b{position}"] = 1
+        operations.append(UpdateOne(
+            {"_id": f"phase|{timer.task_id}|{span['phase']}|{span['model'] or ''}"},
+            {
+                "$inc": increments,
+                "$set": {"type": "phase", "task": timer.task_id, "phase": span["phase"], "model": span["model"]}
+            },
+            upsert=True
+        ))
+    for direction, byte_count in timer.bytes_moved.items():
+        if byte_count:
+            operations.append(UpdateOne(
+                {"_id": f"bytes|{timer.task_id}|{direction}"},
+                {
+                    "$inc": {"value": byte_count},
+                    "$set": {"type": "bytes", "task": timer.task_id, "direction": direction}
+                },
+                upsert=True
+            ))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+
+def _format_labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items() if value is not None)
+
+
+def render_prometheus_text(collection):
+    """
+    Render the cumulative histograms and byte counters in the Prometheus text exposition format.
+
+    :param collection: The pipeline metrics collection.
+    :return: The metrics page.
+    """
+    lines = [
+        "# HELP lyricwave_pipeline_phase_duration_seconds Duration of each pipeline phase.",
+        "# TYPE lyricwave_pipeline_phase_duration_seconds histogram"
+    ]
+    byte_lines = [
+        "# HELP lyricwave_pipeline_bytes_total Bytes moved to and from the object store by pipeline tasks.",
+        "# TYPE lyricwave_pipeline_bytes_total counter"
+    ]
+    for document in collection.find({}):
+        if document.get("type") == "phase":
+            labels = {"task": document["task"], "phase": document["phase"], "model": document.get("model")}
+            buckets = document.get("buckets", {})
+            for position, upper_bound in enumerate(PHASE_DURATION_BUCKETS):
+                bucket_labels = _format_labels({**labels, "le": upper_bound})
+                lines.append(f"lyricwave_pipeline_phase_duration_seconds_bucket{{{bucket_labels}}} {buckets.get(f'b{position}', 0)}")
+            lines.append(f"lyricwave_pipeline_phase_duration_seconds_bucket{{{_format_labels({**labels, 'le': '+Inf'})}}} {document['count']}")
+            lines.append(f"lyricwave_pipeline_phase_duration_seconds_sum{{{_format_labels(labels)}}} {document['sum']}")
+            lines.append(f"lyricwave_pipeline_phase_duration_seconds_count{{{_format_labels(labels)}}} {document['count']}")
+        elif document.get("type") == "bytes":
+            labels = _format_labels({"task": document["task"], "direction": document["direction"]})
+            byte_lines.append(f"lyricwave_pipeline_bytes_total{{{labels}}} {document['value']}")
+    return "\n".join(lines + byte_lines) + "\n"
+
+
+def serve(port, mongo_uri, mongo_db):
+    """
+    Expose the pipeline metrics on http://0.0.0.0:<port>/metrics.
+    """
+    from pymongo import MongoClient
+
+    collection = MongoClient(mongo_uri)[mongo_db][PIPELINE_METRICS_COLLECTION]
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus_text(collection).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prometheus exporter for the LyricWave pipeline metrics.")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PIPELINE_METRICS_PORT", 9464)))
+    args = parser.parse_args()
+    serve(args.port, os.environ.get("MONGO_URI"), os.environ.get("MONGO_DB"))
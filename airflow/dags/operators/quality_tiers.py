@@ -0,0 +1,73 @@
+"""
+Quality tiers of the generated songs, read from `config/quality_tiers.json`.
+
+Every song document may carry a `quality_tier` (draft, standard or high) chosen by the Song
+Generation API from the load of the pipeline. The tier selects the checkpoints of MusicGen, Bark
+and Stable Diffusion, MusicGen's token budget and the diffusion steps and resolution of the cover.
+Songs without a tier, or with an unknown one, use the default tier, which keeps the settings songs
+were generated with before tiers existed.
+
+Run as a module to print the settings of every tier:
+
+    python -m operators.quality_tiers
+"""
+from functools import lru_cache
+import json
+import os
+
+# JSON file describing the quality tiers
+QUALITY_TIERS_FILE = os.environ.get(
+    "QUALITY_TIERS_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "quality_tiers.json")
+)
+
+
+@lru_cache(maxsize=None)
+def load_quality_tiers(path=QUALITY_TIERS_FILE):
+    """
+    Read the quality tiers configuration.
+
+    :param path: Path of the JSON file.
+    :type path: str
+    :return: The configuration.
+    :rtype: dict
+    """
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+def tier_name(song_info, config=None):
+    """
+    The quality tier a song is generated at.
+
+    :param song_info: The song document.
+    :type song_info: dict
+    :param config: The configuration; loaded from QUALITY_TIERS_FILE when None.
+    :type config: dict
+    :return: The tier name.
+    :rtype: str
+    """
+    config = config or load_quality_tiers()
+    name = (song_info or {}).get("quality_tier")
+    return name if name in config["tiers"] else config["default_tier"]
+
+
+def stage_settings(song_info, stage, config=None):
+    """
+    Settings of a model stage for the quality tier of a song.
+
+    :param song_info: The song document.
+    :type song_info: dict
+    :param stage: The stage: melody, voice or cover.
+    :type stage: str
+    :param config: The configuration; loaded from QUALITY_TIERS_FILE when None.
+    :type config: dict
+    :return: The settings of the stage.
+    :rtype: dict
+    """
+    config = config or load_quality_tiers()
+    return config["tiers"][tier_name(song_info, config)][stage]
+
+
+if __name__ == "__main__":
+    print(json.dumps(load_quality_tiers()["tiers"], indent=2))
@@ -0,0 +1,51 @@
+from operators.base_custom_operator import BaseCustomOperator
+from operators import storage_gc
+import json
+
+class ReconcileStorageOperator(BaseCustomOperator):
+    """
+    Deletes the MinIO objects no song needs anymore: those of deleted songs, of songs that failed
+    long ago and the temporary uploads of crashed tasks (see `operators/storage_gc.py`).
+
+    The bucket and the songs collection are walked together in song ID order, so memory stays
+    bounded whatever their size. The report (objects scanned, orphans and bytes per reason, bytes
+    reclaimed) is logged and returned as the XCom of the task.
+
+    :param mongo_uri: MongoDB connection URI.
+    :type mongo_uri: str
+    :param mongo_db: MongoDB database name.
+    :type mongo_db: str
+    :param mongo_db_collection: MongoDB collection name.
+    :type mongo_db_collection: str
+    :param minio_endpoint: MinIO server endpoint.
+    :type minio_endpoint: str
+    :param minio_access_key: MinIO access key.
+    :type minio_access_key: str
+    :param minio_secret_key: MinIO secret key.
+    :type minio_secret_key: str
+    :param minio_bucket_name: MinIO bucket name.
+    :type minio_bucket_name: str
+    :param dry_run: Only report the orphans; a `dry_run` key in the DAG run configuration overrides it.
+    :type dry_run: bool
+    """
+
+    def __init__(self, *args, dry_run=storage_gc.STORAGE_GC_DRY_RUN, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dry_run = dry_run
+
+    def execute(self, context):
+        self._log_to_mongodb("Starting execution of ReconcileStorageOperator", context, "INFO")
+
+        conf = getattr(context.get('dag_run'), "conf", None) or {}
+        dry_run = bool(conf.get("dry_run", self.dry_run))
+
+        minio_client = self._get_minio_client(context)
+        with self._timed("reconcile"):
+            report = storage_gc.reconcile(minio_client, self.minio_bucket_name, self._get_mongodb_collection(), dry_run=dry_run)
+
+        for error in report["errors"]:
+            self._log_to_mongodb(f"Error deleting orphan object {error}", context, "ERROR")
+        self._log_to_mongodb(f"Storage reconciliation report: {json.dumps(report)}", context, "INFO")
+        self._log_to_mongodb("ReconcileStorageOperator execution completed", context, "INFO")
+
+        return report
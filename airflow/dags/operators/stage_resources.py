@@ -0,0 +1,108 @@
+"""
+Resource classes of the pipeline stages, read from `config/stage_resources.json`.
+
+Every stage declares its memory and CPU weight and a resource class. The class routes the stage to
+a Celery queue (and so to a worker type) and to an Airflow pool whose slots measure that resource:
+model stages take their resident size in slots of the `model_memory_gb` pool, so the model workers
+never hold more models than fit in memory, and media stages take their thread count in slots of the
+`media_cpu` pool. With the `upstream` weight rule a task's priority adds up the weights of the
+stages before it, so songs close to the end are finished before new ones are started.
+
+Run as a module to print the pools in the format of `airflow pools import`:
+
+    python -m operators.stage_resources pools > pools.json
+"""
+from functools import lru_cache
+import argparse
+import json
+import math
+import os
+
+# JSON file describing the pools, resource classes and stages
+STAGE_RESOURCES_FILE = os.environ.get(
+    "STAGE_RESOURCES_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "stage_resources.json")
+)
+
+
+@lru_cache(maxsize=None)
+def load_stage_resources(path=STAGE_RESOURCES_FILE):
+    """
+    Read the stage resources configuration.
+
+    :param path: Path of the JSON file.
+    :type path: str
+    :return: The configuration.
+    :rtype: dict
+    """
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+def pool_slots(stage, resource_class):
+    """
+    Slots of its pool taken by one instance of a stage.
+
+    :param stage: The stage settings.
+    :type stage: dict
+    :param resource_class: The resource class of the stage.
+    :type resource_class: dict
+    :return: The number of slots.
+    :rtype: int
+    """
+    weight = resource_class.get("weight")
+    if not weight:
+        return 1
+    return max(1, math.ceil(stage[weight]))
+
+
+def stage_task_kwargs(stage_name, config=None):
+    """
+    Operator arguments placing a stage in its pool and queue, with its priority and concurrency limit.
+
+    :param stage_name: The task ID of the stage.
+    :type stage_name: str
+    :param config: The configuration; loaded from STAGE_RESOURCES_FILE when None.
+    :type config: dict
+    :return: Keyword arguments for the operator.
+    :rtype: dict
+    """
+    config = config or load_stage_resources()
+    stage = config["stages"][stage_name]
+    resource_class = config["resource_classes"][stage["resource_class"]]
+    task_kwargs = {
+        "queue": resource_class["queue"],
+        "pool": resource_class["pool"],
+        "pool_slots": pool_slots(stage, resource_class),
+        "priority_weight": stage["priority_weight"],
+        "weight_rule": config.get("weight_rule", "downstream")
+    }
+    if stage.get("max_active_tis_per_dag"):
+        task_kwargs["max_active_tis_per_dag"] = stage["max_active_tis_per_dag"]
+    return task_kwargs
+
+
+def airflow_pools(config=None):
+    """
+    The pools of the configuration, in the format of `airflow pools import`.
+
+    :param config: The configuration; loaded from STAGE_RESOURCES_FILE when None.
+    :type config: dict
+    :return: Pools by name.
+    :rtype: dict
+    """
+    config = config or load_stage_resources()
+    return {
+        name: {"slots": pool["slots"], "description": pool.get("description", ""), "include_deferred": False}
+        for name, pool in config["pools"].items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage resources of the LyricWave pipeline.")
+    parser.add_argument("command", choices=["pools", "stages"], help="Print the Airflow pools or the task arguments of every stage")
+    args = parser.parse_args()
+    if args.command == "pools":
+        print(json.dumps(airflow_pools(), indent=2))
+    else:
+        print(json.dumps({name: stage_task_kwargs(name) for name in load_stage_resources()["stages"]}, indent=2))
@@ -0,0 +1,319 @@
+"""
+Garbage collection of the MinIO objects and worker temporary files left behind by the pipeline.
+
+Every object of a song is stored under its ID: `{song_id}_*` (melody, voice, renditions, cover
+variants, waveforms, preview) and `{song_id}/hls/*`, with the render generation of quality upgrades
+after the ID (`{song_id}_g{n}_*` and `{song_id}/hls/g{n}/*`), so deleting a song removes every object under
+that prefix with batched `remove_objects` calls. The reconciler collects what deletes, failures and
+crashes leave behind. It lists the bucket, which MinIO returns in key order and so in song ID
+order, and walks it alongside the songs collection sorted by `_id`, holding one song and one
+delete batch in memory however large both are. An object older than STORAGE_GC_MIN_AGE_HOURS is
+an orphan when:
+
+- `deleted_song`: its song no longer exists;
+- `temporary`: it is a temporary upload (`.tmp-`) a crashed task never published;
+- `failed_song`: its song failed more than STORAGE_GC_FAILED_RETENTION_DAYS ago;
+- `stale_render`: it belongs to a render generation the song neither serves nor is rendering: the
+  partial render of a failed upgrade, or the draft of an upgraded song once the upgrade is older
+  than STORAGE_GC_MIN_AGE_HOURS, so the names, URLs and playlists handed out before it expired;
+- `voice_part`: it is a segment of a progressively generated voice whose whole voice is stored.
+
+Objects whose names don't start with a song ID are left alone. Run as a module to report the
+orphans without deleting them, or to delete them:
+
+    python -m operators.storage_gc --dry-run
+    python -m operators.storage_gc
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import glob
+import importlib
+import json
+import os
+import tempfile
+import time
+
+from operators.base_custom_operator import ARTIFACT_TEMP_SUFFIX, render_generation_of
+from operators.generate_voice_operator import VOICE_PART_OBJECT_INFIX
+
+# Only report the orphans, without deleting them
+STORAGE_GC_DRY_RUN = os.environ.get("STORAGE_GC_DRY_RUN", "true").lower() == "true"
+
+# Objects and temporary files younger than this are never collected, so uploads in progress are safe
+STORAGE_GC_MIN_AGE_HOURS = float(os.environ.get("STORAGE_GC_MIN_AGE_HOURS", 24))
+
+# Days the objects of a failed song are kept, so the song can still be retried from its checkpoints
+STORAGE_GC_FAILED_RETENTION_DAYS = float(os.environ.get("STORAGE_GC_FAILED_RETENTION_DAYS", 7))
+
+# Objects removed per remove_objects request (S3 accepts at most 1000)
+STORAGE_GC_DELETE_BATCH = int(os.environ.get("STORAGE_GC_DELETE_BATCH", 1000))
+
+# Suffixes of the temporary files the operators write on the workers
+LOCAL_TEMP_FILE_SUFFIXES = (".wav", ".pcm", ".mp4", ".mp3", ".m4a", ".opus", ".jpg", ".webp", ".avif", ".json")
+
+SONG_ID_LENGTH = 24
+HEX_DIGITS = set("0123456789abcdef")
+
+
+def song_id_of(object_name):
+    """
+    The ID of the song an object belongs to.
+
+    :param object_name: The object name.
+    :type object_name: str
+    :return: The song ID, or None if the object was not stored by the pipeline.
+    :rtype: str
+    """
+    song_id = object_name[:SONG_ID_LENGTH]
+    if len(object_name) <= SONG_ID_LENGTH or object_name[SONG_ID_LENGTH] not in "_/" or not set(song_id) <= HEX_DIGITS:
+        return None
+    return song_id
+
+
+def remove_song_objects(minio_client, bucket_name, song_id, batch_size=STORAGE_GC_DELETE_BATCH):
+    """
+    Remove every object of a song with batched remove_objects calls.
+
+    :param minio_client: The MinIO client.
+    :param bucket_name: The bucket.
+    :type bucket_name: str
+    :param song_id: The song ID.
+    :type song_id: str
+    :param batch_size: Objects removed per request.
+    :type batch_size: int
+    :return: The objects and bytes removed.
+    :rtype: tuple
+    """
+    objects = (
+        song_object for song_object in minio_client.list_objects(bucket_name, prefix=str(song_id), recursive=True)
+        if song_id_of(song_object.object_name) == str(song_id)
+    )
+    deleter = BatchDeleter(minio_client, bucket_name, batch_size)
+    for song_object in objects:
+        deleter.add(song_object)
+    deleter.flush()
+    return deleter.deleted_objects, deleter.deleted_bytes
+
+
+class BatchDeleter:
+    """
+    Removes objects in batches of remove_objects requests, counting what was removed.
+
+    :param minio_client: The MinIO client.
+    :param bucket_name: The bucket.
+    :type bucket_name: str
+    :param batch_size: Objects removed per request.
+    :type batch_size: int
+    """
+
+    def __init__(self, minio_client, bucket_name, batch_size=STORAGE_GC_DELETE_BATCH):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.batch_size = batch_size
+        self.batch = []
+        self.deleted_objects = 0
+        self.deleted_bytes = 0
+        self.errors = []
+
+    def add(self, song_object):
+        self.batch.append(song_object)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        DeleteObject = importlib.import_module("minio.deleteobjects").DeleteObject
+        # remove_objects is lazy: the request is only sent while its errors are iterated
+        errors = list(self.minio_client.remove_objects(
+            self.bucket_name, [DeleteObject(song_object.object_name) for song_object in self.batch]
+        ))
+        failed = {error.name for error in errors}
+        for song_object in self.batch:
+            if song_object.object_name not in failed:
+                self.deleted_objects += 1
+                self.deleted_bytes += song_object.size or 0
+        self.errors.extend(f"{error.name}: {error.message}" for error in errors)
+        self.batch = []
+
+
+def live_render_generations(song):
+    """
+    The render generations whose objects a song still needs: the one it serves, plus the one of
+    the quality upgrade in progress.
+
+    :param song: The song document.
+    :type song: dict
+    :return: The render generations.
+    :rtype: set
+    """
+    generations = {song.get("render_generation") or 0}
+    if song.get("upgrading"):
+        generations.add((song.get("upgrade_render") or {}).get("render_generation") or 0)
+    return generations
+
+
+def is_stale_render(object_name, song, min_age_hours=STORAGE_GC_MIN_AGE_HOURS):
+    """
+    Whether an object belongs to a render generation its song no longer needs.
+
+    :param object_name: The object name.
+    :type object_name: str
+    :param song: The song document.
+    :type song: dict
+    :param min_age_hours: Hours the draft of an upgraded song is kept after the upgrade.
+    :type min_age_hours: float
+    :rtype: bool
+    """
+    render_generation = render_generation_of(object_name)
+    if render_generation in live_render_generations(song):
+        return False
+    if render_generation > (song.get("render_generation") or 0):
+        # Never served: the partial render of a failed upgrade
+        return True
+    return bool(song.get("upgraded_at")) and song["upgraded_at"] < datetime.now() - timedelta(hours=min_age_hours)
+
+
+def iter_orphans(objects, songs, now=None, min_age_hours=STORAGE_GC_MIN_AGE_HOURS,
+                 failed_retention_days=STORAGE_GC_FAILED_RETENTION_DAYS):
+    """
+    Walk the bucket listing and the songs together, both in song ID order, classifying every object.
+
+    :param objects: The objects of the bucket in key order, as listed by MinIO.
+    :param songs: The song documents sorted by `_id`, with `song_status`, `failed_at`, `voice_file_name`,
+        `render_generation`, `upgrading`, `upgrade_render.render_generation` and `upgraded_at`.
+    :param now: The current UTC time.
+    :type now: datetime
+    :param min_age_hours: Objects younger than this are kept.
+    :type min_age_hours: float
+    :param failed_retention_days: Days the objects of a failed song are kept.
+    :type failed_retention_days: float
+    :return: (object, reason) pairs; reason is None for the objects kept and "unmanaged" for the
+        objects not stored by the pipeline.
+    """
+    now = now or datetime.now(timezone.utc)
+    songs = iter(songs)
+    song = next(songs, None)
+    for song_object in objects:
+        if song_object.is_dir:
+            continue
+        song_id = song_id_of(song_object.object_name)
+        if song_id is None:
+            yield song_object, "unmanaged"
+            continue
+        while song is not None and str(song["_id"]) < song_id:
+            song = next(songs, None)
+        last_modified = song_object.last_modified
+        if last_modified is not None and now - last_modified < timedelta(hours=min_age_hours):
+            yield song_object, None
+        elif song is None or str(song["_id"]) != song_id:
+            yield song_object, "deleted_song"
+        elif ARTIFACT_TEMP_SUFFIX in song_object.object_name:
+            yield song_object, "temporary"
+        elif song.get("song_status") == "failed" and song.get("failed_at") and \
+                song["failed_at"] < datetime.now() - timedelta(days=failed_retention_days):
+            yield song_object, "failed_song"
+        elif is_stale_render(song_object.object_name, song, min_age_hours):
+            yield song_object, "stale_render"
+        elif VOICE_PART_OBJECT_INFIX in song_object.object_name and song.get("voice_file_name"):
+            yield song_object, "voice_part"
+        else:
+            yield song_object, None
+
+
+def reconcile(minio_client, bucket_name, songs_collection, dry_run=STORAGE_GC_DRY_RUN, **orphan_kwargs):
+    """
+    Find the orphan objects of the bucket and, unless in dry-run mode, delete them.
+
+    :param minio_client: The MinIO client.
+    :param bucket_name: The bucket.
+    :type bucket_name: str
+    :param songs_collection: The songs collection.
+    :param dry_run: Only report the orphans.
+    :type dry_run: bool
+    :return: The report: objects and bytes scanned, orphans and bytes per reason, reclaimed bytes and errors.
+    :rtype: dict
+    """
+    started_at = time.perf_counter()
+    objects = minio_client.list_objects(bucket_name, recursive=True)
+    songs = songs_collection.find({}, {
+        "song_status": 1, "failed_at": 1, "voice_file_name": 1,
+        "render_generation": 1, "upgrading": 1, "upgrade_render.render_generation": 1, "upgraded_at": 1
+    }).sort([("_id", 1)])
+    deleter = BatchDeleter(minio_client, bucket_name)
+    report = {"dry_run": dry_run, "scanned_objects": 0, "scanned_bytes": 0, "unmanaged_objects": 0, "orphans": {}}
+    for song_object, reason in iter_orphans(objects, songs, **orphan_kwargs):
+        report["scanned_objects"] += 1
+        report["scanned_bytes"] += song_object.size or 0
+        if reason == "unmanaged":
+            report["unmanaged_objects"] += 1
+        elif reason is not None:
+            orphans = report["orphans"].setdefault(reason, {"objects": 0, "bytes": 0})
+            orphans["objects"] += 1
+            orphans["bytes"] += song_object.size or 0
+            if not dry_run:
+                deleter.add(song_object)
+    deleter.flush()
+    report.update({
+        "orphan_bytes": sum(orphans["bytes"] for orphans in report["orphans"].values()),
+        "reclaimed_objects": deleter.deleted_objects,
+        "reclaimed_bytes": deleter.deleted_bytes,
+        "errors": deleter.errors[:100],
+        "elapsed_seconds": round(time.perf_counter() - started_at, 3)
+    })
+    return report
+
+
+def clean_local_temp_files(directory=None, min_age_hours=STORAGE_GC_MIN_AGE_HOURS, dry_run=STORAGE_GC_DRY_RUN):
+    """
+    Remove the temporary files a crashed task left in the temporary directory of a worker.
+
+    :param directory: The temporary directory; the system one when None.
+    :type directory: str
+    :param min_age_hours: Files modified more recently are kept.
+    :type min_age_hours: float
+    :param dry_run: Only report the files.
+    :type dry_run: bool
+    :return: The files and bytes found and removed.
+    :rtype: dict
+    """
+    directory = directory or tempfile.gettempdir()
+    cutoff = time.time() - min_age_hours * 3600
+    report = {"dry_run": dry_run, "directory": directory, "files": 0, "bytes": 0, "reclaimed_bytes": 0}
+    for path in glob.iglob(os.path.join(directory, "tmp*")):
+        if not path.endswith(LOCAL_TEMP_FILE_SUFFIXES) or not os.path.isfile(path):
+            continue
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                continue
+            report["files"] += 1
+            report["bytes"] += stat.st_size
+            if not dry_run:
+                os.remove(path)
+                report["reclaimed_bytes"] += stat.st_size
+        except FileNotFoundError:
+            # Removed by its task in the meantime
+            continue
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect the orphan MinIO objects of the pipeline.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the orphans")
+    args = parser.parse_args()
+
+    minio_client = importlib.import_module("minio").Minio(
+        os.environ.get("MINIO_ENDPOINT"),
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        secure=False
+    )
+    songs_collection = importlib.import_module("pymongo").MongoClient(os.environ.get("MONGO_URI"))[
+        os.environ.get("MONGO_DB")][os.environ.get("MONGO_DB_COLLECTION")]
+    report = reconcile(minio_client, os.environ.get("MINIO_BUCKET_NAME"), songs_collection, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Waveform peaks and preview window selection for the generated tracks.
+
+Peaks follow the JSON format of BBC audiowaveform (version 2, 8 bit), which waveform renderers such
+as peaks.js and wavesurfer.js read directly.
+"""
+import numpy as np
+
+# Points (min/max pairs) kept per track; enough for a full width waveform on any screen
+WAVEFORM_POINTS = 2000
+# Duration of the preview clip cut from the final song
+PREVIEW_DURATION_MS = 10000
+
+
+def _mono_samples(segment):
+    """
+    Return the samples of a pydub AudioSegment as a mono float array in [-1, 1].
+    """
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    if segment.channels > 1:
+        samples = samples.reshape(-1, segment.channels).mean(axis=1)
+    return samples / float(1 << (8 * segment.sample_width - 1))
+
+
+def compute_peaks(segment, points=WAVEFORM_POINTS):
+    """
+    Downsample a track to `points` min/max pairs.
+
+    :param segment: The track.
+    :type segment: pydub.AudioSegment
+    :param points: The number of min/max pairs.
+    :type points: int
+    :return: The peaks document, in audiowaveform JSON format.
+    :rtype: dict
+    """
+    samples = _mono_samples(segment)
+    samples_per_pixel = max(1, int(np.ceil(len(samples) / points)))
+    padded_length = samples_per_pixel * int(np.ceil(len(samples) / samples_per_pixel)) if len(samples) else 0
+    frames = np.pad(samples, (0, padded_length - len(samples))).reshape(-1, samples_per_pixel) if padded_length else np.zeros((0, 1))
+
+    peaks = np.empty(len(frames) * 2, dtype=np.int8)
+    peaks[0::2] = np.clip(np.round(frames.min(axis=1) * 127), -128, 127)
+    peaks[1::2] = np.clip(np.round(frames.max(axis=1) * 127), -128, 127)
+    return {
+        "version": 2,
+        "channels": 1,
+        "sample_rate": segment.frame_rate,
+        "samples_per_pixel": samples_per_pixel,
+        "bits": 8,
+        "length": len(frames),
+        "data": peaks.tolist()
+    }
+
+
+def loudest_window_start(segment, window_ms=PREVIEW_DURATION_MS, hop_ms=500):
+    """
+    Find where the `window_ms` window with the highest energy starts, a cheap stand-in for the hook.
+
+    :param segment: The track.
+    :type segment: pydub.AudioSegment
+    :param window_ms: The window duration in milliseconds.
+    :type window_ms: int
+    :param hop_ms: The resolution of the search in milliseconds.
+    :type hop_ms: int
+    :return: The start of the window in milliseconds.
+    :rtype: int
+    """
+    if len(segment) <= window_ms:
+        return 0
+    samples = _mono_samples(segment)
+    hop = max(1, int(segment.frame_rate * hop_ms / 1000))
+    hops = len(samples) // hop
+    hop_energy = (samples[:hops * hop].reshape(hops, hop) ** 2).sum(axis=1)
+    hops_per_window = max(1, window_ms // hop_ms)
+    window_energy = np.convolve(hop_energy, np.ones(hops_per_window), mode="valid")
+    return int(np.argmax(window_energy)) * hop_ms
@@ -0,0 +1,50 @@
+from datetime import datetime
+from airflow import DAG
+from airflow.decorators import task
+from operators.reconcile_storage_operator import ReconcileStorageOperator
+from operators import storage_gc
+import os
+
+# Schedule of the storage garbage collection
+STORAGE_GC_SCHEDULE = os.environ.get("STORAGE_GC_SCHEDULE", "@daily")
+
+# Celery queues of the workers whose temporary directory is swept
+STORAGE_GC_WORKER_QUEUES = [queue for queue in os.environ.get("STORAGE_GC_WORKER_QUEUES", "models,default").split(",") if queue]
+
+# Define default arguments for the DAG
+default_args = {
+    'owner': 'airflow',
+    'start_date': datetime(2023, 1, 1),
+    'retries': 1,
+    'logging_level': 'INFO'
+}
+
+@task
+def clean_worker_temp_files(dag_run=None):
+    """
+    Remove the temporary files crashed tasks left on the worker running this task.
+    """
+    conf = dag_run.conf or {}
+    report = storage_gc.clean_local_temp_files(dry_run=bool(conf.get("dry_run", storage_gc.STORAGE_GC_DRY_RUN)))
+    print(f"Worker temporary files: {report}")
+    return report
+
+
+# Create the DAG with the specified default arguments
+with DAG('storage_gc_dag', default_args=default_args, default_view="graph", schedule_interval=STORAGE_GC_SCHEDULE,
+         catchup=False, max_active_runs=1) as dag:
+    ReconcileStorageOperator(
+        task_id='reconcile_storage_task',
+        queue='default',
+        mongo_uri=os.environ.get("MONGO_URI"),
+        mongo_db=os.environ.get("MONGO_DB"),
+        mongo_db_collection=os.environ.get("MONGO_DB_COLLECTION"),
+        minio_endpoint=os.environ.get("MINIO_ENDPOINT"),
+        minio_access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        minio_secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        minio_bucket_name=os.environ.get("MINIO_BUCKET_NAME")
+    )
+
+    # One sweep per worker queue, pinned to it, as every worker has its own temporary directory
+    for queue in STORAGE_GC_WORKER_QUEUES:
+        clean_worker_temp_files.override(task_id=f"clean_temp_files_{queue}", queue=queue)()
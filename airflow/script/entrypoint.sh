@@ -113,6 +113,10 @@ case "$1" in
   webserver)
     airflow db migrate
     airflow connections create-default-connections
+    # Create or resize the pools of the pipeline stages declared in dags/config/stage_resources.json
+    if [ -e "./dags/config/stage_resources.json" ]; then
+      (cd dags && python -m operators.stage_resources pools) > /tmp/stage_pools.json && airflow pools import /tmp/stage_pools.json
+    fi
     if [ "$AIRFLOW__CORE__EXECUTOR" = "LocalExecutor" ] || [ "$AIRFLOW__CORE__EXECUTOR" = "SequentialExecutor" ]; then
       # With the "Local" and "Sequential" executors it should all run in one container.
       airflow scheduler &
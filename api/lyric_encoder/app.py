@@ -0,0 +1,56 @@
+from flask import Flask, request, jsonify
+import vector_index
+import logging
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Texts embedded per request at most, and characters kept of every text
+LYRIC_ENCODER_MAX_TEXTS = int(os.environ.get("LYRIC_ENCODER_MAX_TEXTS", 32))
+LYRIC_ENCODER_MAX_TEXT_LENGTH = int(os.environ.get("LYRIC_ENCODER_MAX_TEXT_LENGTH", 2000))
+
+# The only process loading the sentence encoder of the semantic search queries, so the APIs stay light;
+# loaded when the worker starts rather than on the first query
+lyric_encoder = vector_index.LyricEncoder()
+lyric_encoder.load()
+
+# Create a Flask application
+app = Flask(__name__)
+
+# API endpoint for embedding texts with the encoder the lyric vector index was built with
+@app.route('/encode', methods=['POST'])
+def encode():
+    try:
+        texts = (request.get_json(silent=True) or {}).get('texts')
+        if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+            return _create_response("error", 400, "Invalid or missing 'texts' parameter. Must be a list of strings.")
+        if len(texts) > LYRIC_ENCODER_MAX_TEXTS:
+            return _create_response("error", 400, f"A request can contain at most {LYRIC_ENCODER_MAX_TEXTS} texts.")
+
+        embeddings = lyric_encoder.encode([text[:LYRIC_ENCODER_MAX_TEXT_LENGTH] for text in texts])
+        return _create_response("success", 200, "Texts encoded successfully", {
+            "model": lyric_encoder.model_name,
+            "embeddings": embeddings.tolist()
+        })
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return _create_response("error", 500, "An internal server error occurred")
+
+# API endpoint for checking that the encoder is loaded
+@app.route('/health', methods=['GET'])
+def health():
+    return _create_response("success", 200, "Lyric encoder ready", {"model": lyric_encoder.model_name})
+
+def _create_response(status, code, message, data=None):
+    response_data = {
+        "status": status,
+        "code": code,
+        "message": message,
+        "data": data
+    }
+    return jsonify(response_data), code
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
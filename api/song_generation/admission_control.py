@@ -0,0 +1,365 @@
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from song_status_watcher import TERMINAL_SONG_STATUSES
+import threading
+import logging
+import math
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Songs planned in Airflow and not finished yet above which new submissions wait in the admission queue
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 20))
+# Songs waiting in the admission queue above which submissions are rejected with a 429
+ADMISSION_MAX_QUEUED = int(os.environ.get("ADMISSION_MAX_QUEUED", 200))
+# Songs each client can submit within a sliding window of ADMISSION_CLIENT_WINDOW_SECONDS
+ADMISSION_CLIENT_MAX_SONGS = int(os.environ.get("ADMISSION_CLIENT_MAX_SONGS", 10))
+ADMISSION_CLIENT_WINDOW_SECONDS = float(os.environ.get("ADMISSION_CLIENT_WINDOW_SECONDS", 60))
+# Seconds between the passes of the dispatcher moving queued songs to Airflow
+ADMISSION_DISPATCH_INTERVAL = float(os.environ.get("ADMISSION_DISPATCH_INTERVAL", 5))
+# A song left in the dispatching state this long (its process died while triggering it) is queued again
+ADMISSION_DISPATCH_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_DISPATCH_TIMEOUT_SECONDS", 300))
+# Pipeline durations after which a planned song that never finished (its DAG run was deleted, marked failed
+# by hand or never started) stops holding an admission slot
+ADMISSION_IN_FLIGHT_STALE_FACTOR = float(os.environ.get("ADMISSION_IN_FLIGHT_STALE_FACTOR", 4))
+# Recently completed songs whose stage timings are averaged to estimate completion times
+ADMISSION_ETA_SAMPLE_SIZE = int(os.environ.get("ADMISSION_ETA_SAMPLE_SIZE", 20))
+# Pipeline duration assumed until enough songs have been generated
+ADMISSION_DEFAULT_SONG_SECONDS = float(os.environ.get("ADMISSION_DEFAULT_SONG_SECONDS", 300))
+# Seconds the estimated pipeline duration is reused before it is read again from MongoDB
+ADMISSION_ETA_REFRESH_SECONDS = float(os.environ.get("ADMISSION_ETA_REFRESH_SECONDS", 30))
+
+# Priorities accepted by /generate_song; queued songs are dispatched highest priority first
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+# Indexes of the songs collection behind the queries of the controller, by name
+ADMISSION_INDEXES = {
+    # Queue length, songs ahead of a priority and the claim order of the dispatcher
+    "admission_queue": [("admission_status", 1), ("priority", -1), ("queued_at", 1)],
+    # Songs in flight, planned recently enough to still count
+    "admission_in_flight_recent": [("planned", 1), ("song_status", 1), ("planned_at", 1)],
+    # Songs re-rendered at a higher quality tier, which also take a slot
+    "admission_upgrading": [("upgrading", 1), ("planned_at", 1)],
+    # Recent submissions of a client
+    "admission_client_window": [("client_id", 1), ("submitted_at", -1)],
+    # Latest completed songs, whose stage timings estimate completion times
+    "admission_eta_sample": [("song_status", 1), ("_id", -1)]
+}
+
+# Collections whose indexes this process already checked
+_ensured_collections = set()
+
+
+def ensure_indexes(collection):
+    """
+    Create the indexes the admission queries rely on if they don't exist, once per process.
+
+    Args:
+        collection (Collection): The songs collection.
+    """
+    if collection.full_name in _ensured_collections:
+        return
+    # Attempted once per process, even if it fails, so a failure never delays every dispatcher pass
+    _ensured_collections.add(collection.full_name)
+    for name, keys in ADMISSION_INDEXES.items():
+        collection.create_index(keys, name=name)
+
+
+class AdmissionController:
+    """
+    Decides whether a submitted song is scheduled right away, waits in the admission queue or is rejected.
+
+    The number of songs in flight (planned within the last ADMISSION_IN_FLIGHT_STALE_FACTOR pipeline
+    durations and not in a terminal status), the admission queue and
+    the recent submissions of every client live in the songs collection, so every API process and
+    instance behind the round-robin HAProxy sees the same backlog and the same client rates. Queued
+    songs carry `admission_status` "queued" and a `priority`; a dispatcher thread per process claims
+    them atomically, highest priority first, whenever a slot frees up, and hands them to `dispatch`.
+
+    Completion times are estimated with Little's law from the recent pipeline durations (the sum
+    of the recorded stage timings of the last completed songs): a song with `ahead` songs before it
+    completes after (ahead / ADMISSION_MAX_IN_FLIGHT + 1) pipeline durations.
+
+    Args:
+        collection (Collection): The songs collection.
+        dispatch (callable): Schedules a queued song document in Airflow; returns whether it succeeded.
+        schedule_delay_seconds (float): Delay between scheduling a song and the start of its DAG run.
+        clock (callable): Returns the current UTC datetime; replaced by simulations.
+        idle_task (callable, optional): Called with the controller after every dispatcher pass, e.g. to
+            use the workers left idle.
+    """
+
+    def __init__(self, collection, dispatch, schedule_delay_seconds=0,
+                 max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queued=ADMISSION_MAX_QUEUED,
+                 client_max_songs=ADMISSION_CLIENT_MAX_SONGS, client_window_seconds=ADMISSION_CLIENT_WINDOW_SECONDS,
+                 clock=datetime.utcnow, idle_task=None):
+        self._collection = collection
+        self.clock = clock
+        self._idle_task = idle_task
+        self._dispatch = dispatch
+        self.schedule_delay_seconds = schedule_delay_seconds
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.client_max_songs = client_max_songs
+        self.client_window_seconds = client_window_seconds
+        self._song_seconds = None
+        self._song_seconds_read_at = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def admit(self, client_id, priority=DEFAULT_PRIORITY):
+        """
+        Decide what to do with a new submission.
+
+        Args:
+            client_id (str): The client submitting the song.
+            priority (int): The priority of the song.
+
+        Returns:
+            dict: `decision` ("accept", "queue" or "reject"), plus `retry_after` and `reason` for rejections
+            or `ahead` (songs to be generated before it) and `estimated_completion_seconds` otherwise.
+        """
+        return self.admit_many(client_id, 1, priority)[0]
+
+    def admit_many(self, client_id, count, priority=DEFAULT_PRIORITY):
+        """
+        Decide what to do with the songs of a bulk submission, in order, as if they were submitted one by one.
+
+        The client window, the songs in flight and the queue are read once for the whole batch: the
+        songs past the client's remaining quota are rate limited, the next ones take the free slots
+        of the pipeline, then the free slots of the queue, and the rest are rejected as overloaded.
+
+        Args:
+            client_id (str): The client submitting the songs.
+            count (int): The number of songs.
+            priority (int): The priority of the songs.
+
+        Returns:
+            list: One decision per song, as returned by admit.
+        """
+        self.ensure_started()
+        remaining, retry_after = self.client_quota(client_id)
+        admissible = min(count, max(remaining, 0))
+        decisions = []
+        if admissible:
+            in_flight = self.in_flight_count()
+            queued = self.queued_count()
+            # Songs already queued keep their turn, so free slots are only taken while the queue is empty
+            free_slots = max(self.max_in_flight - in_flight, 0) if queued == 0 else 0
+            accepted = min(admissible, free_slots)
+            for position in range(accepted):
+                decisions.append({
+                    "decision": "accept",
+                    "ahead": in_flight + position,
+                    "estimated_completion_seconds": self.estimate_completion_seconds(in_flight + position)
+                })
+            queued_ahead = None
+            for position in range(admissible - accepted):
+                if queued + position >= self.max_queued:
+                    # A queue slot frees up roughly every pipeline duration / max in flight seconds
+                    decisions.append({
+                        "decision": "reject",
+                        "reason": "overloaded",
+                        "retry_after": math.ceil(self.estimate_song_seconds() / max(self.max_in_flight, 1))
+                    })
+                    continue
+                if queued_ahead is None:
+                    queued_ahead = self._collection.count_documents({"admission_status": "queued", "priority": {"$gte": priority}})
+                ahead = in_flight + accepted + queued_ahead + position
+                decisions.append({
+                    "decision": "queue",
+                    "ahead": ahead,
+                    "estimated_completion_seconds": self.estimate_completion_seconds(ahead)
+                })
+        decisions.extend(
+            {"decision": "reject", "reason": "rate_limited", "retry_after": math.ceil(retry_after)}
+            for _ in range(count - admissible)
+        )
+        return decisions
+
+    def client_quota(self, client_id):
+        """
+        Check the submissions of a client within the sliding window.
+
+        Args:
+            client_id (str): The client identifier.
+
+        Returns:
+            tuple: The songs the client can still submit, and the seconds until its oldest submission in
+            the window expires (the whole window if it has none), when it can submit one more.
+        """
+        window_start = self.clock() - timedelta(seconds=self.client_window_seconds)
+        recent = list(self._collection.find(
+            {"client_id": client_id, "submitted_at": {"$gt": window_start}}, {"submitted_at": 1}
+        ).sort([("submitted_at", -1)]).limit(self.client_max_songs))
+        if not recent:
+            return self.client_max_songs, self.client_window_seconds
+        return self.client_max_songs - len(recent), max((recent[-1]["submitted_at"] - window_start).total_seconds(), 1)
+
+    def client_retry_after(self, client_id):
+        """
+        Check whether a client can submit a song now.
+
+        Args:
+            client_id (str): The client identifier.
+
+        Returns:
+            float: 0 if the client can submit, otherwise the seconds until its oldest submission in the window expires.
+        """
+        remaining, retry_after = self.client_quota(client_id)
+        return 0 if remaining > 0 else retry_after
+
+    def admission_fields(self, client_id, priority, admission):
+        """
+        Fields recording the admission of a new song document, marking it as queued when it has to wait.
+
+        Args:
+            client_id (str): The client submitting the song.
+            priority (int): The priority of the song.
+            admission (dict): The decision returned by admit.
+
+        Returns:
+            dict: The fields to store in the song document.
+        """
+        fields = {
+            "client_id": client_id,
+            "priority": priority,
+            "submitted_at": self.clock(),
+            "admission_status": "admitted"
+        }
+        if admission["decision"] == "queue":
+            fields.update({"admission_status": "queued", "song_status": "queued", "queued_at": fields["submitted_at"]})
+        return fields
+
+    def planned_fields(self):
+        """
+        Fields flagging a song document as planned in Airflow, from when it counts as in flight.
+        """
+        return {"planned": True, "planned_at": self.clock()}
+
+    def in_flight_count(self):
+        """
+        Count the songs planned in Airflow that have not finished yet, including the songs re-rendered
+        at a higher quality tier, which keep their status while they run.
+
+        Songs planned more than ADMISSION_IN_FLIGHT_STALE_FACTOR pipeline durations ago are left out:
+        a song whose failure never reached the task failure callback would otherwise hold a slot forever.
+        """
+        stale_before = self.clock() - timedelta(seconds=ADMISSION_IN_FLIGHT_STALE_FACTOR * self.estimate_song_seconds())
+        return self._collection.count_documents({"$or": [
+            {"planned": True, "song_status": {"$nin": list(TERMINAL_SONG_STATUSES)}, "planned_at": {"$gt": stale_before}},
+            {"upgrading": True, "planned_at": {"$gt": stale_before}}
+        ]})
+
+    def queued_count(self):
+        """
+        Count the songs waiting in the admission queue.
+        """
+        return self._collection.count_documents({"admission_status": "queued"})
+
+    def estimate_song_seconds(self):
+        """
+        Average pipeline duration of the recently completed songs, read at most every ADMISSION_ETA_REFRESH_SECONDS.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._song_seconds is not None and now - self._song_seconds_read_at < ADMISSION_ETA_REFRESH_SECONDS:
+                return self._song_seconds
+        durations = []
+        cursor = self._collection.find(
+            {"song_status": "song_indexed", "stage_metrics": {"$exists": True}}, {"stage_metrics": 1}
+        ).sort([("_id", -1)]).limit(ADMISSION_ETA_SAMPLE_SIZE)
+        for song in cursor:
+            durations.append(sum(stage.get("total_seconds", 0) for stage in song["stage_metrics"].values()))
+        song_seconds = sum(durations) / len(durations) if durations else ADMISSION_DEFAULT_SONG_SECONDS
+        with self._lock:
+            self._song_seconds = song_seconds
+            self._song_seconds_read_at = now
+        return song_seconds
+
+    def estimate_completion_seconds(self, ahead):
+        """
+        Estimate the seconds until a song with `ahead` songs before it is generated.
+        """
+        batches = ahead / max(self.max_in_flight, 1) + 1
+        return round(self.schedule_delay_seconds + batches * self.estimate_song_seconds())
+
+    def dispatch_queued(self):
+        """
+        Hand queued songs to Airflow while there are free slots.
+
+        Returns:
+            int: The number of songs dispatched.
+        """
+        dispatched = 0
+        while self.in_flight_count() < self.max_in_flight:
+            song_info = self._claim_next()
+            if song_info is None:
+                break
+            try:
+                scheduled = self._dispatch(song_info)
+            except Exception as e:
+                logger.error(f"An error occurred: {str(e)}")
+                scheduled = False
+            if not scheduled:
+                # Put the song back in the queue and retry in the next pass
+                self._collection.update_one(
+                    {"_id": song_info["_id"]}, {"$set": {"admission_status": "queued"}, "$unset": {"dispatching_at": ""}}
+                )
+                break
+            dispatched += 1
+        return dispatched
+
+    def notify(self):
+        """
+        Wake the dispatcher up, e.g. after a song was queued.
+        """
+        self._wakeup.set()
+
+    def _claim_next(self):
+        """
+        Atomically move the next queued song (or one abandoned while dispatching) to the dispatching state.
+        """
+        now = self.clock()
+        return self._collection.find_one_and_update(
+            {"$or": [
+                {"admission_status": "queued"},
+                {"admission_status": "dispatching",
+                 "dispatching_at": {"$lt": now - timedelta(seconds=ADMISSION_DISPATCH_TIMEOUT_SECONDS)}}
+            ]},
+            {"$set": {"admission_status": "dispatching", "dispatching_at": now}},
+            sort=[("priority", -1), ("queued_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def ensure_started(self):
+        """
+        Start the dispatcher thread, once per process. It has to be created inside each Gunicorn worker
+        after the fork, so the `post_worker_init` hook of `gunicorn.conf.py` calls it when a worker
+        starts, and admit calls it again in case the thread died.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="admission-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            ensure_indexes(self._collection)
+        except Exception as e:
+            logger.error(f"Error creating the admission indexes: {str(e)}")
+        while True:
+            try:
+                self.dispatch_queued()
+                if self._idle_task is not None:
+                    self._idle_task(self)
+            except Exception as e:
+                # Any error ends this pass only; the thread must outlive it or the queue stalls until the next submission
+                logger.error(f"Error dispatching queued songs: {str(e)}")
+            self._wakeup.wait(ADMISSION_DISPATCH_INTERVAL)
+            self._wakeup.clear()
@@ -1,13 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from song_status_watcher import SongStatusWatcher, TERMINAL_SONG_STATUSES
+from admission_control import AdmissionController, DEFAULT_PRIORITY, MIN_PRIORITY, MAX_PRIORITY
+from quality_policy import QualityUpgrader, QUALITY_TIERS, DEFAULT_QUALITY_TIER, quality_fields
+import metrics
+import presigned_urls
+import vector_index
 import os
 import requests
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
 import uuid
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
+from minio import Minio
+from minio.deleteobjects import DeleteObject
 import base64
 import logging
+import json
+import math
+import queue
+import re
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,16 +47,79 @@ ELASTICSEARCH_INDEX = os.environ.get("ELASTICSEARCH_INDEX")
 
 LYRIC_WAVE_STREAMING_SERVICE_URL = os.environ.get("LYRIC_WAVE_STREAMING_SERVICE_URL")
 
+# Bulk submission settings
+BULK_MAX_SONGS = int(os.environ.get("BULK_MAX_SONGS", 500))
+AIRFLOW_TRIGGER_CONCURRENCY = int(os.environ.get("AIRFLOW_TRIGGER_CONCURRENCY", 8))
+# Songs of a bulk request generated by the same DAG run, one mapped task group instance each
+AIRFLOW_MAPPED_RUN_SIZE = int(os.environ.get("AIRFLOW_MAPPED_RUN_SIZE", 50))
+
+# Song status push channel settings
+SONG_STATUS_POLL_INTERVAL = float(os.environ.get("SONG_STATUS_POLL_INTERVAL", 2))
+SONG_STATUS_HEARTBEAT_SECONDS = float(os.environ.get("SONG_STATUS_HEARTBEAT_SECONDS", 5))
+SONG_STATUS_MAX_WAIT_SECONDS = float(os.environ.get("SONG_STATUS_MAX_WAIT_SECONDS", 30))
+# Song statuses are lowercase words joined by underscores, e.g. "melody_generated"
+SONG_STATUS_PATTERN = re.compile(r"[a-z_]{1,64}")
+# Width of the cover thumbnails linked from the song listings
+COVER_THUMBNAIL_WIDTH = int(os.environ.get("COVER_THUMBNAIL_WIDTH", 256))
+# Link the media files of a song as presigned MinIO URLs instead of streaming API URLs
+EMBED_PRESIGNED_URLS = os.environ.get("EMBED_PRESIGNED_URLS", "false").lower() == "true"
+MINIO_BUCKET_NAME = os.environ.get("MINIO_BUCKET_NAME")
+# MinIO connection used to delete the objects of the deleted songs
+MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT")
+MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY")
+MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY")
+# Objects removed per remove_objects request when a song is deleted (S3 accepts at most 1000)
+SONG_OBJECTS_DELETE_BATCH = 1000
+# Delay between scheduling a DAG run and its logical date
+DAG_RUN_SCHEDULE_DELAY_SECONDS = 120
+# Time-series collection the pipeline operators log to, one measurement per message
+PIPELINE_LOGS_COLLECTION = os.environ.get("PIPELINE_LOGS_COLLECTION", "pipeline_logs")
+# Songs returned by the semantic search and the similar songs by default, and at most
+SEMANTIC_SEARCH_DEFAULT_LIMIT = 10
+SEMANTIC_SEARCH_MAX_LIMIT = 50
+
 elasticsearch_client = Elasticsearch(ELASTICSEARCH_HOST)
 
+# Pooled HTTP session used to trigger Airflow DAG runs, sized for concurrent bulk triggering
+airflow_session = requests.Session()
+airflow_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=AIRFLOW_TRIGGER_CONCURRENCY))
+airflow_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=AIRFLOW_TRIGGER_CONCURRENCY))
+
+# Time every MongoDB command; the listener must be registered before the client is created
+metrics.register_mongo_listener()
+
 # Connect to MongoDB using the provided URI
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client[MONGO_DB]
 songs_collection = db[MONGO_COLLECTION]
 music_style_collection = db['music_styles']
+pipeline_logs_collection = db[PIPELINE_LOGS_COLLECTION]
+
+# MinIO client shared by the requests of this process, created on first use
+_minio_client = None
+
+# Lyric embeddings appended by the indexing stage, memory-mapped read-only from the shared volume
+lyric_vector_index = vector_index.VectorIndex(vector_index.VECTOR_INDEX_DIR) if vector_index.VECTOR_INDEX_DIR else None
+# Embeds the semantic search queries through the lyric encoder service, so no model is loaded in the API
+lyric_encoder = vector_index.RemoteLyricEncoder(vector_index.LYRIC_ENCODER_URL) if vector_index.LYRIC_ENCODER_URL else None
+
+# One watcher per process fans song status transitions out to every subscriber
+song_status_watcher = SongStatusWatcher(songs_collection, poll_interval=SONG_STATUS_POLL_INTERVAL)
+
+# Re-renders the songs downgraded under load at their requested quality tier once the workers are idle
+quality_upgrader = QualityUpgrader(songs_collection, lambda song_info: _dispatch_upgrade(song_info))
+
+# Admits, queues or rejects the songs submitted to /generate_song depending on the backlog of the pipeline
+admission_controller = AdmissionController(
+    songs_collection,
+    lambda song_info: _dispatch_queued_song(song_info),
+    schedule_delay_seconds=DAG_RUN_SCHEDULE_DELAY_SECONDS,
+    idle_task=quality_upgrader.upgrade_when_idle
+)
 
 # Create a Flask application
 app = Flask(__name__)
+metrics.init_app(app)
 
 # Global error handler
 @app.errorhandler(Exception)
@@ -108,6 +187,83 @@ def get_song_by_id(song_id):
         response_data = _create_response("error", 500, "An internal server error occurred")
         return response_data
 
+# API endpoint for retrieving the status of a song, optionally long-polling for the next transition
+@app.route('/songs/<string:song_id>/status', methods=['GET'])
+def get_song_status(song_id):
+    try:
+        if not ObjectId.is_valid(song_id):
+            return _create_response("error", 400, "Invalid song ID format. Must be a valid ObjectId.")
+        wait_seconds = _get_status_wait_seconds()
+        if wait_seconds is None:
+            return _create_response("error", 400, "Invalid 'wait' parameter. Must be a number of seconds.")
+        since = request.args.get('since')
+        if since is not None and not SONG_STATUS_PATTERN.fullmatch(since):
+            return _create_response("error", 400, "Invalid 'since' parameter. Must be a song status.")
+
+        # Subscribe before reading the current status so no transition is missed in between
+        subscription = song_status_watcher.subscribe(song_id) if wait_seconds > 0 else None
+        try:
+            song_status = _get_song_status(song_id)
+            if song_status is False:
+                return _create_response("error", 404, "Song not found")
+            if subscription is not None and song_status == since and song_status not in TERMINAL_SONG_STATUSES:
+                deadline = time.monotonic() + wait_seconds
+                while song_status == since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        song_status = subscription.get(timeout=remaining)["song_status"]
+                    except queue.Empty:
+                        break
+        finally:
+            if subscription is not None:
+                song_status_watcher.unsubscribe(song_id, subscription)
+
+        return _create_response("success", 200, "Song status retrieved successfully", {"song_id": song_id, "song_status": song_status})
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        response_data = _create_response("error", 500, "An internal server error occurred")
+        return response_data
+
+# API endpoint for following the status of a song through Server-Sent Events
+@app.route('/songs/<string:song_id>/status/stream', methods=['GET'])
+def stream_song_status(song_id):
+    if not ObjectId.is_valid(song_id):
+        return _create_response("error", 400, "Invalid song ID format. Must be a valid ObjectId.")
+    subscription = song_status_watcher.subscribe(song_id)
+    try:
+        song_status = _get_song_status(song_id)
+    except Exception:
+        song_status_watcher.unsubscribe(song_id, subscription)
+        raise
+    if song_status is False:
+        song_status_watcher.unsubscribe(song_id, subscription)
+        return _create_response("error", 404, "Song not found")
+
+    def generate():
+        last_status = song_status
+        try:
+            yield _format_status_event(song_id, last_status)
+            while last_status not in TERMINAL_SONG_STATUSES:
+                try:
+                    event = subscription.get(timeout=SONG_STATUS_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment lines keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["song_status"] != last_status:
+                    last_status = event["song_status"]
+                    yield _format_status_event(song_id, last_status)
+        finally:
+            song_status_watcher.unsubscribe(song_id, subscription)
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    }
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
 # API endpoint for generating a song
 @app.route('/generate_song', methods=['POST'])
 def generate_song():
@@ -119,6 +275,8 @@ def generate_song():
         description = request.json.get('description')
         keywords = request.json.get('keywords')
         music_style_id = request.json.get('music_style_id')
+        priority = request.json.get('priority', DEFAULT_PRIORITY)
+        quality_tier = request.json.get('quality_tier', DEFAULT_QUALITY_TIER)
 
         # Validate the length of song_text
         max_length = 200
@@ -140,18 +298,42 @@ def generate_song():
         if not music_style:
             return _create_response("error", 400, "Invalid music style ID. The specified style does not exist.")
 
+        # Validate the priority used to order the admission queue
+        if not isinstance(priority, int) or isinstance(priority, bool) or not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+            return _create_response("error", 400, f"Invalid priority. Must be an integer between {MIN_PRIORITY} and {MAX_PRIORITY}.")
+
+        # Validate the requested quality tier; it may be lowered while the pipeline is loaded
+        if quality_tier not in QUALITY_TIERS:
+            return _create_response("error", 400, f"Invalid quality tier. Must be one of: {', '.join(QUALITY_TIERS)}.")
+
         if song_title and song_text:
             logger.info(f"Generating song for '{song_title}' with description: {description}")
 
-            # Generate a unique DAG run ID
-            dag_run_id = str(uuid.uuid4())
-
-            # Calculate the logical date 2 minutes from now
-            logical_date = datetime.utcnow() + timedelta(minutes=2)
-            logical_date_str = logical_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            # Admit the song, queue it until the pipeline has room for it or reject it
+            client_id = _get_client_id()
+            admission = admission_controller.admit(client_id, priority)
+            if admission["decision"] == "reject":
+                return _create_rejection_response(admission)
+            if admission["decision"] == "queue":
+                song_info = {
+                    "song_title": song_title,
+                    "song_text": song_text,
+                    "description": description,
+                    "keywords": keywords,
+                    "music_style_id": music_style_id,
+                    "planned": False,  # Planned by the admission dispatcher when a slot frees up
+                    **admission_controller.admission_fields(client_id, priority, admission),
+                    **quality_fields(quality_tier, admission["ahead"])
+                }
+                song_info_id = songs_collection.insert_one(song_info).inserted_id
+                admission_controller.notify()
+                logger.info(f"Queued song with ID {song_info_id}, {admission['ahead']} songs ahead")
+                song_data = _get_song_info_with_urls(song_info)
+                song_data.update(_get_admission_data(admission))
+                return _create_response("success", 202, "Song queued for generation.", {"song_info": song_data})
 
-            # Build the URL to trigger the DAG execution
-            airflow_dag_url = f"{AIRFLOW_API_URL}/dags/{AIRFLOW_DAG_ID}/dagRuns"
+            # Generate a unique DAG run ID and a logical date 2 minutes from now
+            dag_run_id, logical_date_str = _new_dag_run_schedule()
 
             # Create a BSON document with song information, including keywords and style_id
             song_info = {
@@ -162,7 +344,9 @@ def generate_song():
                 "music_style_id": music_style_id,
                 "dag_run_id": dag_run_id,
                 "logical_date": logical_date_str,
-                "planned": False  # Initial status, not yet planned
+                "planned": False,  # Initial status, not yet planned
+                **admission_controller.admission_fields(client_id, priority, admission),
+                **quality_fields(quality_tier, admission["ahead"])
             }
 
             # Insert the BSON document into the MongoDB collection and get the ObjectID
@@ -171,41 +355,22 @@ def generate_song():
             logger.info(f"Inserted song information into MongoDB with ID: {song_info_id}")
 
             # Configure DAG run parameters, including song_info_id
-            dag_run_conf = {
-                "conf": {
-                    "song_id": str(song_info_id),
-                },
-                "dag_run_id": dag_run_id,
-                "logical_date": logical_date_str,
-                "note": f"Song generation for DAG run ID: {dag_run_id}"
-            }
-
-            # Encode the API executor's username and password in Base64
-            credentials = f"{API_EXECUTOR_USERNAME}:{API_EXECUTOR_PASSWORD}"
-            credentials_base64 = base64.b64encode(credentials.encode()).decode()
-
-            # Create headers for the request
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Basic {credentials_base64}"
-            }
+            dag_run_conf = _build_dag_run_conf(song_info_id, dag_run_id, logical_date_str)
+            headers = _get_airflow_headers()
 
             # Trigger an Airflow DAG execution by sending a POST request
-            response = requests.post(
-                airflow_dag_url,
-                json=dag_run_conf,
-                headers=headers
-            )
+            response = _trigger_dag_run(dag_run_conf)
 
             if response.status_code == 200:
                 # Update the BSON document with "planned" flag and date
                 songs_collection.update_one(
                     {"_id": song_info_id},
-                    {"$set": {"planned": True, "planned_date": logical_date_str}}
+                    {"$set": {**admission_controller.planned_fields(), "planned_date": logical_date_str}}
                 )
 
                 logger.info("DAG execution triggered successfully")
                 song_data = _get_song_info_with_urls(song_info)
+                song_data.update(_get_admission_data(admission))
                 response_data = _create_response("success", 200, "Song generated and scheduled successfully.", {"song_info": song_data})
                 return response_data
             else:
@@ -226,6 +391,129 @@ def generate_song():
         return response_data
 
 
+# API endpoint for generating many songs in a single request
+@app.route('/generate_songs', methods=['POST'])
+def generate_songs():
+    logger.info("Received a request to generate songs in bulk.")
+    try:
+        songs = request.json.get('songs')
+        if not isinstance(songs, list) or not songs:
+            return _create_response("error", 400, "Invalid or missing 'songs' parameter in the request.")
+        if len(songs) > BULK_MAX_SONGS:
+            return _create_response("error", 400, f"A bulk request can contain at most {BULK_MAX_SONGS} songs.")
+        # One priority for the whole batch, used to order its queued songs
+        priority = request.json.get('priority', DEFAULT_PRIORITY)
+        if not isinstance(priority, int) or isinstance(priority, bool) or not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+            return _create_response("error", 400, f"Invalid priority. Must be an integer between {MIN_PRIORITY} and {MAX_PRIORITY}.")
+
+        results = [None] * len(songs)
+        candidates = []
+        seen_titles = set()
+        for index, song in enumerate(songs):
+            song = song if isinstance(song, dict) else {}
+            song_title = song.get('title')
+            song_text = song.get('text')
+            music_style_id = song.get('music_style_id')
+            if not song_title or not song_text:
+                results[index] = _bulk_item_result(index, "error", 400, "Missing title or text parameters.")
+            elif not isinstance(song_title, str) or not isinstance(song_text, str):
+                results[index] = _bulk_item_result(index, "error", 400, "Title and text must be strings.")
+            elif len(song_text) > 200:
+                results[index] = _bulk_item_result(index, "error", 400, "Song text exceeds the maximum allowed length (200 characters).")
+            elif not ObjectId.is_valid(music_style_id):
+                results[index] = _bulk_item_result(index, "error", 400, "Invalid music style ID format. Must be a valid ObjectId.")
+            elif song.get('quality_tier', DEFAULT_QUALITY_TIER) not in QUALITY_TIERS:
+                results[index] = _bulk_item_result(index, "error", 400, f"Invalid quality tier. Must be one of: {', '.join(QUALITY_TIERS)}.")
+            elif song_title in seen_titles:
+                results[index] = _bulk_item_result(index, "error", 400, "A song with the same title appears earlier in the batch.")
+            else:
+                seen_titles.add(song_title)
+                candidates.append((index, song))
+
+        # Validate the whole batch with one title query and one style query
+        existing_titles = set()
+        music_styles = {}
+        if candidates:
+            existing_titles = {
+                song["song_title"] for song in songs_collection.find(
+                    {"song_title": {"$in": [song['title'] for _, song in candidates]}},
+                    {"song_title": 1}
+                )
+            }
+            music_styles = {
+                str(style["_id"]): style for style in music_style_collection.find(
+                    {"_id": {"$in": list({ObjectId(song['music_style_id']) for _, song in candidates})}}
+                )
+            }
+
+        admissible = []
+        for index, song in candidates:
+            if song['title'] in existing_titles:
+                results[index] = _bulk_item_result(index, "error", 400, "A song with the same title already exists.")
+            elif song['music_style_id'] not in music_styles:
+                results[index] = _bulk_item_result(index, "error", 400, "Invalid music style ID. The specified style does not exist.")
+            else:
+                admissible.append((index, song))
+
+        # Admit the valid songs in order, as /generate_song would one by one, reading the backlog once
+        client_id = _get_client_id()
+        admissions = dict(zip(
+            [index for index, _ in admissible], admission_controller.admit_many(client_id, len(admissible), priority)
+        )) if admissible else {}
+
+        song_documents = []
+        scheduled_songs = 0
+        dag_run_id, logical_date_str = None, None
+        for index, song in admissible:
+            admission = admissions[index]
+            if admission["decision"] == "reject":
+                message, data = _rejection_message_and_data(admission)
+                results[index] = _bulk_item_result(index, "error", 429, message, data)
+                continue
+            song_info = {
+                "song_title": song['title'],
+                "song_text": song['text'],
+                "description": song.get('description'),
+                "keywords": song.get('keywords'),
+                "music_style_id": song['music_style_id'],
+                "planned": False,  # Initial status, not yet planned
+                **admission_controller.admission_fields(client_id, priority, admission),
+                # Lowered while the pipeline is loaded, from the songs ahead of this one, as in /generate_song
+                **quality_fields(song.get('quality_tier', DEFAULT_QUALITY_TIER), admission["ahead"])
+            }
+            if admission["decision"] == "accept":
+                # Admitted songs are coalesced into mapped DAG runs of up to AIRFLOW_MAPPED_RUN_SIZE songs;
+                # queued ones are planned by the admission dispatcher when a slot frees up
+                if scheduled_songs % AIRFLOW_MAPPED_RUN_SIZE == 0:
+                    dag_run_id, logical_date_str = _new_dag_run_schedule()
+                scheduled_songs += 1
+                song_info.update({"dag_run_id": dag_run_id, "logical_date": logical_date_str})
+            song_documents.append((index, song_info))
+
+        inserted = _insert_songs(song_documents, results)
+        queued = [(index, song_info) for index, song_info in inserted if admissions[index]["decision"] == "queue"]
+        for index, song_info in queued:
+            song_data = _get_song_info_with_urls(song_info, music_styles[song_info["music_style_id"]].get("style_name", "Unknown"))
+            song_data.update(_get_admission_data(admissions[index]))
+            results[index] = _bulk_item_result(index, "success", 202, "Song queued for generation.", {"song_info": song_data})
+        if queued:
+            admission_controller.notify()
+        scheduled = [(index, song_info) for index, song_info in inserted if admissions[index]["decision"] == "accept"]
+        _schedule_songs(scheduled, results, music_styles, admissions)
+
+        accepted = sum(1 for result in results if result["status"] == "success")
+        logger.info(f"Bulk request processed: {accepted - len(queued)} songs scheduled, {len(queued)} queued, {len(results) - accepted} rejected")
+        response_data = _create_response("success", 200, "Bulk request processed.", {
+            "accepted": accepted,
+            "rejected": len(results) - accepted,
+            "results": results
+        })
+        return response_data
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        response_data = _create_response("error", 500, "An internal server error occurred.")
+        return response_data
+
 # API endpoint for listing all songs paginated, descending by date
 @app.route('/songs', methods=['GET'])
 def list_songs():
@@ -257,7 +545,8 @@ def delete_song_by_id(song_id):
         if song_info:
             songs_collection.delete_one({"_id": ObjectId(song_id)})
             song_data = _get_song_info_with_urls(song_info)
-            response_data = _create_response("success", 200, "Song deleted successfully", {"song_info": song_data})
+            deleted_objects = _delete_song_files(song_id)
+            response_data = _create_response("success", 200, "Song deleted successfully", {"song_info": song_data, "deleted_objects": deleted_objects})
             return response_data
         else:
             response_data = _create_response("error", 404, "Song not found", {"song_info": None})
@@ -266,6 +555,67 @@ def delete_song_by_id(song_id):
         logger.error(f"An error occurred: {str(e)}")
         response_data = _create_response("error", 500, "An internal server error occurred")
         return response_data
+
+# API endpoint for retrieving the pipeline log of a song
+@app.route('/songs/<string:song_id>/logs', methods=['GET'])
+def get_song_logs(song_id):
+    try:
+        if not ObjectId.is_valid(song_id):
+            return _create_response("error", 400, "Invalid song ID format. Must be a valid ObjectId.")
+        query = {"meta.song_id": ObjectId(song_id)}
+        stage = request.args.get('stage')
+        if stage:
+            query["meta.stage"] = stage
+
+        # One query on the (meta.song_id, timestamp) index of the time-series collection
+        with metrics.timed_call("mongodb", "find_song_logs"):
+            log_entries = list(pipeline_logs_collection.find(query, {"_id": 0}).sort([("timestamp", 1)]))
+        if not log_entries and songs_collection.find_one({"_id": ObjectId(song_id)}, {"_id": 1}) is None:
+            return _create_response("error", 404, "Song not found")
+
+        logs = [{
+            "timestamp": log_entry["timestamp"].strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            "stage": log_entry["meta"].get("stage"),
+            "level": log_entry.get("level"),
+            "message": log_entry.get("message"),
+            "run_id": log_entry.get("run_id"),
+            "try_number": log_entry.get("try_number")
+        } for log_entry in log_entries]
+        response_data = _create_response("success", 200, "Song logs retrieved successfully", {"song_id": song_id, "logs": logs})
+        return response_data
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        response_data = _create_response("error", 500, "An internal server error occurred")
+        return response_data
+
+# API endpoint for finding the songs whose lyrics are the most similar to the lyrics of a song
+@app.route('/songs/<string:song_id>/similar', methods=['GET'])
+def get_similar_songs(song_id):
+    try:
+        if not ObjectId.is_valid(song_id):
+            return _create_response("error", 400, "Invalid song ID format. Must be a valid ObjectId.")
+        limit = _get_semantic_search_limit()
+        if limit is None:
+            return _create_response("error", 400, f"Invalid 'limit' parameter. Must be an integer between 1 and {SEMANTIC_SEARCH_MAX_LIMIT}.")
+        if lyric_vector_index is None:
+            return _create_response("error", 503, "Semantic search is not enabled.")
+
+        with metrics.timed_call("vector_index", "lookup"):
+            embedding = lyric_vector_index.vector(song_id)
+        if embedding is None:
+            if songs_collection.find_one({"_id": ObjectId(song_id)}, {"_id": 1}) is None:
+                return _create_response("error", 404, "Song not found")
+            return _create_response("error", 404, "The song has not been indexed yet.")
+        with metrics.timed_call("vector_index", "search"):
+            neighbours = lyric_vector_index.search(embedding, k=limit, exclude={song_id})
+
+        similar_songs = _get_songs_by_similarity(neighbours)
+        response_data = _create_response("success", 200, "Similar songs retrieved successfully", {"similar_songs": similar_songs})
+        return response_data
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        response_data = _create_response("error", 500, "An internal server error occurred")
+        return response_data
     
 @app.route('/search_songs', methods=['GET'])
 def search_songs():
@@ -276,19 +626,41 @@ def search_songs():
         if not search_term:
             return _create_response("error", 400, "Missing 'q' parameter in the request.")
 
+        # Lexical search matches the words of the lyrics; semantic search compares lyric embeddings
+        mode = request.args.get('mode', 'lexical')
+        if mode not in ('lexical', 'semantic'):
+            return _create_response("error", 400, "Invalid 'mode' parameter. Must be 'lexical' or 'semantic'.")
+        if mode == 'semantic':
+            limit = _get_semantic_search_limit()
+            if limit is None:
+                return _create_response("error", 400, f"Invalid 'limit' parameter. Must be an integer between 1 and {SEMANTIC_SEARCH_MAX_LIMIT}.")
+            if lyric_vector_index is None or lyric_encoder is None:
+                return _create_response("error", 503, "Semantic search is not enabled.")
+            try:
+                with metrics.timed_call("lyric_encoder", "encode"):
+                    query_embedding = lyric_encoder.encode([search_term])[0]
+            except requests.RequestException as e:
+                logger.error(f"Error encoding the search query: {str(e)}")
+                return _create_response("error", 503, "The lyric encoder is unavailable. Retry later.")
+            with metrics.timed_call("vector_index", "search"):
+                neighbours = lyric_vector_index.search(query_embedding, k=limit)
+            matching_songs = _get_songs_by_similarity(neighbours)
+            return _create_response("success", 200, "Songs retrieved successfully", {"matching_songs": matching_songs})
+
         headers = {"Content-Type": "application/json"}
         # Use Elasticsearch to search for songs with the given search term
-        search_results = elasticsearch_client.search(
-            index=ELASTICSEARCH_INDEX,
-            body={
-                "query": {
-                    "match": {
-                        "song_text": search_term
+        with metrics.timed_call("elasticsearch", "search"):
+            search_results = elasticsearch_client.search(
+                index=ELASTICSEARCH_INDEX,
+                body={
+                    "query": {
+                        "match": {
+                            "song_text": search_term
+                        }
                     }
-                }
-            },
-            headers=headers
-        )
+                },
+                headers=headers
+            )
 
         # Extract the song IDs from the search results
         song_ids = [hit["_source"]["song_id"] for hit in search_results["hits"]["hits"]]
@@ -317,15 +689,343 @@ def _create_response(status, code, message, data=None):
     }
     return jsonify(response_data), code
 
-def _get_song_info_with_urls(song_info):
+def _new_dag_run_schedule():
+    """
+    Generate a unique DAG run ID and its logical date, 2 minutes from now.
+    """
+    dag_run_id = str(uuid.uuid4())
+    logical_date = datetime.utcnow() + timedelta(seconds=DAG_RUN_SCHEDULE_DELAY_SECONDS)
+    return dag_run_id, logical_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _build_dag_run_conf(song_info_id, dag_run_id, logical_date_str):
+    return {
+        "conf": {
+            "song_id": str(song_info_id),
+        },
+        "dag_run_id": dag_run_id,
+        "logical_date": logical_date_str,
+        "note": f"Song generation for DAG run ID: {dag_run_id}"
+    }
+
+def _build_mapped_dag_run_conf(song_info_ids, dag_run_id, logical_date_str):
+    """
+    Build the configuration of a DAG run generating several songs, one mapped task group per song.
+    """
+    return {
+        "conf": {
+            "song_ids": [str(song_info_id) for song_info_id in song_info_ids],
+        },
+        "dag_run_id": dag_run_id,
+        "logical_date": logical_date_str,
+        "note": f"Generation of {len(song_info_ids)} songs for DAG run ID: {dag_run_id}"
+    }
+
+def _get_airflow_headers():
+    # Encode the API executor's username and password in Base64
+    credentials = f"{API_EXECUTOR_USERNAME}:{API_EXECUTOR_PASSWORD}"
+    credentials_base64 = base64.b64encode(credentials.encode()).decode()
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Basic {credentials_base64}"
+    }
+
+def _trigger_dag_run(dag_run_conf):
+    """
+    Trigger an Airflow DAG execution through the shared, pooled HTTP session.
+    """
+    airflow_dag_url = f"{AIRFLOW_API_URL}/dags/{AIRFLOW_DAG_ID}/dagRuns"
+    with metrics.timed_call("airflow", "trigger_dag_run"):
+        return airflow_session.post(airflow_dag_url, json=dag_run_conf, headers=_get_airflow_headers())
+
+def _bulk_item_result(index, status, code, message, data=None):
+    return {
+        "index": index,
+        "status": status,
+        "code": code,
+        "message": message,
+        "data": data
+    }
+
+def _insert_songs(song_documents, results):
+    """
+    Insert the song documents of a bulk request with a single unordered insert_many.
+
+    Documents rejected by MongoDB get an error result; the others are returned as (index, document).
+    """
+    if not song_documents:
+        return []
+    failed_positions = set()
+    try:
+        songs_collection.insert_many([document for _, document in song_documents], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            failed_positions.add(write_error["index"])
+            index = song_documents[write_error["index"]][0]
+            logger.error(f"Error inserting song at index {index}: {write_error.get('errmsg')}")
+            results[index] = _bulk_item_result(index, "error", 500, "Error storing the song.")
+    return [entry for position, entry in enumerate(song_documents) if position not in failed_positions]
+
+def _schedule_songs(inserted, results, music_styles, admissions):
+    """
+    Trigger one mapped DAG run per group of inserted songs sharing a DAG run ID, with bounded
+    parallelism, then flag the planned songs and remove the ones Airflow refused with one bulk write.
+    """
+    dag_runs = {}
+    for index, song_info in inserted:
+        dag_runs.setdefault(song_info["dag_run_id"], []).append(song_info)
+
+    def trigger(songs):
+        dag_run_conf = _build_mapped_dag_run_conf(
+            [song_info["_id"] for song_info in songs], songs[0]["dag_run_id"], songs[0]["logical_date"]
+        )
+        try:
+            return _trigger_dag_run(dag_run_conf).status_code
+        except requests.RequestException as e:
+            logger.error(f"Error triggering DAG execution: {str(e)}")
+            return 503
+
+    with ThreadPoolExecutor(max_workers=AIRFLOW_TRIGGER_CONCURRENCY) as executor:
+        run_status_codes = dict(zip(dag_runs, executor.map(trigger, dag_runs.values())))
+    status_codes = [run_status_codes[song_info["dag_run_id"]] for _, song_info in inserted]
+
+    operations = []
+    for (index, song_info), status_code in zip(inserted, status_codes):
+        if status_code == 200:
+            operations.append(UpdateOne(
+                {"_id": song_info["_id"]},
+                {"$set": {**admission_controller.planned_fields(), "planned_date": song_info["logical_date"]}}
+            ))
+            style_info = music_styles.get(song_info["music_style_id"])
+            song_data = _get_song_info_with_urls(song_info, style_info.get("style_name", "Unknown") if style_info else "Unknown")
+            song_data.update(_get_admission_data(admissions[index]))
+            results[index] = _bulk_item_result(index, "success", 200, "Song generated and scheduled successfully.", {"song_info": song_data})
+        else:
+            # If DAG execution failed, remove the document from MongoDB
+            operations.append(DeleteOne({"_id": song_info["_id"]}))
+            results[index] = _bulk_item_result(index, "error", status_code, "Error triggering DAG execution.")
+    if operations:
+        songs_collection.bulk_write(operations, ordered=False)
+
+def _get_status_wait_seconds():
+    """
+    Read how long the status request may wait for a transition, clamped to [0, SONG_STATUS_MAX_WAIT_SECONDS].
+
+    Returns:
+        float: The seconds to wait, or None if the 'wait' parameter is not a finite number.
+    """
+    try:
+        wait_seconds = float(request.args.get('wait', 0))
+    except ValueError:
+        return None
+    if not math.isfinite(wait_seconds):
+        return None
+    return min(max(wait_seconds, 0.0), SONG_STATUS_MAX_WAIT_SECONDS)
+
+def _get_semantic_search_limit():
+    """
+    Read the number of songs requested from the semantic search.
+
+    Returns:
+        int: The limit, or None if the 'limit' parameter is invalid.
+    """
+    try:
+        limit = int(request.args.get('limit', SEMANTIC_SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return None
+    return limit if 1 <= limit <= SEMANTIC_SEARCH_MAX_LIMIT else None
+
+def _get_songs_by_similarity(neighbours):
+    """
+    Read the songs found in the vector index with one query, keeping their ranking.
+
+    Songs deleted since they were indexed are left out.
+
+    Args:
+        neighbours (list): (song ID, similarity) pairs, most similar first.
+
+    Returns:
+        list: The song data of every song, with its similarity.
+    """
+    songs = {
+        str(song_info["_id"]): song_info
+        for song_info in songs_collection.find({"_id": {"$in": [ObjectId(song_id) for song_id, _ in neighbours]}})
+    }
+    matching_songs = []
+    for song_id, similarity in neighbours:
+        if song_id in songs:
+            song_data = _get_song_info_with_urls(songs[song_id])
+            song_data["similarity"] = round(similarity, 4)
+            matching_songs.append(song_data)
+    return matching_songs
+
+def _get_client_id():
+    """
+    Identify the client of a request for the per-client admission limits.
+
+    HAProxy appends the address it received the request from to X-Forwarded-For, so the last
+    entry can't be forged by the client.
+    """
+    return request.access_route[-1] if request.access_route else request.remote_addr
+
+def _get_admission_data(admission):
+    """
+    Describe where an admitted or queued song stands in the pipeline backlog.
+    """
+    estimated_completion = datetime.utcnow() + timedelta(seconds=admission["estimated_completion_seconds"])
+    return {
+        "admission_status": "queued" if admission["decision"] == "queue" else "admitted",
+        "songs_ahead": admission["ahead"],
+        "estimated_completion_date": estimated_completion.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    }
+
+def _rejection_message_and_data(admission):
+    """
+    Describe a rejected submission: why it was rejected and when to retry.
+    """
+    if admission["reason"] == "rate_limited":
+        message = "Too many songs submitted by this client. Retry later."
+    else:
+        message = "The song generation queue is full. Retry later."
+    return message, {"reason": admission["reason"], "retry_after_seconds": admission["retry_after"]}
+
+def _create_rejection_response(admission):
+    """
+    Build the 429 response of a rejected submission, telling the client when to retry.
+    """
+    message, data = _rejection_message_and_data(admission)
+    response, code = _create_response("error", 429, message, data)
+    return response, code, {"Retry-After": str(admission["retry_after"])}
+
+def _dispatch_queued_song(song_info):
+    """
+    Schedule a song that waited in the admission queue, as /generate_song does for admitted songs.
+
+    Returns:
+        bool: Whether Airflow accepted the DAG run.
+    """
+    dag_run_id, logical_date_str = _new_dag_run_schedule()
+    response = _trigger_dag_run(_build_dag_run_conf(song_info["_id"], dag_run_id, logical_date_str))
+    if response.status_code != 200:
+        logger.error(f"Error triggering DAG execution: {response.text}")
+        return False
+    songs_collection.update_one(
+        {"_id": song_info["_id"]},
+        {
+            "$set": {
+                "dag_run_id": dag_run_id,
+                "logical_date": logical_date_str,
+                **admission_controller.planned_fields(),
+                "planned_date": logical_date_str,
+                "song_status": "planned",
+                "admission_status": "dispatched"
+            },
+            "$unset": {"dispatching_at": ""}
+        }
+    )
+    logger.info(f"Dispatched queued song with ID {song_info['_id']}")
+    return True
+
+def _dispatch_upgrade(song_info):
+    """
+    Schedule the re-render of a song at a higher quality tier. Unlike queued songs, the song keeps
+    its status, so it is still served as generated while the upgrade runs.
+
+    Returns:
+        bool: Whether Airflow accepted the DAG run.
+    """
+    dag_run_id, logical_date_str = _new_dag_run_schedule()
+    response = _trigger_dag_run(_build_dag_run_conf(song_info["_id"], dag_run_id, logical_date_str))
+    if response.status_code != 200:
+        logger.error(f"Error triggering DAG execution: {response.text}")
+        return False
+    songs_collection.update_one(
+        {"_id": song_info["_id"]},
+        {"$set": {"upgrade_dag_run_id": dag_run_id, **admission_controller.planned_fields()}}
+    )
+    logger.info(f"Dispatched the quality upgrade of song with ID {song_info['_id']}")
+    return True
+
+def _get_minio_client():
+    """
+    Get the MinIO client shared by every request served by this process, created on first use.
+
+    Returns:
+        Minio: A MinIO client instance.
+    """
+    global _minio_client
+    if _minio_client is None:
+        _minio_client = Minio(
+            MINIO_ENDPOINT,
+            access_key=MINIO_ACCESS_KEY,
+            secret_key=MINIO_SECRET_KEY,
+            secure=False
+        )
+    return _minio_client
+
+def _delete_song_files(song_id):
+    """
+    Delete the files of a deleted song: every MinIO object stored under its ID, in batched
+    remove_objects requests, and its search index document.
+
+    Failures are logged and not raised, since the song document is already gone; the storage
+    garbage collection DAG removes whatever is left.
+
+    Args:
+        song_id (str): The ID of the deleted song.
+
+    Returns:
+        int: The number of objects deleted.
+    """
+    deleted_objects = 0
+    try:
+        minio_client = _get_minio_client()
+        # Melody, voice, final song and its renditions, cover variants, waveforms, preview and HLS presentation
+        with metrics.timed_call("minio", "list_objects"):
+            object_names = [song_object.object_name for song_object in minio_client.list_objects(MINIO_BUCKET_NAME, prefix=song_id, recursive=True)]
+        for start in range(0, len(object_names), SONG_OBJECTS_DELETE_BATCH):
+            batch = object_names[start:start + SONG_OBJECTS_DELETE_BATCH]
+            # remove_objects is lazy: the request is only sent while its errors are iterated
+            with metrics.timed_call("minio", "remove_objects"):
+                errors = list(minio_client.remove_objects(MINIO_BUCKET_NAME, [DeleteObject(object_name) for object_name in batch]))
+            for error in errors:
+                logger.error(f"Error deleting object {error.name} of song {song_id}: {error.message}")
+            deleted_objects += len(batch) - len(errors)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+    try:
+        with metrics.timed_call("elasticsearch", "delete"):
+            elasticsearch_client.delete(index=ELASTICSEARCH_INDEX, id=song_id)
+    except NotFoundError:
+        # Deleted before it was indexed
+        pass
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+    return deleted_objects
+
+def _get_song_status(song_id):
+    """
+    Read the current status of a song with a projection, skipping the style lookup.
+
+    Returns the status (None if the song has not started processing yet) or False if the song does not exist.
+    """
+    song_info = songs_collection.find_one({"_id": ObjectId(song_id)}, {"song_status": 1})
+    if song_info is None:
+        return False
+    return song_info.get("song_status")
+
+def _format_status_event(song_id, song_status):
+    return f"event: song_status\ndata: {json.dumps({'song_id': song_id, 'song_status': song_status})}\n\n"
+
+def _get_song_info_with_urls(song_info, music_style_name=None):
     melody_url = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/stream_melody/{song_info['_id']}"
     voice_url = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/stream_voice/{song_info['_id']}"
     song_url = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/stream_song/{song_info['_id']}"
     image_url = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/show_image/{song_info['_id']}"
     
-    music_style_id = song_info.get("music_style_id")
-    style_info = music_style_collection.find_one({"_id": ObjectId(music_style_id)})
-    music_style_name = style_info.get("style_name") if style_info else "Unknown"
+    if music_style_name is None:
+        music_style_id = song_info.get("music_style_id")
+        style_info = music_style_collection.find_one({"_id": ObjectId(music_style_id)})
+        music_style_name = style_info.get("style_name") if style_info else "Unknown"
 
     song_data = {
         "song_info_id": str(song_info["_id"]),
@@ -335,14 +1035,105 @@ def _get_song_info_with_urls(song_info):
         "keywords": song_info.get("keywords", ""),
         "planned_date": song_info.get("logical_date", ""),
         "music_style": music_style_name,
+        "quality_tier": song_info.get("quality_tier", DEFAULT_QUALITY_TIER),
         "melody_url": melody_url,
         "voice_url": voice_url,
         "image_url": image_url,
+        "image_thumbnail_url": f"{image_url}?w={COVER_THUMBNAIL_WIDTH}",
         "song_url": song_url
     }
+    # Songs downgraded under load are re-rendered at the requested tier later
+    if song_info.get("upgrade_pending"):
+        song_data["requested_quality_tier"] = song_info.get("requested_quality_tier")
+
+    # Waveform peaks and preview clip for list views, when the pipeline produced them
+    if song_info.get("song_waveforms"):
+        song_data["waveform_url"] = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/waveform/{song_info['_id']}"
+    if song_info.get("song_preview"):
+        song_data["preview_url"] = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/preview/{song_info['_id']}"
+
+    # HLS presentation of the final song, when the pipeline packaged it
+    if song_info.get("song_hls"):
+        # Upgraded renders are packaged under their own prefix, e.g. {song_id}/hls/g1/master.m3u8
+        master_playlist = song_info["song_hls"].get("master_playlist", f"{song_info['_id']}/hls/master.m3u8")
+        song_data["song_hls_url"] = f"{LYRIC_WAVE_STREAMING_SERVICE_URL}/hls/{song_info['_id']}/{master_playlist.split('/hls/', 1)[1]}"
+
+    # Smaller renditions of the final song, when the pipeline produced them
+    renditions = song_info.get("song_renditions")
+    if renditions:
+        song_data["song_renditions"] = [
+            {
+                "name": rendition["name"],
+                "content_type": rendition["content_type"],
+                "bitrate_kbps": rendition["bitrate_kbps"],
+                "url": f"{song_url}?quality={rendition['name']}"
+            }
+            for rendition in renditions.values()
+        ]
+
+    # Direct links to MinIO save clients the hop through the streaming API
+    if EMBED_PRESIGNED_URLS:
+        song_data.update(_get_presigned_media_urls(song_info, song_data))
     
     return song_data
 
+def _get_presigned_media_urls(song_info, song_data):
+    """
+    Presign the media files of a song, so clients download them straight from MinIO.
+
+    Files the song does not have yet keep their streaming API URL, and the original mix is linked
+    as song_url since a presigned URL cannot negotiate a rendition.
+
+    Args:
+        song_info (dict): Information about the song.
+        song_data (dict): The song data with the streaming API URLs.
+
+    Returns:
+        dict: The URL fields to replace, with media_urls_expires_in_seconds.
+    """
+    presigned_url_cache = presigned_urls.get_presigned_url_cache()
+    expires_in_seconds = []
+
+    def presign(object_name, content_type, file_extension):
+        # Same headers as the streaming API sends with the file
+        url, fresh_seconds = presigned_url_cache.get(MINIO_BUCKET_NAME, object_name, presigned_urls.response_header_overrides({
+            "Content-Type": content_type,
+            "Content-Disposition": f'inline; filename="{object_name}.{file_extension}"'
+        }))
+        expires_in_seconds.append(fresh_seconds)
+        return url
+
+    media_urls = {}
+    for url_field, file_key, content_type, file_extension in (
+        ("melody_url", "melody_file_name", "audio/wav", "melody.wav"),
+        ("voice_url", "voice_file_name", "audio/wav", "voice.wav"),
+        ("song_url", "final_song_name", "audio/mp4", "final_song_name.mp4"),
+        ("image_url", "song_cover_name", "image/jpeg", "image.jpg")
+    ):
+        if song_info.get(file_key):
+            media_urls[url_field] = presign(song_info[file_key], content_type, file_extension)
+
+    thumbnails = [
+        variant for variant in song_info.get("song_cover_variants") or []
+        if variant["width"] == COVER_THUMBNAIL_WIDTH and variant["format"] in ("webp", "jpeg")
+    ]
+    if thumbnails:
+        # WebP is decoded by every current browser; JPEG when the worker could not encode it
+        thumbnail = min(thumbnails, key=lambda variant: variant["format"] != "webp")
+        media_urls["image_thumbnail_url"] = presign(thumbnail["file_name"], thumbnail["content_type"], thumbnail["format"])
+
+    if song_data.get("song_renditions"):
+        # song_renditions was built from the same dictionary, in the same order
+        media_urls["song_renditions"] = [
+            dict(rendition_data, url=presign(rendition["file_name"], rendition["content_type"], rendition["extension"]))
+            for rendition_data, rendition in zip(song_data["song_renditions"], song_info["song_renditions"].values())
+        ]
+
+    if expires_in_seconds:
+        media_urls["media_urls_expires_in_seconds"] = int(min(expires_in_seconds))
+    return media_urls
+
 # Start the Flask application if this script is executed directly
 if __name__ == '__main__':
+    admission_controller.ensure_started()
     app.run(host='0.0.0.0', port=5000)
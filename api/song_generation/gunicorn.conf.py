@@ -0,0 +1,22 @@
+from prometheus_client import multiprocess
+import os
+import shutil
+
+
+def on_starting(server):
+    # Start every deployment with an empty multiprocess metrics directory
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # Dispatch the songs left queued by a restart and run the idle upgrades without waiting for a new submission
+    import app
+    app.admission_controller.ensure_started()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of workers that exited so /metrics stays accurate
+    multiprocess.mark_process_dead(worker.pid)
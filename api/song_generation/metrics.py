@@ -0,0 +1,99 @@
+from flask import Response, g, request
+from prometheus_client import (
+    CollectorRegistry, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from pymongo import monitoring
+from contextlib import contextmanager
+import os
+import time
+
+# Latency buckets (in seconds) shared by request and downstream call histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "lyricwave_http_request_duration_seconds",
+    "Latency of the HTTP requests served by the API.",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+DOWNSTREAM_LATENCY = Histogram(
+    "lyricwave_downstream_call_duration_seconds",
+    "Latency of the calls made to MongoDB, Elasticsearch, MinIO and Airflow.",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+
+
+@contextmanager
+def timed_call(service, operation):
+    """
+    Time a call to a downstream service.
+
+    Args:
+        service (str): The downstream service (mongodb, elasticsearch, minio, airflow).
+        operation (str): The operation performed.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        DOWNSTREAM_LATENCY.labels(service, operation).observe(time.perf_counter() - start)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    Times every MongoDB command through pymongo's command monitoring, so no call site needs wrapping.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DOWNSTREAM_LATENCY.labels("mongodb", event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        DOWNSTREAM_LATENCY.labels("mongodb", event.command_name).observe(event.duration_micros / 1e6)
+
+
+def register_mongo_listener():
+    """
+    Register the MongoDB command timer; must run before any MongoClient is created.
+    """
+    monitoring.register(MongoCommandTimer())
+
+
+def init_app(app):
+    """
+    Record the latency of every request per route and expose the metrics on /metrics.
+
+    Args:
+        app (Flask): The Flask application.
+    """
+    @app.before_request
+    def _start_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started_at = g.pop("request_started_at", None)
+        if started_at is not None:
+            # Label with the route template, not the raw path, to keep cardinality bounded
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.perf_counter() - started_at)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(_render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _render_metrics():
+    """
+    Render the metrics of all the Gunicorn workers when running in multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,127 @@
+from pymongo import ReturnDocument
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Quality tiers from the cheapest to the most expensive; their model settings live with the DAGs, in config/quality_tiers.json
+QUALITY_TIERS = ("draft", "standard", "high")
+DEFAULT_QUALITY_TIER = "standard"
+# Songs ahead in the backlog (in flight plus queued) from which new songs are generated at most at the standard tier
+QUALITY_STANDARD_BACKLOG = int(os.environ.get("QUALITY_STANDARD_BACKLOG", 10))
+# Songs ahead in the backlog from which new songs are generated at the draft tier
+QUALITY_DRAFT_BACKLOG = int(os.environ.get("QUALITY_DRAFT_BACKLOG", 30))
+# Songs in flight below which the workers count as idle and downgraded songs are re-rendered at their requested tier
+QUALITY_UPGRADE_IDLE_IN_FLIGHT = int(os.environ.get("QUALITY_UPGRADE_IDLE_IN_FLIGHT", 2))
+
+
+def choose_tier(requested_tier, backlog):
+    """
+    Pick the tier a new song is generated at, downgrading it while the pipeline is loaded.
+
+    Args:
+        requested_tier (str): The tier requested by the client.
+        backlog (int): The songs to be generated before it.
+
+    Returns:
+        str: The tier to generate the song at.
+    """
+    if backlog >= QUALITY_DRAFT_BACKLOG:
+        allowed_tier = "draft"
+    elif backlog >= QUALITY_STANDARD_BACKLOG:
+        allowed_tier = "standard"
+    else:
+        allowed_tier = QUALITY_TIERS[-1]
+    return min(requested_tier, allowed_tier, key=QUALITY_TIERS.index)
+
+
+def quality_fields(requested_tier, backlog):
+    """
+    Fields recording the quality tier of a new song document.
+
+    Args:
+        requested_tier (str): The tier requested by the client.
+        backlog (int): The songs to be generated before it.
+
+    Returns:
+        dict: The fields to store in the song document.
+    """
+    quality_tier = choose_tier(requested_tier, backlog)
+    return {
+        "quality_tier": quality_tier,
+        "requested_quality_tier": requested_tier,
+        # Downgraded songs are re-rendered at the requested tier once the workers are idle
+        "upgrade_pending": quality_tier != requested_tier
+    }
+
+
+class QualityUpgrader:
+    """
+    Re-renders downgraded songs at their requested tier while the pipeline is idle.
+
+    Runs after every pass of the admission dispatcher. A song is claimed atomically, so the API
+    processes never re-render it twice; its checkpoints and artifact records are dropped so every
+    stage runs again at the new tier. The song is flagged as `upgrading` meanwhile: its stages leave
+    its status alone and write their objects under the next `render_generation` and their fields to
+    `upgrade_render`, so the draft is served untouched until the last stage swaps both renders in
+    one update and removes the objects of the draft. A failed upgrade only records
+    `upgrade_failed_at` and `upgrade_failure_reason`.
+
+    Args:
+        collection (Collection): The songs collection.
+        dispatch (callable): Schedules a song document in Airflow; returns whether it succeeded.
+        idle_in_flight (int): Songs in flight below which the workers count as idle.
+    """
+
+    def __init__(self, collection, dispatch, idle_in_flight=QUALITY_UPGRADE_IDLE_IN_FLIGHT):
+        self._collection = collection
+        self._dispatch = dispatch
+        self.idle_in_flight = idle_in_flight
+
+    def upgrade_when_idle(self, admission_controller):
+        """
+        Re-render one downgraded song if nothing is queued and few songs are in flight.
+
+        Args:
+            admission_controller (AdmissionController): The controller tracking the backlog.
+
+        Returns:
+            bool: Whether a song was scheduled again.
+        """
+        if admission_controller.queued_count() or admission_controller.in_flight_count() >= self.idle_in_flight:
+            return False
+        candidate = self._collection.find_one(
+            {"upgrade_pending": True, "song_status": "song_indexed"},
+            {"quality_tier": 1, "requested_quality_tier": 1, "render_generation": 1},
+            sort=[("_id", 1)]
+        )
+        if candidate is None:
+            return False
+        song_info = self._collection.find_one_and_update(
+            {"_id": candidate["_id"], "upgrade_pending": True},
+            {
+                "$set": {"upgrade_pending": False, "upgrading": True, "upgrade_render": {
+                    "quality_tier": candidate["requested_quality_tier"],
+                    "render_generation": (candidate.get("render_generation") or 0) + 1
+                }},
+                "$unset": {"checkpoints": "", "artifacts": "", "voice_progress": "",
+                           "upgrade_failed_at": "", "upgrade_failure_reason": ""}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if song_info is None:
+            # Claimed by another process
+            return False
+        try:
+            scheduled = self._dispatch(song_info)
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            scheduled = False
+        if not scheduled:
+            self._collection.update_one(
+                {"_id": song_info["_id"]},
+                {"$set": {"upgrade_pending": True, "upgrading": False}, "$unset": {"upgrade_render": ""}}
+            )
+            return False
+        logger.info(f"Re-rendering song {song_info['_id']} at the {song_info['upgrade_render']['quality_tier']} tier")
+        return True
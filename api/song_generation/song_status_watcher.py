@@ -0,0 +1,161 @@
+from pymongo.errors import OperationFailure, PyMongoError
+from bson import ObjectId
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a song no longer changes
+TERMINAL_SONG_STATUSES = {"song_indexed", "failed"}
+
+# Error code returned by MongoDB when change streams are not available (standalone server)
+CHANGE_STREAMS_NOT_SUPPORTED_CODE = 40573
+
+
+class SongStatusWatcher:
+    """
+    Watches song status transitions and fans them out to every subscriber of a song.
+
+    A single background thread per process follows the songs collection through a MongoDB change
+    stream. When the server does not support change streams (standalone deployments), the thread
+    falls back to polling, issuing one query per interval for all the songs that currently have
+    subscribers instead of one query per client.
+
+    Every event delivered to subscribers is a dict with `song_id`, `song_status` and
+    `published_at` (epoch seconds when the watcher observed the transition).
+
+    :param collection: The songs collection to watch.
+    :param poll_interval: Seconds between queries in polling mode.
+    """
+
+    def __init__(self, collection, poll_interval=2.0):
+        self._collection = collection
+        self._poll_interval = poll_interval
+        self._subscribers = {}
+        self._last_known_status = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.mode = None
+
+    def subscribe(self, song_id):
+        """
+        Register interest in the status transitions of a song.
+
+        Args:
+            song_id (str): The song to follow.
+
+        Returns:
+            queue.Queue: A queue receiving the song's status events.
+        """
+        subscription = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(song_id, set()).add(subscription)
+        self._ensure_started()
+        return subscription
+
+    def unsubscribe(self, song_id, subscription):
+        """
+        Stop delivering events of a song to a subscription.
+
+        Args:
+            song_id (str): The song being followed.
+            subscription (queue.Queue): The queue returned by `subscribe`.
+        """
+        with self._lock:
+            subscriptions = self._subscribers.get(song_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[song_id]
+                self._last_known_status.pop(song_id, None)
+
+    def publish(self, song_id, song_status):
+        """
+        Deliver a status transition to every subscriber of the song.
+
+        Args:
+            song_id (str): The song whose status changed.
+            song_status (str): The new status.
+
+        Returns:
+            int: The number of subscriptions the event was delivered to.
+        """
+        event = {"song_id": song_id, "song_status": song_status, "published_at": time.time()}
+        with self._lock:
+            self._last_known_status[song_id] = song_status
+            subscriptions = list(self._subscribers.get(song_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return len(subscriptions)
+
+    def _ensure_started(self):
+        """
+        Start the watcher thread lazily, so it is created inside each Gunicorn worker after the fork.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="song-status-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self._watch_change_stream()
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAMS_NOT_SUPPORTED_CODE:
+                raise
+            logger.info("Change streams are not supported by MongoDB; falling back to polling song statuses")
+            self._poll()
+
+    def _watch_change_stream(self):
+        """
+        Follow song status updates through a change stream, resuming after transient errors.
+        """
+        pipeline = [{
+            "$match": {
+                "operationType": "update",
+                "updateDescription.updatedFields.song_status": {"$exists": True}
+            }
+        }]
+        resume_token = None
+        self.mode = "change_stream"
+        while True:
+            try:
+                with self._collection.watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        song_id = str(change["documentKey"]["_id"])
+                        song_status = change["updateDescription"]["updatedFields"]["song_status"]
+                        self.publish(song_id, song_status)
+            except OperationFailure:
+                raise
+            except PyMongoError as e:
+                logger.error(f"Song status change stream interrupted: {str(e)}")
+                time.sleep(self._poll_interval)
+
+    def _poll(self):
+        """
+        Poll the statuses of all the subscribed songs with a single query per interval.
+        """
+        self.mode = "polling"
+        while True:
+            with self._lock:
+                song_ids = list(self._subscribers.keys())
+                last_known_status = dict(self._last_known_status)
+            if song_ids:
+                try:
+                    cursor = self._collection.find(
+                        {"_id": {"$in": [ObjectId(song_id) for song_id in song_ids]}},
+                        {"song_status": 1}
+                    )
+                    for song in cursor:
+                        song_id = str(song["_id"])
+                        song_status = song.get("song_status")
+                        if song_status is not None and song_status != last_known_status.get(song_id):
+                            self.publish(song_id, song_status)
+                except PyMongoError as e:
+                    logger.error(f"Error polling song statuses: {str(e)}")
+            time.sleep(self._poll_interval)
@@ -2,8 +2,16 @@ from flask import Flask, Response, app, request
 from pymongo import MongoClient
 from bson import ObjectId
 from minio import Minio
+from minio.error import S3Error
 import logging
+import cover_images
+import metrics
+import presigned_urls
+import song_files
 import os
+import re
+import struct
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,12 +27,51 @@ MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY")
 MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY")
 MINIO_BUCKET_NAME = os.environ.get("MINIO_BUCKET_NAME")
 
+# Quality aliases accepted by /stream_song, mapped to the renditions produced by GenerateSongOperator
+SONG_QUALITY_ALIASES = {"low": "opus_48", "medium": "opus_96", "high": "aac_128"}
+# Media types clients use for the codecs of the renditions, mapped to the stored content types
+ACCEPT_MEDIA_TYPE_ALIASES = {"audio/opus": "audio/ogg", "audio/aac": "audio/mp4", "audio/x-m4a": "audio/mp4", "audio/m4a": "audio/mp4"}
+
+# HLS files are stored under {song_id}/hls/ (under {song_id}/hls/g{n}/ for the render generation n of a
+# quality upgrade) and never change once packaged
+HLS_ASSET_PATTERN = re.compile(r"^(?:g[0-9]+/)?(?:[a-z0-9_]+/)?[a-z0-9_]+\.(m3u8|mp4|m4s)$")
+HLS_CONTENT_TYPES = {"m3u8": "application/vnd.apple.mpegurl", "mp4": "audio/mp4", "m4s": "audio/mp4"}
+HLS_SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+HLS_PLAYLIST_CACHE_CONTROL = "public, max-age=3600"
+HLS_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Tracks with precomputed waveform peaks
+WAVEFORM_TRACKS = ("song", "melody", "voice")
+# Waveforms and previews are small and only change if the song is regenerated
+DERIVED_FILE_CACHE_CONTROL = "public, max-age=86400"
+
+# Segments of a progressively generated voice are polled this often while the voice is being synthesized
+VOICE_PROGRESSIVE_POLL_SECONDS = float(os.environ.get("VOICE_PROGRESSIVE_POLL_SECONDS", 1))
+# A progressive voice stream ends when no new segment is published for this long
+VOICE_PROGRESSIVE_MAX_WAIT_SECONDS = float(os.environ.get("VOICE_PROGRESSIVE_MAX_WAIT_SECONDS", 120))
+# Total seconds a progressive voice stream may wait for new segments in the sync serving mode, where it holds its
+# worker while it sleeps; kept below Gunicorn's 30 second worker timeout. The ASGI mode waits without holding a thread
+VOICE_PROGRESSIVE_SYNC_MAX_WAIT_SECONDS = float(os.environ.get("VOICE_PROGRESSIVE_SYNC_MAX_WAIT_SECONDS", 20))
+# Fields read to follow the synthesis of a voice; never cached, as they change with every segment
+VOICE_PROGRESS_PROJECTION = {"voice_progress": 1, "voice_file_name": 1, "song_status": 1}
+# Published segments are raw 16-bit mono PCM, streamed behind a single WAV header
+VOICE_PART_SAMPLE_BYTES = 2
+
+# "proxy" streams audio and images through the API; "redirect" answers with a redirect to a presigned MinIO URL
+STREAMING_DELIVERY_MODE = os.environ.get("STREAMING_DELIVERY_MODE", "proxy")
+
+# Time every MongoDB command; the listener must be registered before the client is created
+metrics.register_mongo_listener()
+
 # Connect to MongoDB using the provided URI
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client[MONGO_DB]
 songs_collection = db[MONGO_COLLECTION]
+# Object names of the songs, read with a projection and cached once a song is complete
+song_files_cache = song_files.SongFilesCache(songs_collection)
 
 app = Flask(__name__)
+metrics.init_app(app)
 
 @app.route('/stream_melody/<string:song_id>', methods=['GET'])
 def stream_melody(song_id):
@@ -37,9 +84,12 @@ def stream_melody(song_id):
     Returns:
         Response: A response object that streams the melody audio file.
     """
-    song_info = songs_collection.find_one({"_id": ObjectId(song_id)})
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
     if song_info:
-        return _stream_file_from_minio(song_info, MINIO_BUCKET_NAME, "melody_file_name", "audio/wav", "melody.wav")
+        return _serve_media_file(_select_song_file(song_info, "melody_file_name", "audio/wav", "melody.wav"))
     else:
         return "Song not found", 404
 
@@ -54,9 +104,12 @@ def stream_voice(song_id):
     Returns:
         Response: A response object that streams the voice audio file.
     """
-    song_info = songs_collection.find_one({"_id": ObjectId(song_id)})
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
     if song_info:
-        return _stream_file_from_minio(song_info, MINIO_BUCKET_NAME, "voice_file_name", "audio/wav", "voice.wav")
+        return _serve_media_file(_select_song_file(song_info, "voice_file_name", "audio/wav", "voice.wav"))
     else:
         return "Song not found", 404
 
@@ -65,15 +118,31 @@ def stream_song(song_id):
     """
     Stream the complete song of a song identified by song_id.
 
+    The rendition is picked from the `quality` query parameter (low, medium, high, original or a
+    rendition name) or negotiated from the `Accept` and `Save-Data` headers. Without any of them the
+    original mix is streamed.
+
     Args:
         song_id (str): The unique identifier of the song.
 
     Returns:
         Response: A response object that streams the complete song audio file.
     """
-    song_info = songs_collection.find_one({"_id": ObjectId(song_id)})
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
     if song_info:
-        return _stream_file_from_minio(song_info, MINIO_BUCKET_NAME, "final_song_name", "audio/mpeg", "final_song_name.mp4")
+        try:
+            song_file = _select_song_rendition(
+                song_info,
+                quality=request.args.get('quality'),
+                accept=request.headers.get('Accept'),
+                save_data=request.headers.get('Save-Data', '').lower() == 'on'
+            )
+        except ValueError as e:
+            return str(e), 400
+        return _serve_media_file(song_file)
     else:
         return "Song not found", 404
 
@@ -82,28 +151,375 @@ def show_image(song_id):
     """
     Show the image associated with a song identified by song_id.
 
+    The `w` (width in pixels) and `format` (avif, webp or jpeg) query parameters select a
+    precomputed variant of the cover, or a copy resized on demand; without `format` the best format
+    listed in the Accept header is used. Without parameters the original JPEG is served.
+
     Args:
         song_id (str): The unique identifier of the song.
 
     Returns:
         Response: A response object that displays the image file.
     """
-    song_info = songs_collection.find_one({"_id": ObjectId(song_id)})
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
+    if song_info:
+        try:
+            song_file = _select_cover(song_info, request.args.get('w'), request.args.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return str(e), 400
+        if song_file.get("resize"):
+            try:
+                image_bytes = cover_images.render_cover(_get_minio_client(), MINIO_BUCKET_NAME, song_file)
+            except Exception as e:
+                logger.error(f"An error occurred: {str(e)}")
+                return "An error occurred", 500
+            headers = _build_stream_headers(song_file)
+            headers['Content-Length'] = str(len(image_bytes))
+            return Response(image_bytes, headers=headers, status=200)
+        return _serve_media_file(song_file)
+    else:
+        return "Song not found", 404
+
+@app.route('/waveform/<string:song_id>', methods=['GET'])
+def show_waveform(song_id):
+    """
+    Serve the precomputed waveform peaks of a track of a song, a few kilobytes of JSON.
+
+    Args:
+        song_id (str): The unique identifier of the song.
+
+    Returns:
+        Response: A response object with the peaks in audiowaveform JSON format.
+    """
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
+    if song_info:
+        try:
+            song_file = _select_waveform(song_info, request.args.get('track', 'song'))
+        except ValueError as e:
+            return str(e), 400
+        if song_file is None:
+            return "Waveform not available", 404
+        return _stream_file_from_minio(song_file, MINIO_BUCKET_NAME)
+    else:
+        return "Song not found", 404
+
+@app.route('/preview/<string:song_id>', methods=['GET'])
+def stream_preview(song_id):
+    """
+    Stream the short low bitrate preview clip of a song.
+
+    Args:
+        song_id (str): The unique identifier of the song.
+
+    Returns:
+        Response: A response object that streams the preview clip.
+    """
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = song_files_cache.get(song_object_id)
     if song_info:
-        return _stream_file_from_minio(song_info, MINIO_BUCKET_NAME, "song_cover_name", "image/jpeg", "image.jpg")
+        song_file = _select_preview(song_info)
+        if song_file is None:
+            return "Preview not available", 404
+        return _stream_file_from_minio(song_file, MINIO_BUCKET_NAME)
     else:
         return "Song not found", 404
 
-def _stream_file_from_minio(song_info, minio_bucket_name, file_key, content_type, file_extension):
+@app.route('/stream_voice_progressive/<string:song_id>', methods=['GET'])
+def stream_voice_progressive(song_id):
+    """
+    Stream the voice of a song while it is still being synthesized.
+
+    The segments published so far are streamed behind a WAV header, then the stream waits for the
+    next ones until the whole voice is played. Once the voice is complete, it is served like
+    /stream_voice.
+
+    Args:
+        song_id (str): The unique identifier of the song.
+
+    Returns:
+        Response: A response object that streams the voice audio.
+    """
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return "Invalid song ID", 400
+    song_info = songs_collection.find_one({"_id": song_object_id}, VOICE_PROGRESS_PROJECTION)
+    if not song_info:
+        return "Song not found", 404
+    if song_info.get("voice_file_name"):
+        return _serve_media_file(_select_song_file(song_info, "voice_file_name", "audio/wav", "voice.wav"))
+    if not song_info.get("voice_progress"):
+        return "Voice not available yet", 404
+    try:
+        minio_client = _get_minio_client()
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return "An error occurred", 500
+    voice_parts = _iter_voice_parts(minio_client, song_object_id, song_info["voice_progress"], HLS_STREAM_CHUNK_SIZE)
+    return Response(metrics.track_stream(request.url_rule.rule, voice_parts), headers=_build_progressive_voice_headers(), status=200)
+
+def _build_progressive_voice_headers():
+    """
+    Build the response headers of a voice streamed while it is synthesized, which must not be cached.
+
+    Returns:
+        dict: The response headers.
+    """
+    return {
+        'Content-Type': 'audio/wav',
+        'Content-Disposition': 'inline; filename=voice.wav',
+        'Cache-Control': 'no-store'
+    }
+
+def _build_wav_header(sample_rate, data_bytes=None):
+    """
+    Build the header of a 16-bit mono PCM WAV stream.
+
+    Args:
+        sample_rate (int): The sample rate.
+        data_bytes (int, optional): The size of the audio data; when None the maximum size is
+            announced, as live WAV streams do, and players read until the stream ends.
+
+    Returns:
+        bytes: The 44 byte header.
+    """
+    data_bytes = 0xFFFFFFFF - 36 if data_bytes is None else data_bytes
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_bytes, b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * VOICE_PART_SAMPLE_BYTES, VOICE_PART_SAMPLE_BYTES, 16,
+        b'data', data_bytes
+    )
+
+def _build_progressive_wav_header(voice_progress):
+    """
+    Build the WAV header of a progressive voice stream, announcing the size of the voice if it is complete.
+
+    Args:
+        voice_progress (dict): The `voice_progress` field of the song document.
+
+    Returns:
+        bytes: The 44 byte header.
+    """
+    complete = voice_progress.get("segments_done", 0) >= voice_progress["segments_total"]
+    data_bytes = sum(part["samples"] for part in voice_progress["parts"]) * VOICE_PART_SAMPLE_BYTES if complete else None
+    return _build_wav_header(voice_progress["sample_rate"], data_bytes)
+
+def _voice_stream_finished(voice_progress, streamed_parts, idle_seconds):
+    """
+    Whether a progressive voice stream is over: every segment is played, or none was published for
+    VOICE_PROGRESSIVE_MAX_WAIT_SECONDS.
+    """
+    return streamed_parts >= voice_progress["segments_total"] or idle_seconds >= VOICE_PROGRESSIVE_MAX_WAIT_SECONDS
+
+def _followed_voice_progress(song_info, voice_progress):
+    """
+    The voice progress a stream keeps following after a poll.
+
+    Args:
+        song_info (dict): The song document read by the poll, or None if the song was deleted.
+        voice_progress (dict): The voice progress followed so far.
+
+    Returns:
+        dict: The new voice progress, or None if the stream must end: the song was deleted or failed,
+        or its voice is regenerated from other lyrics.
+    """
+    if not song_info or song_info.get("song_status") == "failed":
+        return None
+    progress = song_info.get("voice_progress") or {}
+    if progress.get("digest") != voice_progress.get("digest"):
+        return None
+    return progress
+
+def _iter_voice_parts(minio_client, song_object_id, voice_progress, chunk_size):
+    """
+    Yield a WAV header and the published segments of a voice, following the synthesis until the
+    last segment is played. Used by the sync serving mode; the ASGI mode waits between polls
+    without holding a thread (see asgi_app._aiter_voice_parts).
+
+    The stream ends early if the song fails, if its voice is regenerated from other lyrics, or if
+    no segment is published for VOICE_PROGRESSIVE_MAX_WAIT_SECONDS. As the stream holds its sync
+    worker while it sleeps between polls, it also ends once it has waited
+    VOICE_PROGRESSIVE_SYNC_MAX_WAIT_SECONDS in all; the listener reconnects to hear the rest.
+
+    Args:
+        minio_client (Minio): The MinIO client.
+        song_object_id (ObjectId): The song ID.
+        voice_progress (dict): The `voice_progress` field of the song document.
+        chunk_size (int): Size of the chunks read from MinIO.
+
+    Yields:
+        bytes: The chunks of the stream.
+    """
+    yield _build_progressive_wav_header(voice_progress)
+    streamed_parts = 0
+    idle_seconds = 0.0
+    waited_seconds = 0.0
+    try:
+        while True:
+            for part in voice_progress["parts"][streamed_parts:]:
+                with metrics.timed_call("minio", "get_object"):
+                    file_data = minio_client.get_object(MINIO_BUCKET_NAME, part["object_name"])
+                try:
+                    yield from file_data.stream(chunk_size)
+                finally:
+                    file_data.close()
+                    file_data.release_conn()
+                streamed_parts += 1
+                idle_seconds = 0.0
+            if _voice_stream_finished(voice_progress, streamed_parts, idle_seconds) or \
+                    waited_seconds >= VOICE_PROGRESSIVE_SYNC_MAX_WAIT_SECONDS:
+                return
+            time.sleep(VOICE_PROGRESSIVE_POLL_SECONDS)
+            idle_seconds += VOICE_PROGRESSIVE_POLL_SECONDS
+            waited_seconds += VOICE_PROGRESSIVE_POLL_SECONDS
+            song_info = songs_collection.find_one({"_id": song_object_id}, VOICE_PROGRESS_PROJECTION)
+            voice_progress = _followed_voice_progress(song_info, voice_progress)
+            if voice_progress is None:
+                return
+    except Exception as e:
+        # The headers are sent already; the stream ends where the voice stops
+        logger.error(f"An error occurred: {str(e)}")
+
+@app.route('/hls/<string:song_id>/<path:asset>', methods=['GET'])
+def stream_hls_asset(song_id, asset):
+    """
+    Serve a file of the HLS presentation of a song: playlists, init segments and media segments.
+
+    Files are read straight from MinIO without a MongoDB lookup and served with long-lived cache
+    headers, so players start after downloading a playlist and one short segment, and caches in
+    front of the API absorb repeated plays.
+
+    Args:
+        song_id (str): The unique identifier of the song.
+        asset (str): The path of the file inside the presentation, e.g. master.m3u8, aac_64/segment_00000.m4s
+            or g1/aac_64/segment_00000.m4s for an upgraded render.
+
+    Returns:
+        Response: A response object that streams the file.
+    """
+    object_name = _hls_object_name(song_id, asset)
+    if object_name is None:
+        return "Not found", 404
+    try:
+        minio_client = _get_minio_client()
+        with metrics.timed_call("minio", "get_object"):
+            file_data = minio_client.get_object(MINIO_BUCKET_NAME, object_name)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return "Not found", 404
+        logger.error(f"An error occurred: {str(e)}")
+        return "An error occurred", 500
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return "An error occurred", 500
+
+    headers = _build_hls_headers(asset, file_data.headers)
+    if headers.get('ETag') and request.headers.get('If-None-Match') == headers['ETag']:
+        file_data.close()
+        file_data.release_conn()
+        return Response(status=304, headers={'ETag': headers['ETag'], 'Cache-Control': headers['Cache-Control']})
+    return Response(metrics.track_stream(request.url_rule.rule, file_data.stream(HLS_STREAM_CHUNK_SIZE)), headers=headers, status=200)
+
+def _hls_object_name(song_id, asset):
+    """
+    Map a file of the HLS presentation of a song to its object in MinIO.
+
+    Args:
+        song_id (str): The unique identifier of the song.
+        asset (str): The path of the file inside the presentation.
+
+    Returns:
+        str: The object name, or None if the song ID or the path is not valid.
+    """
+    if not ObjectId.is_valid(song_id) or not HLS_ASSET_PATTERN.match(asset):
+        return None
+    return f"{song_id}/hls/{asset}"
+
+def _build_hls_headers(asset, object_headers):
+    """
+    Build the response headers of a file of the HLS presentation.
+
+    Args:
+        asset (str): The path of the file inside the presentation.
+        object_headers (Mapping): The headers of the MinIO object response.
+
+    Returns:
+        dict: The response headers.
+    """
+    extension = asset.rsplit(".", 1)[1]
+    headers = {
+        'Content-Type': HLS_CONTENT_TYPES[extension],
+        'Cache-Control': HLS_PLAYLIST_CACHE_CONTROL if extension == "m3u8" else HLS_SEGMENT_CACHE_CONTROL,
+        # Browser players (hls.js, Shaka) fetch the presentation with XHR
+        'Access-Control-Allow-Origin': '*'
+    }
+    for header in ('Content-Length', 'ETag', 'Last-Modified'):
+        if object_headers.get(header):
+            headers[header] = object_headers[header]
+    return headers
+
+def _serve_media_file(song_file):
+    """
+    Serve an audio file or a cover, through the API or as a redirect to MinIO depending on STREAMING_DELIVERY_MODE.
+
+    Args:
+        song_file (dict): The file to serve, as returned by _select_song_file, _select_song_rendition or _select_cover.
+
+    Returns:
+        Response: A response object that streams the file data or redirects to it.
+    """
+    if STREAMING_DELIVERY_MODE != "redirect":
+        return _stream_file_from_minio(song_file, MINIO_BUCKET_NAME)
+    try:
+        headers = _build_redirect_headers(song_file)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return "An error occurred", 500
+    return Response(status=307, headers=headers)
+
+def _build_redirect_headers(song_file):
+    """
+    Build the headers of a redirect to a presigned MinIO URL of a file.
+
+    The URL asks MinIO to answer with the headers the API would have sent, and the redirect can be
+    cached by the client for as long as the cached URL is handed out. Shared by the WSGI and ASGI
+    serving modes.
+
+    Args:
+        song_file (dict): The file to serve.
+
+    Returns:
+        dict: The response headers.
+    """
+    with metrics.timed_call("minio", "presigned_get_object"):
+        url, fresh_seconds = presigned_urls.get_presigned_url_cache().get(
+            MINIO_BUCKET_NAME,
+            song_file["object_name"],
+            presigned_urls.response_header_overrides(_build_stream_headers(song_file))
+        )
+    headers = {
+        'Location': url,
+        'Cache-Control': f'private, max-age={int(fresh_seconds)}'
+    }
+    if song_file.get("vary"):
+        headers['Vary'] = song_file["vary"]
+    return headers
+
+def _stream_file_from_minio(song_file, minio_bucket_name):
     """
     Stream a file from MinIO.
 
     Args:
-        song_info (dict): Information about the song.
+        song_file (dict): The file to stream, as returned by _select_song_file or _select_song_rendition.
         minio_bucket_name (str): The name of the MinIO bucket.
-        file_key (str): The key of the file in MinIO.
-        content_type (str): The content type of the file.
-        file_extension (str): The file extension.
 
     Returns:
         Response: A response object that streams the file data.
@@ -111,47 +527,263 @@ def _stream_file_from_minio(song_info, minio_bucket_name, file_key, content_type
     try:
         # Retrieve the file path from MinIO
         minio_client = _get_minio_client()
-        file_data = minio_client.get_object(minio_bucket_name, song_info[file_key])
+        with metrics.timed_call("minio", "get_object"):
+            file_data = minio_client.get_object(minio_bucket_name, song_file["object_name"])
 
         # Define response headers for streaming audio
-        headers = {
-            'Content-Type': content_type,
-            'Cache-Control': 'no-store',
-            'Content-Disposition': f'inline; filename="{song_info[file_key]}.{file_extension}"',
-            'Accept-Ranges': 'none'
-        }
+        headers = _build_stream_headers(song_file)
 
         # Generator function to stream the file data in chunks
         def generate():
             for data in file_data.stream(1024):
                 yield data
 
-        return Response(generate(), headers=headers, status=200)
+        return Response(metrics.track_stream(request.url_rule.rule, generate()), headers=headers, status=200)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            # The song was deleted, or its objects collected, while its names were still cached
+            _invalidate_song_files(song_file["object_name"])
+            return "Song not found", 404
+        logger.error(f"An error occurred: {str(e)}")
+        return "An error occurred", 500
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         return "An error occurred", 500
 
+def _invalidate_song_files(object_name):
+    """
+    Drop the cached object names of the song an object that no longer exists belongs to.
+
+    Args:
+        object_name (str): The missing object.
+    """
+    song_object_id = song_files.song_id_of_object(object_name)
+    if song_object_id is not None:
+        song_files_cache.invalidate(song_object_id)
+
+def _select_song_file(song_info, file_key, content_type, file_extension):
+    """
+    Describe a file of a song stored under a single key of the song document.
+
+    Args:
+        song_info (dict): Information about the song.
+        file_key (str): The key of the file in MinIO.
+        content_type (str): The content type of the file.
+        file_extension (str): The file extension.
+
+    Returns:
+        dict: The object name, content type and file extension of the file.
+    """
+    return {
+        "object_name": song_info[file_key],
+        "content_type": content_type,
+        "file_extension": file_extension
+    }
+
+def _select_cover(song_info, width, image_format, accept):
+    """
+    Pick the cover file to serve, negotiating the format with the Accept header.
+
+    Args:
+        song_info (dict): Information about the song.
+        width (str, optional): The requested width in pixels.
+        image_format (str, optional): The requested format.
+        accept (str, optional): The Accept header of the request.
+
+    Returns:
+        dict: The cover file, see cover_images.select_cover.
+
+    Raises:
+        ValueError: If the width or the format are not valid.
+    """
+    accepted_types = {media_type for media_type, q in _parse_accept(accept) if q > 0}
+    return cover_images.select_cover(song_info, width, image_format, accepted_types)
+
+def _select_waveform(song_info, track):
+    """
+    Describe the waveform file of a track of a song.
+
+    Args:
+        song_info (dict): Information about the song.
+        track (str): The track: song, melody or voice.
+
+    Returns:
+        dict: The waveform file, or None if the song has no waveforms.
+
+    Raises:
+        ValueError: If the track is unknown.
+    """
+    if track not in WAVEFORM_TRACKS:
+        raise ValueError(f"Unknown track '{track}'")
+    waveform_file_name = (song_info.get("song_waveforms") or {}).get(track)
+    if not waveform_file_name:
+        return None
+    return {
+        "object_name": waveform_file_name,
+        "content_type": "application/json",
+        "file_extension": "json",
+        "cache_control": DERIVED_FILE_CACHE_CONTROL
+    }
+
+def _select_preview(song_info):
+    """
+    Describe the preview clip of a song.
+
+    Args:
+        song_info (dict): Information about the song.
+
+    Returns:
+        dict: The preview file, or None if the song has no preview.
+    """
+    song_preview = song_info.get("song_preview")
+    if not song_preview:
+        return None
+    return {
+        "object_name": song_preview["file_name"],
+        "content_type": song_preview["content_type"],
+        "file_extension": "opus",
+        "cache_control": DERIVED_FILE_CACHE_CONTROL
+    }
+
+def _parse_accept(accept_header):
+    """
+    Parse an Accept header into (media range, q) pairs.
+
+    Args:
+        accept_header (str): The raw Accept header, if any.
+
+    Returns:
+        list: The media ranges in header order with their quality value.
+    """
+    media_ranges = []
+    for media_range in (accept_header or "").split(","):
+        parts = [part.strip() for part in media_range.split(";")]
+        if not parts[0]:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        media_type = parts[0].lower()
+        media_ranges.append((ACCEPT_MEDIA_TYPE_ALIASES.get(media_type, media_type), quality))
+    return media_ranges
+
+def _select_song_rendition(song_info, quality=None, accept=None, save_data=False):
+    """
+    Pick the rendition of the final song to stream.
+
+    An explicit quality always wins. Otherwise the renditions whose media type is listed in the
+    Accept header with the highest q are candidates, and the highest bitrate among them is picked,
+    or the lowest one when the client asked to save data. Songs generated before renditions
+    existed, and clients without preferences, get the original mix.
+
+    Args:
+        song_info (dict): Information about the song.
+        quality (str, optional): A quality alias (low, medium, high, original) or a rendition name.
+        accept (str, optional): The Accept header of the request.
+        save_data (bool): Whether the client sent `Save-Data: on`.
+
+    Returns:
+        dict: The object name, content type and file extension of the selected file.
+
+    Raises:
+        ValueError: If the requested quality is unknown.
+    """
+    original = _select_song_file(song_info, "final_song_name", "audio/mp4", "final_song_name.mp4")
+    original["vary"] = "Accept, Save-Data"
+    renditions = list((song_info.get("song_renditions") or {}).values())
+
+    def as_song_file(rendition):
+        return {
+            "object_name": rendition["file_name"],
+            "content_type": rendition["content_type"],
+            "file_extension": rendition["extension"],
+            "vary": "Accept, Save-Data"
+        }
+
+    if quality:
+        if quality == "original":
+            return original
+        rendition_name = SONG_QUALITY_ALIASES.get(quality, quality)
+        for rendition in renditions:
+            if rendition["name"] == rendition_name:
+                return as_song_file(rendition)
+        if rendition_name in SONG_QUALITY_ALIASES.values():
+            # The song has no renditions yet
+            return original
+        raise ValueError(f"Unknown quality '{quality}'")
+
+    candidates = []
+    for media_type, q in _parse_accept(accept):
+        if q <= 0 or media_type in ("*/*", "audio/*"):
+            continue
+        for rendition in renditions:
+            if rendition["content_type"].split(";")[0] == media_type:
+                candidates.append((q, rendition))
+
+    if candidates:
+        best_q = max(q for q, _ in candidates)
+        renditions = [rendition for q, rendition in candidates if q == best_q]
+    elif not save_data or not renditions:
+        return original
+
+    pick = min if save_data else max
+    return as_song_file(pick(renditions, key=lambda rendition: rendition["bitrate_kbps"]))
+
+def _build_stream_headers(song_file):
+    """
+    Build the response headers used when streaming a song file.
+
+    Shared by the WSGI and ASGI serving modes so both answer with the same semantics.
+
+    Args:
+        song_file (dict): The file to stream, as returned by _select_song_file or _select_song_rendition.
+
+    Returns:
+        dict: The response headers.
+    """
+    headers = {
+        'Content-Type': song_file["content_type"],
+        'Cache-Control': song_file.get("cache_control", 'no-store'),
+        'Content-Disposition': f'inline; filename="{song_file["object_name"]}.{song_file["file_extension"]}"',
+        'Accept-Ranges': 'none'
+    }
+    if song_file.get("vary"):
+        headers['Vary'] = song_file["vary"]
+    return headers
+
+_minio_client = None
+
 def _get_minio_client():
     """
-    Create a MinIO client and ensure the bucket exists.
+    Get the MinIO client shared by every request served by this process.
+
+    The client is created, and the bucket checked, on first use only, so requests don't pay for a
+    new client and a bucket_exists round trip to MinIO each.
 
     Returns:
         Minio: A MinIO client instance.
     """
-    try:
-        minio_client = Minio(
-            MINIO_ENDPOINT,
-            access_key=MINIO_ACCESS_KEY,
-            secret_key=MINIO_SECRET_KEY,
-            secure=False
-        )
-        bucket_exists = minio_client.bucket_exists(MINIO_BUCKET_NAME)
-        if not bucket_exists:
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
-        return minio_client
-    except Exception as e:
-        error_message = f"Error connecting to MinIO: {e}"
-        raise Exception(error_message)
+    global _minio_client
+    if _minio_client is None:
+        try:
+            minio_client = Minio(
+                MINIO_ENDPOINT,
+                access_key=MINIO_ACCESS_KEY,
+                secret_key=MINIO_SECRET_KEY,
+                secure=False
+            )
+            bucket_exists = minio_client.bucket_exists(MINIO_BUCKET_NAME)
+            if not bucket_exists:
+                minio_client.make_bucket(MINIO_BUCKET_NAME)
+            _minio_client = minio_client
+        except Exception as e:
+            error_message = f"Error connecting to MinIO: {e}"
+            raise Exception(error_message)
+    return _minio_client
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
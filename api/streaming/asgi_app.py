@@ -0,0 +1,420 @@
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from minio import Minio
+from minio.error import S3Error
+import anyio
+import cover_images
+import song_files
+import urllib3
+import logging
+import metrics
+import os
+import time
+
+from app import (
+    app as flask_app,
+    song_files_cache,
+    _build_stream_headers,
+    _build_redirect_headers,
+    _build_hls_headers,
+    _hls_object_name,
+    _invalidate_song_files,
+    _build_progressive_wav_header,
+    _build_progressive_voice_headers,
+    _followed_voice_progress,
+    _voice_stream_finished,
+    _select_cover,
+    _select_song_file,
+    _select_song_rendition,
+    _select_waveform,
+    _select_preview,
+    MINIO_ENDPOINT,
+    MINIO_ACCESS_KEY,
+    MINIO_SECRET_KEY,
+    MINIO_BUCKET_NAME,
+    STREAMING_DELIVERY_MODE,
+    VOICE_PROGRESS_PROJECTION,
+    VOICE_PROGRESSIVE_POLL_SECONDS,
+    songs_collection
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of the threadpool used to offload blocking MongoDB and MinIO calls
+ASGI_THREADPOOL_SIZE = int(os.environ.get("ASGI_THREADPOOL_SIZE", 256))
+# Size of every chunk read from MinIO; bigger chunks mean fewer threadpool hops per stream
+ASGI_STREAM_CHUNK_SIZE = int(os.environ.get("ASGI_STREAM_CHUNK_SIZE", 64 * 1024))
+# Maximum number of pooled HTTP connections kept open against MinIO
+ASGI_MINIO_POOL_SIZE = int(os.environ.get("ASGI_MINIO_POOL_SIZE", 256))
+
+_minio_client = None
+
+
+def _get_minio_client():
+    """
+    Get the MinIO client shared by every request served by this process.
+
+    Unlike the WSGI mode, the client is created once and backed by a connection pool sized
+    for many concurrent streams, so no request pays for a new client or a bucket check.
+
+    Returns:
+        Minio: A MinIO client instance.
+    """
+    global _minio_client
+    if _minio_client is None:
+        try:
+            http_client = urllib3.PoolManager(
+                maxsize=ASGI_MINIO_POOL_SIZE,
+                timeout=urllib3.Timeout(connect=5, read=60),
+                retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+            )
+            minio_client = Minio(
+                MINIO_ENDPOINT,
+                access_key=MINIO_ACCESS_KEY,
+                secret_key=MINIO_SECRET_KEY,
+                secure=False,
+                http_client=http_client
+            )
+            if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
+                minio_client.make_bucket(MINIO_BUCKET_NAME)
+            _minio_client = minio_client
+        except Exception as e:
+            error_message = f"Error connecting to MinIO: {e}"
+            raise Exception(error_message)
+    return _minio_client
+
+
+def _release_object(file_data):
+    """
+    Close a MinIO object response and hand its connection back to the pool.
+
+    Args:
+        file_data (urllib3.response.HTTPResponse): The MinIO object response.
+    """
+    file_data.close()
+    file_data.release_conn()
+
+
+async def _find_song_files(song_id):
+    """
+    Look up the object names of a song, answering cache hits without a threadpool hop.
+
+    Args:
+        song_id (str): The song ID from the request path.
+
+    Returns:
+        dict: The projected song document, None if the song does not exist, or False if the ID is malformed.
+    """
+    song_object_id = song_files.parse_song_id(song_id)
+    if song_object_id is None:
+        return False
+    song_info = song_files_cache.get_cached(song_object_id)
+    if song_info is None:
+        song_info = await run_in_threadpool(song_files_cache.get, song_object_id)
+    return song_info
+
+
+async def _stream_song_file(request, select_song_file, redirect=False):
+    """
+    Stream a song file from MinIO without holding an event loop thread.
+
+    Blocking MongoDB and MinIO calls run in the threadpool, so one worker process can keep
+    thousands of slow listeners open at the same time.
+
+    Args:
+        request (Request): The incoming request, carrying the song_id path parameter.
+        select_song_file (callable): Picks the file to stream from the song document; may raise ValueError
+            or return None when the song has no such file.
+        redirect (bool): Whether the file may be served as a redirect to MinIO (audio files and covers).
+
+    Returns:
+        Response: A response object that streams the file data.
+    """
+    started_at = time.perf_counter()
+    route = metrics.flask_route_template(request.scope["route"].path)
+    response = await _open_song_file(request.path_params["song_id"], route, select_song_file, redirect=redirect)
+    metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+    return response
+
+
+async def _open_song_file(song_id, route, select_song_file, song_info=None, redirect=False):
+    """
+    Look the song up (unless already read) and open its file in MinIO, returning the streaming or error response.
+    """
+    if song_info is None:
+        song_info = await _find_song_files(song_id)
+        if song_info is False:
+            return PlainTextResponse("Invalid song ID", status_code=400)
+    if not song_info:
+        return PlainTextResponse("Song not found", status_code=404)
+    try:
+        song_file = select_song_file(song_info)
+    except ValueError as e:
+        return PlainTextResponse(str(e), status_code=400)
+    if song_file is None:
+        return PlainTextResponse("File not available", status_code=404)
+    if redirect and STREAMING_DELIVERY_MODE == "redirect":
+        try:
+            return Response(status_code=307, headers=_build_redirect_headers(song_file))
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            return PlainTextResponse("An error occurred", status_code=500)
+    try:
+        minio_client = await run_in_threadpool(_get_minio_client)
+        with metrics.timed_call("minio", "get_object"):
+            file_data = await run_in_threadpool(minio_client.get_object, MINIO_BUCKET_NAME, song_file["object_name"])
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            # The song was deleted, or its objects collected, while its names were still cached
+            _invalidate_song_files(song_file["object_name"])
+            return PlainTextResponse("Song not found", status_code=404)
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+
+    headers = _build_stream_headers(song_file)
+    return StreamingResponse(
+        iterate_in_threadpool(metrics.track_stream(route, file_data.stream(ASGI_STREAM_CHUNK_SIZE))),
+        headers=headers,
+        status_code=200,
+        background=BackgroundTask(_release_object, file_data)
+    )
+
+
+async def stream_melody(request):
+    """
+    Stream the melody of a song identified by song_id.
+    """
+    return await _stream_song_file(
+        request, lambda song_info: _select_song_file(song_info, "melody_file_name", "audio/wav", "melody.wav"), redirect=True)
+
+
+async def stream_voice(request):
+    """
+    Stream the voice of a song identified by song_id.
+    """
+    return await _stream_song_file(
+        request, lambda song_info: _select_song_file(song_info, "voice_file_name", "audio/wav", "voice.wav"), redirect=True)
+
+
+async def stream_voice_progressive(request):
+    """
+    Stream the voice of a song while it is still being synthesized, or the whole voice once it is stored.
+    """
+    started_at = time.perf_counter()
+    route = metrics.flask_route_template(request.scope["route"].path)
+    response = await _open_progressive_voice(request, route)
+    metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+    return response
+
+
+async def _open_progressive_voice(request, route):
+    """
+    Follow the published segments of the voice, waiting for new ones between polls without holding a thread.
+    """
+    song_object_id = song_files.parse_song_id(request.path_params["song_id"])
+    if song_object_id is None:
+        return PlainTextResponse("Invalid song ID", status_code=400)
+    song_info = await run_in_threadpool(songs_collection.find_one, {"_id": song_object_id}, VOICE_PROGRESS_PROJECTION)
+    if not song_info:
+        return PlainTextResponse("Song not found", status_code=404)
+    if song_info.get("voice_file_name"):
+        return await _open_song_file(
+            request.path_params["song_id"], route,
+            lambda song_info: _select_song_file(song_info, "voice_file_name", "audio/wav", "voice.wav"),
+            song_info=song_info, redirect=True)
+    if not song_info.get("voice_progress"):
+        return PlainTextResponse("Voice not available yet", status_code=404)
+    try:
+        minio_client = await run_in_threadpool(_get_minio_client)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+    voice_parts = _aiter_voice_parts(minio_client, song_object_id, song_info["voice_progress"])
+    return StreamingResponse(
+        metrics.track_async_stream(route, voice_parts),
+        headers=_build_progressive_voice_headers(),
+        status_code=200
+    )
+
+
+async def _aiter_voice_parts(minio_client, song_object_id, voice_progress):
+    """
+    Async counterpart of app._iter_voice_parts. MinIO and MongoDB are read in the threadpool, but
+    the waits between polls are async sleeps, so a listener waiting for the next segment holds no
+    thread and its stream only ends when the voice is played, the song fails or its voice is
+    regenerated, or no segment is published for VOICE_PROGRESSIVE_MAX_WAIT_SECONDS.
+    """
+    yield _build_progressive_wav_header(voice_progress)
+    streamed_parts = 0
+    idle_seconds = 0.0
+    try:
+        while True:
+            for part in voice_progress["parts"][streamed_parts:]:
+                with metrics.timed_call("minio", "get_object"):
+                    file_data = await run_in_threadpool(minio_client.get_object, MINIO_BUCKET_NAME, part["object_name"])
+                try:
+                    async for chunk in iterate_in_threadpool(file_data.stream(ASGI_STREAM_CHUNK_SIZE)):
+                        yield chunk
+                finally:
+                    file_data.close()
+                    file_data.release_conn()
+                streamed_parts += 1
+                idle_seconds = 0.0
+            if _voice_stream_finished(voice_progress, streamed_parts, idle_seconds):
+                return
+            await anyio.sleep(VOICE_PROGRESSIVE_POLL_SECONDS)
+            idle_seconds += VOICE_PROGRESSIVE_POLL_SECONDS
+            song_info = await run_in_threadpool(songs_collection.find_one, {"_id": song_object_id}, VOICE_PROGRESS_PROJECTION)
+            voice_progress = _followed_voice_progress(song_info, voice_progress)
+            if voice_progress is None:
+                return
+    except Exception as e:
+        # The headers are sent already; the stream ends where the voice stops
+        logger.error(f"An error occurred: {str(e)}")
+
+
+async def stream_song(request):
+    """
+    Stream the complete song of a song identified by song_id, in the rendition negotiated with the client.
+    """
+    return await _stream_song_file(request, lambda song_info: _select_song_rendition(
+        song_info,
+        quality=request.query_params.get('quality'),
+        accept=request.headers.get('accept'),
+        save_data=request.headers.get('save-data', '').lower() == 'on'
+    ), redirect=True)
+
+
+async def show_image(request):
+    """
+    Show the image associated with a song identified by song_id, as a precomputed variant or resized on demand.
+    """
+    started_at = time.perf_counter()
+    route = metrics.flask_route_template(request.scope["route"].path)
+    response = await _open_cover(request, route)
+    metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+    return response
+
+
+async def _open_cover(request, route):
+    """
+    Serve the cover picked by the w/format parameters, rendering it in the threadpool when it has to be resized.
+    """
+    def select_cover(song_info):
+        return _select_cover(
+            song_info, request.query_params.get('w'), request.query_params.get('format'), request.headers.get('accept'))
+
+    song_info = await _find_song_files(request.path_params["song_id"])
+    if song_info is False:
+        return PlainTextResponse("Invalid song ID", status_code=400)
+    if not song_info:
+        return PlainTextResponse("Song not found", status_code=404)
+    try:
+        song_file = select_cover(song_info)
+    except ValueError as e:
+        return PlainTextResponse(str(e), status_code=400)
+    if not song_file.get("resize"):
+        return await _open_song_file(request.path_params["song_id"], route, select_cover, song_info=song_info, redirect=True)
+    try:
+        minio_client = await run_in_threadpool(_get_minio_client)
+        image_bytes = await run_in_threadpool(cover_images.render_cover, minio_client, MINIO_BUCKET_NAME, song_file)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+    return Response(image_bytes, headers=_build_stream_headers(song_file), status_code=200)
+
+
+async def show_waveform(request):
+    """
+    Serve the precomputed waveform peaks of a track of a song.
+    """
+    return await _stream_song_file(
+        request, lambda song_info: _select_waveform(song_info, request.query_params.get('track', 'song')))
+
+
+async def stream_preview(request):
+    """
+    Stream the short low bitrate preview clip of a song.
+    """
+    return await _stream_song_file(request, _select_preview)
+
+
+async def stream_hls_asset(request):
+    """
+    Serve a file of the HLS presentation of a song straight from MinIO, with long-lived cache headers.
+    """
+    started_at = time.perf_counter()
+    route = metrics.flask_route_template(request.scope["route"].path)
+    response = await _open_hls_asset(request, route)
+    metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+    return response
+
+
+async def _open_hls_asset(request, route):
+    """
+    Open a file of the HLS presentation in MinIO, returning the streaming or error response.
+    """
+    asset = request.path_params["asset"]
+    object_name = _hls_object_name(request.path_params["song_id"], asset)
+    if object_name is None:
+        return PlainTextResponse("Not found", status_code=404)
+    try:
+        minio_client = await run_in_threadpool(_get_minio_client)
+        with metrics.timed_call("minio", "get_object"):
+            file_data = await run_in_threadpool(minio_client.get_object, MINIO_BUCKET_NAME, object_name)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return PlainTextResponse("Not found", status_code=404)
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return PlainTextResponse("An error occurred", status_code=500)
+
+    headers = _build_hls_headers(asset, file_data.headers)
+    if headers.get('ETag') and request.headers.get('if-none-match') == headers['ETag']:
+        await run_in_threadpool(_release_object, file_data)
+        return Response(status_code=304, headers={'ETag': headers['ETag'], 'Cache-Control': headers['Cache-Control']})
+    return StreamingResponse(
+        iterate_in_threadpool(metrics.track_stream(route, file_data.stream(ASGI_STREAM_CHUNK_SIZE))),
+        headers=headers,
+        status_code=200,
+        background=BackgroundTask(_release_object, file_data)
+    )
+
+
+async def _configure_threadpool():
+    """
+    Size the default threadpool used by run_in_threadpool and iterate_in_threadpool.
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_THREADPOOL_SIZE
+
+
+# The streaming routes are served natively; every other route falls through to the Flask app
+app = Starlette(
+    routes=[
+        Route('/stream_melody/{song_id}', stream_melody, methods=['GET']),
+        Route('/stream_voice/{song_id}', stream_voice, methods=['GET']),
+        Route('/stream_voice_progressive/{song_id}', stream_voice_progressive, methods=['GET']),
+        Route('/stream_song/{song_id}', stream_song, methods=['GET']),
+        Route('/show_image/{song_id}', show_image, methods=['GET']),
+        Route('/waveform/{song_id}', show_waveform, methods=['GET']),
+        Route('/preview/{song_id}', stream_preview, methods=['GET']),
+        Route('/hls/{song_id}/{asset:path}', stream_hls_asset, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ],
+    on_startup=[_configure_threadpool]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from PIL import Image
+import threading
+import io
+import os
+
+# Formats covers can be served in, by preference when the client accepts several
+COVER_FORMATS = ["avif", "webp", "jpeg"]
+COVER_CONTENT_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+# Encoder settings used for the covers resized on demand
+COVER_SAVE_OPTIONS = {
+    "avif": {"quality": 50},
+    "webp": {"quality": 75, "method": 4},
+    "jpeg": {"quality": 80, "optimize": True, "progressive": True}
+}
+# Requested widths are rounded up to a multiple of this step, which bounds the number of cache entries per cover
+COVER_WIDTH_STEP = 32
+COVER_MIN_WIDTH = 32
+COVER_MAX_WIDTH = 1024
+# Memory budget of the covers resized on demand, per process
+COVER_RESIZE_CACHE_BYTES = int(os.environ.get("COVER_RESIZE_CACHE_BYTES", 64 * 1024 * 1024))
+# Variants and resized covers only change if the song is regenerated
+COVER_CACHE_CONTROL = "public, max-age=86400"
+
+Image.init()
+COVER_ENCODABLE_FORMATS = {image_format for image_format in COVER_FORMATS if image_format.upper() in Image.SAVE}
+
+
+class CoverResizeCache:
+    """
+    Thread-safe LRU cache of resized covers, bounded by the total size of the cached images.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image_bytes = self._entries.get(key)
+            if image_bytes is not None:
+                self._entries.move_to_end(key)
+            return image_bytes
+
+    def put(self, key, image_bytes):
+        if len(image_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self._entries[key] = image_bytes
+            self.current_bytes += len(image_bytes)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+
+resize_cache = CoverResizeCache(COVER_RESIZE_CACHE_BYTES)
+
+
+def _parse_width(width):
+    if width is None:
+        return None
+    try:
+        width = int(width)
+    except ValueError:
+        raise ValueError(f"Invalid width '{width}'")
+    if width <= 0:
+        raise ValueError(f"Invalid width '{width}'")
+    width = -(-width // COVER_WIDTH_STEP) * COVER_WIDTH_STEP
+    return min(max(width, COVER_MIN_WIDTH), COVER_MAX_WIDTH)
+
+
+def select_cover(song_info, width=None, image_format=None, accepted_types=()):
+    """
+    Pick the cover file to serve for the requested width and format.
+
+    Precomputed variants are preferred: the smallest one at least as wide as requested, in the
+    explicit format or else in the best format the client accepts. Without a matching variant the
+    cover is resized on demand from the original, and without any preference the original JPEG is
+    served as before.
+
+    Args:
+        song_info (dict): Information about the song.
+        width (str, optional): The requested width in pixels.
+        image_format (str, optional): The requested format: avif, webp or jpeg.
+        accepted_types (Iterable): Media types the client accepts, from its Accept header.
+
+    Returns:
+        dict: The file to serve. Covers to resize on demand carry a `resize` entry with the width and format.
+
+    Raises:
+        ValueError: If the width or the format are not valid.
+    """
+    width = _parse_width(width)
+    if image_format is not None and image_format not in COVER_CONTENT_TYPES:
+        raise ValueError(f"Unknown format '{image_format}'")
+
+    if image_format:
+        formats = [image_format]
+    else:
+        formats = [candidate for candidate in COVER_FORMATS if COVER_CONTENT_TYPES[candidate] in accepted_types] + ["jpeg"]
+
+    original = {
+        "object_name": song_info["song_cover_name"],
+        "content_type": "image/jpeg",
+        "file_extension": "image.jpg",
+        "vary": "Accept"
+    }
+    variants = song_info.get("song_cover_variants") or []
+    for candidate_format in formats:
+        candidates = [
+            variant for variant in variants
+            if variant["format"] == candidate_format and (width is None or variant["width"] >= width)
+        ]
+        if candidates:
+            pick = min if width else max
+            variant = pick(candidates, key=lambda candidate: candidate["width"])
+            return {
+                "object_name": variant["file_name"],
+                "content_type": variant["content_type"],
+                "file_extension": variant["format"],
+                "cache_control": COVER_CACHE_CONTROL,
+                "vary": "Accept"
+            }
+
+    resize_format = next((candidate for candidate in formats if candidate in COVER_ENCODABLE_FORMATS), "jpeg")
+    if width is None and resize_format == "jpeg":
+        return original
+    original["resize"] = {"width": width, "format": resize_format}
+    original["content_type"] = COVER_CONTENT_TYPES[resize_format]
+    original["file_extension"] = resize_format
+    original["cache_control"] = COVER_CACHE_CONTROL
+    return original
+
+
+def render_cover(minio_client, bucket_name, song_file):
+    """
+    Resize a cover on demand, going through the resize cache.
+
+    Args:
+        minio_client (Minio): The MinIO client used to read the original cover.
+        bucket_name (str): The name of the MinIO bucket.
+        song_file (dict): The file returned by select_cover, with a `resize` entry.
+
+    Returns:
+        bytes: The encoded cover.
+    """
+    resize = song_file["resize"]
+    cache_key = (song_file["object_name"], resize["width"], resize["format"])
+    image_bytes = resize_cache.get(cache_key)
+    if image_bytes is not None:
+        return image_bytes
+
+    file_data = minio_client.get_object(bucket_name, song_file["object_name"])
+    try:
+        image = Image.open(io.BytesIO(file_data.read()))
+    finally:
+        file_data.close()
+        file_data.release_conn()
+
+    image = image.convert("RGB")
+    if resize["width"] and resize["width"] < image.width:
+        height = max(1, round(image.height * resize["width"] / image.width))
+        image = image.resize((resize["width"], height), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format=resize["format"].upper(), **COVER_SAVE_OPTIONS[resize["format"]])
+    image_bytes = output.getvalue()
+    resize_cache.put(cache_key, image_bytes)
+    return image_bytes
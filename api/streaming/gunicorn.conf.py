@@ -0,0 +1,16 @@
+from prometheus_client import multiprocess
+import os
+import shutil
+
+
+def on_starting(server):
+    # Start every deployment with an empty multiprocess metrics directory
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of workers that exited so /metrics stays accurate
+    multiprocess.mark_process_dead(worker.pid)
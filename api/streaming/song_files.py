@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from bson import ObjectId
+import threading
+import time
+import os
+
+# Fields of the song document read by the streaming routes; lyrics, descriptions and the status history are never fetched
+SONG_FILE_FIELDS = (
+    "melody_file_name", "voice_file_name", "final_song_name", "song_cover_name", "song_cover_variants",
+    "song_renditions", "song_waveforms", "song_preview", "song_status"
+)
+SONG_FILES_PROJECTION = {field: 1 for field in SONG_FILE_FIELDS}
+# Status after which the object names of a song no longer change; songs still being generated are never cached
+SONG_FILES_FINAL_STATUS = "song_indexed"
+# Time a cached entry is trusted, which bounds how long a deleted song keeps being served by a process
+SONG_FILES_CACHE_TTL_SECONDS = float(os.environ.get("SONG_FILES_CACHE_TTL_SECONDS", 300))
+# Songs kept per process
+SONG_FILES_CACHE_SIZE = int(os.environ.get("SONG_FILES_CACHE_SIZE", 10000))
+
+
+def parse_song_id(song_id):
+    """
+    Parse a song ID without raising, so malformed IDs are rejected before reaching MongoDB.
+
+    Args:
+        song_id (str): The song ID from the request path.
+
+    Returns:
+        ObjectId: The parsed ID, or None if it is not a valid ObjectId.
+    """
+    return ObjectId(song_id) if ObjectId.is_valid(song_id) else None
+
+
+def song_id_of_object(object_name):
+    """
+    Get the song an object belongs to; the pipeline stores every object of a song under its ID.
+
+    Args:
+        object_name (str): The object name in MinIO.
+
+    Returns:
+        ObjectId: The song ID, or None if the name does not start with one.
+    """
+    return parse_song_id(object_name[:24])
+
+
+class SongFilesCache:
+    """
+    Thread-safe TTL/LRU cache of the object names of the songs, read with a projection.
+
+    Args:
+        collection (Collection): The songs collection.
+        ttl_seconds (float): Time an entry is trusted.
+        max_entries (int): Maximum number of cached songs; 0 disables the cache.
+    """
+
+    def __init__(self, collection, ttl_seconds=SONG_FILES_CACHE_TTL_SECONDS, max_entries=SONG_FILES_CACHE_SIZE):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_cached(self, song_id):
+        """
+        Get the object names of a song if they are cached, without querying MongoDB.
+
+        Args:
+            song_id (ObjectId): The song ID.
+
+        Returns:
+            dict: The projected song document, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(song_id)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[song_id]
+                return None
+            self._entries.move_to_end(song_id)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, song_id):
+        """
+        Get the object names of a song, reading only the SONG_FILE_FIELDS of its document on a miss.
+
+        Args:
+            song_id (ObjectId): The song ID.
+
+        Returns:
+            dict: The projected song document, or None if the song does not exist.
+        """
+        song_files = self.get_cached(song_id)
+        if song_files is not None:
+            return song_files
+        song_files = self.collection.find_one({"_id": song_id}, SONG_FILES_PROJECTION)
+        with self._lock:
+            self.misses += 1
+            if self.max_entries and song_files and song_files.get("song_status") == SONG_FILES_FINAL_STATUS:
+                self._entries[song_id] = (song_files, time.monotonic() + self.ttl_seconds)
+                self._entries.move_to_end(song_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return song_files
+
+    def invalidate(self, song_id):
+        """
+        Drop the cached entry of a song, e.g. after it is deleted.
+
+        Args:
+            song_id (ObjectId): The song ID.
+        """
+        with self._lock:
+            self._entries.pop(song_id, None)
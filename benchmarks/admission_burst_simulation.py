@@ -0,0 +1,170 @@
+"""
+Burst simulation of the admission control of `/generate_song`.
+
+Replays a submission burst (plus a steady background rate) against the `AdmissionController` of
+the Song Generation API on a mongomock songs collection, in simulated time, with a pipeline of
+`--workers` concurrent song slots and a FIFO backlog in front of them, like the Celery queue. Two
+policies are compared:
+
+- `unlimited`: every submission is scheduled right away, as before admission control;
+- `admission`: submissions beyond `--max-in-flight` songs wait in the admission queue (highest
+  priority first), the queue is bounded by `--max-queued` and every client by `--client-max-songs`
+  per minute; the others get a 429 with Retry-After.
+
+It reports the accepted and rejected songs, the peak pipeline backlog, the latency percentiles
+from submission to completion and the error of the completion time estimated at submission:
+
+    python benchmarks/admission_burst_simulation.py --burst-songs 500 --burst-seconds 60 --workers 4
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+
+import mongomock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api", "song_generation"))
+
+import admission_control  # noqa: E402
+
+POLICIES = ["unlimited", "admission"]
+SIMULATION_START = datetime(2024, 1, 1)
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * percentile) - 1)] if ordered else 0.0
+
+
+def _arrivals(args):
+    """
+    Submission times and clients: the burst spread over `--burst-clients` clients, plus a Poisson background.
+    """
+    rng = random.Random(args.seed)
+    arrivals = []
+    for index in range(args.burst_songs):
+        at = args.burst_start + rng.uniform(0, args.burst_seconds)
+        arrivals.append((at, f"burst-{index % args.burst_clients}", rng.randint(0, 9)))
+    at = 0.0
+    while args.background_rate > 0:
+        at += rng.expovariate(args.background_rate)
+        if at >= args.duration:
+            break
+        arrivals.append((at, f"user-{rng.randrange(10000)}", admission_control.DEFAULT_PRIORITY))
+    return sorted(arrivals)
+
+
+def _run_policy(args, policy, arrivals):
+    rng = random.Random(args.seed + 1)
+    collection = mongomock.MongoClient().lyric_wave.songs
+    clock = {"now": 0.0}
+    backlog = deque()
+    running = []
+    songs = {}
+
+    def sim_datetime():
+        return SIMULATION_START + timedelta(seconds=clock["now"])
+
+    def schedule(song_info):
+        collection.update_one({"_id": song_info["_id"]}, {"$set": {**controller.planned_fields(), "admission_status": "dispatched"}})
+        backlog.append((clock["now"] + args.schedule_delay, song_info["_id"]))
+        return True
+
+    if policy == "unlimited":
+        limits = dict(max_in_flight=10 ** 9, max_queued=10 ** 9, client_max_songs=10 ** 9)
+    else:
+        limits = dict(max_in_flight=args.max_in_flight, max_queued=args.max_queued, client_max_songs=args.client_max_songs)
+    controller = admission_control.AdmissionController(
+        collection, schedule, schedule_delay_seconds=args.schedule_delay, client_window_seconds=60,
+        clock=sim_datetime, **limits
+    )
+    # The dispatcher runs in the simulation loop rather than in a background thread
+    controller.ensure_started = lambda: None
+    admission_control.ADMISSION_ETA_REFRESH_SECONDS = 0
+
+    rejected = {"rate_limited": 0, "overloaded": 0}
+    peak_backlog = 0
+    pending = deque(arrivals)
+    tick = 0
+    while clock["now"] < args.duration or backlog or running or collection.count_documents({"admission_status": "queued"}):
+        clock["now"] = tick * args.tick_seconds
+        while pending and pending[0][0] <= clock["now"]:
+            _, client_id, priority = pending.popleft()
+            admission = controller.admit(client_id, priority)
+            if admission["decision"] == "reject":
+                rejected[admission["reason"]] += 1
+                continue
+            song_info = {"planned": False, **controller.admission_fields(client_id, priority, admission)}
+            song_id = collection.insert_one(song_info).inserted_id
+            songs[song_id] = {"submitted_at": clock["now"], "estimate": admission["estimated_completion_seconds"]}
+            if admission["decision"] == "accept":
+                schedule({"_id": song_id})
+
+        # Songs finishing in this tick free their slots
+        for finish_at, song_id in [entry for entry in running if entry[0] <= clock["now"]]:
+            running.remove((finish_at, song_id))
+            songs[song_id]["completed_at"] = finish_at
+            service = songs[song_id]["service"]
+            collection.update_one({"_id": song_id}, {"$set": {
+                "song_status": "song_indexed", "stage_metrics": {"pipeline": {"total_seconds": service}}
+            }})
+        # Celery hands the oldest scheduled songs to free worker slots
+        while backlog and backlog[0][0] <= clock["now"] and len(running) < args.workers:
+            _, song_id = backlog.popleft()
+            service = max(1.0, rng.gauss(args.song_seconds, args.song_seconds * 0.1))
+            songs[song_id]["service"] = service
+            running.append((clock["now"] + service, song_id))
+        controller.dispatch_queued()
+        peak_backlog = max(peak_backlog, len(backlog))
+        tick += 1
+
+    latencies = [song["completed_at"] - song["submitted_at"] for song in songs.values()]
+    estimate_errors = [abs(song["completed_at"] - song["submitted_at"] - song["estimate"]) for song in songs.values()]
+    return {
+        "policy": policy,
+        "accepted": len(songs),
+        "rejected_rate_limited": rejected["rate_limited"],
+        "rejected_overloaded": rejected["overloaded"],
+        "peak_pipeline_backlog": peak_backlog,
+        "p50_latency_seconds": _percentile(latencies, 0.5),
+        "p95_latency_seconds": _percentile(latencies, 0.95),
+        "mean_eta_error_seconds": statistics.mean(estimate_errors) if estimate_errors else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst simulation of the /generate_song admission control.")
+    parser.add_argument("--burst-songs", type=int, default=500)
+    parser.add_argument("--burst-seconds", type=float, default=60)
+    parser.add_argument("--burst-start", type=float, default=60)
+    parser.add_argument("--burst-clients", type=int, default=20)
+    parser.add_argument("--background-rate", type=float, default=0.02, help="Background submissions per second")
+    parser.add_argument("--duration", type=float, default=3600, help="Seconds during which submissions arrive")
+    parser.add_argument("--workers", type=int, default=4, help="Songs the pipeline generates concurrently")
+    parser.add_argument("--song-seconds", type=float, default=300, help="Mean pipeline duration of a song")
+    parser.add_argument("--schedule-delay", type=float, default=120)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-queued", type=int, default=100)
+    parser.add_argument("--client-max-songs", type=int, default=10, help="Songs per client per minute")
+    parser.add_argument("--tick-seconds", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    arrivals = _arrivals(args)
+    print(f"{len(arrivals)} submissions, {args.burst_songs} in a {args.burst_seconds:.0f}s burst, "
+          f"{args.workers} pipeline slots of ~{args.song_seconds:.0f}s")
+    print(f"{'policy':<11}{'accepted':>9}{'429 rate':>9}{'429 full':>9}{'peak backlog':>14}"
+          f"{'p50 min':>9}{'p95 min':>9}{'ETA err min':>13}")
+    for policy in POLICIES:
+        result = _run_policy(args, policy, arrivals)
+        print(f"{result['policy']:<11}{result['accepted']:>9}{result['rejected_rate_limited']:>9}"
+              f"{result['rejected_overloaded']:>9}{result['peak_pipeline_backlog']:>14}"
+              f"{result['p50_latency_seconds'] / 60:>9.1f}{result['p95_latency_seconds'] / 60:>9.1f}"
+              f"{result['mean_eta_error_seconds'] / 60:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Songs-accepted-per-second benchmark for the Song Generation API.
+
+Submits the same number of songs through `POST /generate_song` (one request per song, with
+configurable client concurrency) and through `POST /generate_songs` (batches), and reports the
+songs accepted per second of each path. Every created song is deleted afterwards.
+
+To keep real DAG runs out of the measurement, start the bundled fake Airflow API and point the
+API's AIRFLOW_API_URL at it (it answers every DAG run trigger with 200 after a fixed latency):
+
+    python benchmarks/bulk_submission_benchmark.py --serve-fake-airflow 8090 --airflow-latency-ms 40
+    python benchmarks/bulk_submission_benchmark.py --api-url http://localhost:8086 --songs 500 --batch-size 100
+
+Both paths go through admission control, so run the API with ADMISSION_MAX_IN_FLIGHT and
+ADMISSION_CLIENT_MAX_SONGS above `--songs`, or queued and rate limited songs are not counted.
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+def _serve_fake_airflow(port, latency_ms):
+    class FakeAirflowHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency_ms / 1000)
+            body = json.dumps({"state": "queued"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Fake Airflow API listening on :{port} with {latency_ms} ms latency per DAG run trigger")
+    ThreadingHTTPServer(("0.0.0.0", port), FakeAirflowHandler).serve_forever()
+
+
+def _load_lyrics(path):
+    with open(path) as styles_file:
+        styles = json.load(styles_file)
+    return [style if isinstance(style, str) else json.dumps(style) for style in styles]
+
+
+def _new_song(music_style_id, lyrics):
+    return {
+        "title": f"benchmark {uuid.uuid4()}",
+        "text": random.choice(lyrics)[:200],
+        "description": "bulk submission benchmark",
+        "keywords": ["benchmark"],
+        "music_style_id": music_style_id
+    }
+
+
+def _run_single(session, args, music_style_id, lyrics):
+    def submit(_):
+        response = session.post(f"{args.api_url}/generate_song", json=_new_song(music_style_id, lyrics))
+        payload = response.json()
+        if response.status_code == 200:
+            return payload["data"]["song_info"]["song_info_id"]
+        return None
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.client_concurrency) as executor:
+        song_ids = list(executor.map(submit, range(args.songs)))
+    return time.perf_counter() - started_at, [song_id for song_id in song_ids if song_id]
+
+
+def _run_bulk(session, args, music_style_id, lyrics):
+    song_ids = []
+    started_at = time.perf_counter()
+    for offset in range(0, args.songs, args.batch_size):
+        batch = [_new_song(music_style_id, lyrics) for _ in range(min(args.batch_size, args.songs - offset))]
+        response = session.post(f"{args.api_url}/generate_songs", json={"songs": batch})
+        for result in response.json()["data"]["results"]:
+            if result["status"] == "success":
+                song_ids.append(result["data"]["song_info"]["song_info_id"])
+    return time.perf_counter() - started_at, song_ids
+
+
+def _cleanup(session, args, song_ids):
+    with ThreadPoolExecutor(max_workers=args.client_concurrency) as executor:
+        list(executor.map(lambda song_id: session.delete(f"{args.api_url}/songs/{song_id}"), song_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk song submission benchmark.")
+    parser.add_argument("--api-url", default="http://localhost:8086")
+    parser.add_argument("--songs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--client-concurrency", type=int, default=8,
+                        help="Parallel clients used for the one-request-per-song path")
+    parser.add_argument("--music-style-id", help="Defaults to the first style returned by /music_styles")
+    parser.add_argument("--lyrics-file", default="music_styles.json",
+                        help="JSON list whose entries are used as song texts")
+    parser.add_argument("--serve-fake-airflow", type=int, metavar="PORT",
+                        help="Only run a fake Airflow API on this port")
+    parser.add_argument("--airflow-latency-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    if args.serve_fake_airflow:
+        _serve_fake_airflow(args.serve_fake_airflow, args.airflow_latency_ms)
+        return
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.client_concurrency))
+    music_style_id = args.music_style_id
+    if music_style_id is None:
+        styles = session.get(f"{args.api_url}/music_styles").json()["data"]["music_styles"]
+        music_style_id = styles[0]["style_id"]
+    lyrics = _load_lyrics(args.lyrics_file)
+
+    print(f"{'path':<16}{'songs':>8}{'accepted':>10}{'seconds':>10}{'songs/s':>10}")
+    for name, run in (("generate_song", _run_single), ("generate_songs", _run_bulk)):
+        elapsed, song_ids = run(session, args, music_style_id, lyrics)
+        print(f"{name:<16}{args.songs:>8}{len(song_ids):>10}{elapsed:>10.2f}{len(song_ids) / elapsed:>10.1f}")
+        _cleanup(session, args, song_ids)
+
+
+if __name__ == "__main__":
+    main()
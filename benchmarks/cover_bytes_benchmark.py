@@ -0,0 +1,60 @@
+"""
+Image bytes per song listing page: original covers versus negotiated thumbnails.
+
+Fetches one page of `GET /songs` from the Song Generation API and downloads the cover of every song
+twice, as the original JPEG (`image_url`) and as the thumbnail a browser would get
+(`image_thumbnail_url` with a modern Accept header). The thumbnail pass runs twice so the second one
+shows the cost once on-demand resizes are cached.
+
+    python benchmarks/cover_bytes_benchmark.py --api-url http://localhost:8086 --per-page 20
+"""
+import argparse
+import time
+
+import requests
+
+BROWSER_ACCEPT = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+
+
+def _download_covers(session, urls, accept):
+    total_bytes = 0
+    content_types = {}
+    started_at = time.perf_counter()
+    for url in urls:
+        response = session.get(url, headers={"Accept": accept})
+        response.raise_for_status()
+        total_bytes += len(response.content)
+        content_type = response.headers.get("Content-Type")
+        content_types[content_type] = content_types.get(content_type, 0) + 1
+    return total_bytes, time.perf_counter() - started_at, content_types
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cover bytes per song listing page.")
+    parser.add_argument("--api-url", required=True, help="Base URL of the Song Generation API")
+    parser.add_argument("--page", type=int, default=1)
+    parser.add_argument("--per-page", type=int, default=20)
+    args = parser.parse_args()
+
+    with requests.Session() as session:
+        response = session.get(f"{args.api_url}/songs", params={"page": args.page, "per_page": args.per_page})
+        response.raise_for_status()
+        songs = response.json()["data"]["songs"]
+
+        passes = [
+            ("original", [song["image_url"] for song in songs], "image/jpeg"),
+            ("thumbnail (cold)", [song["image_thumbnail_url"] for song in songs], BROWSER_ACCEPT),
+            ("thumbnail (warm)", [song["image_thumbnail_url"] for song in songs], BROWSER_ACCEPT)
+        ]
+        print(f"{len(songs)} songs per page")
+        print(f"{'pass':<20}{'KiB / page':>12}{'seconds':>10}  content types")
+        original_bytes = None
+        for name, urls, accept in passes:
+            total_bytes, elapsed, content_types = _download_covers(session, urls, accept)
+            original_bytes = original_bytes or total_bytes
+            print(f"{name:<20}{total_bytes / 1024:>12.1f}{elapsed:>10.3f}  {content_types}")
+        print(f"\nThumbnails use {original_bytes / max(total_bytes, 1):.1f}x fewer bytes than the original covers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+DAG parse time and import memory budget for `audio_streaming_dag.py`.
+
+Every sample runs in a fresh interpreter with `-X importtime`, like a scheduler parse process:
+Airflow itself is imported first (every parse process pays for it anyway), then the DAG file is
+loaded through a DagBag and the time, the RSS growth and the modules imported by the DAG file are
+recorded. The run fails when a budget is exceeded or when a heavy dependency is imported at parse
+time:
+
+    python benchmarks/dag_parse_benchmark.py --repeat 5 --max-parse-seconds 0.5 --max-rss-mb 30
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DAGS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "airflow", "dags"))
+DAG_FILE = os.path.join(DAGS_DIR, "audio_streaming_dag.py")
+# Modules shared with the APIs, on the PYTHONPATH of the Airflow image
+SHARED_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "shared"))
+
+# Modules that must only be imported when a task executes
+HEAVY_MODULES = [
+    "torch", "transformers", "diffusers", "audiocraft", "bark", "scipy", "numpy",
+    "pydub", "PIL", "elasticsearch", "minio", "pymongo"
+]
+
+IMPORT_MARKER = "---dag-parse-start---"
+
+# Runs in the child interpreter
+PARSE_SCRIPT = """
+import json, resource, sys, time
+import airflow
+from airflow.models import DagBag
+baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+already_imported = set(sys.modules)
+print({marker!r}, file=sys.stderr, flush=True)
+started_at = time.perf_counter()
+dag_bag = DagBag(dag_folder={dag_file!r}, include_examples=False, safe_mode=False)
+parse_seconds = time.perf_counter() - started_at
+print(json.dumps({{
+    "parse_seconds": parse_seconds,
+    "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss_kb) / 1024,
+    "dag_ids": sorted(dag_bag.dag_ids),
+    "import_errors": {{path: str(error) for path, error in dag_bag.import_errors.items()}},
+    "heavy_modules": sorted(name for name in {heavy!r} if name in sys.modules and name not in already_imported)
+}}))
+"""
+
+
+def _parse_importtime(stderr, top):
+    """
+    Return the slowest top-level imports done after the marker, from `-X importtime` output.
+    """
+    lines = stderr.splitlines()
+    if IMPORT_MARKER in lines:
+        lines = lines[lines.index(IMPORT_MARKER) + 1:]
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        # Nested imports are indented by two spaces per level; keep the outermost ones
+        if len(name) - len(name.lstrip()) > 1:
+            continue
+        imports.append((int(cumulative_us), name.strip()))
+    return [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+            for cumulative, name in sorted(imports, reverse=True)[:top]]
+
+
+def _parse_once(top):
+    script = PARSE_SCRIPT.format(marker=IMPORT_MARKER, dag_file=DAG_FILE, heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([DAGS_DIR, SHARED_DIR, os.environ.get("PYTHONPATH", "")]))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=DAGS_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    sample = json.loads(completed.stdout.strip().splitlines()[-1])
+    sample["slowest_imports"] = _parse_importtime(completed.stderr, top)
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DAG parse time and import memory budget.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to sample")
+    parser.add_argument("--max-parse-seconds", type=float, default=0.5, help="Budget for the median parse time")
+    parser.add_argument("--max-rss-mb", type=float, default=30, help="Budget for the median RSS growth")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    samples = [_parse_once(args.top) for _ in range(args.repeat)]
+    parse_seconds = statistics.median(sample["parse_seconds"] for sample in samples)
+    rss_growth_mb = statistics.median(sample["rss_growth_mb"] for sample in samples)
+    last = samples[-1]
+
+    print(f"DAGs: {', '.join(last['dag_ids']) or '-'}")
+    print(f"parse time (median of {args.repeat}): {parse_seconds:.3f} s  budget {args.max_parse_seconds} s")
+    print(f"RSS growth (median of {args.repeat}): {rss_growth_mb:.1f} MB  budget {args.max_rss_mb} MB")
+    print("slowest imports during the parse:")
+    for entry in last["slowest_imports"]:
+        print(f"  {entry['cumulative_ms']:>9.1f} ms  {entry['module']}")
+
+    failures = []
+    if last["import_errors"]:
+        failures.append(f"import errors: {last['import_errors']}")
+    if last["heavy_modules"]:
+        failures.append(f"heavy modules imported at parse time: {', '.join(last['heavy_modules'])}")
+    if parse_seconds > args.max_parse_seconds:
+        failures.append(f"parse time {parse_seconds:.3f} s over budget")
+    if rss_growth_mb > args.max_rss_mb:
+        failures.append(f"RSS growth {rss_growth_mb:.1f} MB over budget")
+
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nWithin budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+API CPU time per play of the streaming API when it proxies the media bytes and when it redirects
+players to presigned MinIO URLs (STREAMING_DELIVERY_MODE).
+
+Uploads one object of `--size-mb` to a running MinIO (e.g. the one of docker-compose behind
+HAProxy), then, for each mode, serves the Flask streaming API in a child process (MongoDB is
+replaced by mongomock holding one song document pointing to that object) and plays the song
+`--plays` times with `--concurrency` clients that download the whole file, following redirects.
+The CPU time of the API process is read from /proc before and after the plays:
+
+    python benchmarks/delivery_mode_benchmark.py --minio-endpoint localhost:9000 --size-mb 5 --plays 200
+"""
+import argparse
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from minio import Minio
+
+MODES = ["proxy", "redirect"]
+SONG_ID = "6543a1f2c9e77c0012345678"
+OBJECT_NAME = f"{SONG_ID}_delivery_benchmark.wav"
+
+
+def _serve(args):
+    # Runs in the child process: the streaming API with mongomock in place of MongoDB
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="lyricwave_metrics_"))
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api", "streaming"))
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+
+    import mongomock
+    import pymongo
+    from bson import ObjectId
+    from werkzeug.serving import make_server
+
+    pymongo.MongoClient = mongomock.MongoClient
+    import app as streaming_app
+
+    streaming_app.songs_collection.insert_one({
+        "_id": ObjectId(SONG_ID),
+        "melody_file_name": OBJECT_NAME,
+        "voice_file_name": OBJECT_NAME,
+        "final_song_name": OBJECT_NAME
+    })
+    make_server("127.0.0.1", args.port, streaming_app.app, threaded=True).serve_forever()
+
+
+def _cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as stat_file:
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+    # utime and stime, fields 14 and 15 of proc(5)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_api(args, mode, port):
+    env = dict(
+        os.environ,
+        MONGO_URI="mongodb://benchmark",
+        MONGO_DB="lyric_wave",
+        MONGO_DB_COLLECTION="songs",
+        MINIO_ENDPOINT=args.minio_endpoint,
+        MINIO_PUBLIC_ENDPOINT=args.minio_endpoint,
+        MINIO_ACCESS_KEY=args.access_key,
+        MINIO_SECRET_KEY=args.secret_key,
+        MINIO_BUCKET_NAME=args.bucket,
+        STREAMING_DELIVERY_MODE=mode
+    )
+    process = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(port)], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The streaming API did not start in {mode} mode")
+
+
+def _play(session, url):
+    started_at = time.perf_counter()
+    received = 0
+    api_bytes = 0
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            received += len(chunk)
+        # Bytes of the first response come from the API only when it was not redirected
+        if not response.history:
+            api_bytes = received
+    return time.perf_counter() - started_at, received, api_bytes
+
+
+def _run_mode(args, mode):
+    port = _free_port()
+    process = _start_api(args, mode, port)
+    url = f"http://127.0.0.1:{port}/stream_song/{SONG_ID}"
+    sessions = [requests.Session() for _ in range(args.concurrency)]
+    try:
+        for session in sessions:
+            _play(session, url)
+        cpu_before = _cpu_seconds(process.pid)
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            plays = list(executor.map(lambda index: _play(sessions[index % len(sessions)], url), range(args.plays)))
+        elapsed = time.perf_counter() - started_at
+        cpu_seconds = _cpu_seconds(process.pid) - cpu_before
+    finally:
+        process.terminate()
+        process.wait()
+    durations = sorted(play[0] for play in plays)
+    return {
+        "mode": mode,
+        "plays_per_second": args.plays / elapsed,
+        "api_cpu_ms_per_play": cpu_seconds / args.plays * 1000,
+        "api_mb_per_play": statistics.mean(play[2] for play in plays) / 1e6,
+        "client_mb_per_play": statistics.mean(play[1] for play in plays) / 1e6,
+        "p50_seconds": statistics.median(durations),
+        "p95_seconds": durations[int(len(durations) * 0.95) - 1] if len(durations) > 1 else durations[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API CPU per play, proxied vs redirected media delivery.")
+    parser.add_argument("--minio-endpoint", default="localhost:9000")
+    parser.add_argument("--access-key", default=os.environ.get("MINIO_ACCESS_KEY", "minioadmin"))
+    parser.add_argument("--secret-key", default=os.environ.get("MINIO_SECRET_KEY", "minioadmin"))
+    parser.add_argument("--bucket", default="lyric-wave-benchmark")
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--plays", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args)
+        return
+
+    minio_client = Minio(args.minio_endpoint, access_key=args.access_key, secret_key=args.secret_key, secure=False)
+    if not minio_client.bucket_exists(args.bucket):
+        minio_client.make_bucket(args.bucket)
+    size = int(args.size_mb * 1e6)
+    minio_client.put_object(args.bucket, OBJECT_NAME, io.BytesIO(os.urandom(size)), size, content_type="audio/wav")
+
+    try:
+        results = [_run_mode(args, mode) for mode in MODES]
+    finally:
+        minio_client.remove_object(args.bucket, OBJECT_NAME)
+
+    print(f"{args.plays} plays of a {args.size_mb} MB song, concurrency {args.concurrency}")
+    print(f"{'mode':<10}{'plays/s':>9}{'API CPU ms/play':>17}{'API MB/play':>13}{'p50 s':>8}{'p95 s':>8}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['plays_per_second']:>9.1f}{result['api_cpu_ms_per_play']:>17.2f}"
+              f"{result['api_mb_per_play']:>13.2f}{result['p50_seconds']:>8.3f}{result['p95_seconds']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
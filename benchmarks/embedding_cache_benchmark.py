@@ -0,0 +1,97 @@
+"""
+Text encoder time saved per song by the embedding cache of the melody and cover stages.
+
+Runs the same songs through the offline pipeline of `pipeline_benchmark.py` (which replays the
+style prompts of `music_styles.json` as lyrics, so lyrics repeat like resubmissions do) with:
+
+- `off`: no cache, every stage runs its text encoder;
+- `memory`: one in-memory LRU for the whole run, as in a long-lived process;
+- `disk`: a fresh process-level cache for every task backed by memory-mapped `.npy` files, as on
+  the Airflow workers where each task runs in its own process.
+
+and reports the `text_encode` phase time per song of each stage and the hit ratio:
+
+    python benchmarks/embedding_cache_benchmark.py --models stub --songs 50
+    python benchmarks/embedding_cache_benchmark.py --models tiny --songs 10
+"""
+import argparse
+import os
+import statistics
+import tempfile
+from unittest import mock
+
+from pipeline_benchmark import PipelineBenchmark
+
+MODES = ["off", "memory", "disk"]
+STAGES = ["generate_melody_task", "generate_song_cover_operator"]
+
+
+def _phase_seconds(song_info, stage, phase):
+    spans = ((song_info.get("stage_metrics") or {}).get(stage) or {}).get("spans", [])
+    return sum(span["duration_seconds"] for span in spans if span["phase"] == phase)
+
+
+def _run_mode(args, mode):
+    from operators import embedding_cache
+
+    caches = []
+
+    def new_cache(**kwargs):
+        cache = embedding_cache.EmbeddingCache(**kwargs)
+        caches.append(cache)
+        return cache
+
+    if mode == "off":
+        shared_cache = new_cache(max_entries=0, directory=None)
+        get_cache = lambda: shared_cache  # noqa: E731
+    elif mode == "memory":
+        shared_cache = new_cache(max_entries=args.max_entries, directory=None)
+        get_cache = lambda: shared_cache  # noqa: E731
+    else:
+        directory = tempfile.mkdtemp(prefix="lyricwave_embeddings_")
+        get_cache = lambda: new_cache(max_entries=args.max_entries, directory=directory)  # noqa: E731
+
+    benchmark = PipelineBenchmark(args)
+    with mock.patch.object(embedding_cache, "get_embedding_cache", get_cache):
+        report = benchmark.run()
+    songs = list(benchmark.mongo_client[os.environ["MONGO_DB"]][os.environ["MONGO_DB_COLLECTION"]].find(
+        {"song_status": "song_indexed"}
+    ))
+    hits = sum(cache.hits for cache in caches)
+    lookups = hits + sum(cache.misses for cache in caches)
+    return {
+        "mode": mode,
+        "songs": len(songs),
+        "failures": len(report["failures"]),
+        "text_encode_seconds": {
+            stage: statistics.mean(_phase_seconds(song, stage, "text_encode") for song in songs) if songs else 0.0
+            for stage in STAGES
+        },
+        "hit_ratio": hits / lookups if lookups else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text encoder time saved by the embedding cache.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="stub")
+    parser.add_argument("--songs", type=int, default=50)
+    parser.add_argument("--max-entries", type=int, default=256)
+    parser.add_argument("--rate", type=float, default=100.0, help="Submissions per second")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stub-latency-scale", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = [_run_mode(args, mode) for mode in MODES]
+    baseline = results[0]["text_encode_seconds"]
+    print(f"{args.songs} songs, {args.models} models")
+    print(f"{'mode':<8}{'melody s':>10}{'cover s':>10}{'saved s/song':>14}{'hit ratio':>11}{'failures':>10}")
+    for result in results:
+        seconds = result["text_encode_seconds"]
+        saved = sum(baseline[stage] - seconds[stage] for stage in STAGES)
+        print(f"{result['mode']:<8}{seconds[STAGES[0]]:>10.4f}{seconds[STAGES[1]]:>10.4f}{saved:>14.4f}"
+              f"{result['hit_ratio']:>11.1%}{result['failures']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Time-to-first-audio benchmark: whole-file `/stream_song` versus the HLS presentation.
+
+For every iteration a fresh client fetches the song both ways over a simulated link of the given
+bandwidth and records when playback could start:
+
+* whole file: when the MP4 `moov` box has been received and the `mdat` box has started. The
+  original mix is written without faststart, so this is usually the end of the download.
+* HLS: when the master playlist, the variant playlist, the init segment and the first media
+  segment have been downloaded.
+
+    python benchmarks/hls_ttfa_benchmark.py --base-url http://localhost:8088 \
+        --song-id 6543a1f2c9e77c0012345678 --bandwidth-kbps 1500 --iterations 10
+"""
+import argparse
+import json
+import statistics
+import struct
+import time
+from urllib.parse import urljoin
+
+import requests
+
+
+class ThrottledReader:
+    """
+    Reads a streamed response no faster than the simulated link allows.
+    """
+
+    def __init__(self, response, bandwidth_bytes_per_second, chunk_size=8 * 1024):
+        self.response = response
+        self.bandwidth_bytes_per_second = bandwidth_bytes_per_second
+        self.chunk_size = chunk_size
+        self.started_at = time.perf_counter()
+        self.bytes_read = 0
+
+    def chunks(self):
+        for chunk in self.response.iter_content(self.chunk_size):
+            self.bytes_read += len(chunk)
+            if self.bandwidth_bytes_per_second:
+                ready_at = self.started_at + self.bytes_read / self.bandwidth_bytes_per_second
+                time.sleep(max(0.0, ready_at - time.perf_counter()))
+            yield chunk
+
+
+def _mp4_playable_offset(buffer):
+    """
+    Return the number of bytes after which a progressive MP4 can start playing, or None if unknown yet.
+    """
+    offset = 0
+    moov_end = None
+    while offset + 8 <= len(buffer):
+        size, box_type = struct.unpack(">I4s", buffer[offset:offset + 8])
+        if size == 1:
+            if offset + 16 > len(buffer):
+                return None
+            size = struct.unpack(">Q", buffer[offset + 8:offset + 16])[0]
+        if size < 8:
+            return None
+        if box_type == b"moov":
+            moov_end = offset + size
+        elif box_type == b"mdat" and moov_end is not None:
+            return max(moov_end, offset + 8)
+        offset += size
+    if moov_end is not None and moov_end <= len(buffer):
+        # moov after mdat: the whole file has to be downloaded first
+        return moov_end
+    return None
+
+
+def _whole_file_ttfa(session, base_url, song_id, quality, bandwidth):
+    started_at = time.perf_counter()
+    url = f"{base_url}/stream_song/{song_id}"
+    with session.get(url, params={"quality": quality} if quality else None, stream=True) as response:
+        response.raise_for_status()
+        buffer = bytearray()
+        for chunk in ThrottledReader(response, bandwidth).chunks():
+            buffer += chunk
+            playable_offset = _mp4_playable_offset(buffer)
+            if playable_offset is not None and len(buffer) >= playable_offset:
+                return time.perf_counter() - started_at, len(buffer)
+    return time.perf_counter() - started_at, len(buffer)
+
+
+def _download(session, url, bandwidth):
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        return b"".join(ThrottledReader(response, bandwidth).chunks())
+
+
+def _hls_ttfa(session, base_url, song_id, variant_index, bandwidth):
+    started_at = time.perf_counter()
+    master_url = f"{base_url}/hls/{song_id}/master.m3u8"
+    master = _download(session, master_url, bandwidth).decode()
+    variants = [line for line in master.splitlines() if line and not line.startswith("#")]
+    variant_url = urljoin(master_url, variants[min(variant_index, len(variants) - 1)])
+    playlist = _download(session, variant_url, bandwidth).decode()
+
+    init_uri, first_segment_uri = None, None
+    for line in playlist.splitlines():
+        if line.startswith("#EXT-X-MAP:"):
+            init_uri = line.split('URI="', 1)[1].split('"', 1)[0]
+        elif line and not line.startswith("#"):
+            first_segment_uri = line
+            break
+
+    downloaded = len(master) + len(playlist)
+    if init_uri:
+        downloaded += len(_download(session, urljoin(variant_url, init_uri), bandwidth))
+    downloaded += len(_download(session, urljoin(variant_url, first_segment_uri), bandwidth))
+    return time.perf_counter() - started_at, downloaded
+
+
+def _summary(samples):
+    durations = sorted(duration for duration, _ in samples)
+    return {
+        "p50_seconds": round(statistics.median(durations), 3),
+        "p95_seconds": round(durations[max(0, int(len(durations) * 0.95) - 1)], 3),
+        "bytes_before_playback": int(statistics.median(size for _, size in samples))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-first-audio of whole-file streaming versus HLS.")
+    parser.add_argument("--base-url", required=True, help="Base URL of the streaming API")
+    parser.add_argument("--song-id", required=True, help="ID of a song packaged with ENABLE_HLS_PACKAGING")
+    parser.add_argument("--bandwidth-kbps", type=float, default=1500,
+                        help="Simulated link bandwidth; 0 disables throttling")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--quality", help="quality parameter of the whole-file request (original or high)")
+    parser.add_argument("--variant", type=int, default=0, help="Index of the HLS variant, 0 is the lowest bandwidth")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_kbps * 1000 / 8
+    whole_file, hls = [], []
+    for _ in range(args.iterations):
+        # A new session per iteration so every sample pays for its own connections
+        with requests.Session() as session:
+            whole_file.append(_whole_file_ttfa(session, args.base_url, args.song_id, args.quality, bandwidth))
+        with requests.Session() as session:
+            hls.append(_hls_ttfa(session, args.base_url, args.song_id, args.variant, bandwidth))
+
+    report = {
+        "bandwidth_kbps": args.bandwidth_kbps,
+        "iterations": args.iterations,
+        "whole_file": _summary(whole_file),
+        "hls": _summary(hls)
+    }
+    print(f"{'path':<12}{'p50 s':>10}{'p95 s':>10}{'bytes before playback':>25}")
+    for path in ("whole_file", "hls"):
+        print(f"{path:<12}{report[path]['p50_seconds']:>10.3f}{report[path]['p95_seconds']:>10.3f}"
+              f"{report[path]['bytes_before_playback']:>25}")
+    if report["hls"]["p50_seconds"]:
+        print(f"\nHLS starts {report['whole_file']['p50_seconds'] / report['hls']['p50_seconds']:.1f}x faster (p50)")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
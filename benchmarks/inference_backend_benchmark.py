@@ -0,0 +1,182 @@
+"""
+Parity and CPU latency of the optimized inference backends against eager PyTorch.
+
+For each model stage, runs the same inputs through the eager model and through the backend the
+stage can be switched to (`MELODY_INFERENCE_BACKEND`, `VOICE_INFERENCE_BACKEND`,
+`COVER_INFERENCE_BACKEND`):
+
+- parity: the max abs error of one forward pass (MusicGen and Bark decoder logits, UNet noise
+  prediction), relative to the largest eager output, checked against a tolerance;
+- latency: the median generation time (greedy MusicGen, seeded Bark, a seeded cover with the
+  configured number of denoising steps) and the real-time factor of the audio stages.
+
+The tiny random-weight models of `pipeline/tiny_models.py` check parity in seconds; `--models full`
+loads the checkpoints of the operators to measure the latency that matters:
+
+    python benchmarks/inference_backend_benchmark.py --models tiny
+    python benchmarks/inference_backend_benchmark.py --models full --stages cover --steps 20
+"""
+import argparse
+import copy
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "airflow", "dags"))
+
+import torch  # noqa: E402
+
+from operators import inference_backends, quality_tiers  # noqa: E402
+from pipeline import tiny_models  # noqa: E402
+
+# Backend compared with eager mode for each stage
+STAGE_BACKENDS = {"melody": "int8", "voice": "int8", "cover": "onnx"}
+PROMPT = "a calm acoustic guitar ballad about the sea at night"
+
+
+def _checkpoint(stage, models):
+    if models == "tiny":
+        return f"tiny-{stage}"
+    # The full models are the checkpoints of the default quality tier
+    return quality_tiers.stage_settings(None, stage)["checkpoint"]
+
+
+def _load(stage, models):
+    """
+    The model (or pipeline) of a stage and a processor for its text input.
+    """
+    transformers = importlib.import_module("transformers")
+    checkpoint = _checkpoint(stage, models)
+    if stage == "cover":
+        if models == "tiny":
+            return tiny_models.build_tiny_stable_diffusion(), None
+        return importlib.import_module("diffusers").StableDiffusionPipeline.from_pretrained(checkpoint, torch_dtype=torch.float32), None
+    if models == "tiny":
+        model = tiny_models.build_tiny_musicgen() if stage == "melody" else tiny_models.build_tiny_bark()
+        return model, tiny_models.TinyProcessor(vocab_size=1000)
+    model_class = transformers.MusicgenForConditionalGeneration if stage == "melody" else transformers.BarkModel
+    return model_class.from_pretrained(checkpoint).eval(), transformers.AutoProcessor.from_pretrained(checkpoint)
+
+
+def _max_abs_error(reference, output):
+    error = (reference - output).abs().max().item()
+    return error, error / max(reference.abs().max().item(), 1e-12)
+
+
+def _median_seconds(function, repeats):
+    function()
+    durations = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started_at)
+    return statistics.median(durations)
+
+
+def _audio_stage(stage, args):
+    model, processor = _load(stage, args.models)
+    optimized = inference_backends.quantize_int8(copy.deepcopy(model))
+    generator = torch.Generator().manual_seed(args.seed)
+    if stage == "melody":
+        inputs = processor(text=[PROMPT], padding=True, return_tensors="pt")
+        num_codebooks = model.config.decoder.num_codebooks
+        decoder_input_ids = torch.randint(0, model.config.decoder.vocab_size, (num_codebooks, 16), generator=generator)
+
+        def forward(candidate):
+            return candidate(**inputs, decoder_input_ids=decoder_input_ids).logits
+
+        def generate(candidate):
+            return candidate.generate(**inputs, do_sample=False, max_new_tokens=args.melody_tokens)[0, 0]
+
+        sample_rate = model.config.audio_encoder.sampling_rate
+    else:
+        inputs = processor(PROMPT)
+        input_ids = torch.randint(0, model.semantic.config.input_vocab_size, (1, 32), generator=generator)
+
+        def forward(candidate):
+            return candidate.semantic(input_ids=input_ids).logits
+
+        def generate(candidate):
+            torch.manual_seed(args.seed)
+            return candidate.generate(**inputs)[0]
+
+        sample_rate = model.generation_config.sample_rate
+
+    with torch.no_grad():
+        error, relative_error = _max_abs_error(forward(model), forward(optimized))
+        results = {"stage": stage, "backend": STAGE_BACKENDS[stage], "max_abs_error": error, "relative_error": relative_error}
+        for name, candidate in (("eager", model), ("backend", optimized)):
+            results[f"{name}_seconds"] = _median_seconds(lambda: generate(candidate), args.repeats)
+            results[f"{name}_audio_seconds"] = generate(candidate).shape[-1] / sample_rate
+    return results
+
+
+def _cover_stage(args):
+    pipe, _ = _load("cover", args.models)
+    unet = pipe.unet
+    onnx_unet = inference_backends.load_onnx_unet(_checkpoint("cover", args.models), unet)
+    generator = torch.Generator().manual_seed(args.seed)
+    sample_size = unet.config.sample_size
+    sample = torch.randn(2, unet.config.in_channels, sample_size, sample_size, generator=generator)
+    timestep = torch.tensor(500)
+    encoder_hidden_states = torch.randn(
+        2, inference_backends.TEXT_SEQUENCE_LENGTH, unet.config.cross_attention_dim, generator=generator
+    )
+
+    def generate():
+        return pipe(PROMPT, num_inference_steps=args.steps, generator=torch.Generator().manual_seed(args.seed))
+
+    with torch.no_grad():
+        reference = unet(sample, timestep, encoder_hidden_states=encoder_hidden_states, return_dict=False)[0]
+        output = onnx_unet(sample, timestep, encoder_hidden_states=encoder_hidden_states, return_dict=False)[0]
+        error, relative_error = _max_abs_error(reference, output)
+        results = {"stage": "cover", "backend": "onnx", "max_abs_error": error, "relative_error": relative_error}
+        results["eager_seconds"] = _median_seconds(generate, args.repeats)
+        pipe.unet = onnx_unet
+        results["backend_seconds"] = _median_seconds(generate, args.repeats)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of the optimized inference backends.")
+    parser.add_argument("--models", choices=["tiny", "full"], default="tiny")
+    parser.add_argument("--stages", nargs="*", choices=list(STAGE_BACKENDS), default=list(STAGE_BACKENDS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--melody-tokens", type=int, default=250, help="max_new_tokens of the timed melody generation")
+    parser.add_argument("--steps", type=int, default=50, help="Denoising steps of the timed cover generation")
+    parser.add_argument("--threads", type=int, help="PyTorch and ONNX Runtime threads; all cores by default")
+    parser.add_argument("--int8-tolerance", type=float, default=0.05, help="Allowed relative error of the int8 backend")
+    parser.add_argument("--onnx-tolerance", type=float, default=1e-3, help="Allowed relative error of the ONNX backend")
+    parser.add_argument("--export-dir", help="Directory of the ONNX exports; a temporary one for the tiny models")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.export_dir or args.models == "tiny":
+        inference_backends.EXPORTED_MODELS_DIR = args.export_dir or tempfile.mkdtemp(prefix="lyricwave_exports_")
+    tolerances = {"int8": args.int8_tolerance, "onnx": args.onnx_tolerance}
+
+    results = [_cover_stage(args) if stage == "cover" else _audio_stage(stage, args) for stage in args.stages]
+    print(f"{args.models} models, {torch.get_num_threads()} threads")
+    print(f"{'stage':<8}{'backend':<9}{'max abs err':>13}{'relative':>10}{'eager s':>10}{'backend s':>11}{'speedup':>9}{'RTF eager/backend':>19}  parity")
+    failed = False
+    for result in results:
+        passed = result["relative_error"] <= tolerances[result["backend"]]
+        failed = failed or not passed
+        real_time_factors = ""
+        if result.get("eager_audio_seconds"):
+            real_time_factors = (f"{result['eager_seconds'] / result['eager_audio_seconds']:.2f}/"
+                                 f"{result['backend_seconds'] / result['backend_audio_seconds']:.2f}")
+        print(f"{result['stage']:<8}{result['backend']:<9}{result['max_abs_error']:>13.2e}{result['relative_error']:>10.2e}"
+              f"{result['eager_seconds']:>10.3f}{result['backend_seconds']:>11.3f}"
+              f"{result['eager_seconds'] / result['backend_seconds']:>8.2f}x{real_time_factors:>19}  {'PASS' if passed else 'FAIL'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
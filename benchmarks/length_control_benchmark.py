@@ -0,0 +1,79 @@
+"""
+MusicGen compute per song and silence padding of the mix, with fixed and voice-sized melodies.
+
+Runs the same songs through the offline pipeline of `pipeline_benchmark.py` twice, once with
+`MELODY_LENGTH_MODE=fixed` (500 tokens for every song, the previous behaviour) and once with
+`MELODY_LENGTH_MODE=voice` (the token budget sized to the measured voice), then reads back from the
+song documents the tokens generated, the melody inference time and the silence the mix added to
+the shorter track:
+
+    python benchmarks/length_control_benchmark.py --models stub --songs 20
+    python benchmarks/length_control_benchmark.py --models tiny --songs 5
+"""
+import argparse
+import os
+import statistics
+from unittest import mock
+
+from pipeline_benchmark import PipelineBenchmark
+
+MODES = ["fixed", "voice"]
+
+
+def _inference_seconds(song_info):
+    spans = ((song_info.get("stage_metrics") or {}).get("generate_melody_task") or {}).get("spans", [])
+    return sum(span["duration_seconds"] for span in spans if span["phase"] == "inference")
+
+
+def _run_mode(args, mode):
+    from operators import generate_melody_operator
+
+    benchmark = PipelineBenchmark(args)
+    with mock.patch.object(generate_melody_operator, "MELODY_LENGTH_MODE", mode):
+        report = benchmark.run()
+    songs = list(benchmark.mongo_client[os.environ["MONGO_DB"]][os.environ["MONGO_DB_COLLECTION"]].find(
+        {"song_mix": {"$exists": True}}
+    ))
+    mixes = [song["song_mix"] for song in songs]
+    song_seconds = sum(max(mix["melody_ms"], mix["voice_ms"]) for mix in mixes) / 1000
+    return {
+        "mode": mode,
+        "songs": len(songs),
+        "failures": len(report["failures"]),
+        "tokens_per_song": statistics.mean(song["melody_max_new_tokens"] for song in songs),
+        "inference_seconds_per_song": statistics.mean(_inference_seconds(song) for song in songs),
+        "melody_seconds_per_song": statistics.mean(mix["melody_ms"] for mix in mixes) / 1000,
+        "voice_seconds_per_song": statistics.mean(mix["voice_ms"] for mix in mixes) / 1000,
+        "padding_seconds_per_song": statistics.mean(mix["padding_ms"] for mix in mixes) / 1000,
+        "padding_ratio": sum(mix["padding_ms"] for mix in mixes) / 1000 / song_seconds if song_seconds else 0.0,
+        "padded_voice": sum(1 for mix in mixes if mix["padded_track"] == "voice"),
+        "padded_melody": sum(1 for mix in mixes if mix["padded_track"] == "melody")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MusicGen compute and silence padding with fixed and voice-sized melodies.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="stub")
+    parser.add_argument("--songs", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100.0, help="Submissions per second")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stub-latency-scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = [_run_mode(args, mode) for mode in MODES]
+    print(f"{args.songs} songs, {args.models} models")
+    print(f"{'mode':<8}{'tokens':>8}{'infer s':>9}{'melody s':>10}{'voice s':>9}{'padding s':>11}{'padding %':>11}{'padded voice/melody':>21}")
+    for result in results:
+        print(f"{result['mode']:<8}{result['tokens_per_song']:>8.0f}{result['inference_seconds_per_song']:>9.3f}"
+              f"{result['melody_seconds_per_song']:>10.1f}{result['voice_seconds_per_song']:>9.1f}"
+              f"{result['padding_seconds_per_song']:>11.1f}{result['padding_ratio']:>11.1%}"
+              f"{result['padded_voice']:>12}/{result['padded_melody']}")
+    fixed, voice = results
+    if fixed["tokens_per_song"]:
+        print(f"\nMusicGen tokens per song: {1 - voice['tokens_per_song'] / fixed['tokens_per_song']:+.1%} saved; "
+              f"inference time per song: {fixed['inference_seconds_per_song'] - voice['inference_seconds_per_song']:+.3f} s saved")
+
+
+if __name__ == "__main__":
+    main()
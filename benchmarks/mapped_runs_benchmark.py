@@ -0,0 +1,137 @@
+"""
+Scheduling overhead of one DAG run per song versus mapped DAG runs of many songs.
+
+Triggers the same number of songs against the Airflow REST API twice: as one run per song (the
+`song_id` configuration sent by `POST /generate_song`) and as runs of `--mapped-run-size` songs
+(the `song_ids` configuration sent by `POST /generate_songs`). Every run is polled until it
+finishes, then the makespan, the task instances executed and the time task instances spent waiting
+in the scheduler and executor queues are reported.
+
+The benchmark uses `mapped_runs_dag.py`, which has the shape of the real DAG but whose stages only
+sleep, so no model is loaded. Pause the DAG again after the run to keep it out of the scheduler loop.
+
+    cp benchmarks/mapped_runs_dag.py airflow/dags/
+    python benchmarks/mapped_runs_benchmark.py --airflow-api-url http://localhost:8080/api/v1 \\
+        --username airflow --password airflow --songs 200 --mapped-run-size 50
+"""
+import argparse
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+TERMINAL_RUN_STATES = {"success", "failed"}
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+class AirflowClient:
+
+    def __init__(self, api_url, username, password, dag_id):
+        self.api_url = api_url.rstrip("/")
+        self.dag_id = dag_id
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+
+    def unpause(self):
+        response = self.session.patch(f"{self.api_url}/dags/{self.dag_id}", json={"is_paused": False})
+        response.raise_for_status()
+
+    def trigger(self, conf):
+        dag_run_id = f"benchmark_{uuid.uuid4()}"
+        response = self.session.post(f"{self.api_url}/dags/{self.dag_id}/dagRuns", json={"dag_run_id": dag_run_id, "conf": conf})
+        response.raise_for_status()
+        return dag_run_id
+
+    def run_state(self, dag_run_id):
+        response = self.session.get(f"{self.api_url}/dags/{self.dag_id}/dagRuns/{dag_run_id}")
+        response.raise_for_status()
+        return response.json()["state"]
+
+    def task_instances(self, dag_run_ids):
+        task_instances = []
+        for offset in range(0, len(dag_run_ids), 100):
+            response = self.session.post(f"{self.api_url}/dags/~/dagRuns/~/taskInstances/list", json={
+                "dag_ids": [self.dag_id],
+                "dag_run_ids": dag_run_ids[offset:offset + 100],
+                "page_limit": 10000
+            })
+            response.raise_for_status()
+            task_instances.extend(response.json()["task_instances"])
+        return task_instances
+
+
+def _run_mode(client, name, confs, poll_interval):
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        dag_run_ids = list(executor.map(client.trigger, confs))
+    pending = set(dag_run_ids)
+    failed = 0
+    while pending:
+        time.sleep(poll_interval)
+        for dag_run_id in list(pending):
+            state = client.run_state(dag_run_id)
+            if state in TERMINAL_RUN_STATES:
+                pending.discard(dag_run_id)
+                failed += state == "failed"
+    makespan = time.perf_counter() - started_at
+
+    task_instances = client.task_instances(dag_run_ids)
+    queue_delays = [
+        (_parse_date(ti["start_date"]) - _parse_date(ti["queued_when"])).total_seconds()
+        for ti in task_instances if ti.get("queued_when") and ti.get("start_date")
+    ]
+    return {
+        "mode": name,
+        "dag_runs": len(dag_run_ids),
+        "failed_runs": failed,
+        "task_instances": len(task_instances),
+        "makespan_s": makespan,
+        "queue_p50_s": statistics.median(queue_delays) if queue_delays else 0.0,
+        "queue_p95_s": statistics.quantiles(queue_delays, n=20)[-1] if len(queue_delays) > 1 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduling overhead of one DAG run per song versus mapped DAG runs.")
+    parser.add_argument("--airflow-api-url", required=True, help="Base URL of the Airflow REST API, e.g. http://localhost:8080/api/v1")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--dag-id", default="mapped_runs_benchmark_dag")
+    parser.add_argument("--songs", type=int, default=200)
+    parser.add_argument("--mapped-run-size", type=int, default=50, help="Songs per mapped run, like AIRFLOW_MAPPED_RUN_SIZE")
+    parser.add_argument("--work-seconds", type=float, default=0.0, help="Simulated work of every stage")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    client = AirflowClient(args.airflow_api_url, args.username, args.password, args.dag_id)
+    client.unpause()
+    song_ids = [f"benchmark-{index}" for index in range(args.songs)]
+
+    single_confs = [{"song_id": song_id, "work_seconds": args.work_seconds} for song_id in song_ids]
+    mapped_confs = [
+        {"song_ids": song_ids[offset:offset + args.mapped_run_size], "work_seconds": args.work_seconds}
+        for offset in range(0, len(song_ids), args.mapped_run_size)
+    ]
+    results = [
+        _run_mode(client, "run per song", single_confs, args.poll_interval),
+        _run_mode(client, f"mapped ({args.mapped_run_size}/run)", mapped_confs, args.poll_interval)
+    ]
+
+    print(f"{args.songs} songs, {args.work_seconds} s of work per stage")
+    print(f"{'mode':<20}{'runs':>6}{'failed':>8}{'TIs':>7}{'makespan s':>12}{'songs/min':>11}{'queue p50 s':>13}{'queue p95 s':>13}")
+    for result in results:
+        songs_per_minute = args.songs / result["makespan_s"] * 60
+        print(f"{result['mode']:<20}{result['dag_runs']:>6}{result['failed_runs']:>8}{result['task_instances']:>7}"
+              f"{result['makespan_s']:>12.1f}{songs_per_minute:>11.1f}{result['queue_p50_s']:>13.2f}{result['queue_p95_s']:>13.2f}")
+    print(f"\nMapped runs finish {results[0]['makespan_s'] / results[1]['makespan_s']:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
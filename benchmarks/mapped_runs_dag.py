@@ -0,0 +1,44 @@
+"""
+Stand-in for `music_generation_dag` used by `mapped_runs_benchmark.py`.
+
+Same shape as the real DAG (a `resolve_song_ids` task and a mapped `song` task group of five
+sequential stages, accepting `song_ids` or the single `song_id` of older triggers) but every stage
+only sleeps `work_seconds` from the run configuration, so the run time is dominated by scheduling.
+Copy it into the DAGs folder of the deployment to benchmark:
+
+    cp benchmarks/mapped_runs_dag.py airflow/dags/
+"""
+from datetime import datetime
+import time
+
+from airflow import DAG
+from airflow.decorators import task, task_group
+
+STAGES = [
+    "generate_voice_task", "generate_melody_task", "generate_song_task",
+    "generate_song_cover_operator", "index_to_elasticsearch_operator"
+]
+
+
+@task
+def resolve_song_ids(dag_run=None):
+    conf = dag_run.conf or {}
+    return [str(song_id) for song_id in conf.get("song_ids") or [conf["song_id"]]]
+
+
+def _stage(task_id):
+    @task(task_id=task_id)
+    def stage(song_id, dag_run=None):
+        time.sleep(float((dag_run.conf or {}).get("work_seconds", 0)))
+        return song_id
+    return stage
+
+
+@task_group(group_id="song")
+def generate_song(song_id):
+    for task_id in STAGES:
+        song_id = _stage(task_id)(song_id)
+
+
+with DAG('mapped_runs_benchmark_dag', start_date=datetime(2023, 1, 1), schedule_interval=None, catchup=False) as dag:
+    generate_song.expand(song_id=resolve_song_ids())
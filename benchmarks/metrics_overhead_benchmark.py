@@ -0,0 +1,78 @@
+"""
+Overhead benchmark for the request metrics middleware of the Flask APIs.
+
+Serves a trivial route through the Flask test client with and without `metrics.init_app`, in
+Prometheus multiprocess mode (as in the Gunicorn images), and reports the added cost per request.
+It also measures the raw cost of one downstream call timing and of one streamed chunk.
+
+    python benchmarks/metrics_overhead_benchmark.py --requests 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Multiprocess mode must be configured before prometheus_client is imported
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="lyricwave_metrics_"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api", "streaming"))
+
+from flask import Flask  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def _build_app(with_metrics):
+    app = Flask(__name__)
+    if with_metrics:
+        metrics.init_app(app)
+
+    @app.route('/ping/<string:song_id>', methods=['GET'])
+    def ping(song_id):
+        return song_id
+
+    return app
+
+
+def _requests_per_second(app, requests):
+    client = app.test_client()
+    for _ in range(min(requests, 500)):
+        client.get('/ping/warmup')
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        client.get('/ping/6543a1f2c9e77c0012345678')
+    return requests / (time.perf_counter() - started_at)
+
+
+def _seconds_per_call(function, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started_at) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request metrics middleware overhead benchmark.")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    baseline = _requests_per_second(_build_app(False), args.requests)
+    instrumented = _requests_per_second(_build_app(True), args.requests)
+    overhead_us = (1 / instrumented - 1 / baseline) * 1e6
+    print(f"baseline:       {baseline:10.0f} req/s")
+    print(f"instrumented:   {instrumented:10.0f} req/s")
+    print(f"overhead:       {overhead_us:10.1f} us/request ({(baseline / instrumented - 1) * 100:.1f}%)")
+
+    def timed_call():
+        with metrics.timed_call("mongodb", "find"):
+            pass
+
+    chunk = b"\0" * 1024
+    chunks = metrics.track_stream("/stream_song/<string:song_id>", iter(lambda: chunk, None))
+    print(f"timed_call:     {_seconds_per_call(timed_call, args.iterations) * 1e6:10.2f} us/call")
+    print(f"streamed chunk: {_seconds_per_call(lambda: next(chunks), args.iterations) * 1e6:10.2f} us/chunk")
+
+
+if __name__ == "__main__":
+    main()
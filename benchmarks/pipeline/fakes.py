@@ -0,0 +1,223 @@
+"""
+In-memory stand-ins for the services the pipeline talks to: MinIO, Elasticsearch and Airflow.
+MongoDB is replaced by mongomock.
+"""
+import io
+import threading
+from datetime import datetime, timezone
+
+import mongomock
+
+
+class FakeObject:
+    """
+    Object returned by FakeMinio.get_object, mimicking the urllib3 response used by the MinIO client.
+    """
+
+    def __init__(self, data):
+        self._buffer = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._buffer.read(amt)
+
+    def stream(self, amt=1024):
+        while True:
+            chunk = self._buffer.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeObjectStat:
+    def __init__(self, bucket_name, object_name, stored):
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.size = len(stored["data"])
+        self.content_type = stored["content_type"]
+        self.metadata = stored["metadata"]
+        self.last_modified = stored["last_modified"]
+        self.etag = str(hash(stored["data"]))
+        self.is_dir = False
+
+
+class FakeMinio:
+    """
+    Thread-safe in-memory implementation of the subset of the MinIO client used by LyricWave.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self._buckets
+
+    def make_bucket(self, bucket_name):
+        self._buckets.setdefault(bucket_name, {})
+
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   metadata=None, **kwargs):
+        payload = data.read(length) if length >= 0 else data.read()
+        with self._lock:
+            self._buckets.setdefault(bucket_name, {})[object_name] = {
+                "data": payload,
+                "content_type": content_type,
+                "metadata": {f"x-amz-meta-{key}": value for key, value in (metadata or {}).items()},
+                "last_modified": datetime.now(timezone.utc)
+            }
+            self.bytes_uploaded += len(payload)
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type="application/octet-stream",
+                    metadata=None, **kwargs):
+        with open(file_path, "rb") as file_data:
+            payload = file_data.read()
+        self.put_object(bucket_name, object_name, io.BytesIO(payload), len(payload), content_type, metadata)
+
+    def _get(self, bucket_name, object_name):
+        try:
+            return self._buckets[bucket_name][object_name]
+        except KeyError:
+            raise FakeNoSuchKey(object_name)
+
+    def get_object(self, bucket_name, object_name, **kwargs):
+        stored = self._get(bucket_name, object_name)
+        with self._lock:
+            self.bytes_downloaded += len(stored["data"])
+        return FakeObject(stored["data"])
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        with open(file_path, "wb") as file_data:
+            file_data.write(self.get_object(bucket_name, object_name).read())
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        return FakeObjectStat(bucket_name, object_name, self._get(bucket_name, object_name))
+
+    def copy_object(self, bucket_name, object_name, source, metadata=None, **kwargs):
+        stored = dict(self._get(source.bucket_name, source.object_name))
+        if metadata is not None:
+            stored["metadata"] = {f"x-amz-meta-{key}": value for key, value in metadata.items()}
+        stored["last_modified"] = datetime.now(timezone.utc)
+        with self._lock:
+            self._buckets.setdefault(bucket_name, {})[object_name] = stored
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        with self._lock:
+            self._buckets.get(bucket_name, {}).pop(object_name, None)
+
+    def remove_objects(self, bucket_name, delete_object_list, **kwargs):
+        for delete_object in delete_object_list:
+            self.remove_object(bucket_name, delete_object._name)
+        return iter(())
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, **kwargs):
+        with self._lock:
+            names = sorted(self._buckets.get(bucket_name, {}))
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            stored = self._buckets[bucket_name].get(name)
+            if stored is not None:
+                yield FakeObjectStat(bucket_name, name, stored)
+
+    def presigned_get_object(self, bucket_name, object_name, expires=None, **kwargs):
+        return f"http://fake-minio/{bucket_name}/{object_name}?X-Amz-Expires={int(expires.total_seconds()) if expires else 604800}"
+
+    def object_count(self):
+        return sum(len(objects) for objects in self._buckets.values())
+
+    def stored_bytes(self):
+        return sum(len(stored["data"]) for objects in self._buckets.values() for stored in objects.values())
+
+
+class FakeNoSuchKey(Exception):
+    """
+    Raised for missing objects; carries the `code` attribute checked on minio.error.S3Error.
+    """
+
+    code = "NoSuchKey"
+
+
+class FakeElasticsearch:
+    """
+    In-memory Elasticsearch accepting the index and match queries issued by LyricWave.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    def index(self, index, body=None, document=None, id=None, **kwargs):
+        with self._lock:
+            documents = self.documents.setdefault(index, [])
+            documents.append(body if body is not None else document)
+        return {"result": "created"}
+
+    def search(self, index, body=None, **kwargs):
+        term = body["query"]["match"]["song_text"].lower()
+        hits = [
+            {"_source": document}
+            for document in self.documents.get(index, [])
+            if any(word in document.get("song_text", "").lower() for word in term.split())
+        ]
+        return {"hits": {"hits": hits}}
+
+
+class FakeDagRun:
+    def __init__(self, conf, dag_id="music_generation_dag", run_id="benchmark"):
+        self.conf = conf
+        self.dag_id = dag_id
+        self.run_id = run_id
+
+
+class FakeTaskInstance:
+    """
+    Minimal task instance shared by the tasks of one simulated DAG run, storing their XComs.
+    """
+
+    def __init__(self, dag_id, xcoms):
+        self.dag_id = dag_id
+        self.task_id = None
+        self.try_number = 1
+        self.map_index = -1
+        self._xcoms = xcoms
+
+    def xcom_pull(self, task_ids=None, key="return_value", **kwargs):
+        return self._xcoms.get(task_ids)
+
+    def xcom_push(self, key, value, **kwargs):
+        self._xcoms[(self.task_id, key)] = value
+
+
+def build_context(dag_run, task_instance, task_id):
+    """
+    Build the execution context handed to an operator.
+    """
+    task_instance.task_id = task_id
+    return {
+        "dag_run": dag_run,
+        "task_instance": task_instance,
+        "ti": task_instance,
+        "run_id": dag_run.run_id,
+        "params": {}
+    }
+
+
+def new_mongo_client():
+    """
+    Create the mongomock client shared by the operators and the API in one benchmark run.
+    """
+    return mongomock.MongoClient()
+
+
+class FakeAirflowResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.text = ""
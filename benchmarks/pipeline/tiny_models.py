@@ -0,0 +1,385 @@
+"""
+Model stand-ins for the offline pipeline benchmark.
+
+Two flavours are available:
+
+* `tiny`: random-weight MusicGen, Bark and Stable Diffusion models built from shrunken configs
+  (real vocabularies and special tokens, a few hidden units and layers). They run the real
+  `transformers`/`diffusers` generation code paths in seconds on a laptop CPU.
+* `stub`: numpy/PIL fakes returning correctly shaped outputs after a configurable delay. They do no
+  tensor compute at all and isolate the cost of everything around inference.
+
+`install(flavour)` returns a context manager patching the `from_pretrained` loaders used by the
+operators, so the operators themselves run unmodified.
+"""
+import contextlib
+import hashlib
+import time
+from unittest import mock
+
+import numpy as np
+
+# Latency of the stub of each checkpoint of the quality tiers, relative to the standard tier's checkpoints
+STUB_CHECKPOINT_LATENCY = {
+    "suno/bark-small": 0.4,
+    "facebook/musicgen-medium": 3.0,
+    "nota-ai/bk-sdm-small": 0.65,
+    "stabilityai/stable-diffusion-2-1": 1.1
+}
+
+# Sampling rates of the real checkpoints, reused by the stand-ins
+MUSICGEN_SAMPLING_RATE = 32000
+MUSICGEN_FRAME_RATE = 50
+BARK_SAMPLE_RATE = 24000
+
+
+def _token_ids(text, vocab_size, max_length=64):
+    """
+    Deterministic character-hash tokenizer, so no tokenizer files are needed offline.
+    """
+    words = text.split() or [""]
+    return [int(hashlib.md5(word.encode()).hexdigest(), 16) % (vocab_size - 1) + 1 for word in words][:max_length]
+
+
+# ---------------------------------------------------------------------------------------------
+# Stub models (numpy + Pillow)
+# ---------------------------------------------------------------------------------------------
+
+class _StubArray:
+    """
+    Wraps a numpy array with the tensor methods the operators call (`numpy`, `cpu`, indexing).
+    """
+
+    def __init__(self, array):
+        self._array = array
+
+    def __getitem__(self, item):
+        return _StubArray(self._array[item])
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    def __array__(self, dtype=None):
+        return self._array if dtype is None else self._array.astype(dtype)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._array
+
+
+class _StubConfig:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class StubProcessor:
+    def __init__(self, vocab_size=1000):
+        self.vocab_size = vocab_size
+
+    def __call__(self, text=None, *args, **kwargs):
+        texts = text if isinstance(text, list) else [text]
+        ids = [_token_ids(item, self.vocab_size) for item in texts]
+        width = max(len(item) for item in ids)
+        input_ids = np.array([item + [0] * (width - len(item)) for item in ids])
+        return {"input_ids": _StubArray(input_ids), "attention_mask": _StubArray((input_ids > 0).astype(np.int64))}
+
+
+class StubTextEncoder:
+    """
+    Returns zero hidden states of the real encoder's width after a fixed delay.
+    """
+
+    def __init__(self, hidden_size, seconds_per_call):
+        self.hidden_size = hidden_size
+        self.seconds_per_call = seconds_per_call
+
+    def __call__(self, input_ids=None, attention_mask=None, **kwargs):
+        time.sleep(self.seconds_per_call)
+        tokens = input_ids.numpy().shape[-1]
+        return _StubConfig(last_hidden_state=_StubArray(np.zeros((1, tokens, self.hidden_size), dtype=np.float32)))
+
+
+class StubMusicgen:
+    def __init__(self, seconds_per_token, encoder_seconds=0.0):
+        self.seconds_per_token = seconds_per_token
+        # T5 encoder of musicgen-small
+        self.text_encoder = StubTextEncoder(768, encoder_seconds)
+        self.config = _StubConfig(
+            audio_encoder=_StubConfig(sampling_rate=MUSICGEN_SAMPLING_RATE, frame_rate=MUSICGEN_FRAME_RATE),
+            decoder=_StubConfig(num_codebooks=4)
+        )
+        self.generation_config = _StubConfig(guidance_scale=3.0, max_new_tokens=1500)
+
+    def generate(self, input_ids=None, max_new_tokens=500, **kwargs):
+        time.sleep(self.seconds_per_token * max_new_tokens)
+        samples = int(max_new_tokens / MUSICGEN_FRAME_RATE * MUSICGEN_SAMPLING_RATE)
+        timeline = np.arange(samples) / MUSICGEN_SAMPLING_RATE
+        audio = (0.2 * np.sin(2 * np.pi * 220 * timeline)).astype(np.float32)
+        return _StubArray(audio.reshape(1, 1, -1))
+
+
+class StubBark:
+    def __init__(self, seconds_per_character):
+        self.seconds_per_character = seconds_per_character
+        self.generation_config = _StubConfig(sample_rate=BARK_SAMPLE_RATE)
+
+    def generate(self, input_ids=None, **kwargs):
+        tokens = input_ids.numpy().shape[-1] if input_ids is not None else 16
+        time.sleep(self.seconds_per_character * tokens * 5)
+        samples = int(tokens * 0.4 * BARK_SAMPLE_RATE)
+        rng = np.random.default_rng(tokens)
+        audio = (0.1 * rng.standard_normal(samples)).astype(np.float32)
+        return _StubArray(audio.reshape(1, -1))
+
+
+class StubStableDiffusion:
+    def __init__(self, seconds_per_image, resolution=512, encoder_seconds=0.0):
+        self.seconds_per_image = seconds_per_image
+        self.resolution = resolution
+        self.device = "cpu"
+        # CLIP text encoder of Stable Diffusion 1.x
+        self.text_encoder = StubTextEncoder(768, encoder_seconds)
+
+    def encode_prompt(self, prompt, device, num_images_per_prompt, do_classifier_free_guidance, **kwargs):
+        # Prompts are padded to the 77 tokens of CLIP
+        embeddings = self.text_encoder(input_ids=_StubArray(np.zeros((1, 77), dtype=np.int64))).last_hidden_state
+        return embeddings, None
+
+    def __call__(self, prompt=None, height=None, width=None, num_inference_steps=50, **kwargs):
+        from PIL import Image
+
+        time.sleep(self.seconds_per_image * num_inference_steps / 50)
+        rng = np.random.default_rng(len(prompt or ""))
+        pixels = rng.integers(0, 255, (height or self.resolution, width or self.resolution, 3), dtype=np.uint8)
+        return _StubConfig(images=[Image.fromarray(pixels)])
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+# ---------------------------------------------------------------------------------------------
+# Tiny random-weight models (torch + transformers + diffusers)
+# ---------------------------------------------------------------------------------------------
+
+class TinyProcessor:
+    """
+    Tokenizer-free processor producing token IDs in the vocabulary range of the tiny models.
+    """
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+
+    def __call__(self, text=None, *args, **kwargs):
+        import torch
+
+        texts = text if isinstance(text, list) else [text]
+        ids = [_token_ids(item, self.vocab_size) for item in texts]
+        width = max(len(item) for item in ids)
+        input_ids = torch.tensor([item + [0] * (width - len(item)) for item in ids])
+        return {"input_ids": input_ids, "attention_mask": (input_ids > 0).long()}
+
+
+class TinyClipTokenizer:
+    """
+    Duck-typed CLIP tokenizer for the tiny Stable Diffusion pipeline.
+    """
+
+    model_max_length = 77
+    added_tokens_encoder = {}
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+
+    def tokenize(self, text):
+        return text.split()
+
+    def batch_decode(self, ids, **kwargs):
+        return ["" for _ in ids]
+
+    def __call__(self, prompt, padding=None, max_length=None, truncation=False, return_tensors="pt", **kwargs):
+        import torch
+
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        length = max_length or self.model_max_length
+        rows = []
+        for item in prompts:
+            ids = [0] + _token_ids(item, self.vocab_size - 3)[:length - 2] + [2]
+            rows.append(ids + [1] * (length - len(ids)) if padding == "max_length" else ids)
+        if padding != "max_length":
+            width = max(len(row) for row in rows)
+            rows = [row + [1] * (width - len(row)) for row in rows]
+        input_ids = torch.tensor(rows)
+        return _StubConfig(input_ids=input_ids, attention_mask=(input_ids != 1).long())
+
+
+def build_tiny_musicgen():
+    from transformers import (
+        EncodecConfig, MusicgenConfig, MusicgenDecoderConfig, MusicgenForConditionalGeneration, T5Config
+    )
+
+    text_encoder_config = T5Config(vocab_size=32128, d_model=16, d_ff=32, d_kv=8, num_layers=2, num_heads=2)
+    # Same 32 kHz sampling rate and 50 Hz frame rate as facebook/musicgen-small
+    audio_encoder_config = EncodecConfig(
+        sampling_rate=MUSICGEN_SAMPLING_RATE,
+        upsampling_ratios=[8, 5, 4, 4],
+        target_bandwidths=[2.2],
+        codebook_size=2048,
+        hidden_size=16,
+        num_filters=2,
+        num_lstm_layers=1
+    )
+    decoder_config = MusicgenDecoderConfig(
+        vocab_size=2048,
+        hidden_size=16,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        ffn_dim=32,
+        num_codebooks=4,
+        pad_token_id=2048,
+        bos_token_id=2048,
+        decoder_start_token_id=2048
+    )
+    config = MusicgenConfig.from_sub_models_config(text_encoder_config, audio_encoder_config, decoder_config)
+    model = MusicgenForConditionalGeneration(config).eval()
+    model.generation_config.decoder_start_token_id = 2048
+    model.generation_config.pad_token_id = 2048
+    model.generation_config.do_sample = True
+    model.generation_config.guidance_scale = 3.0
+    model.generation_config.max_length = 1500
+    return model
+
+
+def build_tiny_bark(max_semantic_tokens=64):
+    from transformers import (
+        BarkCoarseConfig, BarkConfig, BarkFineConfig, BarkModel, BarkSemanticConfig, EncodecConfig
+    )
+    from transformers.models.bark.generation_configuration_bark import BarkGenerationConfig
+
+    # Real vocabularies and special tokens, shrunken hidden sizes
+    common = {"hidden_size": 16, "num_layers": 2, "num_heads": 2, "block_size": 1024}
+    semantic_config = BarkSemanticConfig(input_vocab_size=129600, output_vocab_size=10048, **common)
+    coarse_config = BarkCoarseConfig(input_vocab_size=12096, output_vocab_size=12096, **common)
+    fine_config = BarkFineConfig(input_vocab_size=1056, output_vocab_size=1056, n_codes_total=8, n_codes_given=1, **common)
+    codec_config = EncodecConfig(hidden_size=16, num_filters=2, num_lstm_layers=1, codebook_size=1024)
+    config = BarkConfig.from_sub_model_configs(semantic_config, coarse_config, fine_config, codec_config)
+    model = BarkModel(config).eval()
+    model.generation_config = BarkGenerationConfig(
+        semantic_config={"max_new_tokens": max_semantic_tokens},
+        coarse_acoustics_config={},
+        fine_acoustics_config={},
+        sample_rate=BARK_SAMPLE_RATE
+    )
+    return model
+
+
+def build_tiny_stable_diffusion():
+    from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, pad_token_id=1, vocab_size=1000, hidden_size=32,
+        intermediate_size=37, num_attention_heads=4, num_hidden_layers=2, layer_norm_eps=1e-05
+    ))
+    return StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=TinyClipTokenizer(vocab_size=1000),
+        unet=unet,
+        scheduler=PNDMScheduler(skip_prk_steps=True),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False
+    )
+
+
+# ---------------------------------------------------------------------------------------------
+# Installation
+# ---------------------------------------------------------------------------------------------
+
+class ModelFactory:
+    """
+    Builds (once) and hands out the stand-in models for the requested flavour.
+    """
+
+    def __init__(self, flavour, stub_latency_scale=1.0):
+        self.flavour = flavour
+        self.stub_latency_scale = stub_latency_scale
+        self._models = {}
+
+    def get(self, name, checkpoint=None):
+        # Stubs of bigger or smaller checkpoints only differ in latency; tiny models are the same for every checkpoint
+        scale = STUB_CHECKPOINT_LATENCY.get(checkpoint, 1.0) if self.flavour == "stub" else 1.0
+        key = (name, scale)
+        if key not in self._models:
+            self._models[key] = getattr(self, f"_build_{self.flavour}_{name}")(self.stub_latency_scale * scale)
+        return self._models[key]
+
+    def _build_stub_musicgen(self, latency_scale):
+        return StubMusicgen(seconds_per_token=0.002 * latency_scale, encoder_seconds=0.02 * latency_scale)
+
+    def _build_stub_bark(self, latency_scale):
+        return StubBark(seconds_per_character=0.002 * latency_scale)
+
+    def _build_stub_stable_diffusion(self, latency_scale):
+        return StubStableDiffusion(seconds_per_image=1.0 * latency_scale, encoder_seconds=0.02 * latency_scale)
+
+    def _build_stub_processor(self, latency_scale):
+        return StubProcessor()
+
+    def _build_tiny_musicgen(self, latency_scale):
+        return build_tiny_musicgen()
+
+    def _build_tiny_bark(self, latency_scale):
+        return build_tiny_bark()
+
+    def _build_tiny_stable_diffusion(self, latency_scale):
+        return build_tiny_stable_diffusion()
+
+    def _build_tiny_processor(self, latency_scale):
+        return TinyProcessor(vocab_size=1000)
+
+
+@contextlib.contextmanager
+def install(flavour, stub_latency_scale=1.0):
+    """
+    Patch the model loaders used by the operators with the stand-ins of the given flavour.
+    """
+    import transformers
+    import diffusers
+
+    factory = ModelFactory(flavour, stub_latency_scale)
+    patches = [
+        mock.patch.object(transformers.AutoProcessor, "from_pretrained",
+                          lambda *args, **kwargs: factory.get("processor")),
+        mock.patch.object(transformers.MusicgenForConditionalGeneration, "from_pretrained",
+                          lambda checkpoint, *args, **kwargs: factory.get("musicgen", checkpoint)),
+        mock.patch.object(transformers.BarkModel, "from_pretrained",
+                          lambda checkpoint, *args, **kwargs: factory.get("bark", checkpoint)),
+        mock.patch.object(diffusers.StableDiffusionPipeline, "from_pretrained",
+                          lambda checkpoint, *args, **kwargs: factory.get("stable_diffusion", checkpoint))
+    ]
+    with contextlib.ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        yield factory
@@ -0,0 +1,362 @@
+"""
+End-to-end offline benchmark of the LyricWave song pipeline.
+
+Songs are submitted through the Song Generation API's `POST /generate_song` (Flask test client) and
+every triggered DAG run is executed in-process by running the five operators in sequence, exactly
+as the DAG chains them. MongoDB is replaced by mongomock, MinIO and Elasticsearch by in-memory fakes
+and the models by tiny random-weight checkpoints (or numpy stubs), so the whole pipeline runs on a
+laptop without network access or GPUs.
+
+Load is generated by replaying the prompts of `music_styles.json` at a configurable rate. The
+report includes per stage and per phase latency, end-to-end latency, throughput and peak RSS, and is
+compared against a baseline so performance changes can be measured. Timings depend on the machine,
+so no baseline is committed: `--update-baseline` stores the run as the local baseline of its
+profile (in `pipeline/baseline.json` unless `--baseline` is given) and later runs on the same
+machine are compared against it:
+
+    python benchmarks/pipeline_benchmark.py --models tiny --songs 20 --rate 0.5
+    python benchmarks/pipeline_benchmark.py --models stub --songs 100 --rate 5 --concurrency 4 --update-baseline
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+from unittest import mock
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT_DIR, "airflow", "dags"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api", "song_generation"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "shared"))
+
+# The API reads its configuration from the environment at import time
+os.environ.setdefault("MONGO_DB", "lyric-wave-db")
+os.environ.setdefault("MONGO_DB_COLLECTION", "lyric-wave-songs")
+os.environ.setdefault("MINIO_BUCKET_NAME", "lyric-wave")
+os.environ.setdefault("ELASTICSEARCH_INDEX", "lyricwave-songs-idx")
+os.environ.setdefault("LYRIC_WAVE_STREAMING_SERVICE_URL", "http://localhost:8088")
+# Every submission comes from the test client and is run by the in-process workers, so admission control stays out of the way
+os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT", "1000000")
+os.environ.setdefault("ADMISSION_CLIENT_MAX_SONGS", "1000000")
+# Songs are generated at the requested --tier however long the backlog gets
+os.environ.setdefault("QUALITY_STANDARD_BACKLOG", "1000000")
+os.environ.setdefault("QUALITY_DRAFT_BACKLOG", "1000000")
+
+from pipeline import fakes, tiny_models  # noqa: E402
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(__file__), "pipeline", "baseline.json")
+
+# Tasks of music_generation_dag, in execution order
+STAGES = [
+    ("generate_voice_task", "operators.generate_voice_operator", "GenerateVoiceOperator"),
+    ("generate_melody_task", "operators.generate_melody_operator", "GenerateMelodyOperator"),
+    ("generate_song_task", "operators.generate_song_operator", "GenerateSongOperator"),
+    ("generate_song_cover_operator", "operators.generate_song_cover_operator", "GenerateSongCoverOperator"),
+    ("index_to_elasticsearch_operator", "operators.index_to_elasticsearch_operator", "IndexToElasticsearchOperator")
+]
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(values)
+    return {
+        "p50": round(statistics.median(ordered), 4),
+        "p95": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 4),
+        "max": round(ordered[-1], 4)
+    }
+
+
+class PipelineBenchmark:
+    """
+    Drives songs from the API through the five operators against in-memory services.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.mongo_client = fakes.new_mongo_client()
+        self.minio = fakes.FakeMinio()
+        self.elasticsearch = fakes.FakeElasticsearch()
+        self.dag_runs = queue.Queue()
+        self.stage_latencies = defaultdict(list)
+        self.end_to_end_latencies = []
+        self.failures = []
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def _patches(self):
+        # The operators import their clients lazily, so patching the client modules covers them as well
+        import pymongo
+        import minio
+        import elasticsearch
+
+        return [
+            mock.patch.object(pymongo, "MongoClient", lambda *args, **kwargs: self.mongo_client),
+            mock.patch.object(minio, "Minio", lambda *args, **kwargs: self.minio),
+            mock.patch.object(elasticsearch, "Elasticsearch", lambda *args, **kwargs: self.elasticsearch)
+        ]
+
+    def _load_api(self):
+        import app as song_generation_api
+
+        def trigger_dag_run(dag_run_conf):
+            self.dag_runs.put((dag_run_conf, time.perf_counter()))
+            return fakes.FakeAirflowResponse(200)
+
+        song_generation_api._trigger_dag_run = trigger_dag_run
+        return song_generation_api
+
+    def _seed_music_styles(self, api):
+        with open(os.path.join(ROOT_DIR, "music_styles.json")) as styles_file:
+            styles = json.load(styles_file)
+        result = api.music_style_collection.insert_many([{"style": style, "style_name": style} for style in styles])
+        return [str(style_id) for style_id in result.inserted_ids], styles
+
+    def _build_operators(self):
+        import importlib
+
+        common = {
+            "mongo_uri": "mongodb://benchmark",
+            "mongo_db": os.environ["MONGO_DB"],
+            "mongo_db_collection": os.environ["MONGO_DB_COLLECTION"],
+            "minio_endpoint": "benchmark:9000",
+            "minio_access_key": "benchmark",
+            "minio_secret_key": "benchmark",
+            "minio_bucket_name": os.environ["MINIO_BUCKET_NAME"]
+        }
+        operators = []
+        for task_id, module_name, class_name in STAGES:
+            operator_class = getattr(importlib.import_module(module_name), class_name)
+            kwargs = dict(common)
+            if class_name == "IndexToElasticsearchOperator":
+                kwargs.update(elasticsearch_host="http://benchmark:9200", elasticsearch_index=os.environ["ELASTICSEARCH_INDEX"])
+            operators.append((task_id, operator_class(task_id=task_id, **kwargs)))
+        return operators
+
+    def _run_dag(self, operators, dag_run_conf, submitted_at):
+        """
+        Run the operators in sequence for one DAG run, like music_generation_dag does.
+        """
+        dag_run = fakes.FakeDagRun(dag_run_conf["conf"], run_id=dag_run_conf["dag_run_id"])
+        task_instance = fakes.FakeTaskInstance(dag_run.dag_id, {})
+        for task_id, operator in operators:
+            context = fakes.build_context(dag_run, task_instance, task_id)
+            started_at = time.perf_counter()
+            operator.pre_execute(context)
+            result = operator.execute(context)
+            operator.post_execute(context, result)
+            task_instance._xcoms[task_id] = result
+            with self._lock:
+                self.stage_latencies[task_id].append(time.perf_counter() - started_at)
+        with self._lock:
+            self.end_to_end_latencies.append(time.perf_counter() - submitted_at)
+            self.completed += 1
+
+    def _worker(self):
+        operators = self._build_operators()
+        while True:
+            item = self.dag_runs.get()
+            if item is None:
+                return
+            dag_run_conf, submitted_at = item
+            try:
+                self._run_dag(operators, dag_run_conf, submitted_at)
+            except Exception as e:
+                with self._lock:
+                    self.failures.append({"song_id": dag_run_conf["conf"].get("song_id"), "error": repr(e)})
+
+    def _phase_latencies(self, api):
+        """
+        Aggregate the phase timings the operators persisted in the song documents.
+        """
+        phases = defaultdict(list)
+        for song in api.songs_collection.find({}, {"stage_metrics": 1}):
+            for task_id, stage_metrics in (song.get("stage_metrics") or {}).items():
+                per_phase = defaultdict(float)
+                for span in stage_metrics.get("spans", []):
+                    per_phase[span["phase"]] += span["duration_seconds"]
+                for phase, duration in per_phase.items():
+                    phases[f"{task_id}.{phase}"].append(duration)
+        return {name: _percentiles(values) for name, values in sorted(phases.items())}
+
+    def run(self):
+        args = self.args
+        # Scripts reusing the harness with their own arguments get the standard tier
+        tier = getattr(args, "tier", "standard")
+        random.seed(args.seed)
+        with ExitStack() as stack:
+            for patch in self._patches():
+                stack.enter_context(patch)
+            stack.enter_context(tiny_models.install(args.models, args.stub_latency_scale))
+
+            api = self._load_api()
+            style_ids, prompts = self._seed_music_styles(api)
+            client = api.app.test_client()
+
+            workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(args.concurrency)]
+            for worker in workers:
+                worker.start()
+
+            started_at = time.perf_counter()
+            rejected = 0
+            for index in range(args.songs):
+                # Replay the style prompts at the configured rate
+                next_submission = started_at + index / args.rate
+                time.sleep(max(0.0, next_submission - time.perf_counter()))
+                response = client.post('/generate_song', json={
+                    "title": f"benchmark {index} {uuid.uuid4().hex[:8]}",
+                    "text": random.choice(prompts)[:200],
+                    "description": "offline pipeline benchmark",
+                    "keywords": ["benchmark"],
+                    "music_style_id": random.choice(style_ids),
+                    "quality_tier": tier
+                })
+                if response.status_code != 200:
+                    rejected += 1
+
+            for _ in workers:
+                self.dag_runs.put(None)
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started_at
+
+            return {
+                # Baselines of the other tiers are kept apart from the standard one
+                "profile": args.models if tier == "standard" else f"{args.models}-{tier}",
+                "config": {
+                    "songs": args.songs,
+                    "rate": args.rate,
+                    "concurrency": args.concurrency,
+                    "tier": tier,
+                    "seed": args.seed
+                },
+                "completed": self.completed,
+                "rejected": rejected,
+                "failures": self.failures,
+                "elapsed_seconds": round(elapsed, 3),
+                "throughput_songs_per_second": round(self.completed / elapsed, 4) if elapsed else None,
+                "end_to_end_seconds": _percentiles(self.end_to_end_latencies),
+                "stage_seconds": {task_id: _percentiles(self.stage_latencies[task_id]) for task_id, _, _ in STAGES},
+                "phase_seconds": self._phase_latencies(api),
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "object_store": {
+                    "objects": self.minio.object_count(),
+                    "stored_megabytes": round(self.minio.stored_bytes() / (1024 * 1024), 3),
+                    "uploaded_megabytes": round(self.minio.bytes_uploaded / (1024 * 1024), 3),
+                    "downloaded_megabytes": round(self.minio.bytes_downloaded / (1024 * 1024), 3)
+                }
+            }
+
+
+def _comparable_metrics(report):
+    """
+    Flatten the metrics compared against the baseline, with the direction in which they get worse.
+    """
+    metrics = {
+        "throughput_songs_per_second": (report["throughput_songs_per_second"], "lower"),
+        "peak_rss_mb": (report["peak_rss_mb"], "higher"),
+        "end_to_end_seconds.p50": (report["end_to_end_seconds"]["p50"], "higher"),
+        "end_to_end_seconds.p95": (report["end_to_end_seconds"]["p95"], "higher")
+    }
+    for task_id, latencies in report["stage_seconds"].items():
+        metrics[f"stage_seconds.{task_id}.p50"] = (latencies["p50"], "higher")
+    return metrics
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Return the metrics that regressed by more than `tolerance` (a fraction) against the baseline.
+    """
+    regressions = []
+    current = _comparable_metrics(report)
+    for name, (baseline_value, worse) in _comparable_metrics(baseline).items():
+        value = current.get(name, (None, worse))[0]
+        if value is None or not baseline_value:
+            continue
+        change = (value - baseline_value) / baseline_value
+        if (worse == "higher" and change > tolerance) or (worse == "lower" and -change > tolerance):
+            regressions.append({"metric": name, "baseline": baseline_value, "current": value, "change": round(change, 3)})
+    return regressions
+
+
+def _print_report(report):
+    print(f"profile: {report['profile']}  songs: {report['completed']}/{report['config']['songs']}  "
+          f"failures: {len(report['failures'])}  elapsed: {report['elapsed_seconds']}s")
+    print(f"throughput: {report['throughput_songs_per_second']} songs/s  peak RSS: {report['peak_rss_mb']} MB")
+    print(f"end-to-end: {report['end_to_end_seconds']}")
+    print()
+    print(f"{'stage / phase':<58}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+    for task_id, latencies in report["stage_seconds"].items():
+        print(f"{task_id:<58}{latencies['p50'] or 0:>10.3f}{latencies['p95'] or 0:>10.3f}{latencies['max'] or 0:>10.3f}")
+        for phase, phase_latencies in report["phase_seconds"].items():
+            if phase.startswith(f"{task_id}."):
+                name = "  " + phase[len(task_id) + 1:]
+                print(f"{name:<58}{phase_latencies['p50']:>10.3f}{phase_latencies['p95']:>10.3f}{phase_latencies['max']:>10.3f}")
+    for failure in report["failures"][:5]:
+        print(f"failure: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the song pipeline.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="tiny",
+                        help="Random-weight tiny models or numpy stubs")
+    parser.add_argument("--songs", type=int, default=10, help="Songs submitted through /generate_song")
+    parser.add_argument("--rate", type=float, default=1.0, help="Submissions per second")
+    parser.add_argument("--concurrency", type=int, default=1, help="DAG runs executed in parallel")
+    parser.add_argument("--stub-latency-scale", type=float, default=1.0,
+                        help="Multiplier of the simulated inference time of the stub models")
+    parser.add_argument("--tier", choices=["draft", "standard", "high"], default="standard",
+                        help="Quality tier requested for every song")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="Baseline file, one entry per profile")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the profile's baseline")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = PipelineBenchmark(args).run()
+    _print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2, default=str)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    exit_code = 0
+    if args.update_baseline:
+        baselines[report["profile"]] = report
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, default=str)
+        print(f"\nBaseline for profile '{report['profile']}' updated in {args.baseline}")
+    elif report["profile"] in baselines:
+        regressions = compare_with_baseline(report, baselines[report["profile"]], args.tolerance)
+        print()
+        if regressions:
+            print(f"Regressions above {args.tolerance:.0%} against the baseline:")
+            for regression in regressions:
+                print(f"  {regression['metric']}: {regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})")
+            exit_code = 1
+        else:
+            print(f"No regression above {args.tolerance:.0%} against the baseline.")
+    else:
+        print(f"\nNo baseline stored for profile '{report['profile']}'; run with --update-baseline to create one.")
+
+    if report["failures"]:
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
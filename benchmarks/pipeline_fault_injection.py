@@ -0,0 +1,238 @@
+"""
+Fault injection for the checkpoint/resume behaviour of the pipeline operators.
+
+Runs songs through the offline pipeline of `pipeline_benchmark.py` (mongomock, in-memory MinIO and
+Elasticsearch, stub or tiny models) and, for every timed phase of every stage, makes one song fail
+when the phase starts or right after it ends. The failed task is retried once, as Airflow does with
+`retries: 1`, and the run continues. A scenario passes when:
+
+- the song still reaches `song_indexed`;
+- no temporary upload object is left behind;
+- every artifact recorded in the song document matches the object in MinIO;
+- the retry skips the model inference when the stage's artifacts were stored before the failure.
+
+    python benchmarks/pipeline_fault_injection.py --models stub
+    python benchmarks/pipeline_fault_injection.py --models tiny --stages generate_song_cover_operator --when exit
+"""
+import argparse
+import os
+import random
+import sys
+import uuid
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+from bson import ObjectId
+
+from pipeline_benchmark import PipelineBenchmark
+from pipeline import fakes, tiny_models
+
+
+class InjectedFault(Exception):
+    pass
+
+
+class FaultInjector:
+    """
+    Wraps BaseCustomOperator._timed to record the phases entered and fail one of them once.
+    """
+
+    def __init__(self):
+        self.target = None
+        self.fired = False
+        self.current = None
+        self.entered = []
+
+    def arm(self, stage, phase, when, occurrence):
+        self.target = (stage, phase, when, occurrence)
+        self.fired = False
+        self.entered = []
+
+    def start_try(self, stage, try_number):
+        self.current = (stage, try_number)
+
+    def _occurrences(self, stage, phase):
+        return sum(1 for entry in self.entered if entry == (stage, 1, phase))
+
+    def _maybe_fail(self, stage, phase, when):
+        if self.fired or self.target is None or self.current[1] != 1:
+            return
+        target_stage, target_phase, target_when, occurrence = self.target
+        if (stage, phase, when) == (target_stage, target_phase, target_when) and self._occurrences(stage, phase) == occurrence:
+            self.fired = True
+            raise InjectedFault(f"injected at {when} of {stage}.{phase}")
+
+    @contextmanager
+    def wrap(self, operator, phase, inner):
+        stage = operator.stage_name
+        self.entered.append((stage, self.current[1], phase))
+        self._maybe_fail(stage, phase, "enter")
+        with inner:
+            yield
+        self._maybe_fail(stage, phase, "exit")
+
+
+class FaultInjectionHarness(PipelineBenchmark):
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.injector = FaultInjector()
+
+    def _patches(self):
+        from operators.base_custom_operator import BaseCustomOperator
+
+        original_timed = BaseCustomOperator._timed
+        injector = self.injector
+
+        def timed(operator, phase, *args, **kwargs):
+            return injector.wrap(operator, phase, original_timed(operator, phase, *args, **kwargs))
+
+        return super()._patches() + [mock.patch.object(BaseCustomOperator, "_timed", timed)]
+
+    def _submit_song(self, client, style_ids, prompts):
+        response = client.post('/generate_song', json={
+            "title": f"fault injection {uuid.uuid4().hex[:8]}",
+            "text": random.choice(prompts)[:200],
+            "music_style_id": random.choice(style_ids)
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"Song submission failed: {response.get_json()}")
+        dag_run_conf, _ = self.dag_runs.get()
+        return dag_run_conf
+
+    def _run_with_retry(self, api, operators, dag_run_conf):
+        """
+        Run the operators of one DAG run, retrying a failed task once.
+        """
+        dag_run = fakes.FakeDagRun(dag_run_conf["conf"], run_id=dag_run_conf["dag_run_id"])
+        song_id = dag_run_conf["conf"]["song_id"]
+        task_instance = fakes.FakeTaskInstance(dag_run.dag_id, {})
+        outcome = {"failed_stage": None, "outputs_stored_before_failure": False, "error": None}
+        for task_id, operator in operators:
+            for try_number in (1, 2):
+                task_instance.try_number = try_number
+                context = fakes.build_context(dag_run, task_instance, task_id)
+                self.injector.start_try(task_id, try_number)
+                try:
+                    operator.pre_execute(context)
+                    result = operator.execute(context)
+                    operator.post_execute(context, result)
+                    break
+                except Exception as e:
+                    if try_number == 2:
+                        outcome["error"] = repr(e)
+                        return outcome
+                    artifacts = api.songs_collection.find_one({"_id": ObjectId(song_id)}).get("artifacts") or {}
+                    outcome["failed_stage"] = task_id
+                    outcome["outputs_stored_before_failure"] = bool(operator.output_artifacts) and all(
+                        artifact in artifacts for artifact in operator.output_artifacts
+                    )
+            task_instance._xcoms[task_id] = result
+        return outcome
+
+    def _check_song(self, api, song_id):
+        song_info = api.songs_collection.find_one({"_id": ObjectId(song_id)})
+        bucket = os.environ["MINIO_BUCKET_NAME"]
+        temp_objects = [
+            stat.object_name for stat in self.minio.list_objects(bucket, prefix=song_id)
+            if ".tmp-" in stat.object_name
+        ]
+        invalid_artifacts = []
+        for artifact, record in (song_info.get("artifacts") or {}).items():
+            try:
+                stat = self.minio.stat_object(bucket, record["object_name"])
+            except fakes.FakeNoSuchKey:
+                invalid_artifacts.append(artifact)
+                continue
+            if stat.size != record["size_bytes"] or stat.metadata.get("x-amz-meta-sha256") != record["sha256"]:
+                invalid_artifacts.append(artifact)
+        return song_info.get("song_status"), temp_objects, invalid_artifacts
+
+    def _discover_phases(self, api, client, operators, style_ids, prompts):
+        self.injector.arm(None, None, None, None)
+        outcome = self._run_with_retry(api, operators, self._submit_song(client, style_ids, prompts))
+        if outcome["error"]:
+            raise RuntimeError(f"The pipeline fails without injected faults: {outcome['error']}")
+        counts = {}
+        for stage, _, phase in self.injector.entered:
+            counts[(stage, phase)] = counts.get((stage, phase), 0) + 1
+        return counts
+
+    def run(self):
+        args = self.args
+        random.seed(args.seed)
+        results = []
+        with ExitStack() as stack:
+            for patch in self._patches():
+                stack.enter_context(patch)
+            stack.enter_context(tiny_models.install(args.models, args.stub_latency_scale))
+
+            api = self._load_api()
+            style_ids, prompts = self._seed_music_styles(api)
+            client = api.app.test_client()
+            operators = self._build_operators()
+
+            phases = self._discover_phases(api, client, operators, style_ids, prompts)
+            for (stage, phase), count in phases.items():
+                if args.stages and stage not in args.stages:
+                    continue
+                occurrences = sorted({1, count}) if args.occurrences == "first,last" else [1 if args.occurrences == "first" else count]
+                for occurrence in occurrences:
+                    for when in args.when:
+                        self.injector.arm(stage, phase, when, occurrence)
+                        dag_run_conf = self._submit_song(client, style_ids, prompts)
+                        song_id = dag_run_conf["conf"]["song_id"]
+                        outcome = self._run_with_retry(api, operators, dag_run_conf)
+                        inference_rerun = any(
+                            entry == (stage, 2, "inference") for entry in self.injector.entered
+                        )
+                        song_status, temp_objects, invalid_artifacts = self._check_song(api, song_id)
+                        if not self.injector.fired:
+                            verdict = "not reached"
+                        elif outcome["failed_stage"] is None:
+                            verdict = "absorbed"
+                        else:
+                            verdict = "retried"
+                        passed = (
+                            outcome["error"] is None and song_status == "song_indexed" and not temp_objects
+                            and not invalid_artifacts
+                            and not (outcome["outputs_stored_before_failure"] and inference_rerun)
+                        )
+                        results.append({
+                            "fault": f"{stage}.{phase}#{occurrence} {when}",
+                            "verdict": verdict,
+                            "inference_rerun": inference_rerun,
+                            "outputs_reused": outcome["outputs_stored_before_failure"],
+                            "temp_objects": len(temp_objects),
+                            "invalid_artifacts": invalid_artifacts,
+                            "error": outcome["error"],
+                            "passed": passed
+                        })
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault injection for the checkpoint/resume behaviour of the pipeline.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="stub")
+    parser.add_argument("--stages", nargs="*", help="Only inject faults in these tasks")
+    parser.add_argument("--when", nargs="*", choices=["enter", "exit"], default=["enter", "exit"])
+    parser.add_argument("--occurrences", choices=["first", "last", "first,last"], default="first,last",
+                        help="Which occurrence of a repeated phase (e.g. several uploads) fails")
+    parser.add_argument("--stub-latency-scale", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = FaultInjectionHarness(args).run()
+    print(f"{'fault':<58}{'verdict':<13}{'reused':>8}{'rerun':>7}{'temp':>6}  result")
+    for result in results:
+        status = "PASS" if result["passed"] else f"FAIL {result['invalid_artifacts'] or ''} {result['error'] or ''}"
+        print(f"{result['fault']:<58}{result['verdict']:<13}{str(result['outputs_reused']):>8}"
+              f"{str(result['inference_rerun']):>7}{result['temp_objects']:>6}  {status}")
+    failed = [result for result in results if not result["passed"]]
+    print(f"\n{len(results) - len(failed)}/{len(results)} scenarios passed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
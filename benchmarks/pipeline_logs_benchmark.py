@@ -0,0 +1,170 @@
+"""
+Write and query cost of the pipeline log, legacy `dags_execution_logs` versus the time-series collection.
+
+Loads `--rows` log messages (10M by default, `--messages-per-song` per song, spread over the stages
+like the operators log them) into a running MongoDB in both layouts:
+
+- `legacy`: the previous documents, a string timestamp and a free-text task instance ID, with the
+  song only mentioned in some messages, so the log of a song is found with a regex scan;
+- `timeseries`: the measurements of `operators/pipeline_logs.py`, bucketed by song and stage, read
+  with one query on the `(meta.song_id, timestamp)` index.
+
+and reports the bulk load rate, the latency of the single inserts the operators make, the storage
+and index size, and the latency of reading the whole log of random songs:
+
+    python benchmarks/pipeline_logs_benchmark.py --mongo-uri mongodb://localhost:27017 --rows 10000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "airflow", "dags"))
+
+from operators import pipeline_logs  # noqa: E402
+
+LAYOUTS = ["legacy", "timeseries"]
+STAGES = [
+    "generate_voice_task", "generate_melody_task", "generate_song_task",
+    "generate_song_cover_operator", "package_hls_task", "index_to_elasticsearch_operator"
+]
+MESSAGES = [
+    "Starting execution of {operator}",
+    "Retrieved song information for song ID: {song_id}",
+    "Uploaded {operator} artifact to MinIO",
+    "Updated MongoDB document with ID: {song_id}",
+    "Log message registered for stage {stage}"
+]
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * percentile) - 1)] if ordered else 0.0
+
+
+def _song_id(index):
+    return ObjectId(f"{index + 1:024x}")
+
+
+def _messages(first_row, rows, args, started_at):
+    """
+    The log messages of rows [first_row, first_row + rows), as (song ID, stage, timestamp, level, message).
+    """
+    for row in range(first_row, first_row + rows):
+        song_index, position = divmod(row, args.messages_per_song)
+        song_id = _song_id(song_index)
+        stage = STAGES[position * len(STAGES) // args.messages_per_song]
+        message = MESSAGES[position % len(MESSAGES)].format(operator=stage, song_id=song_id, stage=stage)
+        timestamp = started_at + timedelta(seconds=song_index * 2 + position * 5)
+        yield song_id, stage, timestamp, "ERROR" if position % 97 == 0 else "INFO", message
+
+
+def _document(layout, song_id, stage, timestamp, level, message):
+    if layout == "legacy":
+        return {
+            "task_instance_id": f"music_generation_dag.song.{stage}",
+            "log_level": level,
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "log_message": message
+        }
+    return pipeline_logs.log_document(song_id, stage, level, message, run_id="benchmark", try_number=1, timestamp=timestamp)
+
+
+def _create(db, layout):
+    if layout == "legacy":
+        db.drop_collection(pipeline_logs.LEGACY_LOGS_COLLECTION)
+        return db[pipeline_logs.LEGACY_LOGS_COLLECTION]
+    db.drop_collection(pipeline_logs.PIPELINE_LOGS_COLLECTION)
+    pipeline_logs._ensured_databases.discard(db.name)
+    return pipeline_logs.ensure_collection(db)
+
+
+def _storage_mb(db, collection):
+    stats = db.command("collStats", collection.name)
+    return stats.get("storageSize", 0) / 1e6, stats.get("totalIndexSize", 0) / 1e6
+
+
+def _find_song_logs(layout, collection, song_id):
+    if layout == "legacy":
+        return list(collection.find({"log_message": {"$regex": str(song_id)}}))
+    return list(collection.find({"meta.song_id": song_id}).sort([("timestamp", 1)]))
+
+
+def _run_layout(db, layout, args):
+    collection = _create(db, layout)
+    started_at = datetime.utcnow() - timedelta(days=1)
+
+    load_started = time.perf_counter()
+    for first_row in range(0, args.rows, args.batch):
+        rows = min(args.batch, args.rows - first_row)
+        collection.insert_many(
+            [_document(layout, *message) for message in _messages(first_row, rows, args, started_at)], ordered=False
+        )
+    load_seconds = time.perf_counter() - load_started
+
+    # One insert per message, as the operators log
+    insert_latencies = []
+    for message in _messages(args.rows, args.single_inserts, args, started_at):
+        start = time.perf_counter()
+        collection.insert_one(_document(layout, *message))
+        insert_latencies.append(time.perf_counter() - start)
+
+    storage_mb, index_mb = _storage_mb(db, collection)
+
+    rng = random.Random(args.seed)
+    songs = args.rows // args.messages_per_song
+    query_latencies = []
+    returned = []
+    for _ in range(args.legacy_queries if layout == "legacy" else args.queries):
+        song_id = _song_id(rng.randrange(songs))
+        start = time.perf_counter()
+        returned.append(len(_find_song_logs(layout, collection, song_id)))
+        query_latencies.append(time.perf_counter() - start)
+
+    return {
+        "layout": layout,
+        "load_rows_per_second": args.rows / load_seconds if load_seconds else 0.0,
+        "insert_p50_ms": _percentile(insert_latencies, 0.5) * 1000,
+        "storage_mb": storage_mb,
+        "index_mb": index_mb,
+        "query_p50_ms": _percentile(query_latencies, 0.5) * 1000,
+        "query_p95_ms": _percentile(query_latencies, 0.95) * 1000,
+        "messages_per_query": sum(returned) / len(returned) if returned else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write and query cost of the pipeline log layouts.")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="lyricwave_logs_benchmark")
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--messages-per-song", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--single-inserts", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-queries", type=int, default=5, help="Queries of the legacy layout, which scan the collection")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)[args.db]
+    print(f"{args.rows} log messages, {args.messages_per_song} per song")
+    print(f"{'layout':<12}{'load rows/s':>13}{'insert ms':>11}{'storage MB':>12}{'index MB':>10}"
+          f"{'query p50 ms':>14}{'query p95 ms':>14}{'rows/query':>12}")
+    try:
+        for layout in args.layouts:
+            result = _run_layout(db, layout, args)
+            print(f"{result['layout']:<12}{result['load_rows_per_second']:>13.0f}{result['insert_p50_ms']:>11.2f}"
+                  f"{result['storage_mb']:>12.1f}{result['index_mb']:>10.1f}{result['query_p50_ms']:>14.2f}"
+                  f"{result['query_p95_ms']:>14.2f}{result['messages_per_query']:>12.1f}")
+    finally:
+        db.client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Throughput of the offline pipeline at each quality tier (draft, standard, high).
+
+Runs the same songs through the offline pipeline of `pipeline_benchmark.py` once per tier, with
+the tier requested for every song, and reports the songs per second, the end-to-end latency and
+the inference time of the model stages. With `--models stub` the stand-in of every checkpoint of
+`airflow/dags/config/quality_tiers.json` runs for a latency relative to its size
+(`tiny_models.STUB_CHECKPOINT_LATENCY`), while the diffusion steps, cover resolution and MusicGen
+token budget of each tier are applied as in production:
+
+    python benchmarks/quality_tier_benchmark.py --models stub --songs 20 --concurrency 2
+    python benchmarks/quality_tier_benchmark.py --models tiny --songs 5
+"""
+import argparse
+import os
+import statistics
+
+from pipeline_benchmark import PipelineBenchmark
+
+TIERS = ["draft", "standard", "high"]
+STAGES = {
+    "voice": "generate_voice_task",
+    "melody": "generate_melody_task",
+    "cover": "generate_song_cover_operator"
+}
+
+
+def _phase_seconds(song_info, stage, phase):
+    spans = ((song_info.get("stage_metrics") or {}).get(stage) or {}).get("spans", [])
+    return sum(span["duration_seconds"] for span in spans if span["phase"] == phase)
+
+
+def _run_tier(args, tier):
+    tier_args = argparse.Namespace(**vars(args), tier=tier)
+    benchmark = PipelineBenchmark(tier_args)
+    report = benchmark.run()
+    songs = list(benchmark.mongo_client[os.environ["MONGO_DB"]][os.environ["MONGO_DB_COLLECTION"]].find(
+        {"song_status": "song_indexed"}
+    ))
+    return {
+        "tier": tier,
+        "songs": len(songs),
+        "failures": len(report["failures"]),
+        "throughput_songs_per_second": report["throughput_songs_per_second"] or 0.0,
+        "end_to_end_p50_seconds": report["end_to_end_seconds"]["p50"],
+        "inference_seconds": {
+            name: statistics.mean(_phase_seconds(song, stage, "inference") for song in songs) if songs else 0.0
+            for name, stage in STAGES.items()
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline throughput per quality tier.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="stub")
+    parser.add_argument("--songs", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100.0, help="Submissions per second")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stub-latency-scale", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = [_run_tier(args, tier) for tier in TIERS]
+    print(f"{args.songs} songs, {args.models} models, concurrency {args.concurrency}")
+    print(f"{'tier':<10}{'songs/s':>9}{'vs std':>8}{'p50 s':>8}{'voice s':>9}{'melody s':>10}{'cover s':>9}{'failures':>10}")
+    standard = next(result for result in results if result["tier"] == "standard")["throughput_songs_per_second"]
+    for result in results:
+        seconds = result["inference_seconds"]
+        ratio = result["throughput_songs_per_second"] / standard if standard else 0.0
+        print(f"{result['tier']:<10}{result['throughput_songs_per_second']:>9.3f}{ratio:>7.2f}x"
+              f"{result['end_to_end_p50_seconds']:>8.2f}{seconds['voice']:>9.3f}{seconds['melody']:>10.3f}"
+              f"{seconds['cover']:>9.3f}{result['failures']:>10}")
+
+
+if __name__ == "__main__":
+    main()
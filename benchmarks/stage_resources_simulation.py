@@ -0,0 +1,274 @@
+"""
+Throughput of the generation pipeline under mixed load, with and without stage resource classes.
+
+A discrete-time simulation of the two Celery workers of the compose file running the stages of
+`airflow/dags/config/stage_resources.json` (durations, memory and CPU weights are taken from it):
+
+- `shared`: the previous setup. Every worker consumes every task, there are no pools and the
+  default `downstream` weight rule favours starting new songs.
+- `resource-aware`: tasks are routed to the queue, pool slots, priority weights and concurrency
+  limits derived from the configuration.
+
+A worker running tasks that need more memory than it has swaps (all its tasks slow down) and, past
+`--oom-ratio`, the kernel kills its most recent task, which is retried from scratch after the
+retry delay. Songs arrive as a burst (a bulk submission) followed by a Poisson stream, a fraction of
+them with HLS packaging:
+
+    python benchmarks/stage_resources_simulation.py --burst 20 --songs 40 --arrival-per-minute 1 --hls-fraction 0.5
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "airflow", "dags")))
+
+from operators.stage_resources import load_stage_resources, stage_task_kwargs  # noqa: E402
+
+# Stages of one song and their upstream stages; the HLS packaging is optional
+STAGE_UPSTREAMS = {
+    "generate_voice_task": [],
+    "generate_melody_task": ["generate_voice_task"],
+    "generate_song_task": ["generate_melody_task"],
+    "package_hls_task": ["generate_song_task"],
+    "generate_song_cover_operator": ["generate_song_task"],
+    "index_to_elasticsearch_operator": ["generate_song_cover_operator", "package_hls_task"]
+}
+
+# Worker concurrency from airflow.cfg
+WORKER_CONCURRENCY = 16
+# Slots of the default_pool from airflow.cfg
+DEFAULT_POOL_SLOTS = 128
+
+
+class Worker:
+
+    def __init__(self, name, queues, memory_gb, cpus):
+        self.name = name
+        self.queues = queues
+        self.memory_gb = memory_gb
+        self.cpus = cpus
+        self.running = []
+        self.swap_seconds = 0.0
+
+
+class TaskInstance:
+
+    def __init__(self, song, stage_name, stage, task_kwargs, duration):
+        self.song = song
+        self.stage_name = stage_name
+        self.stage = stage
+        self.task_kwargs = task_kwargs
+        self.duration = duration
+        self.remaining = duration
+        self.priority = None
+        self.ready_at = None
+        self.started_at = None
+
+
+def _stage_graph(hls):
+    upstreams = {
+        stage_name: [upstream for upstream in stage_upstreams if hls or upstream != "package_hls_task"]
+        for stage_name, stage_upstreams in STAGE_UPSTREAMS.items()
+        if hls or stage_name != "package_hls_task"
+    }
+    downstreams = {stage_name: [] for stage_name in upstreams}
+    for stage_name, stage_upstreams in upstreams.items():
+        for upstream in stage_upstreams:
+            downstreams[upstream].append(stage_name)
+    return upstreams, downstreams
+
+
+def _relatives(stage_name, edges):
+    seen = set()
+    pending = list(edges[stage_name])
+    while pending:
+        relative = pending.pop()
+        if relative not in seen:
+            seen.add(relative)
+            pending.extend(edges[relative])
+    return seen
+
+
+def _priority(stage_name, task_kwargs, weights, upstreams, downstreams):
+    """
+    Effective priority of a task instance, as computed by Airflow for each weight rule.
+    """
+    weight_rule = task_kwargs["weight_rule"]
+    if weight_rule == "absolute":
+        return weights[stage_name]
+    relatives = _relatives(stage_name, upstreams if weight_rule == "upstream" else downstreams)
+    return weights[stage_name] + sum(weights[relative] for relative in relatives)
+
+
+def _task_kwargs(config, stage_name, mode):
+    if mode == "resource-aware":
+        return stage_task_kwargs(stage_name, config)
+    return {"queue": "default", "pool": "default_pool", "pool_slots": 1, "priority_weight": 1, "weight_rule": "downstream"}
+
+
+class Simulation:
+
+    def __init__(self, config, mode, args, seed):
+        self.config = config
+        self.mode = mode
+        self.args = args
+        self.random = random.Random(seed)
+        self.workers = [
+            Worker("worker-1", {"models"} if mode == "resource-aware" else {"models", "default"}, args.model_worker_memory_gb, args.model_worker_cpus),
+            Worker("worker-2", {"default"}, args.default_worker_memory_gb, args.default_worker_cpus)
+        ]
+        self.pool_slots = {"default_pool": DEFAULT_POOL_SLOTS}
+        if mode == "resource-aware":
+            self.pool_slots.update({name: pool["slots"] for name, pool in config["pools"].items()})
+        self.pool_used = {name: 0 for name in self.pool_slots}
+        self.queued = []
+        self.songs = []
+        self.oom_kills = 0
+
+    def add_song(self, arrived_at, hls):
+        upstreams, downstreams = _stage_graph(hls)
+        kwargs = {stage_name: _task_kwargs(self.config, stage_name, self.mode) for stage_name in upstreams}
+        weights = {stage_name: kwargs[stage_name]["priority_weight"] for stage_name in upstreams}
+        song = {"arrived_at": arrived_at, "finished_at": None, "upstreams": upstreams, "done": set(), "tasks": {}}
+        for stage_name in upstreams:
+            stage = self.config["stages"][stage_name]
+            # Stage durations vary between songs
+            duration = stage["expected_seconds"] * self.random.lognormvariate(0, self.args.duration_jitter)
+            task = TaskInstance(song, stage_name, stage, kwargs[stage_name], duration)
+            task.priority = _priority(stage_name, kwargs[stage_name], weights, upstreams, downstreams)
+            song["tasks"][stage_name] = task
+        self.songs.append(song)
+        self._enqueue_ready(song, arrived_at)
+
+    def _enqueue_ready(self, song, now):
+        for stage_name, task in song["tasks"].items():
+            if task.ready_at is None and all(upstream in song["done"] for upstream in song["upstreams"][stage_name]):
+                task.ready_at = now
+                self.queued.append(task)
+
+    def _active(self, stage_name):
+        return sum(1 for worker in self.workers for task in worker.running if task.stage_name == stage_name)
+
+    def schedule(self, now):
+        self.queued.sort(key=lambda task: (-task.priority, task.ready_at))
+        for task in list(self.queued):
+            if task.ready_at > now:
+                continue
+            kwargs = task.task_kwargs
+            limit = kwargs.get("max_active_tis_per_dag")
+            if limit and self._active(task.stage_name) >= limit:
+                continue
+            if self.pool_used[kwargs["pool"]] + kwargs["pool_slots"] > self.pool_slots[kwargs["pool"]]:
+                continue
+            candidates = [
+                worker for worker in self.workers
+                if kwargs["queue"] in worker.queues and len(worker.running) < WORKER_CONCURRENCY
+            ]
+            if not candidates:
+                continue
+            worker = min(candidates, key=lambda candidate: len(candidate.running))
+            self.queued.remove(task)
+            self.pool_used[kwargs["pool"]] += kwargs["pool_slots"]
+            task.started_at = now
+            worker.running.append(task)
+
+    def _release(self, worker, task):
+        worker.running.remove(task)
+        self.pool_used[task.task_kwargs["pool"]] -= task.task_kwargs["pool_slots"]
+
+    def step(self, now, dt):
+        for worker in self.workers:
+            if not worker.running:
+                continue
+            memory = sum(task.stage["memory_gb"] for task in worker.running)
+            if memory > worker.memory_gb * self.args.oom_ratio:
+                # The kernel kills the most recent task; its retry starts from scratch after the retry delay
+                victim = max(worker.running, key=lambda task: task.started_at)
+                self._release(worker, victim)
+                victim.remaining = victim.duration
+                victim.started_at = None
+                victim.ready_at = now + self.args.retry_delay
+                self.queued.append(victim)
+                self.oom_kills += 1
+                memory -= victim.stage["memory_gb"]
+            cpu_demand = sum(task.stage["cpu"] for task in worker.running)
+            rate = min(1.0, worker.cpus / cpu_demand) if cpu_demand else 1.0
+            if memory > worker.memory_gb:
+                worker.swap_seconds += dt
+                rate /= self.args.swap_penalty * memory / worker.memory_gb
+            for task in list(worker.running):
+                task.remaining -= dt * rate
+                if task.remaining <= 0:
+                    self._release(worker, task)
+                    song = task.song
+                    song["done"].add(task.stage_name)
+                    if len(song["done"]) == len(song["tasks"]):
+                        song["finished_at"] = now + dt
+                    else:
+                        self._enqueue_ready(song, now + dt)
+
+
+def _run(config, mode, args):
+    arrivals_random = random.Random(args.seed)
+    arrivals = [0.0] * args.burst
+    arrived_at = 0.0
+    for _ in range(args.songs):
+        arrived_at += arrivals_random.expovariate(args.arrival_per_minute / 60)
+        arrivals.append(arrived_at)
+    hls_flags = [arrivals_random.random() < args.hls_fraction for _ in arrivals]
+
+    simulation = Simulation(config, mode, args, args.seed)
+    pending = list(zip(arrivals, hls_flags))
+    now = 0.0
+    while pending or any(song["finished_at"] is None for song in simulation.songs):
+        while pending and pending[0][0] <= now:
+            simulation.add_song(*pending.pop(0))
+        simulation.schedule(now)
+        simulation.step(now, args.dt)
+        now += args.dt
+
+    latencies = sorted(song["finished_at"] - song["arrived_at"] for song in simulation.songs)
+    makespan = max(song["finished_at"] for song in simulation.songs)
+    return {
+        "mode": mode,
+        "songs_per_hour": len(latencies) / makespan * 3600,
+        "latency_p50_min": statistics.median(latencies) / 60,
+        "latency_p95_min": latencies[int(0.95 * (len(latencies) - 1))] / 60,
+        "makespan_min": makespan / 60,
+        "oom_kills": simulation.oom_kills,
+        "swap_min": sum(worker.swap_seconds for worker in simulation.workers) / 60
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated pipeline throughput with and without stage resource classes.")
+    parser.add_argument("--burst", type=int, default=20, help="Songs submitted at once at the start")
+    parser.add_argument("--songs", type=int, default=40, help="Songs arriving afterwards")
+    parser.add_argument("--arrival-per-minute", type=float, default=1.0)
+    parser.add_argument("--hls-fraction", type=float, default=0.5, help="Fraction of the songs packaged as HLS")
+    parser.add_argument("--duration-jitter", type=float, default=0.3, help="Sigma of the lognormal stage duration noise")
+    parser.add_argument("--model-worker-memory-gb", type=float, default=16)
+    parser.add_argument("--model-worker-cpus", type=float, default=8)
+    parser.add_argument("--default-worker-memory-gb", type=float, default=8)
+    parser.add_argument("--default-worker-cpus", type=float, default=8)
+    parser.add_argument("--swap-penalty", type=float, default=4.0, help="Slowdown of a worker whose tasks exceed its memory")
+    parser.add_argument("--oom-ratio", type=float, default=1.5, help="Memory oversubscription at which tasks are killed")
+    parser.add_argument("--retry-delay", type=float, default=300, help="Seconds before a killed task is retried, Airflow's default retry_delay")
+    parser.add_argument("--dt", type=float, default=1.0, help="Simulation step in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    config = load_stage_resources()
+    results = [_run(config, mode, args) for mode in ("shared", "resource-aware")]
+
+    print(f"{args.burst} songs in a burst, then {args.songs} at {args.arrival_per_minute}/min, {args.hls_fraction:.0%} with HLS")
+    print(f"{'mode':<16}{'songs/h':>9}{'p50 min':>9}{'p95 min':>9}{'makespan':>10}{'OOM kills':>11}{'swap min':>10}")
+    for result in results:
+        print(f"{result['mode']:<16}{result['songs_per_hour']:>9.1f}{result['latency_p50_min']:>9.1f}{result['latency_p95_min']:>9.1f}"
+              f"{result['makespan_min']:>10.1f}{result['oom_kills']:>11}{result['swap_min']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Fan-out latency benchmark for the song status watcher of the Song Generation API.
+
+Two modes are available:
+
+* `inprocess` (default) publishes transitions straight into the watcher and measures how long it
+  takes for every subscriber thread to receive them. It isolates the fan-out cost from MongoDB.
+* `mongo` updates `song_status` on a scratch song document of a real MongoDB deployment and
+  measures the time until subscribers are notified, through change streams on a replica set or
+  the polling fallback on a standalone server.
+
+    python benchmarks/status_fanout_benchmark.py --subscribers 1,100,1000 --events 50
+    python benchmarks/status_fanout_benchmark.py --mode mongo --mongo-uri mongodb://localhost:27017/
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api", "song_generation"))
+
+from song_status_watcher import SongStatusWatcher  # noqa: E402
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * percentile) - 1)]
+
+
+def _start_subscribers(watcher, song_id, count, expected_events, latencies, sent_at):
+    """
+    Start `count` subscriber threads recording the delay between the send and the receive time.
+    """
+    threads = []
+    ready = threading.Barrier(count + 1)
+
+    def consume():
+        subscription = watcher.subscribe(song_id)
+        ready.wait()
+        received = 0
+        while received < expected_events:
+            event = subscription.get()
+            received_at = time.perf_counter()
+            if event["song_status"] not in sent_at:
+                # Initial status reported by the polling fallback
+                continue
+            latencies.append(received_at - sent_at[event["song_status"]])
+            received += 1
+        watcher.unsubscribe(song_id, subscription)
+
+    for _ in range(count):
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        threads.append(thread)
+    ready.wait()
+    return threads
+
+
+def _run_inprocess(subscribers, events):
+    watcher = SongStatusWatcher(collection=None)
+    # Mark the watcher as running so no MongoDB thread is started
+    watcher._thread = threading.current_thread()
+    latencies = []
+    sent_at = {}
+    threads = _start_subscribers(watcher, "benchmark-song", subscribers, events, latencies, sent_at)
+    for index in range(events):
+        song_status = f"status_{index}"
+        sent_at[song_status] = time.perf_counter()
+        watcher.publish("benchmark-song", song_status)
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def _run_mongo(subscribers, events, args):
+    from pymongo import MongoClient
+
+    collection = MongoClient(args.mongo_uri)[args.mongo_db][args.mongo_collection]
+    song_id = collection.insert_one({"song_title": "status fan-out benchmark", "song_status": "created"}).inserted_id
+    watcher = SongStatusWatcher(collection, poll_interval=args.poll_interval)
+    latencies = []
+    sent_at = {}
+    try:
+        threads = _start_subscribers(watcher, str(song_id), subscribers, events, latencies, sent_at)
+        # Give the watcher time to open its change stream or start polling
+        time.sleep(1)
+        for index in range(events):
+            song_status = f"status_{index}"
+            sent_at[song_status] = time.perf_counter()
+            collection.update_one({"_id": song_id}, {"$set": {"song_status": song_status}})
+            time.sleep(args.interval)
+        for thread in threads:
+            thread.join(timeout=30)
+    finally:
+        collection.delete_one({"_id": song_id})
+    print(f"watcher mode: {watcher.mode}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Song status fan-out latency benchmark.")
+    parser.add_argument("--mode", choices=["inprocess", "mongo"], default="inprocess")
+    parser.add_argument("--subscribers", default="1,10,100,1000",
+                        type=lambda value: [int(count) for count in value.split(",")])
+    parser.add_argument("--events", type=int, default=20, help="Status transitions published per run")
+    parser.add_argument("--interval", type=float, default=2.5,
+                        help="Seconds between MongoDB updates; keep it above the polling interval")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Watcher polling interval")
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--mongo-db", default=os.environ.get("MONGO_DB", "lyric-wave-db"))
+    parser.add_argument("--mongo-collection", default="status-fanout-benchmark")
+    args = parser.parse_args()
+
+    print(f"{'subscribers':>12}{'events':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for subscribers in args.subscribers:
+        if args.mode == "inprocess":
+            latencies = _run_inprocess(subscribers, args.events)
+        else:
+            latencies = _run_mongo(subscribers, args.events, args)
+        latencies_ms = [latency * 1000 for latency in latencies]
+        print(f"{subscribers:>12}{len(latencies_ms):>10}"
+              f"{statistics.median(latencies_ms):>10.2f}"
+              f"{_percentile(latencies_ms, 0.95):>10.2f}"
+              f"{_percentile(latencies_ms, 0.99):>10.2f}"
+              f"{max(latencies_ms):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
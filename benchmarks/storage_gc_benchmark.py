@@ -0,0 +1,207 @@
+"""
+Throughput and memory of the storage reconciler, and bytes reclaimed from the bucket.
+
+Builds a synthetic catalog of `--songs` songs with the objects the pipeline stores for each
+(melody, voice, final song, renditions, cover and variants, waveforms, preview and, for some, an
+HLS presentation), where `--deleted` of the songs were deleted from MongoDB only, `--failed` failed
+long ago and `--temporary` left an unpublished temporary upload. It then diffs the listing against
+the songs with:
+
+- `streaming`: `storage_gc.iter_orphans`, the merge of both sorted streams the DAG runs;
+- `in-memory`: loading every song ID into a set and every listed object into a list first.
+
+and reports objects per second and the peak Python memory of each (tracemalloc). Finally it runs
+`storage_gc.reconcile` on the in-memory MinIO and mongomock of the offline harness, in dry-run mode
+and for real, checking that exactly the orphans are removed:
+
+    python benchmarks/storage_gc_benchmark.py --songs 200000 --reconcile-songs 2000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "airflow", "dags"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from operators import storage_gc  # noqa: E402
+from pipeline.fakes import FakeMinio  # noqa: E402
+
+BUCKET_NAME = "lyricwave"
+
+# Objects stored for every song, with their typical size in bytes
+SONG_OBJECTS = [
+    ("_melody.wav", 5_300_000), ("_voice.wav", 2_600_000), ("_final_song.mp4", 3_100_000),
+    ("_final_song_aac_128.m4a", 480_000), ("_final_song_opus_64.opus", 240_000), ("_image_cover.jpg", 180_000),
+    ("_image_cover_256.webp", 14_000), ("_image_cover_512.webp", 42_000), ("_waveform_final_song.json", 6_000),
+    ("_preview.opus", 120_000)
+]
+HLS_OBJECTS = [("/hls/master.m3u8", 300), ("/hls/aac_128/init.mp4", 900)] + \
+    [(f"/hls/aac_128/segment_{segment:05d}.m4s", 64_000) for segment in range(8)]
+
+
+class ListedObject:
+    """
+    An entry of a bucket listing, with the fields of minio.datatypes.Object the reconciler reads.
+    """
+    __slots__ = ("object_name", "size", "last_modified", "is_dir")
+
+    def __init__(self, object_name, size, last_modified):
+        self.object_name = object_name
+        self.size = size
+        self.last_modified = last_modified
+        self.is_dir = False
+
+
+def _catalog(args):
+    """
+    Deterministic song states: "live", "deleted", "failed" or "temporary", by song index.
+    """
+    rng = random.Random(args.seed)
+    for index in range(args.songs):
+        draw = rng.random()
+        if draw < args.deleted:
+            yield index, "deleted"
+        elif draw < args.deleted + args.failed:
+            yield index, "failed"
+        elif draw < args.deleted + args.failed + args.temporary:
+            yield index, "temporary"
+        else:
+            yield index, "live"
+
+
+def _song_id(index):
+    return ObjectId(f"{index + 1:024x}")
+
+
+def _song_objects(song_id, state, index, args):
+    objects = SONG_OBJECTS + (HLS_OBJECTS if index % args.hls_every == 0 else [])
+    if state == "temporary":
+        objects = objects + [(f"_voice.wav{storage_gc.ARTIFACT_TEMP_SUFFIX}{index:032x}", 2_600_000)]
+    return sorted((f"{song_id}{suffix}", size) for suffix, size in objects)
+
+
+def _listing(args, old):
+    """
+    The bucket listing in key order, generated lazily like the pages MinIO returns.
+    """
+    for index, state in _catalog(args):
+        for object_name, size in _song_objects(_song_id(index), state, index, args):
+            yield ListedObject(object_name, size, old)
+
+
+def _songs(args, failed_at):
+    """
+    The song documents sorted by `_id`, generated lazily like a MongoDB cursor.
+    """
+    for index, state in _catalog(args):
+        if state == "deleted":
+            continue
+        song = {"_id": _song_id(index), "song_status": "song_indexed"}
+        if state == "failed":
+            song.update({"song_status": "failed", "failed_at": failed_at})
+        yield song
+
+
+def _streaming_diff(args, old, failed_at):
+    orphans = 0
+    for _, reason in storage_gc.iter_orphans(_listing(args, old), _songs(args, failed_at)):
+        orphans += reason not in (None, "unmanaged")
+    return orphans
+
+
+def _in_memory_diff(args, old, failed_at):
+    songs = {str(song["_id"]): song for song in _songs(args, failed_at)}
+    objects = list(_listing(args, old))
+    failed_before = datetime.now() - timedelta(days=storage_gc.STORAGE_GC_FAILED_RETENTION_DAYS)
+    orphans = 0
+    for song_object in objects:
+        song = songs.get(storage_gc.song_id_of(song_object.object_name))
+        orphans += song is None or storage_gc.ARTIFACT_TEMP_SUFFIX in song_object.object_name or \
+            (song.get("song_status") == "failed" and song["failed_at"] < failed_before)
+    return orphans
+
+
+def _measure(diff, args, old, failed_at):
+    tracemalloc.start()
+    started = time.perf_counter()
+    orphans = diff(args, old, failed_at)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return orphans, elapsed, peak
+
+
+def _reconcile(args, old, failed_at):
+    """
+    Run the reconciler on the in-memory MinIO and mongomock, dry run first, and check what it removed.
+    """
+    reconcile_args = argparse.Namespace(**{**vars(args), "songs": args.reconcile_songs})
+    minio_client = FakeMinio()
+    minio_client.make_bucket(BUCKET_NAME)
+    expected_orphans = set()
+    for index, state in _catalog(reconcile_args):
+        for object_name, size in _song_objects(_song_id(index), state, index, reconcile_args):
+            # Stored at 1/1000 of their size to keep the bucket in memory
+            minio_client.put_object(BUCKET_NAME, object_name, io.BytesIO(b"x" * (size // 1000)), size // 1000)
+            minio_client._buckets[BUCKET_NAME][object_name]["last_modified"] = old
+            if state != "live" and (state != "temporary" or storage_gc.ARTIFACT_TEMP_SUFFIX in object_name):
+                expected_orphans.add(object_name)
+    # Unmanaged and recent objects are never collected
+    minio_client.put_object(BUCKET_NAME, "exports/catalog.csv", io.BytesIO(b"x"), 1)
+    minio_client.put_object(BUCKET_NAME, f"{'f' * 24}_voice.wav", io.BytesIO(b"x"), 1)
+
+    songs_collection = mongomock.MongoClient().db.songs
+    songs = list(_songs(reconcile_args, failed_at))
+    if songs:
+        songs_collection.insert_many(songs)
+
+    objects_before = minio_client.object_count()
+    dry_run = storage_gc.reconcile(minio_client, BUCKET_NAME, songs_collection, dry_run=True)
+    assert minio_client.object_count() == objects_before, "dry run deleted objects"
+    report = storage_gc.reconcile(minio_client, BUCKET_NAME, songs_collection, dry_run=False)
+    remaining = {song_object.object_name for song_object in minio_client.list_objects(BUCKET_NAME, recursive=True)}
+    assert not remaining & expected_orphans, "orphans left in the bucket"
+    assert objects_before - len(remaining) == len(expected_orphans), "objects still in use were deleted"
+    return dry_run, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and memory of the storage reconciler.")
+    parser.add_argument("--songs", type=int, default=200000)
+    parser.add_argument("--reconcile-songs", type=int, default=2000)
+    parser.add_argument("--deleted", type=float, default=0.1, help="Fraction of songs deleted from MongoDB only")
+    parser.add_argument("--failed", type=float, default=0.05, help="Fraction of songs failed before the retention")
+    parser.add_argument("--temporary", type=float, default=0.02, help="Fraction of songs with a leftover temporary upload")
+    parser.add_argument("--hls-every", type=int, default=3, help="One song in N has an HLS presentation")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    old = datetime.now(timezone.utc) - timedelta(hours=storage_gc.STORAGE_GC_MIN_AGE_HOURS + 1)
+    failed_at = datetime.now() - timedelta(days=storage_gc.STORAGE_GC_FAILED_RETENTION_DAYS + 1)
+    objects = sum(1 for _ in _listing(args, old))
+
+    print(f"{args.songs} songs, {objects} objects")
+    print(f"{'diff':<12}{'orphans':>10}{'objects/s':>12}{'peak MB':>10}")
+    for name, diff in [("streaming", _streaming_diff), ("in-memory", _in_memory_diff)]:
+        orphans, elapsed, peak = _measure(diff, args, old, failed_at)
+        print(f"{name:<12}{orphans:>10}{objects / elapsed:>12.0f}{peak / 1e6:>10.1f}")
+
+    dry_run, report = _reconcile(args, old, failed_at)
+    print(f"\nreconcile on {args.reconcile_songs} songs: {report['scanned_objects']} objects scanned, "
+          f"{report['unmanaged_objects']} unmanaged")
+    for reason, orphans in sorted(dry_run["orphans"].items()):
+        print(f"  {reason:<14}{orphans['objects']:>8} objects{orphans['bytes'] / 1e3:>12.1f} MB at full size")
+    print(f"  dry run reclaimed {dry_run['reclaimed_bytes']} bytes; run reclaimed {report['reclaimed_objects']} objects, "
+          f"{report['reclaimed_bytes'] / 1e3:.1f} MB at full size, in {report['elapsed_seconds']:.2f} s; no object in use deleted")
+
+
+if __name__ == "__main__":
+    main()
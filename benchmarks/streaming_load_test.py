@@ -0,0 +1,172 @@
+"""
+Load-test harness for the LyricWave Streaming API.
+
+Opens an increasing number of concurrent listeners against one streaming route and reports, for
+every concurrency level, whether all listeners could be fed in real time. Each listener consumes the
+stream at a fixed playback bitrate, like a real player would, so slow clients keep connections open
+exactly as they do in production.
+
+Run it once per serving mode (or pass several targets) to compare the sync and ASGI servers:
+
+    python benchmarks/streaming_load_test.py \
+        --target sync=http://localhost:5001 --target asgi=http://localhost:5002 \
+        --song-id 6543a1f2c9e77c0012345678 --levels 50,100,250,500,1000 --server-cores 2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+class ListenerResult:
+    """
+    Outcome of a single simulated listener.
+    """
+
+    def __init__(self):
+        self.time_to_first_byte = None
+        self.bytes_received = 0
+        self.stalled = False
+        self.error = None
+
+
+async def _listen(session, url, duration, playback_bytes_per_second, buffer_seconds, chunk_size):
+    """
+    Play a stream in real time for `duration` seconds, restarting it whenever it ends.
+
+    A listener is marked as stalled when the bytes received fall more than `buffer_seconds` behind
+    the playback position, i.e. when a real player would have run out of buffered audio.
+    """
+    result = ListenerResult()
+    started_at = time.perf_counter()
+    deadline = started_at + duration
+    try:
+        while time.perf_counter() < deadline:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    result.error = f"HTTP {response.status}"
+                    return result
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    now = time.perf_counter()
+                    if result.time_to_first_byte is None:
+                        result.time_to_first_byte = now - started_at
+                    result.bytes_received += len(chunk)
+
+                    played_bytes = (now - started_at - result.time_to_first_byte) * playback_bytes_per_second
+                    if played_bytes - result.bytes_received > buffer_seconds * playback_bytes_per_second:
+                        result.stalled = True
+
+                    # Consume no faster than the playback rate, like a real player
+                    ahead_seconds = (result.bytes_received / playback_bytes_per_second) - (now - started_at)
+                    if ahead_seconds > buffer_seconds:
+                        await asyncio.sleep(ahead_seconds - buffer_seconds)
+                    if now >= deadline:
+                        break
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+async def _run_level(url, concurrency, args):
+    """
+    Run one concurrency level and summarise the listeners' results.
+    """
+    connector = aiohttp.TCPConnector(limit=0, force_close=False)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.buffer_seconds * 4)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        listeners = []
+        for _ in range(concurrency):
+            listeners.append(asyncio.create_task(_listen(
+                session,
+                url,
+                args.duration,
+                args.playback_kbps * 1000 / 8,
+                args.buffer_seconds,
+                args.chunk_size
+            )))
+            # Ramp listeners up instead of opening every connection in the same millisecond
+            await asyncio.sleep(args.ramp_seconds / concurrency)
+        results = await asyncio.gather(*listeners)
+
+    ttfb = sorted(r.time_to_first_byte for r in results if r.time_to_first_byte is not None)
+    healthy = [r for r in results if not r.stalled and r.error is None]
+    return {
+        "concurrency": concurrency,
+        "healthy_listeners": len(healthy),
+        "stalled_listeners": sum(1 for r in results if r.stalled),
+        "failed_listeners": sum(1 for r in results if r.error is not None),
+        "sustained": len(healthy) >= concurrency * args.success_ratio,
+        "ttfb_p50_ms": round(ttfb[len(ttfb) // 2] * 1000, 1) if ttfb else None,
+        "ttfb_p95_ms": round(ttfb[int(len(ttfb) * 0.95) - 1] * 1000, 1) if ttfb else None,
+        "megabytes_received": round(sum(r.bytes_received for r in results) / (1024 * 1024), 2)
+    }
+
+
+async def _run_target(name, base_url, args):
+    """
+    Run every concurrency level against one target and return its report.
+    """
+    url = f"{base_url.rstrip('/')}/{args.route}/{args.song_id}"
+    levels = []
+    for concurrency in args.levels:
+        level = await _run_level(url, concurrency, args)
+        levels.append(level)
+        print(f"[{name}] {json.dumps(level)}")
+        if not level["sustained"] and args.stop_on_failure:
+            break
+    sustained = [level["concurrency"] for level in levels if level["sustained"]]
+    max_sustained = max(sustained) if sustained else 0
+    return {
+        "target": name,
+        "url": url,
+        "max_sustained_streams": max_sustained,
+        "streams_per_core": round(max_sustained / args.server_cores, 1),
+        "levels": levels
+    }
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Concurrent listener load test for the streaming API.")
+    parser.add_argument("--target", action="append", required=True,
+                        help="name=base_url of a streaming API instance; repeat to compare serving modes")
+    parser.add_argument("--song-id", required=True, help="ID of an already generated song")
+    parser.add_argument("--route", default="stream_song",
+                        choices=["stream_song", "stream_voice", "stream_melody", "show_image"])
+    parser.add_argument("--levels", default="25,50,100,250,500,1000",
+                        type=lambda value: [int(level) for level in value.split(",")],
+                        help="Comma separated list of concurrency levels")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds each listener keeps playing")
+    parser.add_argument("--ramp-seconds", type=float, default=5, help="Seconds used to open all listeners")
+    parser.add_argument("--playback-kbps", type=float, default=128, help="Playback bitrate of each listener")
+    parser.add_argument("--buffer-seconds", type=float, default=2, help="Client side buffer before a stall")
+    parser.add_argument("--chunk-size", type=int, default=16 * 1024)
+    parser.add_argument("--success-ratio", type=float, default=0.99,
+                        help="Fraction of healthy listeners needed to call a level sustained")
+    parser.add_argument("--server-cores", type=float, default=1,
+                        help="CPU cores allotted to the server under test, used for the per core figure")
+    parser.add_argument("--stop-on-failure", action="store_true", help="Stop a target at its first failing level")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser.parse_args()
+
+
+async def main():
+    args = _parse_args()
+    reports = []
+    for target in args.target:
+        name, base_url = target.split("=", 1)
+        reports.append(await _run_target(name, base_url, args))
+
+    print()
+    print(f"{'target':<12}{'max streams':>14}{'streams/core':>16}")
+    for report in reports:
+        print(f"{report['target']:<12}{report['max_sustained_streams']:>14}{report['streams_per_core']:>16}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(reports, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+Recall and queries per second of the lyric vector index against the size of the catalog.
+
+Builds the on-disk index of `shared/vector_index.py` from synthetic clustered
+embeddings (unit vectors around `--clusters` topics, as lyric embeddings group by theme) for every
+catalog size, then runs the same queries through:
+
+- `brute force`: every float16 row scored, as for catalogs below VECTOR_INDEX_IVF_MIN_ROWS;
+- `ivf nprobe=N`: the trained index scoring the rows of the N closest lists only.
+
+Recall@k is measured against an exact float32 search over the original embeddings, so the brute
+force row shows the loss of the float16 storage alone. The time to open the memory-mapped index,
+as the API does on startup, and its size on disk are reported too:
+
+    python benchmarks/vector_index_benchmark.py --sizes 10000 100000 1000000 --nprobe 4 16 64
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+
+import vector_index  # noqa: E402
+
+APPEND_BATCH_ROWS = 10000
+
+
+def _normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _batches(size, centers, args):
+    """
+    Deterministic batches of clustered unit vectors, regenerated identically for every pass.
+    """
+    rng = np.random.default_rng(args.seed)
+    for start in range(0, size, APPEND_BATCH_ROWS):
+        rows = min(APPEND_BATCH_ROWS, size - start)
+        labels = rng.integers(len(centers), size=rows)
+        noise = rng.standard_normal((rows, centers.shape[1])).astype(np.float32) * args.spread
+        yield start, _normalize(centers[labels] + noise).astype(np.float32)
+
+
+def _build(directory, size, centers, queries, args):
+    """
+    Append the catalog to a fresh index, computing the exact float32 top-k of every query on the way.
+    """
+    index = vector_index.VectorIndex(directory, ivf_min_rows=size + 1)
+    best_scores = np.full((len(queries), args.k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), args.k), dtype=np.int64)
+    for start, vectors in _batches(size, centers, args):
+        index.append([os.urandom(vector_index.ID_BYTES).hex() for _ in range(len(vectors))], vectors)
+        scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(vectors)), (len(queries), len(vectors)))], axis=1)
+        top = np.argpartition(-scores, args.k - 1, axis=1)[:, :args.k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return index, best_rows
+
+
+def _measure(index, queries, truth_ids, args, **search_kwargs):
+    started = time.perf_counter()
+    results = [index.search(query, k=args.k, **search_kwargs) for query in queries]
+    elapsed = time.perf_counter() - started
+    recall = np.mean([
+        len({song_id for song_id, _ in result} & truth) / args.k for result, truth in zip(results, truth_ids)
+    ])
+    return len(queries) / elapsed, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and QPS of the lyric vector index by catalog size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=384, help="384 for all-MiniLM-L6-v2")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=0.06, help="Noise of the embeddings around their topic")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed + 1)
+    centers = _normalize(rng.standard_normal((args.clusters, args.dimension))).astype(np.float32)
+    query_topics = centers[rng.integers(args.clusters, size=args.queries)]
+    queries = _normalize(query_topics + rng.standard_normal(query_topics.shape) * args.spread).astype(np.float32)
+
+    print(f"{args.queries} queries, top {args.k}, {args.dimension} dimensions, {args.clusters} topics")
+    print(f"{'rows':>9}{'search':>16}{'QPS':>10}{'recall':>9}{'open ms':>9}{'disk MB':>9}")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix="lyricwave_vectors_")
+        try:
+            index, truth_rows = _build(directory, size, centers, queries, args)
+            reader = vector_index.VectorIndex(directory)
+            started = time.perf_counter()
+            reader.refresh(force=True)
+            open_ms = (time.perf_counter() - started) * 1000
+            snapshot = reader.refresh()
+            truth_ids = [{vector_index._song_id(snapshot.ids[row]) for row in rows} for rows in truth_rows]
+            disk_mb = reader.stats()["size_bytes"] / 1e6
+
+            qps, recall = _measure(reader, queries, truth_ids, args, exact=True)
+            print(f"{size:>9}{'brute force':>16}{qps:>10.1f}{recall:>9.3f}{open_ms:>9.1f}{disk_mb:>9.1f}")
+
+            lists = index.train()
+            reader = vector_index.VectorIndex(directory)
+            reader.refresh(force=True)
+            for nprobe in args.nprobe:
+                qps, recall = _measure(reader, queries, truth_ids, args, nprobe=nprobe)
+                print(f"{size:>9}{f'ivf {nprobe}/{lists}':>16}{qps:>10.1f}{recall:>9.3f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Time to first audio of the voice stage, whole-lyric synthesis versus progressive synthesis.
+
+Runs the same songs through the offline pipeline of `pipeline_benchmark.py` twice:
+
+- `whole`: Bark synthesizes the whole lyric, so nothing can be played before the voice is stored;
+- `progressive`: the lyric is split into segments of `--segment-chars` characters and every
+  segment is published to MinIO and recorded in `voice_progress` as soon as it is decoded, as with
+  VOICE_PROGRESSIVE=true.
+
+and reports the time from the start of the voice task to the first playable audio
+(`voice_first_audio_seconds`), the voice stage latency, the end-to-end latency and the segments
+published. The harness submits lyrics of 200 characters, so the default `--segment-chars` of 50
+splits them like VOICE_SEGMENT_MAX_CHARS=220 splits lyrics of about 900 characters:
+
+    python benchmarks/voice_ttfa_benchmark.py --models stub --songs 20
+"""
+import argparse
+import os
+import statistics
+
+from pipeline_benchmark import PipelineBenchmark
+from operators import generate_voice_operator
+
+MODES = ["whole", "progressive"]
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * percentile) - 1)] if ordered else 0.0
+
+
+def _run_mode(args, mode):
+    generate_voice_operator.VOICE_PROGRESSIVE = mode == "progressive"
+    generate_voice_operator.VOICE_SEGMENT_MAX_CHARS = args.segment_chars
+    benchmark = PipelineBenchmark(args)
+    report = benchmark.run()
+    songs = list(benchmark.mongo_client[os.environ["MONGO_DB"]][os.environ["MONGO_DB_COLLECTION"]].find(
+        {"voice_first_audio_seconds": {"$ne": None}}
+    ))
+    first_audio = [song["voice_first_audio_seconds"] for song in songs]
+    segments = [len((song.get("voice_progress") or {}).get("parts", [])) for song in songs]
+    return {
+        "mode": mode,
+        "songs": len(songs),
+        "failures": len(report["failures"]),
+        "first_audio_p50_seconds": _percentile(first_audio, 0.5),
+        "first_audio_p95_seconds": _percentile(first_audio, 0.95),
+        "voice_stage_p50_seconds": report["stage_seconds"]["generate_voice_task"]["p50"] or 0.0,
+        "end_to_end_p50_seconds": report["end_to_end_seconds"]["p50"] or 0.0,
+        "segments_per_song": statistics.mean(segments) if segments else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first audio of the voice stage.")
+    parser.add_argument("--models", choices=["tiny", "stub"], default="stub")
+    parser.add_argument("--songs", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100.0, help="Submissions per second")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stub-latency-scale", type=float, default=1.0)
+    parser.add_argument("--segment-chars", type=int, default=50, help="Characters of lyrics per progressive segment")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = [_run_mode(args, mode) for mode in MODES]
+    print(f"{args.songs} songs, {args.models} models, segments of {args.segment_chars} characters")
+    print(f"{'mode':<13}{'TTFA p50 s':>12}{'TTFA p95 s':>12}{'voice p50 s':>13}{'e2e p50 s':>11}{'segments':>10}{'failures':>10}")
+    for result in results:
+        print(f"{result['mode']:<13}{result['first_audio_p50_seconds']:>12.3f}{result['first_audio_p95_seconds']:>12.3f}"
+              f"{result['voice_stage_p50_seconds']:>13.3f}{result['end_to_end_p50_seconds']:>11.3f}"
+              f"{result['segments_per_song']:>10.1f}{result['failures']:>10}")
+
+
+if __name__ == "__main__":
+    main()
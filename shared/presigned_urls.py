@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from datetime import timedelta
+from minio import Minio
+import threading
+import time
+import os
+
+# Endpoint clients reach MinIO at; presigned URLs are signed for this host
+MINIO_PUBLIC_ENDPOINT = os.environ.get("MINIO_PUBLIC_ENDPOINT") or os.environ.get("MINIO_ENDPOINT")
+# Whether clients reach MinIO over HTTPS
+MINIO_PUBLIC_SECURE = os.environ.get("MINIO_PUBLIC_SECURE", "false").lower() == "true"
+# Region the URLs are signed for; knowing it saves a bucket location request to MinIO
+MINIO_REGION = os.environ.get("MINIO_REGION", "us-east-1")
+# Validity of the presigned URLs
+PRESIGNED_URL_EXPIRY_SECONDS = int(os.environ.get("PRESIGNED_URL_EXPIRY_SECONDS", 900))
+# Cached URLs are signed again this long before they expire, so clients always get time to start the download
+PRESIGNED_URL_REFRESH_MARGIN_SECONDS = int(os.environ.get("PRESIGNED_URL_REFRESH_MARGIN_SECONDS", 120))
+# Presigned URLs kept per process
+PRESIGNED_URL_CACHE_SIZE = int(os.environ.get("PRESIGNED_URL_CACHE_SIZE", 10000))
+
+# Response headers MinIO can be asked to send with a presigned download, by query parameter
+RESPONSE_HEADER_OVERRIDES = {
+    "Content-Type": "response-content-type",
+    "Content-Disposition": "response-content-disposition",
+    "Cache-Control": "response-cache-control"
+}
+
+
+def response_header_overrides(headers):
+    """
+    Translate the headers the API would send with a file into presigned URL overrides.
+
+    Args:
+        headers (dict): The response headers of the file.
+
+    Returns:
+        dict: The overrides, by query parameter.
+    """
+    return {
+        parameter: headers[header]
+        for header, parameter in RESPONSE_HEADER_OVERRIDES.items() if headers.get(header)
+    }
+
+
+class PresignedUrlCache:
+    """
+    Thread-safe LRU cache of presigned GET URLs.
+
+    Signing is local (no request to MinIO), but every URL signed differs, so caching them also lets
+    clients and proxies reuse a URL until it is signed again.
+
+    Args:
+        endpoint (str): The MinIO endpoint the URLs point to.
+        access_key (str): The MinIO access key.
+        secret_key (str): The MinIO secret key.
+        secure (bool): Whether the URLs use HTTPS.
+        expiry_seconds (int): Validity of the URLs.
+        refresh_margin_seconds (int): Time before expiry at which a cached URL is signed again.
+        max_entries (int): Maximum number of cached URLs.
+    """
+
+    def __init__(self, endpoint=MINIO_PUBLIC_ENDPOINT, access_key=None, secret_key=None, secure=MINIO_PUBLIC_SECURE,
+                 expiry_seconds=PRESIGNED_URL_EXPIRY_SECONDS, refresh_margin_seconds=PRESIGNED_URL_REFRESH_MARGIN_SECONDS,
+                 max_entries=PRESIGNED_URL_CACHE_SIZE):
+        self.client = Minio(
+            endpoint,
+            access_key=access_key or os.environ.get("MINIO_ACCESS_KEY"),
+            secret_key=secret_key or os.environ.get("MINIO_SECRET_KEY"),
+            secure=secure,
+            region=MINIO_REGION
+        )
+        self.expiry_seconds = expiry_seconds
+        self.fresh_seconds = max(1, expiry_seconds - refresh_margin_seconds)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket_name, object_name, response_headers=None):
+        """
+        Get a presigned URL of an object, signing a new one when the cached one is about to expire.
+
+        Args:
+            bucket_name (str): The name of the MinIO bucket.
+            object_name (str): The name of the object.
+            response_headers (dict, optional): Response header overrides, see response_header_overrides.
+
+        Returns:
+            tuple: The URL and the seconds it can still be handed out for.
+        """
+        key = (bucket_name, object_name, tuple(sorted((response_headers or {}).items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[0], entry[1] - now
+        url = self.client.presigned_get_object(
+            bucket_name, object_name, expires=timedelta(seconds=self.expiry_seconds), response_headers=response_headers
+        )
+        with self._lock:
+            self._entries[key] = (url, now + self.fresh_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return url, self.fresh_seconds
+
+
+_presigned_url_cache = None
+
+
+def get_presigned_url_cache():
+    """
+    Get the presigned URL cache shared by every request served by this process.
+
+    Returns:
+        PresignedUrlCache: The cache.
+    """
+    global _presigned_url_cache
+    if _presigned_url_cache is None:
+        _presigned_url_cache = PresignedUrlCache()
+    return _presigned_url_cache
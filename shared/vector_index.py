@@ -0,0 +1,501 @@
+"""
+Lyric embeddings and the on-disk vector index of the semantic song search.
+
+The indexing stage embeds the lyrics of every song with a sentence encoder (LYRIC_EMBEDDING_MODEL,
+mean pooled and L2 normalized, so the dot product is the cosine similarity) and appends them to the
+index in VECTOR_INDEX_DIR, a volume shared with the Song Generation API, which memory-maps it
+read-only. The index is a directory of append-only files:
+
+- `vectors.f16`: one row of `dimension` float16 values per embedding;
+- `ids.bin`: the 12-byte ObjectId of the song of every row;
+- `centroids-<generation>.npy` and `lists-<generation>.i4`: the IVF centroids (spherical k-means
+  over the stored rows) and the list of every row, once the index has been trained;
+- `meta.json`: dimension, model, rows and IVF generation. It is replaced atomically once the rows
+  are written, so readers never see a partial row.
+
+Catalogs below VECTOR_INDEX_IVF_MIN_ROWS rows are searched by brute force, a product of the
+float16 rows and the query in blocks; larger ones are trained on append (again whenever they have
+doubled) and a query only scores the rows of its VECTOR_INDEX_NPROBE closest lists. A song
+embedded again (a retried task, a re-render) appends a row superseding the previous one. Writers
+serialize on an exclusive `flock` of the `lock` file; readers take no lock.
+
+The Song Generation API never loads the encoder: it sends the semantic search queries to the lyric
+encoder service (`api/lyric_encoder`, LYRIC_ENCODER_URL), which runs the same LyricEncoder, through
+RemoteLyricEncoder. This module is copied from `shared/` into the Airflow, Song Generation API and
+lyric encoder images. Run it as a script to inspect or train an index:
+
+    python vector_index.py stats /path/to/index
+    python vector_index.py train /path/to/index
+"""
+from contextlib import contextmanager
+import argparse
+import fcntl
+import importlib
+import json
+import os
+import threading
+import time
+
+# Directory of the vector index, shared by the indexing stage and the Song Generation API; empty disables it
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "")
+
+# Sentence encoder embedding the lyrics and the semantic search queries
+LYRIC_EMBEDDING_MODEL = os.environ.get("LYRIC_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+# URL of the lyric encoder service embedding the semantic search queries of the API; empty disables them
+LYRIC_ENCODER_URL = os.environ.get("LYRIC_ENCODER_URL", "")
+
+# Seconds the API waits for the lyric encoder service to embed a query
+LYRIC_ENCODER_TIMEOUT_SECONDS = float(os.environ.get("LYRIC_ENCODER_TIMEOUT_SECONDS", 5))
+
+# Rows from which the index is trained and searched through its IVF lists instead of by brute force
+VECTOR_INDEX_IVF_MIN_ROWS = int(os.environ.get("VECTOR_INDEX_IVF_MIN_ROWS", 50000))
+
+# IVF lists scored by every query; more lists trade speed for recall
+VECTOR_INDEX_NPROBE = int(os.environ.get("VECTOR_INDEX_NPROBE", 16))
+
+# Seconds a reader keeps its mapping before checking the index for new rows
+VECTOR_INDEX_REFRESH_SECONDS = float(os.environ.get("VECTOR_INDEX_REFRESH_SECONDS", 10))
+
+# Rows converted to float32 at a time when scoring or assigning the whole index
+BLOCK_ROWS = 65536
+# Rows of the k-means training sample per IVF list, and k-means iterations
+KMEANS_SAMPLE_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+ID_BYTES = 12
+
+
+def _song_id(stored_id):
+    # Fixed-width bytes come back without their trailing null bytes
+    return stored_id.ljust(ID_BYTES, b"\0").hex()
+
+
+class LyricEncoder:
+    """
+    Sentence encoder embedding lyrics and queries, loaded on first use.
+
+    :param model_name: The checkpoint of the encoder.
+    :type model_name: str
+    """
+
+    def __init__(self, model_name=LYRIC_EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the tokenizer and the encoder if they are not loaded yet.
+
+        :return: The tokenizer and the model.
+        :rtype: tuple
+        """
+        with self._lock:
+            if self._model is None:
+                transformers = importlib.import_module("transformers")
+                self._tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_name)
+                model = transformers.AutoModel.from_pretrained(self.model_name)
+                model.eval()
+                self._model = model
+        return self._tokenizer, self._model
+
+    def encode(self, texts):
+        """
+        Embed texts.
+
+        :param texts: The texts.
+        :type texts: list
+        :return: One L2 normalized float32 row per text.
+        :rtype: numpy.ndarray
+        """
+        torch = importlib.import_module("torch")
+        tokenizer, model = self.load()
+        inputs = tokenizer(list(texts), padding=True, truncation=True, max_length=256, return_tensors="pt")
+        with torch.no_grad():
+            hidden_states = model(**inputs).last_hidden_state
+        # Mean of the token states, ignoring the padding
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden_states.dtype)
+        embeddings = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
+        return embeddings.cpu().numpy().astype("float32")
+
+
+class RemoteLyricEncoder:
+    """
+    Client of the lyric encoder service, embedding texts like LyricEncoder without loading the model.
+
+    :param url: The URL of the lyric encoder service.
+    :type url: str
+    :param model_name: The encoder the index rows were computed with; answers of another encoder are refused.
+    :type model_name: str
+    :param timeout: Seconds to wait for an answer.
+    :type timeout: float
+    """
+
+    def __init__(self, url=LYRIC_ENCODER_URL, model_name=LYRIC_EMBEDDING_MODEL, timeout=LYRIC_ENCODER_TIMEOUT_SECONDS):
+        self.url = url.rstrip("/")
+        self.model_name = model_name
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                # Pooled connections, shared by the threads of the process
+                self._session = importlib.import_module("requests").Session()
+        return self._session
+
+    def encode(self, texts):
+        """
+        Embed texts with the lyric encoder service.
+
+        :param texts: The texts.
+        :type texts: list
+        :return: One L2 normalized float32 row per text.
+        :rtype: numpy.ndarray
+        :raises requests.RequestException: If the service can't be reached or answers with an error.
+        :raises ValueError: If the service runs another encoder than the one of the index.
+        """
+        numpy = importlib.import_module("numpy")
+        response = self._get_session().post(f"{self.url}/encode", json={"texts": list(texts)}, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()["data"]
+        if data["model"] != self.model_name:
+            raise ValueError(f"The lyric encoder runs {data['model']}, the index was built with {self.model_name}")
+        return numpy.asarray(data["embeddings"], dtype=numpy.float32)
+
+
+class _Snapshot:
+    """
+    Read-only mapping of the rows of the index at a given metadata version.
+    """
+
+    def __init__(self, vectors, ids, live, sorted_ids, sorted_rows, centroids=None, lists_order=None, lists_offsets=None):
+        self.vectors = vectors
+        self.ids = ids
+        self.live = live
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+        self.centroids = centroids
+        self.lists_order = lists_order
+        self.lists_offsets = lists_offsets
+
+
+class VectorIndex:
+    """
+    Append-only float16 vector index of the song lyrics, memory-mapped from a directory.
+
+    :param directory: The directory of the index.
+    :type directory: str
+    :param model: The encoder the rows were computed with, recorded in the metadata.
+    :type model: str
+    :param ivf_min_rows: Rows from which the index is trained on append.
+    :type ivf_min_rows: int
+    :param nprobe: IVF lists scored by every query.
+    :type nprobe: int
+    :param refresh_seconds: Seconds a reader keeps its mapping before checking for new rows.
+    :type refresh_seconds: float
+    """
+
+    def __init__(self, directory, model=LYRIC_EMBEDDING_MODEL, ivf_min_rows=VECTOR_INDEX_IVF_MIN_ROWS,
+                 nprobe=VECTOR_INDEX_NPROBE, refresh_seconds=VECTOR_INDEX_REFRESH_SECONDS):
+        self.directory = directory
+        self.model = model
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = None
+        self._snapshot_version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read_meta(self):
+        """
+        Read the metadata of the index.
+
+        :return: The metadata, or None if nothing was appended yet.
+        :rtype: dict
+        """
+        try:
+            with open(self._path("meta.json")) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        temp_path = self._path("meta.json.tmp")
+        with open(temp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(temp_path, self._path("meta.json"))
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_file(self, name, data, valid_bytes):
+        path = self._path(name)
+        with open(path, "ab") as data_file:
+            # Bytes past the metadata were left by a writer that died before updating it
+            if data_file.tell() != valid_bytes:
+                data_file.truncate(valid_bytes)
+            data_file.write(data)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+
+    def _map_vectors(self, meta):
+        numpy = importlib.import_module("numpy")
+        return numpy.memmap(self._path("vectors.f16"), dtype=numpy.float16, mode="r",
+                            shape=(meta["rows"], meta["dimension"]))
+
+    def append(self, song_ids, vectors):
+        """
+        Append the embeddings of songs, superseding their previous rows.
+
+        :param song_ids: The song IDs, as 24 character hex strings.
+        :type song_ids: list
+        :param vectors: One normalized embedding per song.
+        :type vectors: numpy.ndarray
+        :return: The rows of the index.
+        :rtype: int
+        """
+        numpy = importlib.import_module("numpy")
+        vectors = numpy.asarray(vectors, dtype=numpy.float32).reshape(len(song_ids), -1)
+        with self._write_lock():
+            meta = self.read_meta() or {
+                "dimension": vectors.shape[1], "model": self.model, "rows": 0, "generation": 0, "lists": 0
+            }
+            if meta["dimension"] != vectors.shape[1]:
+                raise ValueError(f"Expected embeddings of {meta['dimension']} dimensions, got {vectors.shape[1]}")
+            rows = meta["rows"]
+            self._append_file("vectors.f16", vectors.astype(numpy.float16).tobytes(), rows * meta["dimension"] * 2)
+            self._append_file("ids.bin", b"".join(bytes.fromhex(str(song_id)) for song_id in song_ids), rows * ID_BYTES)
+            if meta["lists"]:
+                centroids = numpy.load(self._path(f"centroids-{meta['generation']}.npy"))
+                lists = self._assign(vectors, centroids)
+                self._append_file(f"lists-{meta['generation']}.i4", lists.tobytes(), rows * 4)
+            meta["rows"] = rows + len(song_ids)
+            self._write_meta(meta)
+            # Retrained whenever the index doubles, so the lists stay balanced as the catalog grows
+            if meta["rows"] >= self.ivf_min_rows and meta["rows"] >= 2 * meta.get("trained_rows", 0):
+                self._train(meta)
+            return meta["rows"]
+
+    def train(self):
+        """
+        Train the IVF centroids on the current rows and assign every row to a list.
+
+        :return: The number of lists, 0 if the index is empty.
+        :rtype: int
+        """
+        with self._write_lock():
+            meta = self.read_meta()
+            if not meta or not meta["rows"]:
+                return 0
+            return self._train(meta)
+
+    def _train(self, meta):
+        numpy = importlib.import_module("numpy")
+        rows = meta["rows"]
+        vectors = self._map_vectors(meta)
+        lists = max(1, int(numpy.sqrt(rows)))
+        rng = numpy.random.default_rng(0)
+        sample_rows = numpy.sort(rng.choice(rows, min(rows, lists * KMEANS_SAMPLE_PER_LIST), replace=False))
+        sample = numpy.asarray(vectors[sample_rows], dtype=numpy.float32)
+        centroids = sample[rng.choice(len(sample), lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = self._assign(sample, centroids)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, assignment, sample)
+            counts = numpy.bincount(assignment, minlength=lists)
+            # Empty lists keep their centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            centroids /= numpy.maximum(numpy.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        # Files of a new generation, so readers mapping the previous one are not disturbed
+        generation = meta["generation"] + 1
+        numpy.save(self._path(f"centroids-{generation}.npy"), centroids)
+        with open(self._path(f"lists-{generation}.i4"), "wb") as lists_file:
+            for start in range(0, rows, BLOCK_ROWS):
+                lists_file.write(self._assign(vectors[start:start + BLOCK_ROWS], centroids).tobytes())
+            lists_file.flush()
+            os.fsync(lists_file.fileno())
+        previous_generation = meta["generation"]
+        meta.update({"generation": generation, "lists": lists, "trained_rows": rows})
+        self._write_meta(meta)
+        for name in (f"centroids-{previous_generation}.npy", f"lists-{previous_generation}.i4"):
+            # Readers still mapping them keep their inodes until they refresh
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        return lists
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        numpy = importlib.import_module("numpy")
+        lists = [
+            numpy.argmax(numpy.asarray(vectors[start:start + BLOCK_ROWS], dtype=numpy.float32) @ centroids.T, axis=1)
+            for start in range(0, len(vectors), BLOCK_ROWS)
+        ]
+        return numpy.concatenate(lists).astype(numpy.int32) if lists else numpy.zeros(0, dtype=numpy.int32)
+
+    def refresh(self, force=False):
+        """
+        Map the rows appended since the last refresh, at most every refresh_seconds.
+
+        :param force: Check the metadata now.
+        :type force: bool
+        :return: The current snapshot, or None if the index is empty.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return self._snapshot
+            self._checked_at = now
+            meta = self.read_meta()
+            version = (meta["rows"], meta["generation"]) if meta else None
+            if version == self._snapshot_version:
+                return self._snapshot
+            try:
+                self._snapshot = self._load_snapshot(meta) if meta and meta["rows"] else None
+                self._snapshot_version = version
+            except (OSError, ValueError) as e:
+                # Retrained between reading the metadata and opening its files; the next refresh picks it up
+                self._checked_at = None
+                if self._snapshot is None:
+                    raise e
+            return self._snapshot
+
+    def _load_snapshot(self, meta):
+        numpy = importlib.import_module("numpy")
+        rows = meta["rows"]
+        vectors = self._map_vectors(meta)
+        ids = numpy.memmap(self._path("ids.bin"), dtype=f"S{ID_BYTES}", mode="r", shape=(rows,))
+        # Latest row of every song; earlier rows were superseded by a new embedding
+        sorted_ids, first_from_end = numpy.unique(ids[::-1], return_index=True)
+        sorted_rows = rows - 1 - first_from_end
+        live = numpy.zeros(rows, dtype=bool)
+        live[sorted_rows] = True
+        snapshot = _Snapshot(vectors, ids, live, sorted_ids, sorted_rows)
+        if meta["lists"]:
+            lists_path = self._path(f"lists-{meta['generation']}.i4")
+            lists = numpy.memmap(lists_path, dtype=numpy.int32, mode="r", shape=(rows,))
+            snapshot.centroids = numpy.load(self._path(f"centroids-{meta['generation']}.npy"))
+            snapshot.lists_order = numpy.argsort(lists, kind="stable")
+            snapshot.lists_offsets = numpy.searchsorted(lists[snapshot.lists_order], numpy.arange(meta["lists"] + 1))
+        return snapshot
+
+    def __len__(self):
+        snapshot = self.refresh()
+        return len(snapshot.sorted_ids) if snapshot is not None else 0
+
+    def vector(self, song_id):
+        """
+        The stored embedding of a song.
+
+        :param song_id: The song ID, as a 24 character hex string.
+        :type song_id: str
+        :return: The float32 embedding, or None if the song is not indexed.
+        """
+        numpy = importlib.import_module("numpy")
+        snapshot = self.refresh()
+        if snapshot is None:
+            return None
+        key = bytes.fromhex(str(song_id)).rstrip(b"\0")
+        position = numpy.searchsorted(snapshot.sorted_ids, key)
+        if position == len(snapshot.sorted_ids) or snapshot.sorted_ids[position] != key:
+            return None
+        return numpy.asarray(snapshot.vectors[snapshot.sorted_rows[position]], dtype=numpy.float32)
+
+    def search(self, query, k=10, exclude=(), exact=False, nprobe=None):
+        """
+        Find the songs whose embeddings are the most similar to a query embedding.
+
+        :param query: The normalized query embedding.
+        :type query: numpy.ndarray
+        :param k: The number of songs to return.
+        :type k: int
+        :param exclude: Song IDs left out of the results.
+        :type exclude: collection
+        :param exact: Score every row even if the index is trained.
+        :type exact: bool
+        :param nprobe: IVF lists to score; defaults to the index's nprobe.
+        :type nprobe: int
+        :return: (song ID, cosine similarity) pairs, most similar first.
+        :rtype: list
+        """
+        numpy = importlib.import_module("numpy")
+        snapshot = self.refresh()
+        if snapshot is None or k <= 0:
+            return []
+        query = numpy.asarray(query, dtype=numpy.float32).reshape(-1)
+        if snapshot.centroids is not None and not exact:
+            probes = numpy.argsort(snapshot.centroids @ query)[::-1][:nprobe or self.nprobe]
+            candidates = numpy.sort(numpy.concatenate([
+                snapshot.lists_order[snapshot.lists_offsets[probe]:snapshot.lists_offsets[probe + 1]] for probe in probes
+            ]))
+            candidates = candidates[snapshot.live[candidates]]
+            scores = numpy.asarray(snapshot.vectors[candidates], dtype=numpy.float32) @ query
+        else:
+            candidates = None
+            scores = numpy.concatenate([
+                numpy.asarray(snapshot.vectors[start:start + BLOCK_ROWS], dtype=numpy.float32) @ query
+                for start in range(0, len(snapshot.vectors), BLOCK_ROWS)
+            ])
+            scores[~snapshot.live] = -numpy.inf
+
+        wanted = min(k + len(exclude), len(scores))
+        top = numpy.argpartition(-scores, wanted - 1)[:wanted] if wanted < len(scores) else numpy.arange(len(scores))
+        top = top[numpy.argsort(-scores[top])]
+        results = []
+        for position in top:
+            if not numpy.isfinite(scores[position]):
+                break
+            row = candidates[position] if candidates is not None else position
+            song_id = _song_id(snapshot.ids[row])
+            if song_id in exclude:
+                continue
+            results.append((song_id, float(scores[position])))
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self):
+        """
+        Describe the index: rows, indexed songs, IVF lists and size on disk.
+
+        :rtype: dict
+        """
+        meta = self.read_meta() or {"rows": 0}
+        size_bytes = sum(
+            os.path.getsize(self._path(name)) for name in os.listdir(self.directory)
+        ) if os.path.isdir(self.directory) else 0
+        return {**meta, "songs": len(self), "size_bytes": size_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or train a lyric vector index.")
+    parser.add_argument("command", choices=["stats", "train"])
+    parser.add_argument("directory", nargs="?", default=VECTOR_INDEX_DIR)
+    args = parser.parse_args()
+
+    index = VectorIndex(args.directory)
+    if args.command == "train":
+        print(f"Trained {index.train()} IVF lists")
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()